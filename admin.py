@@ -1,10 +1,13 @@
 # admin.py - Admin Panel for Fuel Flux
-from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash, session
+import click
+from flask import (
+    Blueprint, render_template, request, jsonify, redirect, url_for, flash, session, make_response,
+    Response, send_file, stream_with_context,
+)
 from flask_login import login_required, current_user
 from functools import wraps
 from models import (
     db,
-    PumpOwner,
     Pump,
     PumpSubscription,
     PaymentVerification,
@@ -12,10 +15,33 @@ from models import (
     WalletTopupVerification,
     User,
     Wallet,
+    PayoutBatch,
 )
 from datetime import datetime, timedelta
 from werkzeug.security import check_password_hash
+from services.wallet_service import credit_wallet
+from services.ledger_reconciliation import balance_as_of, drifted_wallets, reconcile_all, seed_opening_checkpoints
+from services.escrow_consolidation import consolidate_escrow, escrow_balance
+from services.kpi_cache import get_kpis
+from services.demand_forecast import FORECAST_HISTORY_DAYS, FORECAST_HORIZON_DAYS, run_demand_forecast
+from services.exports import EXPORT_DATASETS, EXPORT_FORMATS, ExportError, export_statement, iter_csv, write_parquet
+from services.topup_verification import BULK_VERIFY_MAX_ITEMS, bulk_verify_topups
+from services.gateway_reconciliation import (
+    MismatchPreview,
+    ReportFormatError,
+    read_settlement_report,
+    reconcile_settlement_report,
+    write_mismatch_csv,
+)
+from services.payouts import (
+    PAYOUT_BATCH_MAX_ITEMS,
+    PayoutConfigError,
+    PayoutResponseError,
+    create_payout_batch,
+    ingest_bank_response,
+)
 import os
+import tempfile
 
 admin_bp = Blueprint("admin", __name__, url_prefix="/admin")
 
@@ -76,23 +102,18 @@ def admin_logout():
 @admin_required
 def dashboard():
     """Main admin dashboard"""
-    pending_payments = PaymentVerification.query.filter_by(status='pending').all()
-    pending_wallet_topups = WalletTopupVerification.query.filter_by(status='pending').all()
-    pending_registrations = PumpRegistrationRequest.query.filter_by(status='pending').all()
-    
-    # Get statistics
-    total_pumps = Pump.query.count()
-    total_owners = PumpOwner.query.count()
-    active_subs = PumpSubscription.query.filter_by(subscription_status='active').count()
-    
+    kpis = get_kpis('admin_queues', 'platform', 'subscriptions')
     return render_template(
         'admin/dashboard.html',
-        pending_payments=pending_payments,
-        pending_wallet_topups=pending_wallet_topups,
-        pending_registrations=pending_registrations,
-        total_pumps=total_pumps,
-        total_owners=total_owners,
-        active_subs=active_subs,
+        pending_payments=kpis['pending_payments'],
+        pending_payments_count=kpis['pending_payments_count'],
+        pending_wallet_topups=kpis['pending_wallet_topups'],
+        pending_wallet_topups_count=kpis['pending_wallet_topups_count'],
+        pending_registrations=kpis['pending_registrations'],
+        pending_registrations_count=kpis['pending_registrations_count'],
+        total_pumps=kpis['total_pumps'],
+        total_owners=kpis['total_pump_owners'],
+        active_subs=kpis['active_subscriptions'],
     )
 
 
@@ -111,7 +132,12 @@ def pending_wallet_topups():
 @admin_bp.route('/wallet-topups/verify/<int:topup_id>', methods=['POST'])
 @admin_required
 def verify_wallet_topup(topup_id):
-    topup = WalletTopupVerification.query.get_or_404(topup_id)
+    # Lock the request so a double-click cannot approve (and credit) it twice
+    topup = (
+        WalletTopupVerification.query.filter_by(id=topup_id)
+        .with_for_update()
+        .first_or_404()
+    )
 
     if topup.status != 'pending':
         return jsonify({"error": "Top-up already processed"}), 400
@@ -131,7 +157,8 @@ def verify_wallet_topup(topup_id):
             db.session.flush()
             user.wallet = wallet
 
-        wallet.balance += topup.amount
+        credit_wallet(Wallet, wallet.id, topup.amount, event_type="wallet_topup",
+                      reference_id=topup.id, reference_type="wallet_topup")
 
         topup.status = 'approved'
         topup.verified_at = datetime.utcnow()
@@ -159,6 +186,33 @@ def verify_wallet_topup(topup_id):
     return jsonify({"error": "Invalid action"}), 400
 
 
+@admin_bp.route('/wallet-topups/bulk-verify', methods=['POST'])
+@admin_required
+def bulk_verify_wallet_topups():
+    """Approve or reject several pending top-ups in one transaction"""
+    data = request.get_json() or {}
+    action = data.get('action')
+    if action not in ('approve', 'reject'):
+        return jsonify({"error": "Invalid action"}), 400
+    try:
+        topup_ids = [int(i) for i in data.get('topup_ids') or []]
+    except (TypeError, ValueError):
+        return jsonify({"error": "topup_ids must be a list of ids"}), 400
+    if not topup_ids:
+        return jsonify({"error": "No top-ups selected"}), 400
+    if len(topup_ids) > BULK_VERIFY_MAX_ITEMS:
+        return jsonify({"error": f"At most {BULK_VERIFY_MAX_ITEMS} top-ups per request"}), 400
+
+    results = bulk_verify_topups(topup_ids, action, session.get('admin_email'), data.get('reason'))
+    done = sum(1 for r in results if r['status'] != 'skipped')
+    verb = 'approved and credited' if action == 'approve' else 'rejected'
+    return jsonify({
+        "success": True,
+        "message": f"{done} wallet top-up(s) {verb}, {len(results) - done} skipped.",
+        "results": results,
+    })
+
+
 # ========================
 # Payment Verification
 # ========================
@@ -335,6 +389,365 @@ def verify_registration(registration_id):
     return jsonify({"error": "Invalid action"}), 400
 
 
+# ========================
+# Ledger Reconciliation
+# ========================
+@admin_bp.route('/ledger/drift')
+@admin_required
+def ledger_drift():
+    """Wallets whose stored balance disagreed with the ledger at the last reconciliation"""
+    return jsonify({
+        "success": True,
+        "wallets": [
+            {
+                "wallet_type": cp.wallet_type,
+                "wallet_id": cp.wallet_id,
+                "ledger_balance": cp.balance,
+                "stored_balance": cp.stored_balance,
+                "drift": cp.drift,
+                "checked_at": cp.created_at.isoformat() if cp.created_at else None,
+            }
+            for cp in drifted_wallets()
+        ],
+    })
+
+
+@admin_bp.route('/ledger/reconcile', methods=['POST'])
+@admin_required
+def ledger_reconcile():
+    """Run an incremental reconciliation now"""
+    try:
+        summary = reconcile_all()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": f"Reconciliation failed: {str(e)}"}), 500
+    return jsonify({"success": True, "checked": summary["checked"], "drifted": summary["drifted"]})
+
+
+@admin_bp.route('/ledger/balance-as-of')
+@admin_required
+def ledger_balance_as_of():
+    """Audit query: ?wallet_type=driver_wallet|pump_wallet&wallet_id=N&at=ISO-8601"""
+    wallet_type = request.args.get('wallet_type', 'driver_wallet')
+    wallet_id = request.args.get('wallet_id', type=int)
+    at_raw = request.args.get('at')
+    if not wallet_id or not at_raw:
+        return jsonify({"success": False, "message": "wallet_id and at required"}), 400
+    try:
+        at = datetime.fromisoformat(at_raw)
+        result = balance_as_of(wallet_type, wallet_id, at)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return jsonify({"success": True, **result})
+
+
+@admin_bp.cli.command("reconcile-ledger")
+@click.option("--seed-missing", is_flag=True,
+              help="First give wallets without a checkpoint an opening one at their stored balance.")
+def reconcile_ledger_command(seed_missing):
+    """Fold new ledger entries into balance checkpoints and report drift."""
+    if seed_missing:
+        click.echo(f"Seeded {seed_opening_checkpoints()} opening checkpoints")
+    summary = reconcile_all()
+    click.echo(f"Checked {summary['checked']} wallets, {len(summary['drifted'])} drifted")
+    for result in summary["drifted"]:
+        click.echo(f"  {result['wallet_type']} {result['wallet_id']}: stored {result['stored_balance']} "
+                   f"vs ledger {result['ledger_balance']} ({result['drift']:+})")
+
+
+# ========================
+# Escrow Balance
+# ========================
+@admin_bp.route('/escrow/balance')
+@admin_required
+def escrow_balance_route():
+    """Total escrow held across the root account and its top-up sub-accounts"""
+    return jsonify({"success": True, **escrow_balance()})
+
+
+@admin_bp.route('/escrow/consolidate', methods=['POST'])
+@admin_required
+def escrow_consolidate():
+    """Roll escrow sub-accounts up into the root account now"""
+    try:
+        summary = consolidate_escrow()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": f"Consolidation failed: {str(e)}"}), 500
+    return jsonify({"success": True, **summary})
+
+
+@admin_bp.cli.command("consolidate-escrow")
+def consolidate_escrow_command():
+    """Move escrow sub-account balances into the main escrow account."""
+    summary = consolidate_escrow()
+    click.echo(f"Moved {summary['moved']:.2f} from {summary['sub_accounts']} sub-accounts; "
+               f"escrow total {summary['total']:.2f}")
+
+
+# ========================
+# Settlement Payouts (NEFT/RTGS bulk files)
+# ========================
+def _payout_batch_dict(batch):
+    return {
+        "batch_ref": batch.batch_ref,
+        "status": batch.status,
+        "item_count": batch.item_count,
+        "total_amount": batch.total_amount,
+        "processed_count": batch.processed_count,
+        "failed_count": batch.failed_count,
+        "created_by": batch.created_by,
+        "created_at": batch.created_at.isoformat() if batch.created_at else None,
+        "response_ingested_at": batch.response_ingested_at.isoformat() if batch.response_ingested_at else None,
+        "file_url": url_for('admin.payout_batch_file', batch_ref=batch.batch_ref),
+    }
+
+
+@admin_bp.route('/payouts/batches')
+@admin_required
+def payout_batches():
+    """Most recent payout batches"""
+    batches = PayoutBatch.query.order_by(PayoutBatch.id.desc()).limit(50).all()
+    return jsonify({"success": True, "batches": [_payout_batch_dict(b) for b in batches]})
+
+
+@admin_bp.route('/payouts/batches', methods=['POST'])
+@admin_required
+def create_payout_batch_route():
+    """Debit pending settlements into a new payout batch and generate its bank file"""
+    limit = min(request.args.get('limit', PAYOUT_BATCH_MAX_ITEMS, type=int), PAYOUT_BATCH_MAX_ITEMS)
+    try:
+        batch, skipped = create_payout_batch(created_by=session.get('admin_email'), limit=max(1, limit))
+    except PayoutConfigError as e:
+        return jsonify({"success": False, "message": str(e)}), 503
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": f"Payout batch failed: {str(e)}"}), 500
+    if batch is None:
+        return jsonify({"success": True, "message": "No settlements ready for payout.", "skipped": skipped})
+    return jsonify({"success": True, "batch": _payout_batch_dict(batch), "skipped": skipped})
+
+
+@admin_bp.route('/payouts/batches/<batch_ref>/file')
+@admin_required
+def payout_batch_file(batch_ref):
+    """Download the NEFT/RTGS CSV to upload to the bank"""
+    batch = PayoutBatch.query.filter_by(batch_ref=batch_ref).first_or_404()
+    response = make_response(batch.file_content)
+    response.mimetype = "text/csv"
+    response.headers["Content-Disposition"] = f'attachment; filename="{batch.batch_ref}.csv"'
+    return response
+
+
+@admin_bp.route('/payouts/batches/<batch_ref>/response', methods=['POST'])
+@admin_required
+def payout_batch_response(batch_ref):
+    """Upload the bank's response CSV (multipart field 'file') to close out the batch"""
+    upload = request.files.get('file')
+    if not upload:
+        return jsonify({"success": False, "message": "Response file required"}), 400
+    try:
+        summary = ingest_bank_response(batch_ref, upload.read())
+    except PayoutResponseError as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": f"Failed to ingest response: {str(e)}"}), 500
+    return jsonify({"success": True, **summary})
+
+
+@admin_bp.cli.command("create-payout-batch")
+@click.option("--limit", type=int, default=PAYOUT_BATCH_MAX_ITEMS, show_default=True)
+@click.option("--out", "out_path", type=click.Path(dir_okay=False, writable=True), default=None,
+              help="Write the bank CSV here as well.")
+def create_payout_batch_command(limit, out_path):
+    """Debit pending settlements into a payout batch and write the NEFT/RTGS file."""
+    try:
+        batch, skipped = create_payout_batch(created_by="cli", limit=max(1, limit))
+    except PayoutConfigError as e:
+        raise click.ClickException(str(e))
+    for item in skipped:
+        click.echo(f"  skipped settlement {item['settlement_id']}: {item['reason']}")
+    if batch is None:
+        click.echo("No settlements ready for payout")
+        return
+    if out_path:
+        with open(out_path, "w", newline="") as f:
+            f.write(batch.file_content)
+    click.echo(f"Batch {batch.batch_ref}: {batch.item_count} items, {batch.total_amount:.2f} INR")
+
+
+@admin_bp.cli.command("ingest-bank-response")
+@click.argument("batch_ref")
+@click.argument("response_file", type=click.File("rb"))
+def ingest_bank_response_command(batch_ref, response_file):
+    """Mark a payout batch's items processed or failed from the bank response CSV."""
+    try:
+        summary = ingest_bank_response(batch_ref, response_file.read())
+    except PayoutResponseError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Batch {summary['batch_ref']} ({summary['batch_status']}): {summary['processed']} processed, "
+               f"{summary['failed']} failed, {summary['still_pending']} still pending, "
+               f"{summary['already_final']} already final")
+    for reference in summary["unknown_references"]:
+        click.echo(f"  unknown reference {reference}")
+
+
+# ========================
+# Gateway Settlement Reconciliation
+# ========================
+GATEWAY_MISMATCH_PREVIEW = 500
+
+
+def _reconcile_window(since, until):
+    """Parse the optional YYYY-MM-DD window; the end date is inclusive"""
+    if not since or not until:
+        return None, None
+    return (datetime.strptime(since, "%Y-%m-%d"),
+            datetime.strptime(until, "%Y-%m-%d") + timedelta(days=1))
+
+
+@admin_bp.route('/gateway-reconciliation', methods=['POST'])
+@admin_required
+def gateway_reconciliation():
+    """
+    Reconcile an uploaded Razorpay settlement report (multipart field 'file',
+    CSV or XLSX) against wallet top-ups and subscription payments. Optional
+    form fields: since/until (YYYY-MM-DD) to also list local payments the
+    report is missing, amount_unit=paise for API exports.
+    """
+    upload = request.files.get('file')
+    if not upload:
+        return jsonify({"success": False, "message": "Settlement report file required"}), 400
+    try:
+        since, until = _reconcile_window(request.form.get('since'), request.form.get('until'))
+    except ValueError:
+        return jsonify({"success": False, "message": "since/until must be YYYY-MM-DD"}), 400
+
+    preview = MismatchPreview(GATEWAY_MISMATCH_PREVIEW)
+    rows = read_settlement_report(upload.stream, upload.filename,
+                                  amount_in_paise=request.form.get('amount_unit') == 'paise')
+    try:
+        summary = reconcile_settlement_report(rows, preview, since=since, until=until)
+    except ReportFormatError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return jsonify({"success": True, "summary": summary, "mismatches": preview.rows,
+                    "truncated": preview.truncated})
+
+
+@admin_bp.cli.command("reconcile-gateway-report")
+@click.argument("report_file", type=click.File("rb"))
+@click.option("--out", "out_file", type=click.File("w"), default="-", show_default=True,
+              help="Where to write the mismatch CSV.")
+@click.option("--since", default=None, help="YYYY-MM-DD; with --until, also report local payments missing from the file.")
+@click.option("--until", default=None, help="YYYY-MM-DD, inclusive.")
+@click.option("--paise", is_flag=True, help="Report amounts are in paise (API exports).")
+def reconcile_gateway_report_command(report_file, out_file, since, until, paise):
+    """Reconcile a Razorpay settlement report (CSV/XLSX) against top-ups and subscription payments."""
+    since, until = _reconcile_window(since, until)
+    rows = read_settlement_report(report_file, report_file.name, amount_in_paise=paise)
+    summary = reconcile_settlement_report(rows, write_mismatch_csv(out_file), since=since, until=until)
+    click.echo(
+        f"{summary['report_rows']} report rows: {summary['matched']} matched, "
+        f"{summary['missing_locally']} missing locally, {summary['amount_differs']} amount differs, "
+        f"{summary['status_differs']} status differs, {summary['missing_in_report']} missing in report",
+        err=True,
+    )
+
+
+# ========================
+# Data Exports
+# ========================
+def _export_filters(args):
+    """(start, end, pump_ids) from start/end (YYYY-MM-DD, end exclusive) and repeated pump_id"""
+    start = datetime.strptime(args['start'], "%Y-%m-%d").date() if args.get('start') else None
+    end = datetime.strptime(args['end'], "%Y-%m-%d").date() if args.get('end') else None
+    pump_ids = [int(p) for p in args.getlist('pump_id')] or None
+    return start, end, pump_ids
+
+
+@admin_bp.route('/exports/<dataset>')
+@admin_required
+def export_dataset(dataset):
+    """
+    Stream a dataset (fuel-transactions, ledger, attendance, entry-logs,
+    vehicle-locations) as ?format=csv (default) or parquet, filtered by
+    ?start=&end= (YYYY-MM-DD, end exclusive) and repeated ?pump_id=.
+    """
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"success": False, "message": f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+    try:
+        start, end, pump_ids = _export_filters(request.args)
+        # Validates the dataset and filters before any bytes are sent
+        export_statement(dataset, start, end, pump_ids)
+    except ExportError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except ValueError:
+        return jsonify({"success": False, "message": "start/end must be YYYY-MM-DD and pump_id an integer"}), 400
+
+    filename = f"{dataset}-{datetime.utcnow():%Y%m%d%H%M%S}.{fmt}"
+    if fmt == 'csv':
+        response = Response(stream_with_context(iter_csv(dataset, start, end, pump_ids)), mimetype='text/csv')
+        response.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
+    # Parquet needs its footer written last, so it is built in a temp file first
+    fd, path = tempfile.mkstemp(suffix=".parquet")
+    os.close(fd)
+    try:
+        write_parquet(dataset, path, start, end, pump_ids)
+        response = send_file(path, mimetype='application/vnd.apache.parquet', as_attachment=True,
+                             download_name=filename)
+    except ExportError as e:
+        os.unlink(path)
+        return jsonify({"success": False, "message": str(e)}), 503
+    except Exception:
+        os.unlink(path)
+        raise
+    response.call_on_close(lambda: os.unlink(path))
+    return response
+
+
+@admin_bp.cli.command("export-data")
+@click.argument("dataset", type=click.Choice(list(EXPORT_DATASETS)))
+@click.option("--format", "fmt", type=click.Choice(EXPORT_FORMATS), default="csv", show_default=True)
+@click.option("--start", type=click.DateTime(formats=["%Y-%m-%d"]), default=None)
+@click.option("--end", type=click.DateTime(formats=["%Y-%m-%d"]), default=None, help="Exclusive.")
+@click.option("--pump-id", "pump_ids", type=int, multiple=True)
+@click.option("--out", "out_path", type=click.Path(dir_okay=False, writable=True), required=True)
+def export_data_command(dataset, fmt, start, end, pump_ids, out_path):
+    """Export a dataset to CSV or Parquet with constant memory."""
+    start = start.date() if start else None
+    end = end.date() if end else None
+    pump_ids = list(pump_ids) or None
+    try:
+        export_statement(dataset, start, end, pump_ids)
+    except ExportError as e:
+        raise click.ClickException(str(e))
+    if fmt == "parquet":
+        try:
+            write_parquet(dataset, out_path, start, end, pump_ids)
+        except ExportError as e:
+            raise click.ClickException(str(e))
+    else:
+        with open(out_path, "w", newline="", encoding="utf-8") as f:
+            for text in iter_csv(dataset, start, end, pump_ids):
+                f.write(text)
+    click.echo(f"Wrote {dataset} to {out_path}")
+
+
+@admin_bp.cli.command("forecast-demand")
+@click.option("--history-days", type=int, default=FORECAST_HISTORY_DAYS, show_default=True)
+@click.option("--horizon", type=int, default=FORECAST_HORIZON_DAYS, show_default=True)
+def forecast_demand_command(history_days, horizon):
+    """Refresh demand forecasts for every pump and fuel type (normally run nightly)."""
+    summary = run_demand_forecast(history_days=history_days, horizon=horizon)
+    click.echo(f"{summary['fitted']}/{summary['series']} series forecast, "
+               f"{summary['forecasts']} rows written in {summary['seconds']}s")
+
+
 # ========================
 # View Screenshot
 # ========================
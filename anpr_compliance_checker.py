@@ -5,6 +5,7 @@ Checks vehicle compliance against hydrotest database
 
 from datetime import datetime, date
 from models import VehicleCompliance, VehicleEntryLog, ANPRCamera, db
+from services.entry_rollup import add_hourly_entries, aggregate_entries, entry_statistics
 from extensions import mail
 from flask_mail import Message
 
@@ -134,6 +135,7 @@ class ComplianceChecker:
             )
             
             db.session.add(entry_log)
+            add_hourly_entries(aggregate_entries([entry_log]))
             db.session.commit()
             
             return entry_log
@@ -221,26 +223,22 @@ FuelFlux ANPR System
     
     @staticmethod
     def get_entry_statistics(pump_id, days=7):
-        """Get entry statistics for dashboard"""
+        """Get entry statistics for dashboard (hourly rollup plus the partial hours at each end)"""
         from datetime import timedelta
         
-        start_date = datetime.now() - timedelta(days=days)
-        
-        logs = VehicleEntryLog.query.filter(
-            VehicleEntryLog.pump_id == pump_id,
-            VehicleEntryLog.detected_at >= start_date
-        ).all()
+        now = datetime.utcnow()
+        counts = entry_statistics(pump_id, now - timedelta(days=days), now)
         
         stats = {
-            'total_entries': len(logs),
-            'compliant': sum(1 for log in logs if log.compliance_status == 'compliant'),
-            'expired': sum(1 for log in logs if log.compliance_status == 'expired'),
-            'expiring_soon': sum(1 for log in logs if log.compliance_status == 'expiring_soon'),
-            'unknown': sum(1 for log in logs if log.compliance_status == 'unknown'),
-            'blacklisted': sum(1 for log in logs if log.compliance_status == 'blacklisted'),
-            'allowed': sum(1 for log in logs if log.is_allowed_entry),
-            'denied': sum(1 for log in logs if not log.is_allowed_entry),
-            'alerts_triggered': sum(1 for log in logs if log.alert_triggered)
+            'total_entries': counts['total_entries'],
+            'compliant': counts['compliant'],
+            'expired': counts['expired'],
+            'expiring_soon': counts['expiring_soon'],
+            'unknown': counts['unknown'],
+            'blacklisted': counts['blacklisted'],
+            'allowed': counts['allowed'],
+            'denied': counts['total_entries'] - counts['allowed'],
+            'alerts_triggered': counts['alerts_triggered']
         }
         
         return stats
@@ -257,7 +257,7 @@ class ANPRProcessor:
                             'camera_id': camera_id,
                             'vehicle_number': plate_number,
                             'confidence': confidence,
-                            'detected_at': datetime.now(),
+                            'detected_at': datetime.utcnow(),  # same UTC clock as DB timestamps
                             'frame_path': frame_path,
                             'plate_path': plate_path
                         }
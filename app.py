@@ -109,6 +109,7 @@ from hydrotesting import hydrotesting_bp
 from escrow import escrow_bp
 from settlement import settlement_bp
 from investor import investor_bp
+from webhooks import webhooks_bp
 
 app.register_blueprint(auth_bp)
 app.register_blueprint(dashboard_bp)
@@ -128,6 +129,7 @@ app.register_blueprint(hydrotesting_bp, url_prefix="/hydrotesting")
 app.register_blueprint(escrow_bp, url_prefix="/escrow")
 app.register_blueprint(settlement_bp, url_prefix="/settlement")
 app.register_blueprint(investor_bp, url_prefix="/investor")
+app.register_blueprint(webhooks_bp, url_prefix="/webhooks")
 
 
 def _is_flask_cli() -> bool:
@@ -234,6 +236,41 @@ if _is_server_process():
         except Exception as e:
             print(f"⚠️  Hydrotest notification service warning: {e}")
 
+        # Start periodic ledger reconciliation (LEDGER_RECONCILE_INTERVAL_MINUTES)
+        try:
+            from services.ledger_reconciliation import start_reconciliation_service
+            start_reconciliation_service(app)
+        except Exception as e:
+            print(f"⚠️  Ledger reconciliation service warning: {e}")
+
+        # Start periodic transaction auto-verification (AUTO_VERIFY_INTERVAL_MINUTES)
+        try:
+            from services.auto_verification import start_auto_verification_service
+            start_auto_verification_service(app)
+        except Exception as e:
+            print(f"⚠️  Auto verification service warning: {e}")
+
+        # Start periodic escrow sub-account consolidation (ESCROW_CONSOLIDATE_INTERVAL_MINUTES)
+        try:
+            from services.escrow_consolidation import start_consolidation_service
+            start_consolidation_service(app)
+        except Exception as e:
+            print(f"⚠️  Escrow consolidation service warning: {e}")
+
+        # Start the payment webhook worker (PAYMENT_WEBHOOK_POLL_SECONDS)
+        try:
+            from services.payment_webhooks import start_webhook_worker
+            start_webhook_worker(app)
+        except Exception as e:
+            print(f"⚠️  Payment webhook worker warning: {e}")
+
+        # Start the nightly demand forecast (DEMAND_FORECAST_HOUR)
+        try:
+            from services.demand_forecast import start_forecast_service
+            start_forecast_service(app)
+        except Exception as e:
+            print(f"⚠️  Demand forecast service warning: {e}")
+
 # --- Create all tables and run app ---
 if __name__ == "__main__":
     app.run(debug=True, host='0.0.0.0', port=5001)
\ No newline at end of file
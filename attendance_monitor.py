@@ -7,13 +7,16 @@ import os
 import threading
 import time
 import base64
+import functools
 import re
 import urllib.parse
 from datetime import datetime, date
-from flask import Blueprint, render_template, request, jsonify, Response, current_app, stream_with_context, send_file
+from flask import Blueprint, render_template, request, jsonify, Response, current_app, send_file
 from flask_login import login_required, current_user
 from extensions import db
 from models import Pump, PumpOwner, Employee, Attendance, StationVehicle
+from services.attendance_writer import enqueue_attendance_mark, apply_attendance_marks
+from lib import frame_broadcaster, hls_encoder
 
 attendance_monitor_bp = Blueprint("attendance_monitor", __name__)
 
@@ -223,6 +226,15 @@ def get_face_service():
 active_sessions = {}
 session_lock = threading.Lock()
 
+# Each open MJPEG viewer holds one server thread for as long as it watches.
+# Keep this below the gunicorn --threads count (see start.sh) so ordinary
+# requests always have threads left.
+MAX_LIVE_VIEWERS = int(os.getenv("MAX_LIVE_VIEWERS", "48"))
+
+# Running HLS encoders by stream id (see hls_start)
+_hls_sinks = {}
+_hls_sinks_lock = threading.Lock()
+
 
 def _pump_with_access(owner: PumpOwner, pump_id: int):
     """Verify pump belongs to owner"""
@@ -402,24 +414,276 @@ def validate_stream(pump_id):
         return jsonify({"success": False, "message": f"Server error: {str(e)}"}), 500
 
 
-@attendance_monitor_bp.route("/<int:pump_id>/video_feed")
-@login_required
-def video_feed(pump_id):
-    """Video streaming route with face recognition"""
-    owner = current_user
-    if not isinstance(owner, PumpOwner):
-        return Response("Access denied", status=403)
-    
-    pump = _pump_with_access(owner, pump_id)
-    if not pump:
-        return Response("Pump not found", status=404)
-    
-    # Get video source from query parameter
-    rtsp_url = request.args.get("rtsp_url")
-    if not rtsp_url:
-        current_app.logger.error("RTSP URL missing from request")
-        return Response("RTSP URL required", status=400)
-    
+def _camera_frames(app_obj, pump_id: int, owner_id: int, rtsp_url: str, capture_source: str, is_file_source: bool):
+    """
+    Generate annotated BGR frames (face recognition + people count) for one camera.
+    Runs once per camera inside a FrameBroadcaster; viewers never call it directly.
+    """
+    cap = None
+    consecutive_failures = 0
+    max_failures = 10  # Max consecutive frame read failures before giving up
+
+    employee_encodings = {}
+    employee_info = {}
+    face_service = None
+    face_init_done = False
+
+    try:
+        # Try multiple connection methods for better compatibility
+        cap = None
+        connection_methods = [
+            (cv2.CAP_FFMPEG, "FFMPEG"),
+            (cv2.CAP_ANY, "ANY")
+        ]
+
+        if is_file_source:
+            cap = cv2.VideoCapture(capture_source, cv2.CAP_FFMPEG)
+            if not cap or not cap.isOpened():
+                cap = cv2.VideoCapture(capture_source, cv2.CAP_ANY)
+
+            if not cap or not cap.isOpened():
+                current_app.logger.error(f"Failed to open video file: {rtsp_url}")
+                for _ in range(10):
+                    yield _error_image("Video file could not be opened.")
+                    time.sleep(1)
+                return
+
+            ret, test_frame = cap.read()
+            if not ret or test_frame is None:
+                current_app.logger.error(f"Failed to read first frame from video file: {rtsp_url}")
+                for _ in range(10):
+                    yield _error_image("Video file opened but frame decode failed.")
+                    time.sleep(1)
+                return
+            try:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            except Exception:
+                pass
+        else:
+            for backend, backend_name in connection_methods:
+                current_app.logger.info(f"Attempting connection with {backend_name} backend...")
+                cap = cv2.VideoCapture(capture_source, backend)
+
+                cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+                cap.set(cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, 20000)  # 20 second timeout
+                cap.set(cv2.CAP_PROP_READ_TIMEOUT_MSEC, 20000)
+
+                max_connect_attempts = 8
+                connected = False
+
+                for attempt in range(max_connect_attempts):
+                    if cap.isOpened():
+                        ret, test_frame = cap.read()
+                        if ret and test_frame is not None:
+                            current_app.logger.info(f"Successfully connected with {backend_name} backend on attempt {attempt + 1}")
+                            connected = True
+                            break
+                    time.sleep(1.5)
+
+                if connected:
+                    break
+                else:
+                    if cap:
+                        cap.release()
+                    cap = None
+
+        if not cap or not cap.isOpened():
+            current_app.logger.error(f"Failed to open RTSP stream after trying all backends: {rtsp_url}")
+            # Yield multiple error frames so frontend can see it
+            for _ in range(10):
+                yield _error_image("Stream connection timeout. Check camera and network.")
+                time.sleep(1)
+            return
+
+        current_app.logger.info(f"RTSP stream opened successfully for pump {pump_id}")
+
+        # Yield a first frame ASAP to avoid frontend timeouts, then do heavier init.
+        ret, first_frame = cap.read()
+        if not ret or first_frame is None:
+            if is_file_source:
+                try:
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    ret, first_frame = cap.read()
+                except Exception:
+                    ret = False
+            if not ret or first_frame is None:
+                for _ in range(5):
+                    yield _error_image("Unable to decode video frame.")
+                    time.sleep(1)
+                return
+
+        yield first_frame
+
+        # Track last attendance mark per employee (to avoid duplicate marks)
+        last_attendance_mark = {}
+        attendance_cooldown = 30  # seconds between attendance marks for same employee
+
+        frame_count = 0
+        detection_interval = 5  # Process every 5th frame for performance
+
+        people_model = get_people_model()
+        last_people_count = None
+        last_people_update_frame = 0
+        people_interval = 5
+
+        while True:
+            if not face_init_done:
+                face_init_done = True
+                try:
+                    face_service = get_face_service()
+                    employees = Employee.query.filter_by(
+                        pump_id=pump_id,
+                        owner_id=owner_id,
+                        is_active=True
+                    ).all()
+
+                    if face_service and employees:
+                        for emp in employees:
+                            if emp.face_encoding:
+                                try:
+                                    encoding = face_service.deserialize_encoding(emp.face_encoding)
+                                    employee_encodings[emp.id] = encoding
+                                    employee_info[emp.id] = {
+                                        "name": emp.name,
+                                        "designation": emp.designation
+                                    }
+                                except Exception as e:
+                                    current_app.logger.warning(f"Failed to deserialize encoding for employee {emp.id}: {e}")
+                                    continue
+                except Exception as e:
+                    current_app.logger.warning(f"Face/employee init failed: {e}")
+
+            ret, frame = cap.read()
+            if not ret or frame is None:
+                if is_file_source:
+                    try:
+                        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                        consecutive_failures = 0
+                        time.sleep(0.1)
+                        continue
+                    except Exception:
+                        pass
+
+                consecutive_failures += 1
+                current_app.logger.warning(f"Frame read failed (attempt {consecutive_failures}/{max_failures})")
+                if consecutive_failures >= max_failures:
+                    current_app.logger.error(f"Stream connection lost after {max_failures} consecutive failures")
+                    for _ in range(5):
+                        yield _error_image("Stream connection lost. Reconnecting...")
+                        time.sleep(1)
+                    break
+                time.sleep(0.5)
+                continue
+
+            # Reset failure counter on successful read
+            consecutive_failures = 0
+
+            frame_count += 1
+
+            # Process frame for face detection (only if employees are registered and service is available)
+            if employee_encodings and face_service and frame_count % detection_interval == 0:
+                try:
+                    # Find employee in frame
+                    result = face_service.find_employee_in_frame(frame, employee_encodings)
+
+                    if result:
+                        employee_id, confidence, face_location = result
+
+                        # Draw bounding box and label
+                        emp_info = employee_info[employee_id]
+                        frame = face_service.draw_face_box(
+                            frame,
+                            face_location,
+                            emp_info["name"],
+                            confidence
+                        )
+
+                        # Mark attendance if confidence is high and cooldown passed
+                        current_time = time.time()
+                        if confidence >= 0.7:  # High confidence threshold
+                            last_mark_time = last_attendance_mark.get(employee_id, 0)
+
+                            if current_time - last_mark_time >= attendance_cooldown:
+                                # Hand off to the per-process attendance writer
+                                enqueue_attendance_mark(app_obj, pump_id, employee_id, confidence)
+
+                                last_attendance_mark[employee_id] = current_time
+
+                                # Draw attendance confirmation
+                                cv2.putText(
+                                    frame,
+                                    "ATTENDANCE MARKED",
+                                    (10, 30),
+                                    cv2.FONT_HERSHEY_SIMPLEX,
+                                    0.7,
+                                    (0, 255, 0),
+                                    2
+                                )
+
+                except Exception as e:
+                    current_app.logger.warning(f"Error in face detection: {e}")
+
+            if people_model is not None and frame_count - last_people_update_frame >= people_interval:
+                last_people_update_frame = frame_count
+                try:
+                    if hasattr(people_model, "track"):
+                        results = people_model.track(frame, classes=[0], verbose=False, conf=0.35, persist=True)
+                        person_ids = set()
+                        for r in results:
+                            if hasattr(r, "boxes") and r.boxes is not None:
+                                ids = getattr(r.boxes, "id", None)
+                                if ids is not None:
+                                    try:
+                                        person_ids |= set(int(x) for x in ids.tolist())
+                                    except Exception:
+                                        pass
+                        if person_ids:
+                            last_people_count = len(person_ids)
+                        else:
+                            last_people_count = 0
+                    else:
+                        results = people_model(frame, classes=[0], verbose=False, conf=0.35)
+                        count = 0
+                        for r in results:
+                            if hasattr(r, "boxes") and r.boxes is not None:
+                                count += len(r.boxes)
+                        last_people_count = count
+                except Exception as e:
+                    current_app.logger.warning(f"People counting error: {e}")
+
+            if last_people_count is not None:
+                cv2.putText(
+                    frame,
+                    f"People: {last_people_count}",
+                    (10, 60),
+                    cv2.FONT_HERSHEY_SIMPLEX,
+                    0.8,
+                    (255, 255, 0),
+                    2,
+                )
+
+            yield frame
+
+    except Exception as e:
+        current_app.logger.exception(f"Error in video stream generation: {e}")
+        yield _error_image(f"Stream error: {str(e)}")
+
+    finally:
+        if cap is not None:
+            cap.release()
+            try:
+                current_app.logger.info(f"RTSP stream released for pump {pump_id}")
+            except RuntimeError:
+                # Outside app context - just print
+                print(f"RTSP stream released for pump {pump_id}")
+
+
+def _resolve_stream_source(owner: PumpOwner, raw_url: str):
+    """
+    Normalise and validate a camera source from the query string.
+    Returns (rtsp_url, capture_source, is_file_source, error_response).
+    """
+    rtsp_url = raw_url
     # Decode URL in case it was double-encoded
     try:
         rtsp_url = urllib.parse.unquote(rtsp_url)
@@ -437,376 +701,183 @@ def video_feed(pump_id):
         rel_path_norm = rel_path.replace("\\", "/")
         if not rel_path_norm.lower().startswith("uploads/videos/") or not rel_path_norm.lower().endswith(".mp4"):
             current_app.logger.warning(f"Invalid video file source from user {owner.id}: {rtsp_url}")
-            return Response("Invalid video file source", status=400)
+            return rtsp_url, None, True, Response("Invalid video file source", status=400)
 
         base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "uploads", "videos"))
         abs_path = os.path.abspath(os.path.join(os.path.dirname(__file__), rel_path_norm))
         if not abs_path.startswith(base_dir + os.sep) or not os.path.exists(abs_path):
-            return Response("Video file not found", status=404)
+            return rtsp_url, None, True, Response("Video file not found", status=404)
 
         capture_source = abs_path
     else:
         if not rtsp_url.startswith(('rtsp://', 'rtsps://')):
             current_app.logger.warning(f"Invalid RTSP URL format from user {owner.id}: {rtsp_url}")
-            return Response("Invalid RTSP URL format", status=400)
-    
-    # Log the connection attempt
-    current_app.logger.info(f"Starting RTSP stream for pump {pump_id}: {rtsp_url}")
-    # Connection will be attempted during actual streaming with proper timeouts
-    
-    def generate_frames():
-        """Generate video frames with face detection"""
-        cap = None
-        consecutive_failures = 0
-        max_failures = 10  # Max consecutive frame read failures before giving up
+            return rtsp_url, None, False, Response("Invalid RTSP URL format", status=400)
 
-        employee_encodings = {}
-        employee_info = {}
-        face_service = None
-        face_init_done = False
-        
-        try:
-            # Try multiple connection methods for better compatibility
-            cap = None
-            connection_methods = [
-                (cv2.CAP_FFMPEG, "FFMPEG"),
-                (cv2.CAP_ANY, "ANY")
-            ]
-            
-            if is_file_source:
-                cap = cv2.VideoCapture(capture_source, cv2.CAP_FFMPEG)
-                if not cap or not cap.isOpened():
-                    cap = cv2.VideoCapture(capture_source, cv2.CAP_ANY)
+    return rtsp_url, capture_source, is_file_source, None
 
-                if not cap or not cap.isOpened():
-                    current_app.logger.error(f"Failed to open video file: {rtsp_url}")
-                    for _ in range(10):
-                        yield _error_frame("Video file could not be opened.")
-                        time.sleep(1)
-                    return
 
-                ret, test_frame = cap.read()
-                if not ret or test_frame is None:
-                    current_app.logger.error(f"Failed to read first frame from video file: {rtsp_url}")
-                    for _ in range(10):
-                        yield _error_frame("Video file opened but frame decode failed.")
-                        time.sleep(1)
-                    return
-                try:
-                    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-                except Exception:
-                    pass
-            else:
-                for backend, backend_name in connection_methods:
-                    current_app.logger.info(f"Attempting connection with {backend_name} backend...")
-                    cap = cv2.VideoCapture(capture_source, backend)
-                    
-                    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-                    cap.set(cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, 20000)  # 20 second timeout
-                    cap.set(cv2.CAP_PROP_READ_TIMEOUT_MSEC, 20000)
-                    
-                    max_connect_attempts = 8
-                    connected = False
-                    
-                    for attempt in range(max_connect_attempts):
-                        if cap.isOpened():
-                            ret, test_frame = cap.read()
-                            if ret and test_frame is not None:
-                                current_app.logger.info(f"Successfully connected with {backend_name} backend on attempt {attempt + 1}")
-                                connected = True
-                                break
-                        time.sleep(1.5)
-                    
-                    if connected:
-                        break
-                    else:
-                        if cap:
-                            cap.release()
-                        cap = None
-            
-            if not cap or not cap.isOpened():
-                current_app.logger.error(f"Failed to open RTSP stream after trying all backends: {rtsp_url}")
-                # Yield multiple error frames so frontend can see it
-                for _ in range(10):
-                    yield _error_frame("Stream connection timeout. Check camera and network.")
-                    time.sleep(1)
-                return
-            
-            current_app.logger.info(f"RTSP stream opened successfully for pump {pump_id}")
+def _stream_producer(pump_id: int, owner_id: int, rtsp_url: str, capture_source: str, is_file_source: bool):
+    """Producer factory handed to the broadcaster for this camera"""
+    app_obj = current_app._get_current_object()
+    return functools.partial(_camera_frames, app_obj, pump_id, owner_id, rtsp_url, capture_source, is_file_source)
 
-            # Yield a first frame ASAP to avoid frontend timeouts, then do heavier init.
-            ret, first_frame = cap.read()
-            if not ret or first_frame is None:
-                if is_file_source:
-                    try:
-                        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-                        ret, first_frame = cap.read()
-                    except Exception:
-                        ret = False
-                if not ret or first_frame is None:
-                    for _ in range(5):
-                        yield _error_frame("Unable to decode video frame.")
-                        time.sleep(1)
-                    return
 
-            ret_jpg, buffer = cv2.imencode('.jpg', first_frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-            if ret_jpg:
-                first_bytes = buffer.tobytes()
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + first_bytes + b'\r\n')
+def _hls_stream_id(pump_id: int, capture_source: str) -> str:
+    return f"{pump_id}-{hashlib.sha1(capture_source.encode('utf-8')).hexdigest()[:16]}"
 
-            # Track last attendance mark per employee (to avoid duplicate marks)
-            last_attendance_mark = {}
-            attendance_cooldown = 30  # seconds between attendance marks for same employee
-            
-            frame_count = 0
-            detection_interval = 5  # Process every 5th frame for performance
-
-            people_model = get_people_model()
-            last_people_count = None
-            last_people_update_frame = 0
-            people_interval = 5
-            
-            while True:
-                if not face_init_done:
-                    face_init_done = True
-                    try:
-                        face_service = get_face_service()
-                        employees = Employee.query.filter_by(
-                            pump_id=pump_id,
-                            owner_id=owner.id,
-                            is_active=True
-                        ).all()
-
-                        if face_service and employees:
-                            for emp in employees:
-                                if emp.face_encoding:
-                                    try:
-                                        encoding = face_service.deserialize_encoding(emp.face_encoding)
-                                        employee_encodings[emp.id] = encoding
-                                        employee_info[emp.id] = {
-                                            "name": emp.name,
-                                            "designation": emp.designation
-                                        }
-                                    except Exception as e:
-                                        current_app.logger.warning(f"Failed to deserialize encoding for employee {emp.id}: {e}")
-                                        continue
-                    except Exception as e:
-                        current_app.logger.warning(f"Face/employee init failed: {e}")
-
-                ret, frame = cap.read()
-                if not ret or frame is None:
-                    if is_file_source:
-                        try:
-                            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-                            consecutive_failures = 0
-                            time.sleep(0.1)
-                            continue
-                        except Exception:
-                            pass
-
-                    consecutive_failures += 1
-                    current_app.logger.warning(f"Frame read failed (attempt {consecutive_failures}/{max_failures})")
-                    if consecutive_failures >= max_failures:
-                        current_app.logger.error(f"Stream connection lost after {max_failures} consecutive failures")
-                        for _ in range(5):
-                            yield _error_frame("Stream connection lost. Reconnecting...")
-                            time.sleep(1)
-                        break
-                    time.sleep(0.5)
-                    continue
-                
-                # Reset failure counter on successful read
-                consecutive_failures = 0
-                
-                frame_count += 1
-                
-                # Process frame for face detection (only if employees are registered and service is available)
-                if employee_encodings and face_service and frame_count % detection_interval == 0:
-                    try:
-                        # Find employee in frame
-                        result = face_service.find_employee_in_frame(frame, employee_encodings)
-                        
-                        if result:
-                            employee_id, confidence, face_location = result
-                            
-                            # Draw bounding box and label
-                            emp_info = employee_info[employee_id]
-                            frame = face_service.draw_face_box(
-                                frame, 
-                                face_location, 
-                                emp_info["name"], 
-                                confidence
-                            )
-                            
-                            # Mark attendance if confidence is high and cooldown passed
-                            current_time = time.time()
-                            if confidence >= 0.7:  # High confidence threshold
-                                last_mark_time = last_attendance_mark.get(employee_id, 0)
-                                
-                                if current_time - last_mark_time >= attendance_cooldown:
-                                    # Mark attendance in background thread
-                                    threading.Thread(
-                                        target=mark_attendance_async,
-                                        args=(pump_id, employee_id, confidence),
-                                        daemon=True
-                                    ).start()
-                                    
-                                    last_attendance_mark[employee_id] = current_time
-                                    
-                                    # Draw attendance confirmation
-                                    cv2.putText(
-                                        frame,
-                                        "ATTENDANCE MARKED",
-                                        (10, 30),
-                                        cv2.FONT_HERSHEY_SIMPLEX,
-                                        0.7,
-                                        (0, 255, 0),
-                                        2
-                                    )
-                    
-                    except Exception as e:
-                        current_app.logger.warning(f"Error in face detection: {e}")
-
-                if people_model is not None and frame_count - last_people_update_frame >= people_interval:
-                    last_people_update_frame = frame_count
-                    try:
-                        if hasattr(people_model, "track"):
-                            results = people_model.track(frame, classes=[0], verbose=False, conf=0.35, persist=True)
-                            person_ids = set()
-                            for r in results:
-                                if hasattr(r, "boxes") and r.boxes is not None:
-                                    ids = getattr(r.boxes, "id", None)
-                                    if ids is not None:
-                                        try:
-                                            person_ids |= set(int(x) for x in ids.tolist())
-                                        except Exception:
-                                            pass
-                            if person_ids:
-                                last_people_count = len(person_ids)
-                            else:
-                                last_people_count = 0
-                        else:
-                            results = people_model(frame, classes=[0], verbose=False, conf=0.35)
-                            count = 0
-                            for r in results:
-                                if hasattr(r, "boxes") and r.boxes is not None:
-                                    count += len(r.boxes)
-                            last_people_count = count
-                    except Exception as e:
-                        current_app.logger.warning(f"People counting error: {e}")
-
-                if last_people_count is not None:
-                    cv2.putText(
-                        frame,
-                        f"People: {last_people_count}",
-                        (10, 60),
-                        cv2.FONT_HERSHEY_SIMPLEX,
-                        0.8,
-                        (255, 255, 0),
-                        2,
-                    )
-                
-                # Encode frame as JPEG
-                ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-                if not ret:
-                    continue
-                
-                frame_bytes = buffer.tobytes()
-                
-                # Yield frame in multipart format
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-        
-        except Exception as e:
-            current_app.logger.exception(f"Error in video stream generation: {e}")
-            yield _error_frame(f"Stream error: {str(e)}")
-        
-        finally:
-            if cap is not None:
-                cap.release()
-                try:
-                    current_app.logger.info(f"RTSP stream released for pump {pump_id}")
-                except RuntimeError:
-                    # Outside app context - just print
-                    print(f"RTSP stream released for pump {pump_id}")
 
+@attendance_monitor_bp.route("/<int:pump_id>/video_feed")
+@login_required
+def video_feed(pump_id):
+    """Video streaming route with face recognition"""
+    owner = current_user
+    if not isinstance(owner, PumpOwner):
+        return Response("Access denied", status=403)
+    
+    pump = _pump_with_access(owner, pump_id)
+    if not pump:
+        return Response("Pump not found", status=404)
+    
+    # Get video source from query parameter
+    rtsp_url = request.args.get("rtsp_url")
+    if not rtsp_url:
+        current_app.logger.error("RTSP URL missing from request")
+        return Response("RTSP URL required", status=400)
+    
+    rtsp_url, capture_source, is_file_source, error = _resolve_stream_source(owner, rtsp_url)
+    if error is not None:
+        return error
+    
+    if frame_broadcaster.total_subscribers() >= MAX_LIVE_VIEWERS:
+        current_app.logger.warning(f"Live viewer limit reached ({MAX_LIVE_VIEWERS}); rejecting stream for pump {pump_id}")
+        resp = Response("Too many live viewers, try again shortly", status=503)
+        resp.headers["Retry-After"] = "10"
+        return resp
+    
+    # Log the connection attempt
+    current_app.logger.info(f"Starting RTSP stream for pump {pump_id}: {rtsp_url}")
+    # Connection will be attempted during actual streaming with proper timeouts
+    
+    # Every viewer of the same camera shares one capture/annotate pipeline
+    subscription = frame_broadcaster.subscribe(
+        (pump_id, capture_source),
+        _stream_producer(pump_id, owner.id, rtsp_url, capture_source, is_file_source),
+        app=current_app._get_current_object(),
+        encode=_encode_mjpeg_part,
+    )
 
     # Return the streaming response
     resp = Response(
-        stream_with_context(generate_frames()),
+        iter(subscription),
         mimetype='multipart/x-mixed-replace; boundary=frame'
     )
     resp.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
     resp.headers["Pragma"] = "no-cache"
     resp.headers["Expires"] = "0"
     resp.headers["X-Accel-Buffering"] = "no"
+    # Frees the viewer slot even if the body is never iterated
+    resp.call_on_close(subscription.close)
+    return resp
+
+
+@attendance_monitor_bp.route("/<int:pump_id>/hls/start")
+@login_required
+def hls_start(pump_id):
+    """Attach an H.264/HLS encoder to the camera pipeline and return its playlist URL"""
+    owner = current_user
+    if not isinstance(owner, PumpOwner):
+        return jsonify({"success": False, "message": "Access denied"}), 403
+
+    pump = _pump_with_access(owner, pump_id)
+    if not pump:
+        return jsonify({"success": False, "message": "Pump not found"}), 404
+
+    if not hls_encoder.hls_available():
+        return jsonify({"success": False, "message": "HLS output is not enabled"}), 503
+
+    rtsp_url = request.args.get("rtsp_url")
+    if not rtsp_url:
+        return jsonify({"success": False, "message": "RTSP URL required"}), 400
+
+    rtsp_url, capture_source, is_file_source, error = _resolve_stream_source(owner, rtsp_url)
+    if error is not None:
+        return jsonify({"success": False, "message": error.get_data(as_text=True)}), error.status_code
+
+    stream_id = _hls_stream_id(pump_id, capture_source)
+    sink = frame_broadcaster.attach_sink(
+        (pump_id, capture_source),
+        lambda: hls_encoder.HLSSink(stream_id),
+        _stream_producer(pump_id, owner.id, rtsp_url, capture_source, is_file_source),
+        app=current_app._get_current_object(),
+        encode=_encode_mjpeg_part,
+    )
+    sink.touch()
+
+    with _hls_sinks_lock:
+        for stale_id in [sid for sid, s in _hls_sinks.items() if s.closed]:
+            _hls_sinks.pop(stale_id, None)
+        _hls_sinks[stream_id] = sink
+
+    return jsonify({
+        "success": True,
+        "playlist_url": f"/attendance_monitor/{pump_id}/hls/{stream_id}/{hls_encoder.PLAYLIST_NAME}",
+        "ready": os.path.exists(sink.playlist_path)
+    })
+
+
+@attendance_monitor_bp.route("/<int:pump_id>/hls/<stream_id>/<filename>")
+@login_required
+def hls_file(pump_id, stream_id, filename):
+    """Serve the HLS playlist and segments for a running encoder"""
+    owner = current_user
+    if not isinstance(owner, PumpOwner):
+        return Response("Access denied", status=403)
+
+    if not stream_id.startswith(f"{pump_id}-") or not hls_encoder.is_valid_hls_filename(filename):
+        return Response("Not found", status=404)
+
+    pump = _pump_with_access(owner, pump_id)
+    if not pump:
+        return Response("Pump not found", status=404)
+
+    with _hls_sinks_lock:
+        sink = _hls_sinks.get(stream_id)
+    if sink is None or sink.closed:
+        return Response("Stream not running", status=404)
+
+    sink.touch()
+    path = os.path.join(sink.output_dir, filename)
+    if not os.path.exists(path):
+        return Response("Not ready", status=404)
+
+    if filename == hls_encoder.PLAYLIST_NAME:
+        resp = send_file(path, mimetype="application/vnd.apple.mpegurl", conditional=False)
+        resp.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, max-age=0"
+    else:
+        resp = send_file(path, mimetype="video/mp2t", conditional=True)
+        resp.headers["Cache-Control"] = "private, max-age=60"
     return resp
 
 
-def _error_frame(message: str) -> bytes:
+def _encode_mjpeg_part(frame) -> bytes:
+    """Encode one frame as a multipart/x-mixed-replace JPEG part"""
+    ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    if not ret:
+        return b''
+    return (b'--frame\r\n'
+            b'Content-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n')
+
+
+def _error_image(message: str):
     """Generate an error frame image with message"""
     import numpy as np
     # Create a black frame with error message
     frame = np.zeros((480, 640, 3), dtype=np.uint8)
     cv2.putText(frame, "STREAM ERROR", (50, 200), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
     cv2.putText(frame, message[:50], (50, 250), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1)
-    ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-    if ret:
-        frame_bytes = buffer.tobytes()
-        return (b'--frame\r\n'
-                b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-    return b''
-
+    return frame
 
-def mark_attendance_async(pump_id: int, employee_id: int, confidence: float):
-    """Mark attendance asynchronously"""
-    try:
-        with current_app.app_context():
-            today = date.today()
-            now = datetime.now()
-            
-            # Check if attendance already marked today
-            attendance = Attendance.query.filter_by(
-                employee_id=employee_id,
-                attendance_date=today
-            ).first()
-            
-            if attendance:
-                # Update check-in time if not set, or update check-out if check-in exists
-                if not attendance.check_in_time:
-                    attendance.check_in_time = now
-                    attendance.status = "present"
-                    attendance.detection_method = "face_recognition"
-                    attendance.detected_confidence = confidence
-                else:
-                    # Update check-out time
-                    attendance.check_out_time = now
-                    if attendance.check_in_time:
-                        delta = now - attendance.check_in_time
-                        attendance.total_hours = delta.total_seconds() / 3600.0
-            else:
-                # Create new attendance record
-                attendance = Attendance(
-                    employee_id=employee_id,
-                    pump_id=pump_id,
-                    attendance_date=today,
-                    check_in_time=now,
-                    status="present",
-                    detection_method="face_recognition",
-                    detected_confidence=confidence
-                )
-                db.session.add(attendance)
-            
-            db.session.commit()
-            current_app.logger.info(
-                f"Attendance marked for employee {employee_id} at pump {pump_id} "
-                f"(confidence: {confidence:.2f})"
-            )
-    
-    except Exception as e:
-        current_app.logger.exception(f"Error marking attendance async: {e}")
-        db.session.rollback()
 
 
 @attendance_monitor_bp.route("/<int:pump_id>/attendance/report")
@@ -917,38 +988,23 @@ def detect_face(pump_id):
                 "message": f"Low confidence match ({confidence:.2f}). Please ensure clear face visibility."
             }), 400
         
-        # Mark attendance
+        # Mark attendance through the same upsert the background writer uses
         today = date.today()
         now = datetime.now()
+        apply_attendance_marks([{
+            "employee_id": employee_id,
+            "attendance_date": today,
+            "pump_id": pump_id,
+            "first_seen": now,
+            "last_seen": now,
+            "confidence": confidence,
+        }])
         
         attendance = Attendance.query.filter_by(
             employee_id=employee_id,
             attendance_date=today
         ).first()
         
-        if attendance:
-            if not attendance.check_in_time:
-                attendance.check_in_time = now
-                attendance.status = "present"
-            else:
-                attendance.check_out_time = now
-                if attendance.check_in_time:
-                    delta = now - attendance.check_in_time
-                    attendance.total_hours = delta.total_seconds() / 3600.0
-        else:
-            attendance = Attendance(
-                employee_id=employee_id,
-                pump_id=pump_id,
-                attendance_date=today,
-                check_in_time=now,
-                status="present",
-                detection_method="face_recognition",
-                detected_confidence=confidence
-            )
-            db.session.add(attendance)
-        
-        db.session.commit()
-        
         emp_info = employee_info[employee_id]
         
         return jsonify({
@@ -26,6 +26,11 @@ class Config:
             "connect_args": {"check_same_thread": False},
             "poolclass": NullPool,
         }
+    elif DATABASE_URL.startswith("postgresql"):
+        # Stored timestamps are naive UTC; make server-side now() agree (SQLite's already is)
+        SQLALCHEMY_ENGINE_OPTIONS = {"connect_args": {"options": "-c timezone=UTC"}}
+    elif DATABASE_URL.startswith("mysql"):
+        SQLALCHEMY_ENGINE_OPTIONS = {"connect_args": {"init_command": "SET time_zone = '+00:00'"}}
 
     # ---------------- MAIL ----------------
     MAIL_SERVER = 'smtp.gmail.com'
@@ -41,6 +46,7 @@ class Config:
 
     RAZORPAY_KEY_ID = os.getenv("RAZORPAY_KEY_ID")
     RAZORPAY_KEY_SECRET = os.getenv("RAZORPAY_KEY_SECRET")
+    RAZORPAY_WEBHOOK_SECRET = os.getenv("RAZORPAY_WEBHOOK_SECRET")
 
     # ---------------- PAYMENT DETAILS ----------------
     UPI_ID = "fuelf93367611@barodampay"
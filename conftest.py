@@ -0,0 +1,23 @@
+"""
+Shared pytest fixtures for the root-level *_test.py checks.
+
+`app` is a bare Flask app on a throwaway in-memory SQLite database with
+every table created; each test gets a fresh one.
+"""
+import pytest
+from flask import Flask
+
+from extensions import db
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
@@ -0,0 +1,71 @@
+"""
+Driver cohort rebuild checks.
+
+Settled sales are attributed through their driver wallet ledger debit, so
+a vehicle that changed hands or was deleted keeps its history with the
+driver who paid at the time.
+
+Usage:
+    python -m pytest -q driver_cohorts_test.py
+"""
+import uuid
+from datetime import date, datetime
+
+from extensions import db
+from models import (
+    DriverCohort, DriverMonthlyActivity, FuelTransaction, Pump, PumpOwner, User, Vehicle, Wallet,
+    WalletLedgerEntry,
+)
+from services.driver_cohorts import rebuild_driver_cohorts
+
+
+def _driver(email):
+    driver = User(full_name="Cohort Driver", email=email)
+    db.session.add(driver)
+    db.session.flush()
+    wallet = Wallet(user_id=driver.id, balance=0.0)
+    db.session.add(wallet)
+    db.session.flush()
+    return driver.id, wallet.id
+
+
+def _settled_sale(pump, plate, wallet_id, amount, created_at):
+    sale = FuelTransaction(pump_id=pump.id, vehicle_number=plate, fuel_type="Diesel", quantity_litres=10.0,
+                           unit_price=amount / 10, amount=amount, status="settled", created_at=created_at)
+    db.session.add(sale)
+    db.session.flush()
+    db.session.add(WalletLedgerEntry(group_uuid=str(uuid.uuid4()), event_type="fuel_sale", direction="debit",
+                                     wallet_type="driver_wallet", wallet_id=wallet_id, amount=amount,
+                                     balance_after=0.0, reference_id=sale.id, reference_type="fuel_transaction"))
+
+
+def test_history_stays_with_the_driver_who_paid(app):
+    owner = PumpOwner(full_name="Cohort Owner", email="cohort-owner@example.com")
+    db.session.add(owner)
+    db.session.flush()
+    pump = Pump(name="Cohort Pump", location="Pune", owner_id=owner.id)
+    db.session.add(pump)
+    seller, seller_wallet = _driver("seller@example.com")
+    buyer, buyer_wallet = _driver("buyer@example.com")
+    leaver, leaver_wallet = _driver("leaver@example.com")
+
+    # The cab was the seller's in January and is the buyer's from March
+    _settled_sale(pump, "KA01AB1234", seller_wallet, 100.0, datetime(2026, 1, 10))
+    _settled_sale(pump, "KA01AB1234", buyer_wallet, 200.0, datetime(2026, 3, 5))
+    db.session.add(Vehicle(name="Cab", type="Sedan", year="2020", license="KA01AB1234",
+                           fuel_type="Diesel", user_id=buyer))
+    # The leaver's vehicle no longer exists
+    _settled_sale(pump, "MH12XY9876", leaver_wallet, 50.0, datetime(2026, 2, 20))
+    db.session.commit()
+
+    assert rebuild_driver_cohorts(chunk_size=2) == 3
+
+    cohorts = {c.user_id: c.cohort_month for c in DriverCohort.query}
+    assert cohorts == {seller: date(2026, 1, 1), buyer: date(2026, 3, 1), leaver: date(2026, 2, 1)}
+    activity = {(a.user_id, a.activity_month): (a.transaction_count, a.total_amount)
+                for a in DriverMonthlyActivity.query}
+    assert activity == {
+        (seller, date(2026, 1, 1)): (1, 100.0),
+        (buyer, date(2026, 3, 1)): (1, 200.0),
+        (leaver, date(2026, 2, 1)): (1, 50.0),
+    }
@@ -2,9 +2,17 @@
 Employee Management Routes
 Handles employee registration, listing, and management
 """
+import csv
+import io
+import multiprocessing
 import os
+import threading
 import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, date
+import numpy as np
 from flask import Blueprint, request, jsonify, current_app
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
@@ -16,6 +24,28 @@ employee_bp = Blueprint("employee", __name__, url_prefix="/employee")
 # Lazy initialization of face recognition service
 _face_service = None
 
+# One face-encoding pool per server process, shared by bulk enrollments.
+# Workers are spawned, not forked: a fork of this threaded process (camera
+# and scheduler threads) could inherit locks held by those threads.
+ENROLL_POOL_WORKERS = int(os.getenv("BULK_ENROLL_WORKERS", "0")) or (os.cpu_count() or 1)
+_encode_pool = None
+_encode_pool_lock = threading.Lock()
+
+
+def _get_encode_pool(reset=False):
+    """The shared encoding pool, created on first use (or again after it broke)"""
+    global _encode_pool
+    with _encode_pool_lock:
+        if reset and _encode_pool is not None:
+            _encode_pool.shutdown(wait=False)
+            _encode_pool = None
+        if _encode_pool is None:
+            _encode_pool = ProcessPoolExecutor(
+                max_workers=ENROLL_POOL_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _encode_pool
+
 def get_face_service():
     """Get or initialize face recognition service"""
     global _face_service
@@ -160,6 +190,214 @@ def add_employee(pump_id):
         return jsonify({"success": False, "message": f"Error adding employee: {error_msg}"}), 500
 
 
+ALLOWED_PHOTO_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
+BULK_MAX_PHOTOS = 500
+BULK_MAX_UNCOMPRESSED_BYTES = 200 * 1024 * 1024
+
+
+def _save_bulk_photos(upload_dir, files, saved):
+    """
+    Save uploaded photos (plain images and/or zip archives) under unique names.
+    Fills `saved` with lower-cased original basename -> saved filename as it
+    goes, so the caller can clean up after a partial failure.
+    """
+    total_bytes = 0
+
+    def _store(original_name, data):
+        nonlocal total_bytes
+        base = os.path.basename(original_name.replace("\\", "/"))
+        if not base or os.path.splitext(base)[1].lower() not in ALLOWED_PHOTO_EXTENSIONS:
+            return
+        if len(saved) >= BULK_MAX_PHOTOS:
+            raise ValueError(f"Too many photos (max {BULK_MAX_PHOTOS})")
+        total_bytes += len(data)
+        if total_bytes > BULK_MAX_UNCOMPRESSED_BYTES:
+            raise ValueError("Uploaded photos are too large")
+        unique_filename = f"{uuid.uuid4().hex}_{secure_filename(base)}"
+        with open(os.path.join(upload_dir, unique_filename), "wb") as fh:
+            fh.write(data)
+        saved[base.lower()] = unique_filename
+
+    for f in files:
+        if not f or not f.filename:
+            continue
+        if f.filename.lower().endswith(".zip"):
+            with zipfile.ZipFile(f.stream) as archive:
+                for info in archive.infolist():
+                    if info.is_dir():
+                        continue
+                    if info.file_size > BULK_MAX_UNCOMPRESSED_BYTES:
+                        raise ValueError(f"Archive member too large: {info.filename}")
+                    _store(info.filename, archive.read(info))
+        else:
+            _store(f.filename, f.read())
+
+
+def _find_duplicate(encoding, known_encodings, known_ids, tolerance):
+    """Return the id of the closest known encoding within tolerance, if any"""
+    if not known_encodings:
+        return None
+    distances = np.linalg.norm(np.vstack(known_encodings) - encoding, axis=1)
+    best = int(np.argmin(distances))
+    return known_ids[best] if distances[best] <= tolerance else None
+
+
+@employee_bp.route("/<int:pump_id>/bulk_add", methods=["POST"])
+@login_required
+def bulk_add_employees(pump_id):
+    """
+    Enroll many employees at once.
+    Expects a `metadata` CSV (name, photo, and optional phone, email,
+    designation, employee_id) plus `photos` as image files and/or a zip.
+    Faces are encoded in a process pool; all rows are inserted in one commit.
+    """
+    owner = current_user
+    if not isinstance(owner, PumpOwner):
+        return jsonify({"success": False, "message": "Access denied"}), 403
+
+    pump = _pump_with_access(owner, pump_id)
+    if not pump:
+        return jsonify({"success": False, "message": "Pump not found"}), 404
+
+    metadata_file = request.files.get("metadata")
+    if not metadata_file or not metadata_file.filename:
+        return jsonify({"success": False, "message": "Employee metadata CSV is required"}), 400
+
+    upload_dir = _ensure_upload_dir()
+    saved_photos = {}
+    try:
+        reader = csv.DictReader(io.StringIO(metadata_file.read().decode("utf-8-sig")))
+        rows = [{(k or "").strip().lower(): (v or "").strip() for k, v in row.items()} for row in reader]
+        if not rows:
+            return jsonify({"success": False, "message": "Metadata CSV has no rows"}), 400
+        if "name" not in rows[0] or "photo" not in rows[0]:
+            return jsonify({"success": False, "message": "Metadata CSV must have 'name' and 'photo' columns"}), 400
+
+        try:
+            _save_bulk_photos(upload_dir, request.files.getlist("photos"), saved_photos)
+        except (ValueError, zipfile.BadZipFile) as e:
+            for stored in saved_photos.values():
+                try:
+                    os.remove(os.path.join(upload_dir, stored))
+                except OSError:
+                    pass
+            return jsonify({"success": False, "message": f"Invalid photos upload: {e}"}), 400
+
+        # Resolve each CSV row to a saved photo before doing any encoding work
+        report = []
+        pending = []
+        for line_no, row in enumerate(rows, start=2):
+            photo_key = os.path.basename(row.get("photo", "").replace("\\", "/")).lower()
+            item = {"row": line_no, "name": row.get("name"), "photo": row.get("photo")}
+            if not row.get("name"):
+                item["status"] = "invalid"
+                item["message"] = "Employee name is required"
+            elif photo_key not in saved_photos:
+                item["status"] = "missing_photo"
+                item["message"] = "Photo not found in upload"
+            else:
+                pending.append((item, row, saved_photos[photo_key]))
+            report.append(item)
+
+        # Encode faces in parallel, off the request thread's GIL
+        from lib.face_recognition_service import encode_photo_for_enrollment
+        photo_paths = [os.path.join(upload_dir, stored) for _, _, stored in pending]
+        results = []
+        if photo_paths:
+            try:
+                results = list(_get_encode_pool().map(encode_photo_for_enrollment, photo_paths, chunksize=4))
+            except BrokenProcessPool:
+                # A worker died (e.g. OOM on a huge image); start a fresh pool and retry once
+                current_app.logger.warning("Face encoding pool broke; restarting it")
+                results = list(_get_encode_pool(reset=True).map(
+                    encode_photo_for_enrollment, photo_paths, chunksize=4))
+
+        face_service = None
+        try:
+            face_service = get_face_service()
+        except ImportError as e:
+            current_app.logger.warning(f"Face recognition not available for bulk enrollment: {e}")
+
+        known_encodings, known_ids = [], []
+        if face_service:
+            existing = Employee.query.filter_by(pump_id=pump_id, owner_id=owner.id, is_active=True).filter(
+                Employee.face_encoding.isnot(None)
+            ).all()
+            for emp in existing:
+                try:
+                    known_encodings.append(face_service.deserialize_encoding(emp.face_encoding))
+                    known_ids.append(f"employee:{emp.id}")
+                except Exception:
+                    continue
+        tolerance = face_service.tolerance if face_service else 0.6
+
+        new_employees = []
+        used_photos = set()
+        for (item, row, stored), (status, encoding) in zip(pending, results):
+            encoding_bytes = None
+            if status == "ok":
+                duplicate_of = _find_duplicate(encoding, known_encodings, known_ids, tolerance)
+                if duplicate_of:
+                    item["status"] = "duplicate"
+                    item["message"] = "Face matches an already enrolled employee"
+                    item["duplicate_of"] = duplicate_of
+                    continue
+                encoding_bytes = face_service.serialize_encoding(encoding)
+                known_encodings.append(encoding)
+                known_ids.append(f"row:{item['row']}")
+                item["status"] = "enrolled"
+            else:
+                # Same policy as add_employee: keep the employee, skip face recognition
+                item["status"] = status
+                item["message"] = "Added without face encoding"
+
+            employee = Employee(
+                pump_id=pump_id,
+                owner_id=owner.id,
+                name=row["name"],
+                phone=row.get("phone") or None,
+                email=row.get("email") or None,
+                designation=row.get("designation") or None,
+                employee_id=row.get("employee_id") or None,
+                photo_filename=stored,
+                face_encoding=encoding_bytes,
+                is_active=True
+            )
+            new_employees.append((item, employee))
+            used_photos.add(stored)
+
+        db.session.add_all([employee for _, employee in new_employees])
+        db.session.commit()
+
+        for item, employee in new_employees:
+            item["id"] = employee.id
+
+        for stored in set(saved_photos.values()) - used_photos:
+            try:
+                os.remove(os.path.join(upload_dir, stored))
+            except OSError:
+                pass
+
+        current_app.logger.info(f"Bulk enrolled {len(new_employees)} employees to pump {pump_id} by owner {owner.id}")
+
+        return jsonify({
+            "success": True,
+            "message": f"{len(new_employees)} of {len(rows)} employees added",
+            "added": len(new_employees),
+            "report": report
+        })
+
+    except Exception as e:
+        current_app.logger.exception("Error in bulk employee enrollment")
+        db.session.rollback()
+        for stored in saved_photos.values():
+            try:
+                os.remove(os.path.join(upload_dir, stored))
+            except OSError:
+                pass
+        return jsonify({"success": False, "message": f"Error adding employees: {str(e)}"}), 500
+
+
 @employee_bp.route("/<int:pump_id>/list", methods=["GET"])
 @login_required
 def list_employees(pump_id):
@@ -1,9 +1,12 @@
-from flask import Blueprint, request, jsonify
+import json
+
+import click
+from flask import Blueprint, request, jsonify, current_app, make_response
 from flask_login import login_required, current_user
 from datetime import datetime
 
 from extensions import db
-from models import PumpOwner, FuelTransaction
+from models import User, PumpOwner, FuelTransaction
 from services.escrow_service import (
     EscrowError,
     InsufficientFundsError,
@@ -12,16 +15,35 @@ from services.escrow_service import (
     create_fuel_transaction,
     verify_fuel_transaction,
     settle_fuel_transaction,
-    get_transaction_receipt,
+    settle_fuel_transactions_batch,
+    verified_transaction_ids,
+    SETTLEMENT_CHUNK_SIZE,
+    driver_vehicle_numbers,
     list_pump_transactions,
     list_driver_transactions,
     get_pending_verifications_for_pump,
     get_daily_sales_for_pump
 )
+from services.auto_verification import AUTO_VERIFY_BATCH_SIZE, auto_verify_pending
+from services.fuel_ingest import (
+    CSV_MIMETYPES,
+    INGEST_CHUNK_SIZE,
+    NDJSON_MIMETYPES,
+    IngestFormatError,
+    ingest_fuel_transactions,
+    parse_batch
+)
+from services.pagination import InvalidCursorError
+from services.driver_cohorts import rebuild_driver_cohorts
+from services.receipts import backfill_receipts, receipt_pdf, receipts_json
+from services.sales_rollup import rebuild_daily_sales
+from services.wallet_service import run_with_balance_retry
 
 
 escrow_bp = Blueprint("escrow", __name__)
 
+MAX_BATCH_RECEIPTS = 500
+
 
 def _pump_owner_required():
     """Ensure current user is a PumpOwner and has an associated pump"""
@@ -31,6 +53,23 @@ def _pump_owner_required():
     return hasattr(current_user, 'pumps') and current_user.pumps
 
 
+def _visible_transaction_ids(transaction_ids):
+    """The subset of ids the current user may see: their pumps' sales, or their vehicles'"""
+    if not transaction_ids:
+        return set()
+    query = db.session.query(FuelTransaction.id).filter(FuelTransaction.id.in_(transaction_ids))
+    if isinstance(current_user, PumpOwner):
+        query = query.filter(FuelTransaction.pump_id.in_([p.id for p in current_user.pumps]))
+    elif isinstance(current_user, User):
+        vehicle_numbers = driver_vehicle_numbers(current_user.id)
+        if not vehicle_numbers:
+            return set()
+        query = query.filter(FuelTransaction.vehicle_number.in_(vehicle_numbers))
+    else:
+        return set()
+    return {row[0] for row in query.all()}
+
+
 @escrow_bp.route("/fuel-transaction", methods=["POST"])
 @login_required
 def create_transaction():
@@ -71,6 +110,57 @@ def create_transaction():
         return jsonify({"success": False, "message": f"Failed to create transaction: {str(e)}"}), 500
 
 
+@escrow_bp.route("/fuel-transactions/ingest", methods=["POST"])
+@login_required
+def ingest_transactions():
+    """
+    Bulk upload of buffered dispenser / POS sales.
+    Body is NDJSON (application/x-ndjson) or CSV (text/csv), or pass
+    ?format=ndjson|csv. Each row needs idempotency_key, pump_id,
+    vehicle_number, fuel_type, quantity_litres and unit_price; sold_at (ISO
+    8601) and extra_data (NDJSON only) are optional.
+    Returns an outcome per row: created, duplicate (key already ingested,
+    with the existing transaction_id) or rejected with a reason.
+    """
+    if not _pump_owner_required():
+        return jsonify({"success": False, "message": "Access denied"}), 403
+
+    fmt = request.args.get("format")
+    if not fmt:
+        if request.mimetype in NDJSON_MIMETYPES:
+            fmt = "ndjson"
+        elif request.mimetype in CSV_MIMETYPES:
+            fmt = "csv"
+        else:
+            return jsonify({"success": False, "message": "Send NDJSON or CSV, or pass ?format=ndjson|csv"}), 415
+
+    try:
+        rows = parse_batch(request.get_data(cache=False), fmt)
+    except IngestFormatError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    try:
+        outcomes = ingest_fuel_transactions(
+            rows,
+            allowed_pump_ids=[p.id for p in current_user.pumps],
+            attendant_id=current_user.id,
+            chunk_size=max(1, min(request.args.get("chunk_size", INGEST_CHUNK_SIZE, type=int), 2000))
+        )
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Bulk ingest error: {str(e)}")
+        return jsonify({"success": False, "message": f"Ingest failed: {str(e)}"}), 500
+
+    counts = {status: sum(1 for o in outcomes if o["status"] == status)
+              for status in ("created", "duplicate", "rejected")}
+    return jsonify({
+        "success": True,
+        "message": f"{counts['created']} created, {counts['duplicate']} duplicate, {counts['rejected']} rejected.",
+        **counts,
+        "outcomes": outcomes
+    })
+
+
 @escrow_bp.route("/fuel-transaction/<int:transaction_id>/verify", methods=["POST"])
 @login_required
 def verify_transaction(transaction_id):
@@ -100,6 +190,52 @@ def verify_transaction(transaction_id):
         return jsonify({"success": False, "message": f"Verification failed: {str(e)}"}), 500
 
 
+@escrow_bp.route("/fuel-transactions/auto-verify", methods=["POST"])
+@login_required
+def auto_verify_transactions():
+    """
+    Run the automatic verification rules now over the owner's pending
+    transactions (optionally one pump). Unambiguous ANPR/totaliser matches
+    are verified; the rest stay pending with their review reasons.
+    """
+    if not _pump_owner_required():
+        return jsonify({"success": False, "message": "Access denied"}), 403
+
+    data = request.get_json(force=True, silent=True) or {}
+    pump_ids = [p.id for p in current_user.pumps]
+    if data.get("pump_id") is not None:
+        try:
+            pump_id = int(data["pump_id"])
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "message": "pump_id must be an integer"}), 400
+        if pump_id not in pump_ids:
+            return jsonify({"success": False, "message": "Pump not found"}), 404
+        pump_ids = [pump_id]
+
+    try:
+        summary = auto_verify_pending(pump_ids)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Auto verification error: {str(e)}")
+        return jsonify({"success": False, "message": f"Auto verification failed: {str(e)}"}), 500
+
+    return jsonify({
+        "success": True,
+        "message": f"{summary['verified']} transactions verified automatically.",
+        **summary
+    })
+
+
+@escrow_bp.cli.command("auto-verify")
+@click.option("--pump-id", "pump_ids", type=int, multiple=True, help="Limit to these pumps (repeatable).")
+@click.option("--batch-size", type=int, default=AUTO_VERIFY_BATCH_SIZE, show_default=True)
+def auto_verify_command(pump_ids, batch_size):
+    """Verify pending transactions backed by ANPR and totaliser evidence."""
+    summary = auto_verify_pending(pump_ids or None, batch_size=max(1, batch_size))
+    click.echo(f"Verified {summary['verified']}, {summary['needs_review']} need review, "
+               f"{summary['waiting']} waiting for evidence")
+
+
 @escrow_bp.route("/fuel-transaction/<int:transaction_id>/settle", methods=["POST"])
 @login_required
 def settle_transaction(transaction_id):
@@ -111,9 +247,13 @@ def settle_transaction(transaction_id):
     if not _pump_owner_required():
         return jsonify({"success": False, "message": "Access denied"}), 403
 
-    try:
-        transaction, group_uuid = settle_fuel_transaction(transaction_id)
+    def _settle():
+        result = settle_fuel_transaction(transaction_id)
         db.session.commit()
+        return result
+
+    try:
+        transaction, group_uuid = run_with_balance_retry(_settle)
         if transaction.status == "failed":
             reason = transaction.extra_data.get("failure_reason", "Unknown error")
             return jsonify({
@@ -143,17 +283,195 @@ def settle_transaction(transaction_id):
         return jsonify({"success": False, "message": f"Settlement failed: {str(e)}"}), 500
 
 
+@escrow_bp.route("/fuel-transactions/settle-batch", methods=["POST"])
+@login_required
+def settle_transactions_batch():
+    """
+    Settle many verified transactions in one call (e.g. end of shift).
+    Body: {"transaction_ids": [...]} or {"pump_id": N}; with neither, every
+    verified transaction on the owner's pumps is settled.
+    Returns a per-transaction outcome: settled, or failed with a reason.
+    """
+    if not _pump_owner_required():
+        return jsonify({"success": False, "message": "Access denied"}), 403
+
+    data = request.get_json(force=True, silent=True) or {}
+    owner_pump_ids = [p.id for p in current_user.pumps]
+    chunk_size = min(int(data.get("chunk_size") or SETTLEMENT_CHUNK_SIZE), 1000)
+
+    try:
+        if data.get("transaction_ids"):
+            requested = [int(i) for i in data["transaction_ids"]]
+            owned = {
+                row[0] for row in db.session.query(FuelTransaction.id).filter(
+                    FuelTransaction.id.in_(requested),
+                    FuelTransaction.pump_id.in_(owner_pump_ids)
+                ).all()
+            }
+            transaction_ids = [i for i in requested if i in owned]
+            not_found = [
+                {"transaction_id": i, "status": "failed", "reason": "Transaction not found"}
+                for i in requested if i not in owned
+            ]
+        else:
+            pump_id = data.get("pump_id")
+            if pump_id is not None and int(pump_id) not in owner_pump_ids:
+                return jsonify({"success": False, "message": "Pump not found"}), 404
+            transaction_ids = verified_transaction_ids([int(pump_id)] if pump_id is not None else owner_pump_ids)
+            not_found = []
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "transaction_ids and pump_id must be integers"}), 400
+
+    try:
+        outcomes = settle_fuel_transactions_batch(transaction_ids, chunk_size=chunk_size) + not_found
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Batch settlement error: {str(e)}")
+        return jsonify({"success": False, "message": f"Batch settlement failed: {str(e)}"}), 500
+
+    settled = sum(1 for o in outcomes if o["status"] == "settled")
+    return jsonify({
+        "success": True,
+        "message": f"{settled} of {len(outcomes)} transactions settled.",
+        "settled": settled,
+        "failed": len(outcomes) - settled,
+        "outcomes": outcomes
+    })
+
+
+@escrow_bp.cli.command("settle-verified")
+@click.option("--pump-id", "pump_ids", type=int, multiple=True, help="Limit to these pumps (repeatable).")
+@click.option("--chunk-size", type=int, default=SETTLEMENT_CHUNK_SIZE, show_default=True)
+def settle_verified_command(pump_ids, chunk_size):
+    """Settle all verified fuel transactions (scheduled end-of-shift job)."""
+    transaction_ids = verified_transaction_ids(pump_ids or None)
+    outcomes = settle_fuel_transactions_batch(transaction_ids, chunk_size=chunk_size)
+    settled = sum(1 for o in outcomes if o["status"] == "settled")
+    click.echo(f"Settled {settled} of {len(outcomes)} verified transactions")
+    for outcome in outcomes:
+        if outcome["status"] != "settled":
+            click.echo(f"  #{outcome['transaction_id']}: {outcome['reason']}")
+
+
+@escrow_bp.cli.command("rebuild-daily-sales")
+@click.option("--pump-id", type=int, default=None, help="Only this pump.")
+@click.option("--from", "start", type=click.DateTime(formats=["%Y-%m-%d"]), default=None, help="First day (inclusive).")
+@click.option("--to", "end", type=click.DateTime(formats=["%Y-%m-%d"]), default=None, help="Last day (exclusive).")
+def rebuild_daily_sales_command(pump_id, start, end):
+    """Backfill or repair the pump_daily_sales rollup from settled transactions."""
+    written = rebuild_daily_sales(pump_id, start.date() if start else None, end.date() if end else None)
+    click.echo(f"Rebuilt {written} daily sales rows")
+
+
+@escrow_bp.cli.command("rebuild-driver-cohorts")
+@click.option("--chunk-size", type=int, default=5000, show_default=True)
+def rebuild_driver_cohorts_command(chunk_size):
+    """Backfill or repair driver cohorts and monthly activity from settled transactions."""
+    written = rebuild_driver_cohorts(max(1, chunk_size))
+    click.echo(f"Rebuilt {written} driver activity months")
+
+
+@escrow_bp.cli.command("backfill-receipts")
+@click.option("--chunk-size", type=int, default=500, show_default=True)
+def backfill_receipts_command(chunk_size):
+    """Store receipts for settled transactions that do not have one yet."""
+    stored = backfill_receipts(max(1, chunk_size))
+    click.echo(f"Stored {stored} receipts")
+
+
 @escrow_bp.route("/fuel-transaction/<int:transaction_id>/receipt", methods=["GET"])
 @login_required
 def transaction_receipt(transaction_id):
     """
     Step 6: Get a non-editable digital receipt.
+    Settled receipts are immutable: served from storage with a strong ETag,
+    so clients revalidate with If-None-Match and get 304s.
     """
+    if transaction_id not in _visible_transaction_ids([transaction_id]):
+        return jsonify({"success": False, "message": "Transaction not found"}), 404
+
+    try:
+        receipt = receipts_json([transaction_id])[transaction_id]
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": f"Failed to generate receipt: {str(e)}"}), 500
+
+    # Stored JSON is spliced in as-is, so the body (and ETag) never change
+    response = make_response('{"success":true,"receipt":' + receipt["json"] + "}")
+    response.mimetype = "application/json"
+    if receipt["etag"]:
+        response.set_etag(receipt["etag"])
+        response.cache_control.private = True
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+        return response.make_conditional(request)
+    response.cache_control.no_cache = True
+    return response
+
+
+@escrow_bp.route("/fuel-transaction/<int:transaction_id>/receipt.pdf", methods=["GET"])
+@login_required
+def transaction_receipt_pdf(transaction_id):
+    """PDF of a settled transaction's receipt, rendered once and stored"""
+    if transaction_id not in _visible_transaction_ids([transaction_id]):
+        return jsonify({"success": False, "message": "Transaction not found"}), 404
+
     try:
-        receipt = get_transaction_receipt(transaction_id)
-        return jsonify({"success": True, "receipt": receipt})
+        receipt = receipt_pdf(transaction_id)
+        db.session.commit()
     except Exception as e:
+        db.session.rollback()
         return jsonify({"success": False, "message": f"Failed to generate receipt: {str(e)}"}), 500
+    if receipt is None:
+        return jsonify({"success": False, "message": "Receipt PDF is available once the transaction is settled"}), 409
+
+    response = make_response(receipt.pdf)
+    response.mimetype = "application/pdf"
+    response.headers["Content-Disposition"] = f'inline; filename="receipt-{transaction_id}.pdf"'
+    response.set_etag(f"{receipt.etag}-pdf")
+    response.cache_control.private = True
+    response.cache_control.max_age = 31536000
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
+
+
+@escrow_bp.route("/fuel-transactions/receipts", methods=["POST"])
+@login_required
+def batch_receipts():
+    """
+    Many receipts in one call. Body: {"transaction_ids": [...]} (up to
+    MAX_BATCH_RECEIPTS). Returns receipts in request order with each one's
+    etag (null while unsettled), plus ids that were not found.
+    """
+    data = request.get_json(force=True, silent=True) or {}
+    try:
+        requested = list(dict.fromkeys(int(i) for i in data.get("transaction_ids") or []))
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "transaction_ids must be integers"}), 400
+    if not requested:
+        return jsonify({"success": False, "message": "transaction_ids required"}), 400
+    if len(requested) > MAX_BATCH_RECEIPTS:
+        return jsonify({"success": False, "message": f"At most {MAX_BATCH_RECEIPTS} receipts per call"}), 400
+
+    visible = _visible_transaction_ids(requested)
+    try:
+        receipts = receipts_json([i for i in requested if i in visible])
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": f"Failed to generate receipts: {str(e)}"}), 500
+
+    items = [
+        '{"etag":' + json.dumps(receipts[i]["etag"]) + ',"receipt":' + receipts[i]["json"] + "}"
+        for i in requested if i in receipts
+    ]
+    not_found = [i for i in requested if i not in receipts]
+    response = make_response(
+        '{"success":true,"receipts":[' + ",".join(items) + '],"not_found":' + json.dumps(not_found) + "}"
+    )
+    response.mimetype = "application/json"
+    return response
 
 
 @escrow_bp.route("/fuel-transactions/pump", methods=["GET"])
@@ -168,11 +486,11 @@ def pump_fuel_transactions():
         return jsonify({"success": False, "message": "pump_id required"}), 400
 
     status = request.args.get("status")
-    limit = min(request.args.get("limit", 100, type=int), 500)
-    offset = request.args.get("offset", 0, type=int)
+    limit = max(1, min(request.args.get("limit", 100, type=int), 500))
+    cursor = request.args.get("cursor")
 
     try:
-        transactions, total = list_pump_transactions(pump_id, status, limit, offset)
+        transactions, next_cursor, total = list_pump_transactions(pump_id, status, limit, cursor)
         return jsonify({
             "success": True,
             "transactions": [
@@ -195,8 +513,10 @@ def pump_fuel_transactions():
             ],
             "total": total,
             "limit": limit,
-            "offset": offset
+            "next_cursor": next_cursor
         })
+    except InvalidCursorError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
     except Exception as e:
         return jsonify({"success": False, "message": f"Failed to fetch transactions: {str(e)}"}), 500
 
@@ -208,11 +528,11 @@ def driver_fuel_transactions():
     if isinstance(current_user, PumpOwner):
         return jsonify({"success": False, "message": "Access denied"}), 403
 
-    limit = min(request.args.get("limit", 100, type=int), 500)
-    offset = request.args.get("offset", 0, type=int)
+    limit = max(1, min(request.args.get("limit", 100, type=int), 500))
+    cursor = request.args.get("cursor")
 
     try:
-        transactions, total = list_driver_transactions(current_user.id, limit, offset)
+        transactions, next_cursor, total = list_driver_transactions(current_user.id, limit, cursor)
         return jsonify({
             "success": True,
             "transactions": [
@@ -238,8 +558,10 @@ def driver_fuel_transactions():
             ],
             "total": total,
             "limit": limit,
-            "offset": offset
+            "next_cursor": next_cursor
         })
+    except InvalidCursorError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
     except Exception as e:
         return jsonify({"success": False, "message": f"Failed to fetch transactions: {str(e)}"}), 500
 
@@ -278,7 +600,9 @@ def pending_verifications():
                     "unit_price": t.unit_price,
                     "amount": t.amount,
                     "created_at": t.created_at.isoformat(),
-                    "attendant": t.attendant.full_name if t.attendant else None
+                    "attendant": t.attendant.full_name if t.attendant else None,
+                    # Why the auto-verification rules left it for a human, if they ran
+                    "auto_verification": (t.extra_data or {}).get("auto_verification")
                 }
                 for t in pending
             ]
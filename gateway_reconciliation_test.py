@@ -0,0 +1,100 @@
+"""
+Gateway reconciliation checks.
+
+Seeds wallet top-ups and runs a small Razorpay settlement report through
+read_settlement_report / reconcile_settlement_report.
+
+Usage:
+    python -m pytest -q gateway_reconciliation_test.py
+"""
+import io
+import uuid
+from datetime import datetime, timedelta
+
+from extensions import db
+from models import User, Wallet, WalletTopup
+from services.gateway_reconciliation import (
+    MismatchPreview,
+    read_settlement_report,
+    reconcile_settlement_report,
+)
+
+
+def _topup(driver, wallet, amount, payment_id, status="paid", paid_at=None):
+    topup = WalletTopup(driver_id=driver.id, wallet_id=wallet.id, amount=amount, txn_uuid=str(uuid.uuid4()),
+                        status=status, razorpay_order_id=f"order_{payment_id}",
+                        razorpay_payment_id=payment_id, paid_at=paid_at or datetime.utcnow())
+    db.session.add(topup)
+    return topup
+
+
+def _seed():
+    driver = User(full_name="Recon Driver", email="recon-driver@example.com")
+    db.session.add(driver)
+    db.session.flush()
+    wallet = Wallet(user_id=driver.id, balance=0.0)
+    db.session.add(wallet)
+    db.session.flush()
+    return driver, wallet
+
+
+def _reconcile(report, **kwargs):
+    sink = MismatchPreview(100)
+    rows = read_settlement_report(io.BytesIO(report.encode("utf-8")), "report.csv")
+    return reconcile_settlement_report(rows, sink, **kwargs), sink.rows
+
+
+def test_refund_against_paid_topup_is_flagged(app):
+    driver, wallet = _seed()
+    _topup(driver, wallet, 500.0, "pay_kept")
+    refunded = _topup(driver, wallet, 300.0, "pay_refunded")
+    db.session.commit()
+
+    summary, mismatches = _reconcile(
+        "type,entity_id,payment_id,order_id,amount,status\n"
+        "payment,pay_kept,,order_pay_kept,500.00,captured\n"
+        "payment,pay_refunded,,order_pay_refunded,300.00,captured\n"
+        "refund,rfnd_1,pay_refunded,,300.00,processed\n"
+    )
+
+    assert summary["matched"] == 2
+    assert summary["status_differs"] == 1
+    assert mismatches == [{
+        "kind": "status_differs", "source": "wallet_topup", "local_id": refunded.id,
+        "payment_id": "pay_refunded", "order_id": "order_pay_refunded", "gateway_amount": 300.0,
+        "local_amount": 300.0, "gateway_status": "refunded", "local_status": "paid", "report_row": 4,
+    }]
+
+
+def test_refund_against_refunded_topup_matches(app):
+    driver, wallet = _seed()
+    _topup(driver, wallet, 300.0, "pay_refunded", status="refunded")
+    db.session.commit()
+
+    summary, mismatches = _reconcile(
+        "type,entity_id,payment_id,order_id,amount,status\n"
+        "payment,pay_refunded,,order_pay_refunded,300.00,captured\n"
+        "refund,rfnd_1,pay_refunded,,300.00,processed\n"
+        "refund,rfnd_2,pay_refunded,,300.00,failed\n"
+    )
+
+    assert summary["matched"] == 2
+    assert mismatches == []
+
+
+def test_missing_in_report_only_within_window(app):
+    driver, wallet = _seed()
+    now = datetime.utcnow()
+    _topup(driver, wallet, 100.0, "pay_reported", paid_at=now)
+    missing = _topup(driver, wallet, 200.0, "pay_missing", paid_at=now)
+    _topup(driver, wallet, 400.0, "pay_old", paid_at=now - timedelta(days=10))
+    db.session.commit()
+
+    summary, mismatches = _reconcile(
+        "type,entity_id,amount,status\n"
+        "payment,pay_reported,100.00,captured\n",
+        since=now - timedelta(days=1), until=now + timedelta(days=1),
+    )
+
+    assert summary["missing_in_report"] == 1
+    assert [m["local_id"] for m in mismatches] == [missing.id]
@@ -1,3 +1,4 @@
+import click
 from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash, send_file
 from flask_login import login_required, current_user
 from extensions import db
@@ -6,7 +7,7 @@ from models import (
     HydrotestNotification, ContractorMaster
 )
 from werkzeug.utils import secure_filename
-from datetime import datetime, timedelta, date
+from datetime import datetime, timedelta, date, timezone
 import os
 import uuid
 import json
@@ -812,6 +813,18 @@ def anpr_stop_camera(camera_id):
     return redirect(url_for('hydrotesting.anpr_cameras', pump_id=pump.id))
 
 
+def _local_time(value):
+    """Naive UTC timestamp as this server's local time, for display"""
+    if value is None:
+        return None
+    return value.replace(tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+
+
+@hydrotesting_bp.app_template_filter('local_time')
+def local_time_filter(value):
+    return _local_time(value)
+
+
 @hydrotesting_bp.route('/anpr/entry_logs')
 @login_required
 def anpr_entry_logs():
@@ -852,10 +865,21 @@ def anpr_live_feed(camera_id):
     for log in latest:
         detections.append({
             'vehicle_number': log.vehicle_number,
-            'detected_at': log.detected_at.strftime('%H:%M:%S'),
+            'detected_at': _local_time(log.detected_at).strftime('%H:%M:%S'),
             'compliance_status': log.compliance_status,
             'is_allowed_entry': log.is_allowed_entry,
             'confidence': log.detection_confidence
         })
     
     return jsonify({'detections': detections})
+
+
+@hydrotesting_bp.cli.command('rebuild-entry-rollup')
+@click.option('--pump-id', type=int, default=None)
+@click.option('--start', type=click.DateTime(formats=['%Y-%m-%d']), default=None)
+@click.option('--end', type=click.DateTime(formats=['%Y-%m-%d']), default=None, help='Exclusive.')
+def rebuild_entry_rollup_command(pump_id, start, end):
+    """Recompute the hourly ANPR entry rollup from raw entry logs."""
+    from services.entry_rollup import rebuild_hourly_entries
+    written = rebuild_hourly_entries(pump_id=pump_id, start=start, end=end)
+    click.echo(f"Wrote {written} hourly entry rows")
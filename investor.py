@@ -8,11 +8,13 @@ from datetime import datetime, timedelta
 from sqlalchemy import func, and_, or_
 from extensions import db
 from models import (
-    User, PumpOwner, Pump, FuelTransaction, WalletLedgerEntry,
-    Wallet, PumpWallet, PumpSettlement, Vehicle, PumpSubscription,
+    Pump, WalletLedgerEntry,
     Admin, Employee, Attendance, VehicleVerification, PaymentVerification,
-    WalletTopupVerification, PumpRegistrationRequest, Investor
+    WalletTopupVerification, PumpRegistrationRequest, Investor, PumpDailySales
 )
+from services.driver_cohorts import cohort_matrix
+from services.kpi_cache import cached, get_kpis
+from services.timeseries import daily_series, last_n_days
 
 investor_bp = Blueprint('investor', __name__, url_prefix='/investor')
 
@@ -143,217 +145,136 @@ def verify_otp():
     return render_template('Investor/verify_otp.html')
 
 
+# Charts cover at most a year of daily points
+MAX_CHART_DAYS = 366
+MAX_COHORT_MONTHS = 36
+
+
+def _daily_sales_series(days):
+    """Settled transactions and revenue per day for the last `days` days (oldest first)"""
+    days = min(max(days, 1), MAX_CHART_DAYS)
+    return cached('sales', ('daily', days), lambda: _compute_daily_sales_series(days))
+
+
+def _compute_daily_sales_series(days):
+    start, end = last_n_days(days)
+    return [
+        {'date': d['date'], 'transactions': int(d['transactions']), 'revenue': float(d['revenue'])}
+        for d in daily_series(
+            PumpDailySales.sales_date,
+            {
+                'transactions': func.sum(PumpDailySales.transaction_count),
+                'revenue': func.sum(PumpDailySales.total_amount),
+            },
+            start, end
+        )
+    ]
+
+
+def _fuel_distribution():
+    return cached('sales', 'fuel_distribution', _compute_fuel_distribution)
+
+
+def _compute_fuel_distribution():
+    data = db.session.query(
+        PumpDailySales.fuel_type,
+        func.sum(PumpDailySales.transaction_count).label('count'),
+        func.sum(PumpDailySales.total_amount).label('revenue')
+    ).group_by(PumpDailySales.fuel_type).all()
+    return [
+        {
+            'fuel_type': d.fuel_type,
+            'count': int(d.count),
+            'revenue': float(d.revenue)
+        }
+        for d in data
+    ]
+
+
+def _top_pumps(limit=10):
+    return cached('sales', ('top_pumps', limit), lambda: _compute_top_pumps(limit))
+
+
+def _compute_top_pumps(limit):
+    data = db.session.query(
+        Pump.name,
+        func.sum(PumpDailySales.transaction_count).label('transactions'),
+        func.sum(PumpDailySales.total_amount).label('revenue')
+    ).join(
+        PumpDailySales, Pump.id == PumpDailySales.pump_id
+    ).group_by(
+        Pump.id, Pump.name
+    ).order_by(
+        func.sum(PumpDailySales.total_amount).desc()
+    ).limit(limit).all()
+    return [
+        {
+            'name': d.name,
+            'transactions': int(d.transactions),
+            'revenue': float(d.revenue)
+        }
+        for d in data
+    ]
+
+
 @investor_bp.route('/dashboard')
 @login_required
 def dashboard():
     """Main investor dashboard with comprehensive analytics - FIXED"""
     try:
-        # Get date ranges
         today = datetime.utcnow().date()
         thirty_days_ago = today - timedelta(days=30)
-        ninety_days_ago = today - timedelta(days=90)
-        
-        # Core Metrics
-        total_cab_owners = User.query.count()
-        total_pump_owners = PumpOwner.query.count()
-        total_pumps = Pump.query.count()
-        total_vehicles = Vehicle.query.count()
-        
-        # Financial Metrics
-        total_driver_wallet_balance = db.session.query(func.sum(Wallet.balance)).scalar() or 0
-        total_pump_wallet_balance = db.session.query(func.sum(PumpWallet.balance)).scalar() or 0
-        total_transactions = FuelTransaction.query.count()
-        
-        # Transaction Metrics
-        total_revenue = db.session.query(func.sum(FuelTransaction.amount)).filter(
-            FuelTransaction.status == 'settled'
-        ).scalar() or 0
-        
-        today_transactions = FuelTransaction.query.filter(
-            func.date(FuelTransaction.created_at) == today,
-            FuelTransaction.status == 'settled'
-        ).count()
-        
-        today_revenue = db.session.query(func.sum(FuelTransaction.amount)).filter(
-            func.date(FuelTransaction.created_at) == today,
-            FuelTransaction.status == 'settled'
-        ).scalar() or 0
-        
-        # Monthly Growth (Last 30 days)
-        monthly_transactions = FuelTransaction.query.filter(
-            FuelTransaction.created_at >= thirty_days_ago,
-            FuelTransaction.status == 'settled'
-        ).count()
-        
-        monthly_revenue = db.session.query(func.sum(FuelTransaction.amount)).filter(
-            FuelTransaction.created_at >= thirty_days_ago,
-            FuelTransaction.status == 'settled'
-        ).scalar() or 0
-        
-        # Quarterly Growth (Last 90 days)
-        quarterly_transactions = FuelTransaction.query.filter(
-            FuelTransaction.created_at >= ninety_days_ago,
-            FuelTransaction.status == 'settled'
-        ).count()
-        
-        quarterly_revenue = db.session.query(func.sum(FuelTransaction.amount)).filter(
-            FuelTransaction.created_at >= ninety_days_ago,
-            FuelTransaction.status == 'settled'
-        ).scalar() or 0
-        
-        # Subscription Metrics (FIXED - no amount field)
-        active_subscriptions = PumpSubscription.query.filter(
-            PumpSubscription.subscription_status == 'active'
-        ).count()
-        
-        # Calculate estimated subscription revenue based on subscription types
-        active_subs = PumpSubscription.query.filter(
-            PumpSubscription.subscription_status == 'active'
-        ).all()
-        
-        subscription_pricing = {
-            'silver': 999,
-            'gold': 1999,
-            'diamond': 4999
-        }
         
-        total_subscription_revenue = sum(
-            subscription_pricing.get(sub.subscription_type, 0) 
-            for sub in active_subs
-        )
-        
-        # Settlement Metrics (FIXED - correct field names)
-        pending_settlements = PumpSettlement.query.filter(
-            PumpSettlement.status == 'pending'
-        ).count()
-        
-        total_settled_amount = db.session.query(func.sum(PumpSettlement.amount)).filter(
-            PumpSettlement.status == 'processed'  # FIXED: use 'processed' instead of 'approved'
-        ).scalar() or 0
-        
-        # Daily Transaction Data for Charts (Last 30 days)
-        daily_data = []
-        for i in range(30):
-            date = today - timedelta(days=i)
-            transactions_count = FuelTransaction.query.filter(
-                func.date(FuelTransaction.created_at) == date,
-                FuelTransaction.status == 'settled'
-            ).count()
-            
-            revenue_count = db.session.query(func.sum(FuelTransaction.amount)).filter(
-                func.date(FuelTransaction.created_at) == date,
-                FuelTransaction.status == 'settled'
-            ).scalar() or 0
-            
-            daily_data.append({
-                'date': date.strftime('%Y-%m-%d'),
-                'transactions': transactions_count,
-                'revenue': float(revenue_count)
-            })
-        
-        daily_data.reverse()  # Show oldest to newest
-        
-        # Fuel Type Distribution
-        fuel_type_data = db.session.query(
-            FuelTransaction.fuel_type,
-            func.count(FuelTransaction.id).label('count'),
-            func.sum(FuelTransaction.amount).label('revenue')
-        ).filter(
-            FuelTransaction.status == 'settled'
-        ).group_by(FuelTransaction.fuel_type).all()
-        
-        fuel_distribution = [
-            {
-                'fuel_type': ft.fuel_type,
-                'count': ft.count,
-                'revenue': float(ft.revenue)
-            }
-            for ft in fuel_type_data
-        ]
-        
-        # Top Performing Pumps
-        top_pumps = db.session.query(
-            Pump.name,
-            func.count(FuelTransaction.id).label('transactions'),
-            func.sum(FuelTransaction.amount).label('revenue')
-        ).join(
-            FuelTransaction, Pump.id == FuelTransaction.pump_id
-        ).filter(
-            FuelTransaction.status == 'settled'
-        ).group_by(
-            Pump.id, Pump.name
-        ).order_by(
-            func.sum(FuelTransaction.amount).desc()
-        ).limit(10).all()
-        
-        top_pumps_data = [
-            {
-                'name': tp.name,
-                'transactions': tp.transactions,
-                'revenue': float(tp.revenue)
-            }
-            for tp in top_pumps
-        ]
-        
-        # Growth Metrics (Month over Month)
-        last_month_start = today.replace(day=1) - timedelta(days=1)
-        last_month_end = today.replace(day=1) - timedelta(days=1)
-        last_month_end = last_month_end.replace(day=28) if last_month_end.month == 2 else last_month_end.replace(day=30)
-        
-        last_month_transactions = FuelTransaction.query.filter(
-            FuelTransaction.created_at >= last_month_start,
-            FuelTransaction.created_at <= last_month_end,
-            FuelTransaction.status == 'settled'
-        ).count()
-        
-        last_month_revenue = db.session.query(func.sum(FuelTransaction.amount)).filter(
-            FuelTransaction.created_at >= last_month_start,
-            FuelTransaction.created_at <= last_month_end,
-            FuelTransaction.status == 'settled'
-        ).scalar() or 0
+        # Every headline number comes from the KPI cache (one query per group on a miss)
+        kpis = get_kpis('platform', 'wallets', 'sales', 'subscriptions', 'settlements')
         
         # Safe division to avoid division by zero
-        mom_transaction_growth = ((monthly_transactions - last_month_transactions) / max(last_month_transactions, 1)) * 100
-        mom_revenue_growth = ((monthly_revenue - last_month_revenue) / max(last_month_revenue, 1)) * 100
+        mom_transaction_growth = (
+            (kpis['monthly_transactions'] - kpis['last_month_transactions'])
+            / max(kpis['last_month_transactions'], 1)
+        ) * 100
+        mom_revenue_growth = (
+            (kpis['monthly_revenue'] - kpis['last_month_revenue']) / max(kpis['last_month_revenue'], 1)
+        ) * 100
         
         # Average transaction value
-        avg_transaction_value = total_revenue / max(total_transactions, 1)
+        avg_transaction_value = kpis['total_revenue'] / max(kpis['total_transactions'], 1)
         
         return render_template('Investor/dashboard.html', **{
             # Core Metrics
-            'total_cab_owners': total_cab_owners,
-            'total_pump_owners': total_pump_owners,
-            'total_pumps': total_pumps,
-            'total_vehicles': total_vehicles,
+            'total_cab_owners': kpis['total_cab_owners'],
+            'total_pump_owners': kpis['total_pump_owners'],
+            'total_pumps': kpis['total_pumps'],
+            'total_vehicles': kpis['total_vehicles'],
             
             # Financial Metrics
-            'total_driver_wallet_balance': total_driver_wallet_balance,
-            'total_pump_wallet_balance': total_pump_wallet_balance,
-            'total_transactions': total_transactions,
-            'total_revenue': total_revenue,
+            'total_driver_wallet_balance': kpis['total_driver_wallet_balance'],
+            'total_pump_wallet_balance': kpis['total_pump_wallet_balance'],
+            'total_transactions': kpis['total_transactions'],
+            'total_revenue': kpis['total_revenue'],
             
             # Today's Metrics
-            'today_transactions': today_transactions,
-            'today_revenue': today_revenue,
+            'today_transactions': kpis['today_transactions'],
+            'today_revenue': kpis['today_revenue'],
             
             # Period Metrics
-            'monthly_transactions': monthly_transactions,
-            'monthly_revenue': monthly_revenue,
-            'quarterly_transactions': quarterly_transactions,
-            'quarterly_revenue': quarterly_revenue,
+            'monthly_transactions': kpis['monthly_transactions'],
+            'monthly_revenue': kpis['monthly_revenue'],
+            'quarterly_transactions': kpis['quarterly_transactions'],
+            'quarterly_revenue': kpis['quarterly_revenue'],
             
             # Subscription Metrics
-            'active_subscriptions': active_subscriptions,
-            'total_subscription_revenue': total_subscription_revenue,
+            'active_subscriptions': kpis['active_subscriptions'],
+            'total_subscription_revenue': kpis['total_subscription_revenue'],
             
             # Settlement Metrics
-            'pending_settlements': pending_settlements,
-            'total_settled_amount': total_settled_amount,
+            'pending_settlements': kpis['pending_settlements'],
+            'total_settled_amount': kpis['total_settled_amount'],
             
-            # Chart Data
-            'daily_data': daily_data,
-            'fuel_distribution': fuel_distribution,
-            'top_pumps_data': top_pumps_data,
+            # Chart Data (Last 30 days, oldest to newest)
+            'daily_data': _daily_sales_series(30),
+            'fuel_distribution': _fuel_distribution(),
+            'top_pumps_data': _top_pumps(),
             
             # Growth Metrics
             'mom_transaction_growth': round(mom_transaction_growth, 2),
@@ -405,23 +326,10 @@ def dashboard():
 def revenue_chart_api():
     """API endpoint for revenue chart data"""
     days = request.args.get('days', 30, type=int)
-    today = datetime.utcnow().date()
-    start_date = today - timedelta(days=days)
-    
-    data = []
-    for i in range(days):
-        date = today - timedelta(days=i)
-        revenue = db.session.query(func.sum(FuelTransaction.amount)).filter(
-            func.date(FuelTransaction.created_at) == date,
-            FuelTransaction.status == 'settled'
-        ).scalar() or 0
-        
-        data.append({
-            'date': date.strftime('%Y-%m-%d'),
-            'revenue': float(revenue)
-        })
-    
-    data.reverse()
+    data = [
+        {'date': d['date'], 'revenue': d['revenue']}
+        for d in _daily_sales_series(days)
+    ]
     return jsonify({'data': data})
 
 
@@ -430,22 +338,10 @@ def revenue_chart_api():
 def transaction_chart_api():
     """API endpoint for transaction volume chart data"""
     days = request.args.get('days', 30, type=int)
-    today = datetime.utcnow().date()
-    
-    data = []
-    for i in range(days):
-        date = today - timedelta(days=i)
-        transactions = FuelTransaction.query.filter(
-            func.date(FuelTransaction.created_at) == date,
-            FuelTransaction.status == 'settled'
-        ).count()
-        
-        data.append({
-            'date': date.strftime('%Y-%m-%d'),
-            'transactions': transactions
-        })
-    
-    data.reverse()
+    data = [
+        {'date': d['date'], 'transactions': d['transactions']}
+        for d in _daily_sales_series(days)
+    ]
     return jsonify({'data': data})
 
 
@@ -453,51 +349,19 @@ def transaction_chart_api():
 @login_required
 def fuel_distribution_api():
     """API endpoint for fuel type distribution"""
-    data = db.session.query(
-        FuelTransaction.fuel_type,
-        func.count(FuelTransaction.id).label('count'),
-        func.sum(FuelTransaction.amount).label('revenue')
-    ).filter(
-        FuelTransaction.status == 'settled'
-    ).group_by(FuelTransaction.fuel_type).all()
-    
-    return jsonify({
-        'data': [
-            {
-                'fuel_type': d.fuel_type,
-                'count': d.count,
-                'revenue': float(d.revenue)
-            }
-            for d in data
-        ]
-    })
+    return jsonify({'data': _fuel_distribution()})
 
 
 @investor_bp.route('/api/top-pumps')
 @login_required
 def top_pumps_api():
     """API endpoint for top performing pumps"""
-    data = db.session.query(
-        Pump.name,
-        func.count(FuelTransaction.id).label('transactions'),
-        func.sum(FuelTransaction.amount).label('revenue')
-    ).join(
-        FuelTransaction, Pump.id == FuelTransaction.pump_id
-    ).filter(
-        FuelTransaction.status == 'settled'
-    ).group_by(
-        Pump.id, Pump.name
-    ).order_by(
-        func.sum(FuelTransaction.amount).desc()
-    ).limit(10).all()
-    
-    return jsonify({
-        'data': [
-            {
-                'name': d.name,
-                'transactions': d.transactions,
-                'revenue': float(d.revenue)
-            }
-            for d in data
-        ]
-    })
+    return jsonify({'data': _top_pumps()})
+
+
+@investor_bp.route('/api/cohorts')
+@login_required
+def cohorts_api():
+    """API endpoint for monthly driver cohort retention"""
+    months = min(max(request.args.get('months', 12, type=int), 1), MAX_COHORT_MONTHS)
+    return jsonify({'data': cached('sales', ('cohorts', months), lambda: cohort_matrix(months))})
@@ -0,0 +1,50 @@
+"""
+Ledger reconciliation checks.
+
+Reconciles a driver wallet whose balance predates the ledger (funded
+without any ledger entries) against its opening checkpoint.
+
+Usage:
+    python -m pytest -q ledger_reconciliation_test.py
+"""
+from extensions import db
+from models import User, Wallet, WalletBalanceCheckpoint
+from services.ledger_reconciliation import reconcile_all, seed_opening_checkpoints
+from services.wallet_service import credit_wallet
+
+
+def _wallet_with_balance(balance):
+    driver = User(full_name="Ledger Driver", email="ledger-driver@example.com")
+    db.session.add(driver)
+    db.session.flush()
+    wallet = Wallet(user_id=driver.id, balance=balance)
+    db.session.add(wallet)
+    db.session.commit()
+    return wallet.id
+
+
+def test_balance_without_ledger_entries_is_not_drift(app):
+    wallet_id = _wallet_with_balance(250.0)
+
+    assert seed_opening_checkpoints() == 1
+    summary = reconcile_all()
+    assert summary["checked"] == 1
+    assert summary["drifted"] == []
+
+    # Later movements are checked against the opening balance
+    credit_wallet(Wallet, wallet_id, 100.0, event_type="wallet_topup")
+    db.session.commit()
+    assert reconcile_all()["drifted"] == []
+
+    # A balance change with no ledger entry is still caught
+    db.session.get(Wallet, wallet_id).balance = 400.0
+    db.session.commit()
+    drifted = reconcile_all()["drifted"]
+    assert [(d["wallet_id"], d["ledger_balance"], d["drift"]) for d in drifted] == [(wallet_id, 350.0, 50.0)]
+
+
+def test_seeding_skips_wallets_with_a_checkpoint(app):
+    _wallet_with_balance(80.0)
+    assert seed_opening_checkpoints() == 1
+    assert seed_opening_checkpoints() == 0
+    assert WalletBalanceCheckpoint.query.count() == 1
@@ -264,3 +264,49 @@ class FaceRecognitionService:
         
         return frame
 
+
+
+# Longest side (px) photos are scaled down to before bulk enrollment encoding.
+# HOG face detection cost grows with pixel count; phone photos are far larger
+# than needed for a 128-d encoding.
+ENROLLMENT_MAX_DIM = 800
+
+
+def encode_photo_for_enrollment(image_path: str, max_dim: int = ENROLLMENT_MAX_DIM) -> Tuple[str, Optional[np.ndarray]]:
+    """
+    Downscale a photo and extract exactly one face encoding from it.
+    Module-level so it can run in a ProcessPoolExecutor worker.
+
+    Returns (status, encoding) where status is one of:
+    ok, no_face, multiple_faces, unreadable, unavailable
+    """
+    if not FACE_RECOGNITION_AVAILABLE:
+        return "unavailable", None
+
+    try:
+        image = cv2.imread(image_path)
+        if image is None and Image is not None:
+            image = cv2.cvtColor(np.array(Image.open(image_path).convert("RGB")), cv2.COLOR_RGB2BGR)
+        if image is None:
+            return "unreadable", None
+
+        height, width = image.shape[:2]
+        scale = max_dim / float(max(height, width))
+        if scale < 1.0:
+            image = cv2.resize(image, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+
+        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        face_locations = face_recognition.face_locations(rgb_image)
+        if not face_locations:
+            return "no_face", None
+        if len(face_locations) > 1:
+            return "multiple_faces", None
+
+        face_encodings = face_recognition.face_encodings(rgb_image, face_locations)
+        if not face_encodings:
+            return "no_face", None
+        return "ok", face_encodings[0]
+
+    except Exception as e:
+        print(f"Error encoding enrollment photo {image_path}: {e}")
+        return "unreadable", None
@@ -0,0 +1,254 @@
+"""
+Frame Broadcaster for live camera views
+Runs one producer (capture -> annotate) per camera key in a background
+thread. Each frame is encoded once for all MJPEG subscribers and handed
+as-is to any attached sinks (e.g. the HLS encoder).
+"""
+import queue
+import threading
+import time
+from typing import Callable, Dict, Hashable, Iterator, Optional
+
+# Stop a producer this long after its last viewer leaves, so a page reload
+# re-attaches to the running pipeline instead of reconnecting the camera.
+IDLE_GRACE_SECONDS = 5.0
+
+# Frames buffered per viewer. When a viewer falls behind, its oldest frame is
+# dropped; the producer never waits on a slow client.
+SUBSCRIBER_BUFFER = 2
+
+_END = object()
+
+
+class Subscription:
+    """A single viewer's bounded frame buffer"""
+
+    def __init__(self, broadcaster: "FrameBroadcaster", maxsize: int = SUBSCRIBER_BUFFER):
+        self.broadcaster = broadcaster
+        self.frames: "queue.Queue" = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def offer(self, chunk) -> None:
+        """Non-blocking put that discards the oldest frame when full"""
+        while True:
+            try:
+                self.frames.put_nowait(chunk)
+                return
+            except queue.Full:
+                try:
+                    self.frames.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def __iter__(self) -> Iterator[bytes]:
+        try:
+            while True:
+                try:
+                    chunk = self.frames.get(timeout=30)
+                except queue.Empty:
+                    if self.broadcaster.finished:
+                        return
+                    continue
+                if chunk is _END:
+                    return
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """
+        Detach from the broadcaster; safe to call more than once. Register it
+        with the response's call_on_close: a body that is never iterated
+        (HEAD, client gone before the first chunk) never reaches the
+        generator's finally.
+        """
+        self.broadcaster.unsubscribe(self)
+
+
+class FrameBroadcaster:
+    """
+    Runs `producer_factory()` once and publishes every frame it yields.
+
+    `encode(frame)` turns a frame into the bytes sent to subscribers; it is
+    skipped entirely while nobody is subscribed. Sinks receive the raw frame
+    through `sink.write(frame)` and keep the pipeline alive while
+    `sink.active` is true.
+    """
+
+    def __init__(self, key: Hashable, producer_factory: Callable[[], Iterator], app=None,
+                 encode: Optional[Callable[[object], Optional[bytes]]] = None):
+        self.key = key
+        self.producer_factory = producer_factory
+        self.app = app
+        self.encode = encode
+        self.finished = False
+        self.last_chunk: Optional[bytes] = None
+        self._subscribers = set()
+        self._sinks = []
+        self._lock = threading.Lock()
+        self._idle_since: Optional[float] = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @property
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._subscribers)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def subscribe(self) -> Subscription:
+        sub = Subscription(self)
+        with self._lock:
+            self._subscribers.add(sub)
+            self._idle_since = None
+            # Late joiners get the most recent frame straight away
+            if self.last_chunk is not None:
+                sub.offer(self.last_chunk)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            self._subscribers.discard(sub)
+            if not self._subscribers and self._idle_since is None:
+                self._idle_since = time.time()
+
+    def add_sink(self, sink) -> None:
+        with self._lock:
+            if sink not in self._sinks:
+                self._sinks.append(sink)
+            self._idle_since = None
+
+    def get_sink(self, sink_type):
+        with self._lock:
+            for sink in self._sinks:
+                if isinstance(sink, sink_type):
+                    return sink
+        return None
+
+    def _publish(self, frame) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers)
+            sinks = list(self._sinks)
+
+        for sink in sinks:
+            try:
+                sink.write(frame)
+            except Exception as e:
+                print(f"Frame broadcaster {self.key} sink error: {e}")
+
+        # Only pay for the MJPEG encode while someone is watching it
+        if not subscribers:
+            return
+        chunk = self.encode(frame) if self.encode else frame
+        if not chunk:
+            return
+        with self._lock:
+            self.last_chunk = chunk
+        for sub in subscribers:
+            sub.offer(chunk)
+
+    def _should_stop(self) -> bool:
+        with self._lock:
+            if self._subscribers:
+                return False
+            live_sinks = [sink for sink in self._sinks if sink.active]
+            if live_sinks:
+                self._idle_since = None
+                return False
+            if self._idle_since is None:
+                self._idle_since = time.time()
+            return (time.time() - self._idle_since) > IDLE_GRACE_SECONDS
+
+    def _run(self) -> None:
+        producer = None
+        try:
+            if self.app is not None:
+                with self.app.app_context():
+                    producer = self.producer_factory()
+                    self._pump(producer)
+            else:
+                producer = self.producer_factory()
+                self._pump(producer)
+        except Exception as e:
+            print(f"Frame broadcaster {self.key} stopped with error: {e}")
+        finally:
+            _remove(self)
+            with self._lock:
+                self.finished = True
+                subscribers = list(self._subscribers)
+            for sub in subscribers:
+                sub.offer(_END)
+
+    def _pump(self, producer: Iterator) -> None:
+        try:
+            for frame in producer:
+                if frame is not None:
+                    self._publish(frame)
+                if self._should_stop():
+                    break
+        finally:
+            # Runs the producer's own cleanup (e.g. releasing the capture)
+            close = getattr(producer, "close", None)
+            if close:
+                close()
+            with self._lock:
+                sinks = list(self._sinks)
+                self._sinks = []
+            for sink in sinks:
+                sink.close()
+
+
+_broadcasters: Dict[Hashable, FrameBroadcaster] = {}
+_registry_lock = threading.Lock()
+
+
+def _remove(broadcaster: FrameBroadcaster) -> None:
+    with _registry_lock:
+        if _broadcasters.get(broadcaster.key) is broadcaster:
+            _broadcasters.pop(broadcaster.key, None)
+
+
+def get_broadcaster(key: Hashable) -> Optional[FrameBroadcaster]:
+    with _registry_lock:
+        return _broadcasters.get(key)
+
+
+def total_subscribers() -> int:
+    """Open viewer connections across every broadcaster in this process"""
+    with _registry_lock:
+        broadcasters = list(_broadcasters.values())
+    return sum(b.subscriber_count for b in broadcasters)
+
+
+def _get_or_start(key: Hashable, producer_factory: Callable[[], Iterator], app=None,
+                  encode=None) -> FrameBroadcaster:
+    """Caller must hold _registry_lock"""
+    broadcaster = _broadcasters.get(key)
+    if broadcaster is None or broadcaster.finished:
+        broadcaster = FrameBroadcaster(key, producer_factory, app=app, encode=encode)
+        _broadcasters[key] = broadcaster
+        broadcaster.start()
+    return broadcaster
+
+
+def subscribe(key: Hashable, producer_factory: Callable[[], Iterator], app=None, encode=None) -> Subscription:
+    """Attach to the running broadcaster for `key`, starting one if needed"""
+    with _registry_lock:
+        # Subscribe while holding the registry lock so the broadcaster cannot
+        # be retired between lookup and attach.
+        return _get_or_start(key, producer_factory, app=app, encode=encode).subscribe()
+
+
+def attach_sink(key: Hashable, sink_factory: Callable[[], object], producer_factory: Callable[[], Iterator],
+                app=None, encode=None):
+    """Attach a sink of the factory's type to the broadcaster for `key`, reusing an existing one"""
+    with _registry_lock:
+        broadcaster = _get_or_start(key, producer_factory, app=app, encode=encode)
+        sink = sink_factory()
+        existing = broadcaster.get_sink(type(sink))
+        if existing is not None and not existing.closed:
+            return existing
+        broadcaster.add_sink(sink)
+        return sink
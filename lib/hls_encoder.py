@@ -0,0 +1,169 @@
+"""
+HLS Encoder for live camera views
+Pipes annotated frames into a single ffmpeg process that encodes H.264 and
+writes short HLS segments to tmpfs, so remote viewers pull a few hundred
+kbit/s of video instead of a full JPEG per frame.
+"""
+import os
+import queue
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Optional
+
+import cv2
+
+# Opt-in: set LIVE_STREAM_HLS=1 (and have ffmpeg on PATH) to enable.
+HLS_ENABLED = os.getenv("LIVE_STREAM_HLS", "").strip().lower() in {"1", "true", "yes"}
+FFMPEG_BIN = os.getenv("FFMPEG_BIN", "ffmpeg")
+
+HLS_FPS = int(os.getenv("LIVE_STREAM_HLS_FPS", "12"))
+HLS_SEGMENT_SECONDS = 2
+HLS_LIST_SIZE = 5
+
+# A sink nobody has fetched from for this long stops keeping the pipeline alive
+HLS_VIEWER_TIMEOUT_SECONDS = 20.0
+
+PLAYLIST_NAME = "index.m3u8"
+SEGMENT_NAME_RE = re.compile(r"^seg_\d{5}\.ts$")
+
+_FRAME_QUEUE_SIZE = 4
+
+
+def hls_available() -> bool:
+    return HLS_ENABLED and shutil.which(FFMPEG_BIN) is not None
+
+
+def _hls_root() -> str:
+    # Prefer tmpfs so segments never touch disk
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    root = os.path.join(base, "fuelflux_hls")
+    os.makedirs(root, exist_ok=True)
+    return root
+
+
+def is_valid_hls_filename(filename: str) -> bool:
+    return filename == PLAYLIST_NAME or bool(SEGMENT_NAME_RE.match(filename or ""))
+
+
+class HLSSink:
+    """Frame sink for FrameBroadcaster that feeds one ffmpeg H.264/HLS encoder"""
+
+    def __init__(self, stream_id: str):
+        self.stream_id = stream_id
+        self.output_dir = os.path.join(_hls_root(), stream_id)
+        self.closed = False
+        self.last_access = time.time()
+        self._size = None
+        self._process: Optional[subprocess.Popen] = None
+        self._frames: "queue.Queue" = queue.Queue(maxsize=_FRAME_QUEUE_SIZE)
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer_started = False
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        return not self.closed and (time.time() - self.last_access) < HLS_VIEWER_TIMEOUT_SECONDS
+
+    def touch(self) -> None:
+        self.last_access = time.time()
+
+    @property
+    def playlist_path(self) -> str:
+        return os.path.join(self.output_dir, PLAYLIST_NAME)
+
+    def _start_encoder(self, width: int, height: int) -> None:
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+        os.makedirs(self.output_dir, exist_ok=True)
+        cmd = [
+            FFMPEG_BIN, "-loglevel", "error", "-nostdin",
+            "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}",
+            "-use_wallclock_as_timestamps", "1", "-i", "-",
+            "-an",
+            "-c:v", "libx264", "-preset", "veryfast", "-tune", "zerolatency",
+            "-pix_fmt", "yuv420p", "-r", str(HLS_FPS),
+            "-g", str(HLS_FPS * HLS_SEGMENT_SECONDS), "-sc_threshold", "0",
+            "-f", "hls",
+            "-hls_time", str(HLS_SEGMENT_SECONDS),
+            "-hls_list_size", str(HLS_LIST_SIZE),
+            "-hls_flags", "delete_segments+omit_endlist+independent_segments",
+            "-hls_segment_filename", os.path.join(self.output_dir, "seg_%05d.ts"),
+            self.playlist_path,
+        ]
+        self._process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                         stderr=subprocess.DEVNULL)
+        self._size = (width, height)
+
+    def write(self, frame) -> None:
+        """Queue a frame for encoding; drops the oldest frame if ffmpeg falls behind"""
+        if self.closed:
+            return
+        with self._lock:
+            if not self._writer_started:
+                self._writer_started = True
+                self._writer.start()
+        try:
+            self._frames.put_nowait(frame)
+        except queue.Full:
+            try:
+                self._frames.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                self._frames.put_nowait(frame)
+            except queue.Full:
+                pass
+
+    def _write_loop(self) -> None:
+        try:
+            while not self.closed:
+                try:
+                    frame = self._frames.get(timeout=1)
+                except queue.Empty:
+                    continue
+                if frame is None:
+                    break
+                if self._process is None:
+                    height, width = frame.shape[:2]
+                    # libx264 with yuv420p needs even dimensions
+                    self._start_encoder(width - width % 2, height - height % 2)
+                if (frame.shape[1], frame.shape[0]) != self._size:
+                    frame = cv2.resize(frame, self._size)
+                if self._process.poll() is not None:
+                    print(f"HLS encoder for {self.stream_id} exited with code {self._process.returncode}")
+                    break
+                self._process.stdin.write(frame.tobytes())
+        except (BrokenPipeError, OSError) as e:
+            print(f"HLS encoder pipe closed for {self.stream_id}: {e}")
+        finally:
+            self.closed = True
+            self._stop_encoder()
+
+    def _stop_encoder(self) -> None:
+        process = self._process
+        self._process = None
+        if process is not None:
+            try:
+                process.stdin.close()
+            except Exception:
+                pass
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        if not self._writer_started:
+            self._stop_encoder()
+            return
+        try:
+            self._frames.put_nowait(None)
+        except queue.Full:
+            pass
@@ -0,0 +1,53 @@
+"""add vehicle plate key
+
+Revision ID: 4e7b2d9a8f13
+Revises: 9d3a6f0b1c52
+Create Date: 2026-10-19 12:37:45.119872
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4e7b2d9a8f13'
+down_revision = '9d3a6f0b1c52'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('vehicles', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('plate_key', sa.String(length=50), nullable=True))
+        batch_op.create_index(batch_op.f('ix_vehicles_plate_key'), ['plate_key'], unique=False)
+
+    # Backfill with the same normalisation as models.normalize_plate
+    conn = op.get_bind()
+    vehicles = sa.table('vehicles', sa.column('id', sa.Integer), sa.column('license', sa.String),
+                        sa.column('plate_key', sa.String))
+    rows = conn.execute(sa.select(vehicles.c.id, vehicles.c.license)).fetchall()
+    updates = [
+        {"vid": row.id, "key": re.sub(r"[^A-Z0-9]", "", (row.license or "").upper())}
+        for row in rows
+    ]
+    if updates:
+        conn.execute(
+            vehicles.update().where(vehicles.c.id == sa.bindparam("vid")).values(plate_key=sa.bindparam("key")),
+            updates,
+        )
+
+    op.create_table('plate_registry_version',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute("INSERT INTO plate_registry_version (id, version) VALUES (1, 1)")
+
+
+def downgrade():
+    op.drop_table('plate_registry_version')
+    with op.batch_alter_table('vehicles', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_vehicles_plate_key'))
+        batch_op.drop_column('plate_key')
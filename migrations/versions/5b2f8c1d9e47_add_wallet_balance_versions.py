@@ -0,0 +1,32 @@
+"""add wallet balance versions
+
+Revision ID: 5b2f8c1d9e47
+Revises: 734e4bbafdae
+Create Date: 2026-10-19 10:41:07.218334
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b2f8c1d9e47'
+down_revision = '734e4bbafdae'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('wallets', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+    with op.batch_alter_table('pump_wallets', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('pump_wallets', schema=None) as batch_op:
+        batch_op.drop_column('version')
+
+    with op.batch_alter_table('wallets', schema=None) as batch_op:
+        batch_op.drop_column('version')
@@ -0,0 +1,36 @@
+"""unique attendance per employee day
+
+Revision ID: 734e4bbafdae
+Revises: a39dbda100cd
+Create Date: 2026-10-19 09:12:41.532118
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '734e4bbafdae'
+down_revision = 'a39dbda100cd'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Concurrent marks could previously create more than one row per
+    # employee/day; keep the earliest row so the constraint can be added.
+    op.execute(
+        """
+        DELETE FROM attendance
+        WHERE id NOT IN (
+            SELECT MIN(id) FROM attendance GROUP BY employee_id, attendance_date
+        )
+        """
+    )
+
+    with op.batch_alter_table('attendance', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_attendance_employee_date', ['employee_id', 'attendance_date'])
+
+
+def downgrade():
+    with op.batch_alter_table('attendance', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_attendance_employee_date', type_='unique')
@@ -0,0 +1,37 @@
+"""add keyset pagination indexes
+
+Revision ID: 9d3a6f0b1c52
+Revises: c81e4a7f2d30
+Create Date: 2026-10-19 12:04:18.660291
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9d3a6f0b1c52'
+down_revision = 'c81e4a7f2d30'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('fuel_transactions', schema=None) as batch_op:
+        batch_op.create_index('ix_fuel_tx_pump_created', ['pump_id', 'created_at', 'id'], unique=False)
+        batch_op.create_index('ix_fuel_tx_pump_status_created', ['pump_id', 'status', 'created_at', 'id'], unique=False)
+        batch_op.create_index('ix_fuel_tx_vehicle_created', ['vehicle_number', 'created_at', 'id'], unique=False)
+
+    with op.batch_alter_table('wallet_ledger_entries', schema=None) as batch_op:
+        batch_op.create_index('ix_ledger_wallet_created', ['wallet_type', 'wallet_id', 'created_at', 'id'], unique=False)
+        batch_op.create_index('ix_ledger_reference', ['reference_type', 'reference_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('wallet_ledger_entries', schema=None) as batch_op:
+        batch_op.drop_index('ix_ledger_reference')
+        batch_op.drop_index('ix_ledger_wallet_created')
+
+    with op.batch_alter_table('fuel_transactions', schema=None) as batch_op:
+        batch_op.drop_index('ix_fuel_tx_vehicle_created')
+        batch_op.drop_index('ix_fuel_tx_pump_status_created')
+        batch_op.drop_index('ix_fuel_tx_pump_created')
@@ -0,0 +1,37 @@
+"""add pump demand forecasts
+
+Revision ID: a2d8b6e4c170
+Revises: f3a7c2d9e041
+Create Date: 2026-10-19 18:48:09.551274
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a2d8b6e4c170'
+down_revision = 'f3a7c2d9e041'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('pump_demand_forecasts',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('pump_id', sa.Integer(), nullable=False),
+    sa.Column('fuel_type', sa.String(length=20), nullable=False),
+    sa.Column('forecast_date', sa.Date(), nullable=False),
+    sa.Column('litres', sa.Float(), nullable=False),
+    sa.Column('litres_lower', sa.Float(), nullable=False),
+    sa.Column('litres_upper', sa.Float(), nullable=False),
+    sa.Column('model', sa.String(length=32), nullable=False),
+    sa.Column('generated_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+    sa.ForeignKeyConstraint(['pump_id'], ['pumps.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('pump_id', 'forecast_date', 'fuel_type', name='uq_pump_demand_forecast')
+    )
+
+
+def downgrade():
+    op.drop_table('pump_demand_forecasts')
@@ -0,0 +1,34 @@
+"""add fuel transaction receipts
+
+Revision ID: a7d3e9c1f5b2
+Revises: f1a8c4e2b6d9
+Create Date: 2026-10-19 14:21:37.902145
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d3e9c1f5b2'
+down_revision = 'f1a8c4e2b6d9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('fuel_transaction_receipts',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('transaction_id', sa.Integer(), nullable=False),
+    sa.Column('receipt_json', sa.Text(), nullable=False),
+    sa.Column('etag', sa.String(length=64), nullable=False),
+    sa.Column('pdf', sa.LargeBinary(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+    sa.ForeignKeyConstraint(['transaction_id'], ['fuel_transactions.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('transaction_id')
+    )
+
+
+def downgrade():
+    op.drop_table('fuel_transaction_receipts')
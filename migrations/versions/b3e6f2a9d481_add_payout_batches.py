@@ -0,0 +1,61 @@
+"""add payout batches and beneficiary bank details
+
+Revision ID: b3e6f2a9d481
+Revises: a7d3e9c1f5b2
+Create Date: 2026-10-19 15:08:44.216730
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3e6f2a9d481'
+down_revision = 'a7d3e9c1f5b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('payout_batches',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('batch_ref', sa.String(length=32), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('item_count', sa.Integer(), nullable=False),
+    sa.Column('total_amount', sa.Float(), nullable=False),
+    sa.Column('file_content', sa.Text(), nullable=False),
+    sa.Column('created_by', sa.String(length=120), nullable=True),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+    sa.Column('response_ingested_at', sa.DateTime(), nullable=True),
+    sa.Column('processed_count', sa.Integer(), nullable=False),
+    sa.Column('failed_count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('batch_ref')
+    )
+    with op.batch_alter_table('pump_settlements', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('payout_batch_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('utr', sa.String(length=50), nullable=True))
+        batch_op.add_column(sa.Column('failure_reason', sa.String(length=255), nullable=True))
+        batch_op.create_index(batch_op.f('ix_pump_settlements_payout_batch_id'), ['payout_batch_id'], unique=False)
+        batch_op.create_foreign_key('fk_pump_settlements_payout_batch_id', 'payout_batches', ['payout_batch_id'], ['id'])
+
+    with op.batch_alter_table('pump_owners', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('bank_account_name', sa.String(length=100), nullable=True))
+        batch_op.add_column(sa.Column('bank_account_number', sa.String(length=34), nullable=True))
+        batch_op.add_column(sa.Column('bank_ifsc', sa.String(length=11), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('pump_owners', schema=None) as batch_op:
+        batch_op.drop_column('bank_ifsc')
+        batch_op.drop_column('bank_account_number')
+        batch_op.drop_column('bank_account_name')
+
+    with op.batch_alter_table('pump_settlements', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_pump_settlements_payout_batch_id', type_='foreignkey')
+        batch_op.drop_index(batch_op.f('ix_pump_settlements_payout_batch_id'))
+        batch_op.drop_column('failure_reason')
+        batch_op.drop_column('utr')
+        batch_op.drop_column('payout_batch_id')
+
+    op.drop_table('payout_batches')
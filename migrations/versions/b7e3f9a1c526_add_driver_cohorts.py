@@ -0,0 +1,78 @@
+"""add driver cohorts
+
+Revision ID: b7e3f9a1c526
+Revises: a2d8b6e4c170
+Create Date: 2026-10-19 19:32:41.208317
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e3f9a1c526'
+down_revision = 'a2d8b6e4c170'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('driver_cohorts',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('cohort_month', sa.Date(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id')
+    )
+    with op.batch_alter_table('driver_cohorts', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_driver_cohorts_cohort_month'), ['cohort_month'], unique=False)
+
+    op.create_table('driver_monthly_activity',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('activity_month', sa.Date(), nullable=False),
+    sa.Column('transaction_count', sa.Integer(), nullable=False),
+    sa.Column('total_amount', sa.Float(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'activity_month', name='uq_driver_monthly_activity')
+    )
+
+    # Backfill from settled history, attributed through each sale's driver wallet
+    # debit; `flask escrow rebuild-driver-cohorts` repairs later
+    if op.get_bind().dialect.name == 'postgresql':
+        month = "CAST(date_trunc('month', t.created_at) AS DATE)"
+    else:
+        month = "date(t.created_at, 'start of month')"
+    op.execute(
+        f"""
+        INSERT INTO driver_monthly_activity (user_id, activity_month, transaction_count, total_amount, updated_at)
+        SELECT w.user_id, {month}, COUNT(*), COALESCE(SUM(t.amount), 0), CURRENT_TIMESTAMP
+        FROM fuel_transactions t
+        JOIN wallet_ledger_entries l
+          ON l.reference_type = 'fuel_transaction' AND l.reference_id = t.id
+         AND l.event_type = 'fuel_sale' AND l.direction = 'debit' AND l.wallet_type = 'driver_wallet'
+        JOIN wallets w ON w.id = l.wallet_id
+        WHERE t.status = 'settled' AND t.created_at IS NOT NULL
+        GROUP BY w.user_id, {month}
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO driver_cohorts (user_id, cohort_month, updated_at)
+        SELECT user_id, MIN(activity_month), CURRENT_TIMESTAMP
+        FROM driver_monthly_activity
+        GROUP BY user_id
+        """
+    )
+
+
+def downgrade():
+    op.drop_table('driver_monthly_activity')
+    with op.batch_alter_table('driver_cohorts', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_driver_cohorts_cohort_month'))
+
+    op.drop_table('driver_cohorts')
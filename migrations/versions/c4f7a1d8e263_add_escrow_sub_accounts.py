@@ -0,0 +1,41 @@
+"""add escrow sub-accounts
+
+Revision ID: c4f7a1d8e263
+Revises: b3e6f2a9d481
+Create Date: 2026-10-19 15:46:03.771928
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4f7a1d8e263'
+down_revision = 'b3e6f2a9d481'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('escrow_accounts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('parent_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('shard', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+        batch_op.create_index(batch_op.f('ix_escrow_accounts_parent_id'), ['parent_id'], unique=False)
+        batch_op.create_foreign_key('fk_escrow_accounts_parent_id', 'escrow_accounts', ['parent_id'], ['id'])
+
+    # Seed the root so concurrent first top-ups never race to create it
+    if op.get_bind().execute(sa.text("SELECT id FROM escrow_accounts WHERE name = 'main'")).first() is None:
+        op.execute(
+            "INSERT INTO escrow_accounts (name, balance, version, created_at) "
+            "VALUES ('main', 0, 1, CURRENT_TIMESTAMP)"
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('escrow_accounts', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_escrow_accounts_parent_id', type_='foreignkey')
+        batch_op.drop_index(batch_op.f('ix_escrow_accounts_parent_id'))
+        batch_op.drop_column('version')
+        batch_op.drop_column('shard')
+        batch_op.drop_column('parent_id')
@@ -0,0 +1,63 @@
+"""add wallet balance checkpoints
+
+Revision ID: c81e4a7f2d30
+Revises: 5b2f8c1d9e47
+Create Date: 2026-10-19 11:26:53.804417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c81e4a7f2d30'
+down_revision = '5b2f8c1d9e47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('wallet_balance_checkpoints',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('wallet_type', sa.String(length=16), nullable=False),
+    sa.Column('wallet_id', sa.Integer(), nullable=False),
+    sa.Column('last_entry_id', sa.Integer(), nullable=False),
+    sa.Column('last_entry_at', sa.DateTime(), nullable=True),
+    sa.Column('balance', sa.Float(), nullable=False),
+    sa.Column('stored_balance', sa.Float(), nullable=False),
+    sa.Column('drift', sa.Float(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('wallet_balance_checkpoints', schema=None) as batch_op:
+        batch_op.create_index('ix_balance_checkpoint_wallet', ['wallet_type', 'wallet_id', 'last_entry_id'], unique=False)
+
+    with op.batch_alter_table('wallet_ledger_entries', schema=None) as batch_op:
+        batch_op.create_index('ix_ledger_wallet_entry', ['wallet_type', 'wallet_id', 'id'], unique=False)
+
+    # Opening checkpoints: balances that predate the ledger (manual credits
+    # without entries) are taken as given, so only later entries are checked
+    for wallet_type, table in (('driver_wallet', 'wallets'), ('pump_wallet', 'pump_wallets')):
+        op.execute(
+            f"""
+            INSERT INTO wallet_balance_checkpoints
+                (wallet_type, wallet_id, last_entry_id, last_entry_at, balance, stored_balance, drift, created_at)
+            SELECT '{wallet_type}', w.id,
+                   COALESCE((SELECT MAX(e.id) FROM wallet_ledger_entries e
+                             WHERE e.wallet_type = '{wallet_type}' AND e.wallet_id = w.id), 0),
+                   COALESCE((SELECT MAX(e.created_at) FROM wallet_ledger_entries e
+                             WHERE e.wallet_type = '{wallet_type}' AND e.wallet_id = w.id), CURRENT_TIMESTAMP),
+                   COALESCE(w.balance, 0), COALESCE(w.balance, 0), 0, CURRENT_TIMESTAMP
+            FROM {table} w
+            """
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('wallet_ledger_entries', schema=None) as batch_op:
+        batch_op.drop_index('ix_ledger_wallet_entry')
+
+    with op.batch_alter_table('wallet_balance_checkpoints', schema=None) as batch_op:
+        batch_op.drop_index('ix_balance_checkpoint_wallet')
+
+    op.drop_table('wallet_balance_checkpoints')
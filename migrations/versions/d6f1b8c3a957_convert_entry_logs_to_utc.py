@@ -0,0 +1,111 @@
+"""convert ANPR entry logs to UTC
+
+Revision ID: d6f1b8c3a957
+Revises: b7e3f9a1c526
+Create Date: 2026-10-19 21:14:52.603418
+
+"""
+import os
+from datetime import datetime, timedelta
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd6f1b8c3a957'
+down_revision = 'b7e3f9a1c526'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 5000
+
+
+def _local_offset_minutes():
+    """
+    UTC offset of the clock the ANPR processor stamped detections with: the
+    app host's local time. ANPR_LOCAL_UTC_OFFSET_MINUTES overrides it when
+    migrating from another machine.
+    """
+    override = os.getenv("ANPR_LOCAL_UTC_OFFSET_MINUTES")
+    if override:
+        return int(override)
+    return int(datetime.now().astimezone().utcoffset().total_seconds() // 60)
+
+
+def _shift_detections(minutes):
+    conn = op.get_bind()
+    if conn.dialect.name == 'postgresql':
+        op.execute(
+            f"UPDATE vehicle_entry_logs SET detected_at = detected_at - INTERVAL '{minutes} minutes', "
+            f"exit_time = exit_time - INTERVAL '{minutes} minutes'"
+        )
+        return
+    logs = sa.table('vehicle_entry_logs', sa.column('id', sa.Integer), sa.column('detected_at', sa.DateTime),
+                    sa.column('exit_time', sa.DateTime))
+    delta = timedelta(minutes=minutes)
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.select(logs.c.id, logs.c.detected_at, logs.c.exit_time)
+            .where(logs.c.id > last_id).order_by(logs.c.id).limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        conn.execute(
+            logs.update().where(logs.c.id == sa.bindparam('log_id')).values(
+                detected_at=sa.bindparam('detected'), exit_time=sa.bindparam('exited'),
+            ),
+            [
+                {
+                    'log_id': row.id,
+                    'detected': row.detected_at - delta if row.detected_at else None,
+                    'exited': row.exit_time - delta if row.exit_time else None,
+                }
+                for row in rows
+            ],
+        )
+        last_id = rows[-1].id
+
+
+def _rebuild_hourly_rollup():
+    if op.get_bind().dialect.name == 'postgresql':
+        hour = "date_trunc('hour', detected_at)"
+    else:
+        hour = "strftime('%Y-%m-%d %H:00:00', detected_at)"
+    op.execute("DELETE FROM vehicle_entry_hourly")
+    op.execute(
+        f"""
+        INSERT INTO vehicle_entry_hourly
+            (pump_id, hour_start, total_entries, compliant, expired, expiring_soon, unknown,
+             blacklisted, allowed, alerts_triggered, updated_at)
+        SELECT pump_id, {hour}, COUNT(*),
+               SUM(CASE WHEN compliance_status = 'compliant' THEN 1 ELSE 0 END),
+               SUM(CASE WHEN compliance_status = 'expired' THEN 1 ELSE 0 END),
+               SUM(CASE WHEN compliance_status = 'expiring_soon' THEN 1 ELSE 0 END),
+               SUM(CASE WHEN compliance_status = 'unknown' THEN 1 ELSE 0 END),
+               SUM(CASE WHEN compliance_status = 'blacklisted' THEN 1 ELSE 0 END),
+               SUM(CASE WHEN is_allowed_entry THEN 1 ELSE 0 END),
+               SUM(CASE WHEN alert_triggered THEN 1 ELSE 0 END),
+               CURRENT_TIMESTAMP
+        FROM vehicle_entry_logs
+        WHERE detected_at IS NOT NULL
+        GROUP BY pump_id, {hour}
+        """
+    )
+
+
+def upgrade():
+    # Detections were stamped with the host's local datetime.now(); everything
+    # else, and the processor from now on, uses naive UTC
+    minutes = _local_offset_minutes()
+    if minutes:
+        _shift_detections(minutes)
+        _rebuild_hourly_rollup()
+
+
+def downgrade():
+    minutes = _local_offset_minutes()
+    if minutes:
+        _shift_detections(-minutes)
+        _rebuild_hourly_rollup()
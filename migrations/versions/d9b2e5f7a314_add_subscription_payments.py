@@ -0,0 +1,53 @@
+"""add subscription payments and top-up gateway id indexes
+
+Revision ID: d9b2e5f7a314
+Revises: c4f7a1d8e263
+Create Date: 2026-10-19 16:32:18.204517
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9b2e5f7a314'
+down_revision = 'c4f7a1d8e263'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('subscription_payments',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('pump_owner_id', sa.Integer(), nullable=False),
+    sa.Column('pump_id', sa.Integer(), nullable=False),
+    sa.Column('plan_type', sa.String(length=50), nullable=False),
+    sa.Column('duration', sa.String(length=50), nullable=False),
+    sa.Column('amount', sa.Float(), nullable=False),
+    sa.Column('currency', sa.String(length=8), nullable=False),
+    sa.Column('razorpay_order_id', sa.String(length=100), nullable=True),
+    sa.Column('razorpay_payment_id', sa.String(length=100), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+    sa.ForeignKeyConstraint(['pump_id'], ['pumps.id'], ),
+    sa.ForeignKeyConstraint(['pump_owner_id'], ['pump_owners.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('razorpay_payment_id')
+    )
+    with op.batch_alter_table('subscription_payments', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_subscription_payments_razorpay_order_id'), ['razorpay_order_id'], unique=False)
+
+    with op.batch_alter_table('wallet_topups', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_wallet_topups_razorpay_order_id'), ['razorpay_order_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_wallet_topups_razorpay_payment_id'), ['razorpay_payment_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('wallet_topups', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_wallet_topups_razorpay_payment_id'))
+        batch_op.drop_index(batch_op.f('ix_wallet_topups_razorpay_order_id'))
+
+    with op.batch_alter_table('subscription_payments', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_subscription_payments_razorpay_order_id'))
+
+    op.drop_table('subscription_payments')
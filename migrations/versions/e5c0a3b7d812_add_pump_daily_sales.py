@@ -0,0 +1,53 @@
+"""add pump daily sales rollup
+
+Revision ID: e5c0a3b7d812
+Revises: 4e7b2d9a8f13
+Create Date: 2026-10-19 13:15:02.447610
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5c0a3b7d812'
+down_revision = '4e7b2d9a8f13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('pump_daily_sales',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('pump_id', sa.Integer(), nullable=False),
+    sa.Column('sales_date', sa.Date(), nullable=False),
+    sa.Column('fuel_type', sa.String(length=20), nullable=False),
+    sa.Column('transaction_count', sa.Integer(), nullable=False),
+    sa.Column('total_litres', sa.Float(), nullable=False),
+    sa.Column('total_amount', sa.Float(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+    sa.ForeignKeyConstraint(['pump_id'], ['pumps.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('pump_id', 'sales_date', 'fuel_type', name='uq_pump_daily_sales')
+    )
+    with op.batch_alter_table('pump_daily_sales', schema=None) as batch_op:
+        batch_op.create_index('ix_pump_daily_sales_date', ['sales_date'], unique=False)
+
+    # Backfill from settled history; `flask escrow rebuild-daily-sales` repairs later
+    op.execute(
+        """
+        INSERT INTO pump_daily_sales
+            (pump_id, sales_date, fuel_type, transaction_count, total_litres, total_amount, updated_at)
+        SELECT pump_id, DATE(created_at), fuel_type, COUNT(*), SUM(quantity_litres), SUM(amount), CURRENT_TIMESTAMP
+        FROM fuel_transactions
+        WHERE status = 'settled'
+        GROUP BY pump_id, DATE(created_at), fuel_type
+        """
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('pump_daily_sales', schema=None) as batch_op:
+        batch_op.drop_index('ix_pump_daily_sales_date')
+
+    op.drop_table('pump_daily_sales')
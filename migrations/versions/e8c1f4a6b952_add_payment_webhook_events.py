@@ -0,0 +1,44 @@
+"""add payment webhook events
+
+Revision ID: e8c1f4a6b952
+Revises: d9b2e5f7a314
+Create Date: 2026-10-19 17:05:41.618390
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8c1f4a6b952'
+down_revision = 'd9b2e5f7a314'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('payment_webhook_events',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('event_id', sa.String(length=64), nullable=False),
+    sa.Column('event_type', sa.String(length=64), nullable=False),
+    sa.Column('payment_id', sa.String(length=100), nullable=True),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('received_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+    sa.Column('processed_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('event_id')
+    )
+    with op.batch_alter_table('payment_webhook_events', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_payment_webhook_events_payment_id'), ['payment_id'], unique=False)
+        batch_op.create_index('ix_webhook_events_status_id', ['status', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('payment_webhook_events', schema=None) as batch_op:
+        batch_op.drop_index('ix_webhook_events_status_id')
+        batch_op.drop_index(batch_op.f('ix_payment_webhook_events_payment_id'))
+
+    op.drop_table('payment_webhook_events')
@@ -0,0 +1,28 @@
+"""add fuel transaction idempotency key
+
+Revision ID: f1a8c4e2b6d9
+Revises: e5c0a3b7d812
+Create Date: 2026-10-19 13:52:10.583214
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1a8c4e2b6d9'
+down_revision = 'e5c0a3b7d812'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('fuel_transactions', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('idempotency_key', sa.String(length=64), nullable=True))
+        batch_op.create_unique_constraint('uq_fuel_tx_pump_idempotency', ['pump_id', 'idempotency_key'])
+
+
+def downgrade():
+    with op.batch_alter_table('fuel_transactions', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_fuel_tx_pump_idempotency', type_='unique')
+        batch_op.drop_column('idempotency_key')
@@ -0,0 +1,70 @@
+"""add vehicle entry hourly rollup and entry log pump/time index
+
+Revision ID: f3a7c2d9e041
+Revises: e8c1f4a6b952
+Create Date: 2026-10-19 18:12:57.340126
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a7c2d9e041'
+down_revision = 'e8c1f4a6b952'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('vehicle_entry_hourly',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('pump_id', sa.Integer(), nullable=False),
+    sa.Column('hour_start', sa.DateTime(), nullable=False),
+    sa.Column('total_entries', sa.Integer(), nullable=False),
+    sa.Column('compliant', sa.Integer(), nullable=False),
+    sa.Column('expired', sa.Integer(), nullable=False),
+    sa.Column('expiring_soon', sa.Integer(), nullable=False),
+    sa.Column('unknown', sa.Integer(), nullable=False),
+    sa.Column('blacklisted', sa.Integer(), nullable=False),
+    sa.Column('allowed', sa.Integer(), nullable=False),
+    sa.Column('alerts_triggered', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+    sa.ForeignKeyConstraint(['pump_id'], ['pumps.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('pump_id', 'hour_start', name='uq_vehicle_entry_hourly')
+    )
+    with op.batch_alter_table('vehicle_entry_logs', schema=None) as batch_op:
+        batch_op.create_index('ix_vehicle_entry_logs_pump_detected', ['pump_id', 'detected_at'], unique=False)
+
+    # Backfill from existing entry logs; `flask hydrotesting rebuild-entry-rollup` repairs later
+    if op.get_bind().dialect.name == 'postgresql':
+        hour = "date_trunc('hour', detected_at)"
+    else:
+        hour = "strftime('%Y-%m-%d %H:00:00', detected_at)"
+    op.execute(
+        f"""
+        INSERT INTO vehicle_entry_hourly
+            (pump_id, hour_start, total_entries, compliant, expired, expiring_soon, unknown,
+             blacklisted, allowed, alerts_triggered, updated_at)
+        SELECT pump_id, {hour}, COUNT(*),
+               SUM(CASE WHEN compliance_status = 'compliant' THEN 1 ELSE 0 END),
+               SUM(CASE WHEN compliance_status = 'expired' THEN 1 ELSE 0 END),
+               SUM(CASE WHEN compliance_status = 'expiring_soon' THEN 1 ELSE 0 END),
+               SUM(CASE WHEN compliance_status = 'unknown' THEN 1 ELSE 0 END),
+               SUM(CASE WHEN compliance_status = 'blacklisted' THEN 1 ELSE 0 END),
+               SUM(CASE WHEN is_allowed_entry THEN 1 ELSE 0 END),
+               SUM(CASE WHEN alert_triggered THEN 1 ELSE 0 END),
+               CURRENT_TIMESTAMP
+        FROM vehicle_entry_logs
+        WHERE detected_at IS NOT NULL
+        GROUP BY pump_id, {hour}
+        """
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('vehicle_entry_logs', schema=None) as batch_op:
+        batch_op.drop_index('ix_vehicle_entry_logs_pump_detected')
+
+    op.drop_table('vehicle_entry_hourly')
@@ -2,8 +2,10 @@
 from extensions import db
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
-from sqlalchemy import func, UniqueConstraint
+from sqlalchemy import func, Index, UniqueConstraint
+from sqlalchemy.orm import validates
 from datetime import datetime
+import re
 
 class User(db.Model, UserMixin):  
     __tablename__ = "users"  # explicit table name
@@ -32,6 +34,14 @@ class User(db.Model, UserMixin):
         return f"<User {self.email} | Wallet: {self.wallet_balance}>"
 
 
+_PLATE_STRIP_RE = re.compile(r"[^A-Z0-9]")
+
+
+def normalize_plate(plate):
+    """Canonical form of a number plate: upper case, letters and digits only"""
+    return _PLATE_STRIP_RE.sub("", (plate or "").upper())
+
+
 class Vehicle(db.Model):
     __tablename__ = "vehicles"
     id = db.Column(db.Integer, primary_key=True)
@@ -39,15 +49,33 @@ class Vehicle(db.Model):
     type = db.Column(db.String(50), nullable=False)
     year = db.Column(db.String(10), nullable=False)
     license = db.Column(db.String(50), nullable=False)
+    # license reduced to A-Z0-9 (e.g. "ka-01 ab 1234" -> "KA01AB1234") for lookups
+    plate_key = db.Column(db.String(50), nullable=True, index=True)
     fuel_type = db.Column(db.String(20), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
 
+    @validates("license")
+    def _sync_plate_key(self, key, value):
+        self.plate_key = normalize_plate(value)
+        return value
+
+
+class PlateRegistryVersion(db.Model):
+    """Single row bumped with every vehicle write, so plate caches in other processes can tell they are stale"""
+    __tablename__ = "plate_registry_version"
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
+
 
 class Wallet(db.Model):
     __tablename__ = "wallets"
     id = db.Column(db.Integer, primary_key=True)
     balance = db.Column(db.Float, default=0.0)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    # Bumped on every balance change; ORM writes fail on a stale version
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+
+    __mapper_args__ = {"version_id_col": version}
 
 
 
@@ -62,6 +90,11 @@ class PumpOwner(db.Model, UserMixin):
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(200), nullable=True)
 
+    # Payout beneficiary for NEFT/RTGS settlement batches
+    bank_account_name = db.Column(db.String(100), nullable=True)
+    bank_account_number = db.Column(db.String(34), nullable=True)
+    bank_ifsc = db.Column(db.String(11), nullable=True)
+
     # Relationships
     pumps = db.relationship("Pump", backref="owner", lazy=True)
     wallet = db.relationship("PumpWallet", backref="owner", uselist=False, cascade="all, delete-orphan")
@@ -101,6 +134,9 @@ class PumpWallet(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     balance = db.Column(db.Float, default=0.0)
     owner_id = db.Column(db.Integer, db.ForeignKey('pump_owners.id'), nullable=False)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+
+    __mapper_args__ = {"version_id_col": version}
 
 
 class EscrowAccount(db.Model):
@@ -109,8 +145,15 @@ class EscrowAccount(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), unique=True, nullable=False, default="main")
     balance = db.Column(db.Float, nullable=False, default=0.0)
+    # Sub-accounts ("main#3") take top-ups so they do not all queue on the
+    # root row's lock; consolidation rolls them up into the root
+    parent_id = db.Column(db.Integer, db.ForeignKey("escrow_accounts.id"), nullable=True, index=True)
+    shard = db.Column(db.Integer, nullable=True)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
     created_at = db.Column(db.DateTime, server_default=func.now())
 
+    __mapper_args__ = {"version_id_col": version}
+
 
 class WalletTopup(db.Model):
     __tablename__ = "wallet_topups"
@@ -125,8 +168,8 @@ class WalletTopup(db.Model):
     txn_uuid = db.Column(db.String(36), nullable=False, unique=True)
     status = db.Column(db.String(20), nullable=False, default="created")
 
-    razorpay_order_id = db.Column(db.String(100), nullable=True)
-    razorpay_payment_id = db.Column(db.String(100), nullable=True)
+    razorpay_order_id = db.Column(db.String(100), nullable=True, index=True)
+    razorpay_payment_id = db.Column(db.String(100), nullable=True, index=True)
     razorpay_signature = db.Column(db.String(255), nullable=True)
 
     created_at = db.Column(db.DateTime, server_default=func.now())
@@ -153,6 +196,7 @@ class FuelTransaction(db.Model):
     verified_at = db.Column(db.DateTime, nullable=True)
     settled_at = db.Column(db.DateTime, nullable=True)
     extra_data = db.Column(db.JSON, nullable=True)  # OCR results, pump pulse data, ANPR confidence, etc.
+    idempotency_key = db.Column(db.String(64), nullable=True)  # client-supplied by bulk ingest, unique per pump
     created_at = db.Column(db.DateTime, server_default=func.now(), nullable=False)
     updated_at = db.Column(db.DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
 
@@ -161,6 +205,28 @@ class FuelTransaction(db.Model):
     attendant = db.relationship("PumpOwner", foreign_keys=[attendant_id], backref="attended_transactions")
     verifier = db.relationship("PumpOwner", foreign_keys=[verifier_id], backref="verified_transactions")
 
+    __table_args__ = (
+        # Keyset pagination paths: newest first on (created_at, id)
+        Index("ix_fuel_tx_pump_created", "pump_id", "created_at", "id"),
+        Index("ix_fuel_tx_pump_status_created", "pump_id", "status", "created_at", "id"),
+        Index("ix_fuel_tx_vehicle_created", "vehicle_number", "created_at", "id"),
+        UniqueConstraint("pump_id", "idempotency_key", name="uq_fuel_tx_pump_idempotency"),
+    )
+
+
+class FuelTransactionReceipt(db.Model):
+    """Receipt of a settled transaction, rendered once at settlement and never changed"""
+    __tablename__ = "fuel_transaction_receipts"
+
+    id = db.Column(db.Integer, primary_key=True)
+    transaction_id = db.Column(db.Integer, db.ForeignKey("fuel_transactions.id"), nullable=False, unique=True)
+    receipt_json = db.Column(db.Text, nullable=False)  # compact JSON, served byte for byte
+    etag = db.Column(db.String(64), nullable=False)  # sha256 of receipt_json
+    pdf = db.Column(db.LargeBinary, nullable=True)  # optional pre-rendered PDF
+    created_at = db.Column(db.DateTime, server_default=func.now(), nullable=False)
+
+    transaction = db.relationship("FuelTransaction", backref=db.backref("receipt", uselist=False))
+
 
 class WalletLedgerEntry(db.Model):
     __tablename__ = "wallet_ledger_entries"
@@ -177,6 +243,80 @@ class WalletLedgerEntry(db.Model):
     created_at = db.Column(db.DateTime, server_default=func.now(), nullable=False)
     # No updates; ledger entries are immutable
 
+    __table_args__ = (
+        # Per-wallet history in entry order (reconciliation, balance as of)
+        Index("ix_ledger_wallet_entry", "wallet_type", "wallet_id", "id"),
+        # Wallet history pages, newest first on (created_at, id)
+        Index("ix_ledger_wallet_created", "wallet_type", "wallet_id", "created_at", "id"),
+        # Receipt lookups by the entity an entry belongs to
+        Index("ix_ledger_reference", "reference_type", "reference_id"),
+    )
+
+
+class WalletBalanceCheckpoint(db.Model):
+    __tablename__ = "wallet_balance_checkpoints"
+
+    id = db.Column(db.Integer, primary_key=True)
+    wallet_type = db.Column(db.String(16), nullable=False)  # driver_wallet, pump_wallet
+    wallet_id = db.Column(db.Integer, nullable=False)
+    last_entry_id = db.Column(db.Integer, nullable=False)  # last WalletLedgerEntry.id folded in (0 = none)
+    last_entry_at = db.Column(db.DateTime, nullable=True)
+    balance = db.Column(db.Float, nullable=False)  # ledger balance up to last_entry_id
+    stored_balance = db.Column(db.Float, nullable=False)  # Wallet/PumpWallet.balance when checked
+    drift = db.Column(db.Float, nullable=False, default=0.0)  # stored_balance - balance
+    created_at = db.Column(db.DateTime, server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        Index("ix_balance_checkpoint_wallet", "wallet_type", "wallet_id", "last_entry_id"),
+    )
+
+
+class PumpDailySales(db.Model):
+    """Settled sales per pump, day and fuel type, maintained at settlement time"""
+    __tablename__ = "pump_daily_sales"
+
+    id = db.Column(db.Integer, primary_key=True)
+    pump_id = db.Column(db.Integer, db.ForeignKey("pumps.id"), nullable=False)
+    sales_date = db.Column(db.Date, nullable=False)  # date the fuel was sold (FuelTransaction.created_at)
+    fuel_type = db.Column(db.String(20), nullable=False)
+    transaction_count = db.Column(db.Integer, nullable=False, default=0)
+    total_litres = db.Column(db.Float, nullable=False, default=0.0)
+    total_amount = db.Column(db.Float, nullable=False, default=0.0)
+    updated_at = db.Column(db.DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
+
+    pump = db.relationship("Pump", backref="daily_sales")
+
+    __table_args__ = (
+        UniqueConstraint("pump_id", "sales_date", "fuel_type", name="uq_pump_daily_sales"),
+        Index("ix_pump_daily_sales_date", "sales_date"),
+    )
+
+
+class DriverCohort(db.Model):
+    """A driver's first month with a settled fuel sale"""
+    __tablename__ = "driver_cohorts"
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False, unique=True)
+    cohort_month = db.Column(db.Date, nullable=False, index=True)  # first day of the month
+    updated_at = db.Column(db.DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
+
+
+class DriverMonthlyActivity(db.Model):
+    """Settled fuel sales per driver and month; a row means the driver was active that month"""
+    __tablename__ = "driver_monthly_activity"
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    activity_month = db.Column(db.Date, nullable=False)  # first day of the month (FuelTransaction.created_at)
+    transaction_count = db.Column(db.Integer, nullable=False, default=0)
+    total_amount = db.Column(db.Float, nullable=False, default=0.0)
+    updated_at = db.Column(db.DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "activity_month", name="uq_driver_monthly_activity"),
+    )
+
 
 class PumpSettlement(db.Model):
     __tablename__ = "pump_settlements"
@@ -187,16 +327,60 @@ class PumpSettlement(db.Model):
 
     amount = db.Column(db.Float, nullable=False)
     currency = db.Column(db.String(8), nullable=False, default="INR")
+    # pending, approved / rejected (manual), in_payout, processed / failed (bank batch)
     status = db.Column(db.String(20), nullable=False, default="pending")
 
     bank_reference = db.Column(db.String(100), nullable=True)
     requested_at = db.Column(db.DateTime, server_default=func.now())
     processed_at = db.Column(db.DateTime, nullable=True)
 
+    # Bulk payout: the batch file this went out in and the bank's answer
+    payout_batch_id = db.Column(db.Integer, db.ForeignKey("payout_batches.id"), nullable=True, index=True)
+    utr = db.Column(db.String(50), nullable=True)  # bank transfer reference
+    failure_reason = db.Column(db.String(255), nullable=True)
+
     pump_wallet = db.relationship("PumpWallet", backref="settlements")
     pump_owner = db.relationship("PumpOwner", backref="settlements")
 
 
+class PumpDemandForecast(db.Model):
+    """Expected litres per pump, day and fuel type, refreshed by the nightly forecast job"""
+    __tablename__ = "pump_demand_forecasts"
+
+    id = db.Column(db.Integer, primary_key=True)
+    pump_id = db.Column(db.Integer, db.ForeignKey("pumps.id"), nullable=False)
+    fuel_type = db.Column(db.String(20), nullable=False)
+    forecast_date = db.Column(db.Date, nullable=False)
+    litres = db.Column(db.Float, nullable=False)
+    litres_lower = db.Column(db.Float, nullable=False)  # prediction interval bounds
+    litres_upper = db.Column(db.Float, nullable=False)
+    model = db.Column(db.String(32), nullable=False)
+    generated_at = db.Column(db.DateTime, server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("pump_id", "forecast_date", "fuel_type", name="uq_pump_demand_forecast"),
+    )
+
+
+class PayoutBatch(db.Model):
+    """One NEFT/RTGS bulk-transfer file covering many pump settlements"""
+    __tablename__ = "payout_batches"
+
+    id = db.Column(db.Integer, primary_key=True)
+    batch_ref = db.Column(db.String(32), unique=True, nullable=False)  # customer reference prefix on every row
+    status = db.Column(db.String(20), nullable=False, default="awaiting_response")  # awaiting_response, completed
+    item_count = db.Column(db.Integer, nullable=False, default=0)
+    total_amount = db.Column(db.Float, nullable=False, default=0.0)
+    file_content = db.Column(db.Text, nullable=False)  # CSV sent to the bank, kept for re-download
+    created_by = db.Column(db.String(120), nullable=True)
+    created_at = db.Column(db.DateTime, server_default=func.now())
+    response_ingested_at = db.Column(db.DateTime, nullable=True)
+    processed_count = db.Column(db.Integer, nullable=False, default=0)
+    failed_count = db.Column(db.Integer, nullable=False, default=0)
+
+    settlements = db.relationship("PumpSettlement", backref="payout_batch", lazy="dynamic")
+
+
 class PumpSubscription(db.Model):
     __tablename__ = "pump_subscriptions"
 
@@ -214,6 +398,44 @@ class PumpSubscription(db.Model):
     end_date = db.Column(db.DateTime, nullable=True)
 
 
+class SubscriptionPayment(db.Model):
+    """A captured Razorpay payment for a pump subscription (gateway reconciliation key)"""
+    __tablename__ = "subscription_payments"
+
+    id = db.Column(db.Integer, primary_key=True)
+    pump_owner_id = db.Column(db.Integer, db.ForeignKey("pump_owners.id"), nullable=False)
+    pump_id = db.Column(db.Integer, db.ForeignKey("pumps.id"), nullable=False)
+    plan_type = db.Column(db.String(50), nullable=False)
+    duration = db.Column(db.String(50), nullable=False)
+    amount = db.Column(db.Float, nullable=False)
+    currency = db.Column(db.String(8), nullable=False, default="INR")
+    razorpay_order_id = db.Column(db.String(100), nullable=True, index=True)
+    razorpay_payment_id = db.Column(db.String(100), nullable=False, unique=True)
+    status = db.Column(db.String(20), nullable=False, default="captured")  # captured, refunded
+    created_at = db.Column(db.DateTime, server_default=func.now())
+
+
+class PaymentWebhookEvent(db.Model):
+    """A verified gateway webhook, stored raw and applied later by the webhook worker"""
+    __tablename__ = "payment_webhook_events"
+
+    id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(db.String(64), unique=True, nullable=False)  # X-Razorpay-Event-Id, else body hash
+    event_type = db.Column(db.String(64), nullable=False)  # payment.captured, order.paid, payment.failed, ...
+    payment_id = db.Column(db.String(100), nullable=True, index=True)
+    payload = db.Column(db.Text, nullable=False)  # raw body exactly as signed
+    status = db.Column(db.String(20), nullable=False, default="pending")  # pending, processed, ignored, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    received_at = db.Column(db.DateTime, server_default=func.now())
+    processed_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        # Worker queue scan: pending events oldest first
+        Index("ix_webhook_events_status_id", "status", "id"),
+    )
+
+
 class StationVehicle(db.Model):
     __tablename__ = "station_vehicles"
 
@@ -538,6 +760,10 @@ class Attendance(db.Model):
     
     # Relationships
     pump = db.relationship("Pump", backref="attendance_records")
+
+    __table_args__ = (
+        UniqueConstraint("employee_id", "attendance_date", name="uq_attendance_employee_date"),
+    )
     
     def __repr__(self):
         return f"<Attendance Employee ID: {self.employee_id} | Date: {self.attendance_date} | Status: {self.status}>"
@@ -856,10 +1082,37 @@ class VehicleEntryLog(db.Model):
     exit_time = db.Column(db.DateTime)
     duration_minutes = db.Column(db.Integer)
     
+    __table_args__ = (
+        # Per-pump time-window scans (entry statistics, recent detections)
+        Index("ix_vehicle_entry_logs_pump_detected", "pump_id", "detected_at"),
+    )
+    
     def __repr__(self):
         return f"<VehicleEntryLog {self.vehicle_number} | Entry: {self.detected_at}>"
 
 
+class VehicleEntryHourly(db.Model):
+    """ANPR entry counts per pump and hour, maintained as entries are logged"""
+    __tablename__ = "vehicle_entry_hourly"
+
+    id = db.Column(db.Integer, primary_key=True)
+    pump_id = db.Column(db.Integer, db.ForeignKey('pumps.id'), nullable=False)
+    hour_start = db.Column(db.DateTime, nullable=False)  # detected_at truncated to the hour
+    total_entries = db.Column(db.Integer, nullable=False, default=0)
+    compliant = db.Column(db.Integer, nullable=False, default=0)
+    expired = db.Column(db.Integer, nullable=False, default=0)
+    expiring_soon = db.Column(db.Integer, nullable=False, default=0)
+    unknown = db.Column(db.Integer, nullable=False, default=0)
+    blacklisted = db.Column(db.Integer, nullable=False, default=0)
+    allowed = db.Column(db.Integer, nullable=False, default=0)
+    alerts_triggered = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, server_default=func.now(), onupdate=func.now(), nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("pump_id", "hour_start", name="uq_vehicle_entry_hourly"),
+    )
+
+
 class ANPRCamera(db.Model):
     """ANPR Camera configuration for each pump"""
     __tablename__ = "anpr_cameras"
@@ -0,0 +1,127 @@
+"""
+Payment webhook checks.
+
+Queues Razorpay-shaped events through enqueue_webhook_event and applies
+them with process_webhook_events: redelivery, the checkout callback racing
+the webhook, and amounts that do not match the order.
+
+Usage:
+    python -m pytest -q payment_webhooks_test.py
+"""
+import uuid
+
+import pytest
+
+from extensions import db
+from models import (
+    PaymentWebhookEvent, Pump, PumpOwner, PumpSubscription, SubscriptionPayment,
+    User, Wallet, WalletLedgerEntry, WalletTopup,
+)
+from services import payment_webhooks, wallet_service
+from services.payment_webhooks import enqueue_webhook_event, process_webhook_events, sample_event
+from services.subscription_payments import record_subscription_payment, subscription_price
+
+
+@pytest.fixture(autouse=True)
+def _fresh_escrow_shards():
+    # Shard ids are cached per process; every test starts on an empty database
+    wallet_service._escrow_shard_ids.clear()
+
+
+def _topup(amount=500.0, order_id="order_topup"):
+    driver = User(full_name="Webhook Driver", email="webhook-driver@example.com")
+    db.session.add(driver)
+    db.session.flush()
+    wallet = Wallet(user_id=driver.id, balance=0.0)
+    db.session.add(wallet)
+    db.session.flush()
+    topup = WalletTopup(driver_id=driver.id, wallet_id=wallet.id, amount=amount, txn_uuid=str(uuid.uuid4()),
+                        status="created", razorpay_order_id=order_id)
+    db.session.add(topup)
+    db.session.commit()
+    return topup
+
+
+def _pump():
+    owner = PumpOwner(full_name="Webhook Owner", email="webhook-owner@example.com")
+    db.session.add(owner)
+    db.session.flush()
+    pump = Pump(name="Webhook Pump", location="Pune", owner_id=owner.id)
+    db.session.add(pump)
+    db.session.commit()
+    return owner, pump
+
+
+def _order_notes(owner, pump, plan_type="Gold", duration="1 Month"):
+    return {"plan_type": plan_type, "duration": duration, "pump_id": str(pump.id), "user_id": str(owner.id)}
+
+
+def _deliver(event_type, payment_id, order_id, amount, notes=None, event_id=None):
+    return enqueue_webhook_event(sample_event(event_type, payment_id, order_id, amount, notes), event_id)
+
+
+def test_redelivered_topup_event_credits_once(app):
+    topup = _topup()
+
+    _, created = _deliver("payment.captured", "pay_topup", "order_topup", 500.0, event_id="evt_1")
+    _, redelivered = _deliver("payment.captured", "pay_topup", "order_topup", 500.0, event_id="evt_1")
+    # The same capture also arrives as order.paid under its own event id
+    _deliver("order.paid", "pay_topup", "order_topup", 500.0, event_id="evt_2")
+    assert (created, redelivered) == (True, False)
+
+    summary = process_webhook_events()
+    assert summary["events"] == 2
+    assert summary["processed"] == 2
+    assert db.session.get(WalletTopup, topup.id).status == "paid"
+    assert db.session.get(Wallet, topup.wallet_id).balance == 500.0
+    assert WalletLedgerEntry.query.filter_by(wallet_type="driver_wallet").count() == 1
+
+
+def test_callback_before_webhook_activates_once(app):
+    owner, pump = _pump()
+    assert record_subscription_payment(owner, pump, "Gold", "1 Month", "pay_sub", "order_sub") is not None
+    db.session.commit()
+    end_date = PumpSubscription.query.one().end_date
+
+    _deliver("order.paid", "pay_sub", "order_sub", subscription_price("Gold", "1 Month"),
+             _order_notes(owner, pump))
+    assert process_webhook_events()["processed"] == 1
+
+    assert SubscriptionPayment.query.count() == 1
+    assert PumpSubscription.query.one().end_date == end_date
+
+
+def test_webhook_before_callback_activates_once(app):
+    owner, pump = _pump()
+    _deliver("order.paid", "pay_sub", "order_sub", subscription_price("Gold", "1 Month"),
+             _order_notes(owner, pump))
+    assert process_webhook_events()["processed"] == 1
+    subscription = PumpSubscription.query.one()
+    assert (subscription.subscription_type, subscription.subscription_status) == ("Gold", "active")
+
+    assert record_subscription_payment(owner, pump, "Gold", "1 Month", "pay_sub", "order_sub") is None
+    db.session.commit()
+    assert SubscriptionPayment.query.count() == 1
+
+
+def test_payment_captured_reads_plan_from_order(app, monkeypatch):
+    owner, pump = _pump()
+    notes = _order_notes(owner, pump, "Diamond", "6 Months")
+    monkeypatch.setattr(payment_webhooks, "fetch_order_notes", lambda order_id: notes)
+
+    _deliver("payment.captured", "pay_sub", "order_sub", subscription_price("Diamond", "6 Months"))
+    assert process_webhook_events()["processed"] == 1
+    payment = SubscriptionPayment.query.one()
+    assert (payment.plan_type, payment.duration, payment.razorpay_order_id) == ("Diamond", "6 Months", "order_sub")
+
+
+def test_subscription_amount_mismatch_is_refused(app):
+    owner, pump = _pump()
+    _deliver("order.paid", "pay_cheap", "order_cheap", 1.0, _order_notes(owner, pump, "Diamond", "Annual"))
+
+    assert process_webhook_events()["failed"] == 1
+    event = PaymentWebhookEvent.query.one()
+    assert event.status == "failed"
+    assert "Amount mismatch" in event.last_error
+    assert SubscriptionPayment.query.count() == 0
+    assert PumpSubscription.query.count() == 0
@@ -0,0 +1,91 @@
+"""
+Bulk payout checks.
+
+Builds payout batches from pending pump settlements with
+create_payout_batch and applies bank response files with
+ingest_bank_response.
+
+Usage:
+    python -m pytest -q payouts_test.py
+"""
+import pytest
+
+from extensions import db
+from models import PayoutBatch, PumpOwner, PumpSettlement, PumpWallet, WalletLedgerEntry
+from services import payouts
+from services.payouts import PayoutConfigError, create_payout_batch, ingest_bank_response
+
+
+@pytest.fixture
+def debit_account(monkeypatch):
+    monkeypatch.setattr(payouts, "PAYOUT_DEBIT_ACCOUNT", "000111222333")
+
+
+def _owner(email, balance, bank=True):
+    owner = PumpOwner(full_name="Payout Owner", email=email)
+    if bank:
+        owner.bank_account_number, owner.bank_ifsc = "123456789012", "hdfc0000123"
+    db.session.add(owner)
+    db.session.flush()
+    wallet = PumpWallet(owner_id=owner.id, balance=balance)
+    db.session.add(wallet)
+    db.session.flush()
+    return owner, wallet
+
+
+def _settlement(owner, wallet, amount):
+    settlement = PumpSettlement(pump_owner_id=owner.id, pump_wallet_id=wallet.id, amount=amount)
+    db.session.add(settlement)
+    db.session.flush()
+    return settlement.id
+
+
+def test_refused_without_debit_account(app, monkeypatch):
+    monkeypatch.setattr(payouts, "PAYOUT_DEBIT_ACCOUNT", "")
+    owner, wallet = _owner("unconfigured@example.com", 1000.0)
+    settlement_id = _settlement(owner, wallet, 400.0)
+    db.session.commit()
+
+    with pytest.raises(PayoutConfigError):
+        create_payout_batch("admin@example.com")
+
+    assert db.session.get(PumpSettlement, settlement_id).status == "pending"
+    assert db.session.get(PumpWallet, wallet.id).balance == 1000.0
+    assert PayoutBatch.query.count() == 0
+
+
+def test_batch_and_bank_response(app, debit_account):
+    owner, wallet = _owner("payee@example.com", 1000.0)
+    paid = _settlement(owner, wallet, 400.0)
+    bounced = _settlement(owner, wallet, 500.0)
+    too_large = _settlement(owner, wallet, 300.0)
+    no_bank_owner, no_bank_wallet = _owner("nobank@example.com", 1000.0, bank=False)
+    no_bank = _settlement(no_bank_owner, no_bank_wallet, 100.0)
+    db.session.commit()
+
+    batch, skipped = create_payout_batch("admin@example.com")
+
+    assert sorted(s["settlement_id"] for s in skipped) == [too_large, no_bank]
+    assert (batch.item_count, batch.total_amount) == (2, 900.0)
+    assert f"{batch.batch_ref}-{paid}" in batch.file_content
+    assert "000111222333" in batch.file_content
+    assert db.session.get(PumpWallet, wallet.id).balance == 100.0
+    assert db.session.get(PumpSettlement, too_large).status == "pending"
+    assert db.session.get(PumpSettlement, no_bank).status == "pending"
+
+    response = (
+        "Customer Reference,Status,UTR,Reason\n"
+        f"{batch.batch_ref}-{paid},Success,UTR0001,\n"
+        f"{batch.batch_ref}-{bounced},Rejected,,Account closed\n"
+    ).encode("utf-8")
+    summary = ingest_bank_response(batch.batch_ref, response)
+    assert (summary["batch_status"], summary["processed"], summary["failed"]) == ("completed", 1, 1)
+    assert db.session.get(PumpSettlement, paid).utr == "UTR0001"
+    assert db.session.get(PumpSettlement, bounced).failure_reason == "Account closed"
+    # The bounced amount goes back to the wallet, once
+    assert db.session.get(PumpWallet, wallet.id).balance == 600.0
+
+    again = ingest_bank_response(batch.batch_ref, response)
+    assert (again["already_final"], again["failed"]) == (2, 0)
+    assert db.session.get(PumpWallet, wallet.id).balance == 600.0
+    assert WalletLedgerEntry.query.filter_by(event_type="settlement_reversal").count() == 1
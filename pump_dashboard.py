@@ -19,6 +19,7 @@ from models import (
     PumpSubscription,
     PumpReceipt,
 )
+from services.demand_forecast import FORECAST_HORIZON_DAYS, pump_forecast
 
 pump_dashboard_bp = Blueprint("pump_dashboard", __name__)
 
@@ -160,6 +161,21 @@ def subscription_status(pump_id):
     else:
         return jsonify({"active": False, "subscription": None})
 
+
+# Demand forecast from the nightly job
+@pump_dashboard_bp.route("/<int:pump_id>/demand-forecast")
+@login_required
+def demand_forecast(pump_id):
+    owner = current_user
+    if not isinstance(owner, PumpOwner):
+        return jsonify({"error": "Access denied"}), 403
+    pump = _pump_with_access(owner, pump_id)
+    if not pump:
+        return jsonify({"error": "Pump not found"}), 404
+
+    days = min(max(request.args.get("days", FORECAST_HORIZON_DAYS, type=int), 1), FORECAST_HORIZON_DAYS)
+    return jsonify({"success": True, "pump_id": pump_id, "forecasts": pump_forecast(pump_id, days=days)})
+
 # Update profile route
 @pump_dashboard_bp.route("/update_profile", methods=["POST"])
 @login_required
@@ -0,0 +1,260 @@
+"""
+Attendance writer service.
+A single background writer per process that coalesces face-recognition
+attendance marks per (employee, date) and applies them as one bulk upsert.
+When a batch fails its marks are applied one at a time, so one bad mark
+(e.g. for a deleted employee) cannot hold up the rest; a mark that keeps
+failing is dropped, with an error log, after ATTENDANCE_MAX_ATTEMPTS tries.
+"""
+import atexit
+import os
+import threading
+import time
+from datetime import datetime, date
+from typing import Dict, Iterable, Optional, Tuple, Any
+
+from sqlalchemy import case, func
+
+from extensions import db
+from models import Attendance
+
+# Marks for the same employee/date that arrive within this window are merged
+# into a single row write.
+FLUSH_INTERVAL_SECONDS = float(os.getenv("ATTENDANCE_FLUSH_SECONDS", "5"))
+MAX_MARK_ATTEMPTS = int(os.getenv("ATTENDANCE_MAX_ATTEMPTS", "3"))
+
+_pending: Dict[Tuple[int, date], Dict[str, Any]] = {}
+_pending_lock = threading.Lock()
+
+_writer_app = None
+_writer_thread: Optional[threading.Thread] = None
+_writer_lock = threading.Lock()
+
+
+def _merge_mark(key: Tuple[int, date], pump_id: int, confidence: Optional[float], seen_at: datetime,
+                attempts: int = 0):
+    """Fold one mark into the pending batch (caller holds _pending_lock)."""
+    mark = _pending.get(key)
+    if mark is None:
+        _pending[key] = {
+            "employee_id": key[0],
+            "attendance_date": key[1],
+            "pump_id": pump_id,
+            "first_seen": seen_at,
+            "last_seen": seen_at,
+            "confidence": confidence,
+            "attempts": attempts,
+        }
+        return
+
+    mark["attempts"] = max(mark["attempts"], attempts)
+    if seen_at < mark["first_seen"]:
+        mark["first_seen"] = seen_at
+    if seen_at > mark["last_seen"]:
+        mark["last_seen"] = seen_at
+    if confidence is not None and (mark["confidence"] is None or confidence > mark["confidence"]):
+        mark["confidence"] = confidence
+
+
+def enqueue_attendance_mark(app, pump_id: int, employee_id: int, confidence: Optional[float],
+                            seen_at: Optional[datetime] = None):
+    """Queue a face-recognition attendance mark for the background writer."""
+    seen_at = seen_at or datetime.now()
+    key = (employee_id, seen_at.date())
+    with _pending_lock:
+        _merge_mark(key, pump_id, confidence, seen_at)
+    _ensure_writer(app)
+
+
+def _ensure_writer(app):
+    global _writer_app, _writer_thread
+    with _writer_lock:
+        if _writer_thread is not None and _writer_thread.is_alive():
+            return
+        _writer_app = app
+        _writer_thread = threading.Thread(target=_writer_loop, args=(app,), daemon=True)
+        _writer_thread.start()
+
+
+def _take_pending() -> list:
+    with _pending_lock:
+        marks = list(_pending.values())
+        _pending.clear()
+    return marks
+
+
+def _requeue(mark: Dict[str, Any], attempts: int):
+    key = (mark["employee_id"], mark["attendance_date"])
+    with _pending_lock:
+        _merge_mark(key, mark["pump_id"], mark["confidence"], mark["first_seen"], attempts)
+        _merge_mark(key, mark["pump_id"], mark["confidence"], mark["last_seen"], attempts)
+
+
+def _apply_one_by_one(app, marks: list, requeue: bool = True) -> int:
+    """
+    Apply marks individually after a batch failure. A failing mark goes back
+    to the queue until it has failed MAX_MARK_ATTEMPTS times, then it is
+    dropped and logged. Returns the number written.
+    """
+    written = 0
+    for mark in marks:
+        try:
+            apply_attendance_marks([mark])
+            written += 1
+        except Exception as e:
+            db.session.rollback()
+            attempts = mark.get("attempts", 0) + 1
+            if requeue and attempts < MAX_MARK_ATTEMPTS:
+                _requeue(mark, attempts)
+                app.logger.warning(f"Attendance mark for employee {mark['employee_id']} on "
+                                   f"{mark['attendance_date']} failed (attempt {attempts}): {e}")
+            else:
+                app.logger.error(f"Dropping attendance mark for employee {mark['employee_id']} on "
+                                 f"{mark['attendance_date']} after {attempts} attempt(s): {mark} ({e})")
+    return written
+
+
+def _writer_loop(app):
+    while True:
+        time.sleep(FLUSH_INTERVAL_SECONDS)
+        marks = _take_pending()
+        if not marks:
+            continue
+        with app.app_context():
+            try:
+                apply_attendance_marks(marks)
+                app.logger.info(f"Attendance writer flushed {len(marks)} mark(s)")
+            except Exception as e:
+                db.session.rollback()
+                app.logger.warning(f"Attendance batch of {len(marks)} failed, applying one at a time: {e}")
+                written = _apply_one_by_one(app, marks)
+                app.logger.info(f"Attendance writer flushed {written} of {len(marks)} mark(s) individually")
+            finally:
+                db.session.remove()
+
+
+def flush_pending():
+    """Synchronously write whatever is queued (used at shutdown)."""
+    if _writer_app is None:
+        return
+    marks = _take_pending()
+    if not marks:
+        return
+    with _writer_app.app_context():
+        try:
+            apply_attendance_marks(marks)
+        except Exception:
+            db.session.rollback()
+            # No later window to retry in
+            _apply_one_by_one(_writer_app, marks, requeue=False)
+        finally:
+            db.session.remove()
+
+
+atexit.register(flush_pending)
+
+
+def _hours_between(dialect_name: str, end_expr, start_expr):
+    """SQL expression for (end - start) in hours for the active dialect."""
+    if dialect_name == "postgresql":
+        return func.extract("epoch", end_expr - start_expr) / 3600.0
+    return (func.julianday(end_expr) - func.julianday(start_expr)) * 24.0
+
+
+def _row_values(mark: Dict[str, Any]) -> Dict[str, Any]:
+    first_seen = mark["first_seen"]
+    last_seen = mark["last_seen"]
+    has_checkout = last_seen > first_seen
+    return {
+        "employee_id": mark["employee_id"],
+        "pump_id": mark["pump_id"],
+        "attendance_date": mark["attendance_date"],
+        "check_in_time": first_seen,
+        "check_out_time": last_seen if has_checkout else None,
+        "total_hours": (last_seen - first_seen).total_seconds() / 3600.0 if has_checkout else None,
+        "status": "present",
+        "detection_method": "face_recognition",
+        "detected_confidence": mark["confidence"],
+    }
+
+
+def apply_attendance_marks(marks: Iterable[Dict[str, Any]]):
+    """
+    Bulk upsert coalesced marks into Attendance and commit.
+
+    First sighting of the day becomes check-in; any later sighting moves
+    check-out forward and recomputes total_hours, matching the single-mark
+    behaviour the monitor always had.
+    """
+    rows = [_row_values(m) for m in marks]
+    if not rows:
+        return
+
+    dialect_name = db.engine.dialect.name
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        _apply_marks_orm(rows)
+        return
+
+    table = Attendance.__table__
+    stmt = dialect_insert(table).values(rows)
+    excluded = stmt.excluded
+    existing_check_in = table.c.check_in_time
+    latest_seen = func.coalesce(excluded.check_out_time, excluded.check_in_time)
+
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.employee_id, table.c.attendance_date],
+        set_={
+            "check_in_time": func.coalesce(existing_check_in, excluded.check_in_time),
+            "check_out_time": case(
+                (existing_check_in.is_(None), excluded.check_out_time),
+                else_=latest_seen,
+            ),
+            "total_hours": case(
+                (existing_check_in.is_(None), excluded.total_hours),
+                else_=_hours_between(dialect_name, latest_seen, existing_check_in),
+            ),
+            "status": case(
+                (existing_check_in.is_(None), excluded.status),
+                else_=table.c.status,
+            ),
+            "detection_method": case(
+                (existing_check_in.is_(None), excluded.detection_method),
+                else_=table.c.detection_method,
+            ),
+            "detected_confidence": func.coalesce(table.c.detected_confidence, excluded.detected_confidence),
+        },
+    )
+    db.session.execute(stmt)
+    db.session.commit()
+
+
+def _apply_marks_orm(rows: list):
+    """Fallback for dialects without ON CONFLICT: one locked read per row, one commit."""
+    for row in rows:
+        attendance = (
+            Attendance.query.filter_by(
+                employee_id=row["employee_id"],
+                attendance_date=row["attendance_date"],
+            )
+            .with_for_update()
+            .first()
+        )
+        latest_seen = row["check_out_time"] or row["check_in_time"]
+        if attendance is None:
+            db.session.add(Attendance(**row))
+        elif not attendance.check_in_time:
+            attendance.check_in_time = row["check_in_time"]
+            attendance.check_out_time = row["check_out_time"]
+            attendance.total_hours = row["total_hours"]
+            attendance.status = "present"
+            attendance.detection_method = "face_recognition"
+            attendance.detected_confidence = row["detected_confidence"]
+        else:
+            attendance.check_out_time = latest_seen
+            delta = latest_seen - attendance.check_in_time
+            attendance.total_hours = delta.total_seconds() / 3600.0
+    db.session.commit()
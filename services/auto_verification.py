@@ -0,0 +1,315 @@
+"""
+Automatic verification of fuel transactions.
+Pending transactions are checked in batches against two kinds of evidence:
+
+  * ANPR: a VehicleEntryLog detection of the same plate at the same pump
+    shortly before (or just after) the sale, claimed by no other sale
+  * Totaliser: the nozzle totaliser deltas between consecutive PumpReceipt
+    prints covering the sale must account for all litres recorded at the
+    pump in that interval
+
+A sale with a unique ANPR match and no totaliser contradiction is promoted to
+verified with verification_level "auto" and the evidence in extra_data.
+Anything ambiguous is left pending with its reasons for a human to review.
+
+All timestamps compared here are naive UTC: FuelTransaction.created_at and
+PumpReceipt.created_at come from the DB's now(), which config pins to UTC,
+ANPR detections are stamped with datetime.utcnow() by the processor, and
+migration d6f1b8c3a957 converted detections stored in local time.
+"""
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from flask import current_app
+from sqlalchemy import func
+
+from extensions import db
+from models import FuelTransaction, PumpReceipt, VehicleEntryLog, normalize_plate
+
+AUTO_VERIFY_BATCH_SIZE = 200
+# Detection window around the sale: the car is seen entering, then fuels
+ANPR_WINDOW_BEFORE = timedelta(minutes=int(os.getenv("AUTO_VERIFY_ANPR_WINDOW_BEFORE_MINUTES", "20")))
+ANPR_WINDOW_AFTER = timedelta(minutes=int(os.getenv("AUTO_VERIFY_ANPR_WINDOW_AFTER_MINUTES", "5")))
+ANPR_MIN_CONFIDENCE = float(os.getenv("AUTO_VERIFY_ANPR_MIN_CONFIDENCE", "0.7"))
+# Recorded litres may exceed the totaliser delta by this fraction (OCR rounding)
+TOTALISER_TOLERANCE = 0.02
+# With this set, sales wait for a receipt print covering them before auto-verifying
+REQUIRE_TOTALISER = os.getenv("AUTO_VERIFY_REQUIRE_TOTALISER", "false").lower() == "true"
+# Receipts are printed about daily; look this far back for the print before a sale
+RECEIPT_LOOKBACK = timedelta(days=7)
+# A receipt uploaded later than this after its printed day has no usable reading time
+RECEIPT_MAX_UPLOAD_DELAY = timedelta(days=1)
+# Minutes between background runs; 0 leaves scheduling to cron / the CLI
+AUTO_VERIFY_INTERVAL_MINUTES = float(os.getenv("AUTO_VERIFY_INTERVAL_MINUTES", "0"))
+
+NO_DETECTION = "No ANPR detection of this vehicle around the sale"
+
+
+def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Naive UTC for a timestamp, converting timezone-aware values"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _detections_by_key(pump_ids: Iterable[int], start: datetime,
+                       end: datetime) -> Dict[Tuple[int, str], List[VehicleEntryLog]]:
+    """Confident ANPR detections in [start, end], grouped by (pump, normalised plate)"""
+    grouped = defaultdict(list)
+    rows = VehicleEntryLog.query.filter(
+        VehicleEntryLog.pump_id.in_(list(pump_ids)),
+        VehicleEntryLog.detected_at >= start,
+        VehicleEntryLog.detected_at <= end,
+    ).order_by(VehicleEntryLog.detected_at).all()
+    for log in rows:
+        if log.detection_confidence is not None and log.detection_confidence < ANPR_MIN_CONFIDENCE:
+            continue
+        grouped[(log.pump_id, normalize_plate(log.vehicle_number))].append(log)
+    return grouped
+
+
+def _sales_by_key(pump_ids: Iterable[int], start: datetime,
+                  end: datetime) -> Dict[Tuple[int, str], List[FuelTransaction]]:
+    """Every non-failed sale in [start, end], grouped by (pump, normalised plate)"""
+    grouped = defaultdict(list)
+    rows = FuelTransaction.query.filter(
+        FuelTransaction.pump_id.in_(list(pump_ids)),
+        FuelTransaction.created_at >= start,
+        FuelTransaction.created_at <= end,
+        FuelTransaction.status != "failed",
+    ).all()
+    for t in rows:
+        grouped[(t.pump_id, normalize_plate(t.vehicle_number))].append(t)
+    return grouped
+
+
+def _in_window(detected_at: datetime, sold_at: datetime) -> bool:
+    detected_at, sold_at = _as_utc(detected_at), _as_utc(sold_at)
+    return sold_at - ANPR_WINDOW_BEFORE <= detected_at <= sold_at + ANPR_WINDOW_AFTER
+
+
+def _anpr_evidence(transaction: FuelTransaction, detections: List[VehicleEntryLog],
+                   sales: List[FuelTransaction]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    (evidence, None) for a unique match, else (None, reason). A detection only
+    counts if no other sale of the same plate at the pump falls in its window,
+    so one car entering once cannot verify two sales.
+    """
+    matches = [d for d in detections if _in_window(d.detected_at, transaction.created_at)]
+    if not matches:
+        return None, NO_DETECTION
+    unclaimed = [
+        d for d in matches
+        if not any(s.id != transaction.id and _in_window(d.detected_at, s.created_at) for s in sales)
+    ]
+    if not unclaimed:
+        return None, "ANPR detection also matches another sale of this vehicle"
+    # Closest detection before the sale wins; later ones are the car leaving
+    sold_at = _as_utc(transaction.created_at)
+    best = min(unclaimed, key=lambda d: abs((sold_at - _as_utc(d.detected_at)).total_seconds()))
+    return {
+        "entry_log_id": best.id,
+        "detected_at": best.detected_at.isoformat(),
+        "confidence": best.detection_confidence,
+        "detections_in_window": len(matches),
+    }, None
+
+
+def _receipt_time(receipt: PumpReceipt) -> Optional[datetime]:
+    """
+    When the totaliser was read. OCR gives only the printed day, so the
+    upload time (receipts are photographed as they are printed) is used;
+    a receipt uploaded more than a day after its printed day has no usable
+    time and is skipped. The printed day alone is the last resort, for a
+    receipt without an upload time.
+    """
+    uploaded_at = _as_utc(receipt.created_at)
+    if uploaded_at is None:
+        return receipt.print_date
+    if receipt.print_date is not None and (
+        uploaded_at.date() - receipt.print_date.date() > RECEIPT_MAX_UPLOAD_DELAY
+    ):
+        return None
+    return uploaded_at
+
+
+def _nozzle_totals(receipt: PumpReceipt) -> Dict[str, float]:
+    totals = {}
+    for nozzle in (receipt.ocr_data or {}).get("nozzles", []):
+        volume = nozzle.get("vValue")
+        if volume is not None:
+            totals[str(nozzle.get("nozzle"))] = float(volume)
+    return totals
+
+
+def _totaliser_intervals(pump_ids: Iterable[int], start: datetime) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    Per pump, consecutive receipt pairs from `start` on with the litres
+    dispensed between them (sum of per-nozzle V deltas). Pairs with missing
+    or negative readings (OCR misses, totaliser resets) are skipped.
+    """
+    receipts = defaultdict(list)
+    for receipt in PumpReceipt.query.filter(
+        PumpReceipt.pump_id.in_(list(pump_ids)),
+        PumpReceipt.created_at >= start - RECEIPT_LOOKBACK,
+    ).all():
+        if _receipt_time(receipt) is not None:
+            receipts[receipt.pump_id].append(receipt)
+
+    intervals = defaultdict(list)
+    for pump_id, rows in receipts.items():
+        rows.sort(key=_receipt_time)
+        for previous, latest in zip(rows, rows[1:]):
+            if _receipt_time(latest) < start:
+                continue
+            before, after = _nozzle_totals(previous), _nozzle_totals(latest)
+            deltas = [after[n] - before[n] for n in after if n in before]
+            if not deltas or any(d < 0 for d in deltas):
+                continue
+            intervals[pump_id].append({
+                "start": _receipt_time(previous),
+                "end": _receipt_time(latest),
+                "receipt_ids": [previous.id, latest.id],
+                "dispensed_litres": round(sum(deltas), 3),
+            })
+    return intervals
+
+
+def _recorded_litres(pump_id: int, start: datetime, end: datetime) -> float:
+    total = db.session.query(func.coalesce(func.sum(FuelTransaction.quantity_litres), 0.0)).filter(
+        FuelTransaction.pump_id == pump_id,
+        FuelTransaction.created_at > start,
+        FuelTransaction.created_at <= end,
+        FuelTransaction.status != "failed",
+    ).scalar()
+    return float(total)
+
+
+def evaluate_batch(transactions: List[FuelTransaction],
+                   now: Optional[datetime] = None) -> Dict[int, Dict[str, Any]]:
+    """
+    Run the rules over a batch. Returns {transaction_id: outcome} where
+    outcome["status"] is "verified", "waiting" (evidence may still arrive)
+    or "needs_review", with evidence or reasons.
+    """
+    if not transactions:
+        return {}
+    now = now or datetime.utcnow()
+    pump_ids = {t.pump_id for t in transactions}
+    earliest = min(t.created_at for t in transactions)
+    latest = max(t.created_at for t in transactions)
+    # Sales are widened by a second window so rival claims at the edges are seen
+    detections = _detections_by_key(pump_ids, earliest - ANPR_WINDOW_BEFORE, latest + ANPR_WINDOW_AFTER)
+    sales = _sales_by_key(pump_ids, earliest - ANPR_WINDOW_BEFORE - ANPR_WINDOW_AFTER,
+                          latest + ANPR_WINDOW_BEFORE + ANPR_WINDOW_AFTER)
+    intervals = _totaliser_intervals(pump_ids, earliest)
+    recorded_cache: Dict[Tuple[int, datetime, datetime], float] = {}
+
+    outcomes = {}
+    for t in transactions:
+        key = (t.pump_id, normalize_plate(t.vehicle_number))
+        anpr, anpr_reason = _anpr_evidence(t, detections.get(key, []), sales.get(key, []))
+
+        interval = next((i for i in intervals.get(t.pump_id, []) if i["start"] < t.created_at <= i["end"]), None)
+        totaliser, totaliser_reason = None, None
+        if interval is not None:
+            cache_key = (t.pump_id, interval["start"], interval["end"])
+            if cache_key not in recorded_cache:
+                recorded_cache[cache_key] = _recorded_litres(*cache_key)
+            recorded = recorded_cache[cache_key]
+            totaliser = {
+                "receipt_ids": interval["receipt_ids"],
+                "dispensed_litres": interval["dispensed_litres"],
+                "recorded_litres": round(recorded, 3),
+            }
+            if recorded > interval["dispensed_litres"] * (1 + TOTALISER_TOLERANCE):
+                totaliser_reason = (f"Sales recorded between receipts ({recorded:.2f} L) exceed "
+                                    f"totaliser delta ({interval['dispensed_litres']:.2f} L)")
+
+        reasons = [r for r in (anpr_reason, totaliser_reason) if r]
+        if not reasons and (totaliser is not None or not REQUIRE_TOTALISER):
+            outcomes[t.id] = {"status": "verified", "evidence": {"anpr": anpr, "totaliser": totaliser}}
+        elif not reasons or (anpr_reason == NO_DETECTION and not totaliser_reason
+                             and t.created_at + ANPR_WINDOW_AFTER > now):
+            # No receipt print yet, or the camera feed may still be catching up
+            outcomes[t.id] = {"status": "waiting", "reasons": reasons or ["Waiting for a totaliser receipt"]}
+        else:
+            outcomes[t.id] = {"status": "needs_review", "reasons": reasons}
+    return outcomes
+
+
+def auto_verify_pending(pump_ids: Optional[Iterable[int]] = None,
+                        batch_size: int = AUTO_VERIFY_BATCH_SIZE) -> Dict[str, int]:
+    """
+    Evaluate every pending_verification transaction (optionally for some
+    pumps) in batches, committing per batch. Rows another worker holds are
+    skipped. Returns counts per outcome.
+    """
+    summary = {"verified": 0, "waiting": 0, "needs_review": 0}
+    pump_ids = list(pump_ids) if pump_ids is not None else None
+    last_id = 0
+    while True:
+        now = datetime.utcnow()
+        query = FuelTransaction.query.filter(
+            FuelTransaction.status == "pending_verification",
+            FuelTransaction.id > last_id,
+        )
+        if pump_ids is not None:
+            query = query.filter(FuelTransaction.pump_id.in_(pump_ids))
+        transactions = query.order_by(FuelTransaction.id).limit(batch_size).with_for_update(skip_locked=True).all()
+        if not transactions:
+            break
+
+        outcomes = evaluate_batch(transactions, now)
+        for t in transactions:
+            outcome = outcomes[t.id]
+            summary[outcome["status"]] += 1
+            extra_data = dict(t.extra_data or {})
+            if outcome["status"] == "verified":
+                t.status = "verified"
+                t.verification_level = "auto"
+                t.verified_at = now
+                extra_data["auto_verification"] = {"checked_at": now.isoformat(), **outcome["evidence"]}
+                t.extra_data = extra_data
+            else:
+                review = {"status": outcome["status"], "reasons": outcome["reasons"]}
+                previous = extra_data.get("auto_verification") or {}
+                # Only write when the verdict changed, not on every pass
+                if {k: previous.get(k) for k in review} != review:
+                    extra_data["auto_verification"] = {"checked_at": now.isoformat(), **review}
+                    t.extra_data = extra_data
+        db.session.commit()
+        last_id = transactions[-1].id
+
+    current_app.logger.info(
+        f"Auto verification: {summary['verified']} verified, {summary['needs_review']} need review, "
+        f"{summary['waiting']} waiting for evidence"
+    )
+    return summary
+
+
+def auto_verification_scheduler(app):
+    """Run auto_verify_pending every AUTO_VERIFY_INTERVAL_MINUTES"""
+    while True:
+        with app.app_context():
+            try:
+                auto_verify_pending()
+            except Exception as e:
+                db.session.rollback()
+                app.logger.exception(f"Auto verification failed: {e}")
+            finally:
+                db.session.remove()
+        time.sleep(AUTO_VERIFY_INTERVAL_MINUTES * 60)
+
+
+def start_auto_verification_service(app):
+    """Start the background auto-verification thread if an interval is configured"""
+    if AUTO_VERIFY_INTERVAL_MINUTES <= 0:
+        return
+    thread = threading.Thread(target=auto_verification_scheduler, args=(app,), daemon=True)
+    thread.start()
+    print(f"✅ Auto verification service started (every {AUTO_VERIFY_INTERVAL_MINUTES:g} min)")
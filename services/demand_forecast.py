@@ -0,0 +1,218 @@
+"""
+Nightly fuel demand forecast.
+Settled daily litres (PumpDailySales) for the last FORECAST_HISTORY_DAYS are
+loaded once into a (pump x fuel_type) by day matrix and every series is fitted
+together with array operations: a day-of-week seasonal index shrunk toward 1,
+and an exponentially weighted level of the deseasonalised history. Forecasts
+for the next FORECAST_HORIZON_DAYS, with prediction intervals from the
+in-sample residuals, replace the previous run in PumpDemandForecast, which the
+dashboard reads directly.
+"""
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import insert
+
+from extensions import db
+from models import PumpDailySales, PumpDemandForecast
+
+FORECAST_MODEL = "dow-ses-v1"
+FORECAST_HISTORY_DAYS = int(os.getenv("FORECAST_HISTORY_DAYS", "56"))
+FORECAST_HORIZON_DAYS = int(os.getenv("FORECAST_HORIZON_DAYS", "7"))
+# UTC hour of the nightly run; empty leaves scheduling to cron / the CLI
+DEMAND_FORECAST_HOUR = os.getenv("DEMAND_FORECAST_HOUR", "")
+
+SMOOTHING_ALPHA = 0.2      # weight of the newest day in the level
+SEASONAL_SHRINK = 2.0      # pseudo-weeks pulling each weekday index toward 1
+MIN_HISTORY_DAYS = 14      # days since a series' first sale before it is forecast
+INTERVAL_Z = 1.96          # ~95% prediction interval
+FORECAST_CHUNK_SIZE = 5000
+
+SeriesKey = Tuple[int, str]
+
+
+def load_sales_matrix(start: date, end: date, chunk_size: int = FORECAST_CHUNK_SIZE
+                      ) -> Tuple[List[SeriesKey], np.ndarray]:
+    """
+    (series keys, litres matrix) for [start, end): one row per (pump_id,
+    fuel_type) that sold anything in the window, one column per day. Days
+    without a rollup row are 0.
+    """
+    days = (end - start).days
+    keys: Dict[SeriesKey, int] = {}
+    rows: List[int] = []
+    cols: List[int] = []
+    values: List[float] = []
+    query = db.session.query(
+        PumpDailySales.pump_id, PumpDailySales.fuel_type,
+        PumpDailySales.sales_date, PumpDailySales.total_litres,
+    ).filter(PumpDailySales.sales_date >= start, PumpDailySales.sales_date < end)
+    for pump_id, fuel_type, sales_date, litres in query.yield_per(chunk_size):
+        rows.append(keys.setdefault((pump_id, fuel_type), len(keys)))
+        cols.append((sales_date - start).days)
+        values.append(litres or 0.0)
+
+    matrix = np.zeros((len(keys), days))
+    np.add.at(matrix, (np.asarray(rows, dtype=np.intp), np.asarray(cols, dtype=np.intp)), values)
+    return list(keys), matrix
+
+
+def fit_forecast(history: np.ndarray, start: date, horizon: int) -> Dict[str, np.ndarray]:
+    """
+    Fit every row of `history` (series x days, first column = `start`) and
+    forecast `horizon` days past its end. Returns "litres", "lower" and
+    "upper" (series x horizon) plus a boolean "fitted" per series; rows
+    with too little history are not fitted.
+    """
+    n_series, n_days = history.shape
+    weekday = (start.weekday() + np.arange(n_days)) % 7
+
+    # Days before a series' first sale are missing, not zero demand
+    observed = np.cumsum(history > 0, axis=1) > 0
+    n_observed = observed.sum(axis=1)
+    fitted = n_observed >= MIN_HISTORY_DAYS
+    values = np.where(observed, history, 0.0)
+
+    # Weekday index: weekday mean over overall mean, shrunk toward 1
+    day_onehot = weekday[:, None] == np.arange(7)[None, :]                 # days x 7
+    day_sums = values @ day_onehot
+    day_counts = observed.astype(float) @ day_onehot
+    overall = values.sum(axis=1) / np.maximum(n_observed, 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        raw_index = np.where(day_counts > 0, day_sums / day_counts, 0.0) / overall[:, None]
+    raw_index = np.nan_to_num(raw_index, nan=1.0, posinf=1.0)
+    seasonal = (day_counts * raw_index + SEASONAL_SHRINK) / (day_counts + SEASONAL_SHRINK)
+    seasonal /= seasonal.mean(axis=1, keepdims=True)
+
+    # Exponentially weighted level of the deseasonalised observed days
+    day_seasonal = seasonal[:, weekday]
+    deseasonalised = np.where(observed, values / np.maximum(day_seasonal, 1e-9), 0.0)
+    weights = SMOOTHING_ALPHA * (1 - SMOOTHING_ALPHA) ** np.arange(n_days - 1, -1, -1)
+    weight_mass = observed @ weights
+    level = (deseasonalised @ weights) / np.maximum(weight_mass, 1e-12)
+
+    # One-step residual spread, widened with the horizon as for simple exponential smoothing
+    residuals = np.where(observed, values - level[:, None] * day_seasonal, 0.0)
+    sigma = np.sqrt((residuals ** 2).sum(axis=1) / np.maximum(n_observed - 1, 1))
+    steps = np.arange(horizon)
+    spread = INTERVAL_Z * sigma[:, None] * np.sqrt(1 + steps * SMOOTHING_ALPHA ** 2)[None, :]
+
+    future_weekday = (start.weekday() + n_days + steps) % 7
+    litres = level[:, None] * seasonal[:, future_weekday]
+    return {
+        "litres": litres,
+        "lower": np.maximum(litres - spread, 0.0),
+        "upper": litres + spread,
+        "fitted": fitted,
+    }
+
+
+def run_demand_forecast(today: Optional[date] = None, history_days: int = FORECAST_HISTORY_DAYS,
+                        horizon: int = FORECAST_HORIZON_DAYS) -> Dict[str, Any]:
+    """
+    Forecast every (pump, fuel_type) from today for `horizon` days, from the
+    `history_days` complete days before today, replacing forecasts dated
+    today or later. Earlier forecasts are kept for accuracy checks. Commits.
+    """
+    started = time.monotonic()
+    today = today or datetime.utcnow().date()
+    start = today - timedelta(days=history_days)
+    keys, history = load_sales_matrix(start, today)
+    result = fit_forecast(history, start, horizon) if keys else None
+
+    PumpDemandForecast.query.filter(PumpDemandForecast.forecast_date >= today).delete(synchronize_session=False)
+    written = 0
+    if result is not None:
+        generated_at = datetime.utcnow()
+        forecast_dates = [today + timedelta(days=h) for h in range(horizon)]
+        batch = []
+        for s in np.flatnonzero(result["fitted"]):
+            pump_id, fuel_type = keys[s]
+            for h, forecast_date in enumerate(forecast_dates):
+                batch.append({
+                    "pump_id": pump_id,
+                    "fuel_type": fuel_type,
+                    "forecast_date": forecast_date,
+                    "litres": round(float(result["litres"][s, h]), 2),
+                    "litres_lower": round(float(result["lower"][s, h]), 2),
+                    "litres_upper": round(float(result["upper"][s, h]), 2),
+                    "model": FORECAST_MODEL,
+                    "generated_at": generated_at,
+                })
+            if len(batch) >= FORECAST_CHUNK_SIZE:
+                db.session.execute(insert(PumpDemandForecast), batch)
+                written += len(batch)
+                batch = []
+        if batch:
+            db.session.execute(insert(PumpDemandForecast), batch)
+            written += len(batch)
+    db.session.commit()
+
+    return {
+        "series": len(keys),
+        "fitted": int(result["fitted"].sum()) if result is not None else 0,
+        "forecasts": written,
+        "seconds": round(time.monotonic() - started, 2),
+    }
+
+
+def pump_forecast(pump_id: int, today: Optional[date] = None,
+                  days: int = FORECAST_HORIZON_DAYS) -> List[Dict[str, Any]]:
+    """Stored forecasts for one pump from today for `days` days, by date then fuel type"""
+    today = today or datetime.utcnow().date()
+    rows = db.session.query(
+        PumpDemandForecast.forecast_date, PumpDemandForecast.fuel_type, PumpDemandForecast.litres,
+        PumpDemandForecast.litres_lower, PumpDemandForecast.litres_upper, PumpDemandForecast.generated_at,
+    ).filter(
+        PumpDemandForecast.pump_id == pump_id,
+        PumpDemandForecast.forecast_date >= today,
+        PumpDemandForecast.forecast_date < today + timedelta(days=days),
+    ).order_by(PumpDemandForecast.forecast_date, PumpDemandForecast.fuel_type)
+    return [
+        {
+            "date": row.forecast_date.isoformat(),
+            "fuel_type": row.fuel_type,
+            "litres": row.litres,
+            "lower": row.litres_lower,
+            "upper": row.litres_upper,
+            "generated_at": row.generated_at.isoformat() if row.generated_at else None,
+        }
+        for row in rows
+    ]
+
+
+def _seconds_until(hour: int) -> float:
+    now = datetime.utcnow()
+    next_run = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+    if next_run <= now:
+        next_run += timedelta(days=1)
+    return (next_run - now).total_seconds()
+
+
+def forecast_scheduler(app, hour: int):
+    """Run run_demand_forecast every day at `hour` UTC"""
+    while True:
+        time.sleep(_seconds_until(hour))
+        with app.app_context():
+            try:
+                summary = run_demand_forecast()
+                app.logger.info(f"Demand forecast: {summary}")
+            except Exception as e:
+                db.session.rollback()
+                app.logger.exception(f"Demand forecast failed: {e}")
+            finally:
+                db.session.remove()
+
+
+def start_forecast_service(app):
+    """Start the nightly forecast thread if DEMAND_FORECAST_HOUR is configured"""
+    if not DEMAND_FORECAST_HOUR.strip():
+        return
+    hour = int(DEMAND_FORECAST_HOUR) % 24
+    thread = threading.Thread(target=forecast_scheduler, args=(app, hour), daemon=True)
+    thread.start()
+    print(f"✅ Demand forecast service started (daily at {hour:02d}:00 UTC)")
@@ -0,0 +1,199 @@
+"""
+Driver cohorts and retention.
+DriverCohort holds each driver's first month with a settled sale and
+DriverMonthlyActivity one row per driver and month they bought fuel in.
+Settlement adds to both inside its own DB transaction, so the retention
+matrix (drivers of cohort M still active in M+k) is one GROUP BY over
+driver-months instead of joining raw FuelTransaction history to vehicles.
+"""
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func
+
+from extensions import db
+from models import DriverCohort, DriverMonthlyActivity, FuelTransaction, Wallet, WalletLedgerEntry
+from services.sales_rollup import lock_for_rebuild
+
+ActivityKey = Tuple[int, date]
+
+
+def month_start(moment) -> date:
+    return date(moment.year, moment.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def months_between(start: date, end: date) -> int:
+    return (end.year - start.year) * 12 + end.month - start.month
+
+
+def aggregate_driver_activity(sales: Iterable[Tuple[int, FuelTransaction]]) -> Dict[ActivityKey, Dict[str, float]]:
+    """Fold (driver_id, settled transaction) pairs into per-(driver, month) count/amount deltas"""
+    totals: Dict[ActivityKey, Dict[str, float]] = {}
+    for driver_id, t in sales:
+        if driver_id is None:
+            continue
+        bucket = totals.setdefault(
+            (driver_id, month_start(t.created_at or datetime.utcnow())), {"count": 0, "amount": 0.0}
+        )
+        bucket["count"] += 1
+        bucket["amount"] += t.amount or 0.0
+    return totals
+
+
+def add_driver_activity(totals: Dict[ActivityKey, Dict[str, float]]) -> None:
+    """
+    Add deltas to the activity rows and move cohorts back to the earliest
+    month seen, in the caller's transaction (no commit), as upserts where
+    the dialect supports them.
+    """
+    if not totals:
+        return
+    activity_rows = [
+        {"user_id": user_id, "activity_month": month,
+         "transaction_count": int(v["count"]), "total_amount": v["amount"]}
+        for (user_id, month), v in totals.items()
+    ]
+    first_months: Dict[int, date] = {}
+    for user_id, month in totals:
+        first_months[user_id] = min(month, first_months.get(user_id, month))
+    cohort_rows = [{"user_id": user_id, "cohort_month": month} for user_id, month in first_months.items()]
+
+    dialect_name = db.session.get_bind().dialect.name
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        _add_driver_activity_orm(activity_rows, cohort_rows)
+        return
+
+    table = DriverMonthlyActivity.__table__
+    stmt = dialect_insert(table).values(activity_rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.activity_month],
+        set_={
+            "transaction_count": table.c.transaction_count + stmt.excluded.transaction_count,
+            "total_amount": table.c.total_amount + stmt.excluded.total_amount,
+            "updated_at": func.now(),
+        },
+    )
+    db.session.execute(stmt)
+
+    table = DriverCohort.__table__
+    stmt = dialect_insert(table).values(cohort_rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id],
+        set_={"cohort_month": stmt.excluded.cohort_month, "updated_at": func.now()},
+        where=stmt.excluded.cohort_month < table.c.cohort_month,
+    )
+    db.session.execute(stmt)
+
+
+def _add_driver_activity_orm(activity_rows: list, cohort_rows: list) -> None:
+    """Fallback for dialects without ON CONFLICT: locked read-modify-write per row"""
+    for row in activity_rows:
+        activity = (
+            DriverMonthlyActivity.query.filter_by(user_id=row["user_id"], activity_month=row["activity_month"])
+            .with_for_update()
+            .first()
+        )
+        if activity is None:
+            db.session.add(DriverMonthlyActivity(**row))
+        else:
+            activity.transaction_count += row["transaction_count"]
+            activity.total_amount += row["total_amount"]
+    for row in cohort_rows:
+        cohort = DriverCohort.query.filter_by(user_id=row["user_id"]).with_for_update().first()
+        if cohort is None:
+            db.session.add(DriverCohort(**row))
+        elif row["cohort_month"] < cohort.cohort_month:
+            cohort.cohort_month = row["cohort_month"]
+
+
+def rebuild_driver_cohorts(chunk_size: int = 5000) -> int:
+    """
+    Backfill / repair: recompute both tables from every settled transaction,
+    replacing what is there. Each sale is attributed to the owner of the
+    driver wallet its fuel_sale ledger debit hit, i.e. the driver at the
+    time, not whoever holds the plate today. Rows are streamed, so memory
+    grows with driver-months, not rows. Settlements wait on both tables' locks until the rebuild commits.
+    Returns the number of activity rows written. Commits.
+    """
+    # Same order as add_driver_activity takes them
+    lock_for_rebuild(DriverMonthlyActivity, DriverMonthlyActivity.query)
+    lock_for_rebuild(DriverCohort, DriverCohort.query)
+    DriverMonthlyActivity.query.delete(synchronize_session=False)
+    DriverCohort.query.delete(synchronize_session=False)
+
+    source = db.session.query(
+        Wallet.user_id, FuelTransaction.created_at, FuelTransaction.amount,
+    ).join(
+        WalletLedgerEntry,
+        (WalletLedgerEntry.reference_type == "fuel_transaction") & (WalletLedgerEntry.reference_id == FuelTransaction.id),
+    ).join(
+        Wallet, Wallet.id == WalletLedgerEntry.wallet_id,
+    ).filter(
+        FuelTransaction.status == "settled",
+        WalletLedgerEntry.event_type == "fuel_sale",
+        WalletLedgerEntry.direction == "debit",
+        WalletLedgerEntry.wallet_type == "driver_wallet",
+    ).order_by(FuelTransaction.id)
+    totals = aggregate_driver_activity((row.user_id, row) for row in source.yield_per(chunk_size))
+
+    first_months: Dict[int, date] = {}
+    for user_id, month in totals:
+        first_months[user_id] = min(month, first_months.get(user_id, month))
+    db.session.add_all(
+        DriverMonthlyActivity(user_id=user_id, activity_month=month,
+                              transaction_count=int(v["count"]), total_amount=v["amount"])
+        for (user_id, month), v in totals.items()
+    )
+    db.session.add_all(DriverCohort(user_id=user_id, cohort_month=month) for user_id, month in first_months.items())
+    db.session.commit()
+    return len(totals)
+
+
+def cohort_matrix(months: int = 12, today: Optional[date] = None) -> List[Dict[str, Any]]:
+    """
+    Retention for the cohorts of the last `months` months, oldest first:
+    [{"cohort": "YYYY-MM", "drivers": n, "retention": [{"month": k,
+    "active": n, "rate": 0..1}, ...]}], k from 0 up to the current month.
+    """
+    current = month_start(today or datetime.utcnow().date())
+    first = add_months(current, -(months - 1))
+    rows = db.session.query(
+        DriverCohort.cohort_month, DriverMonthlyActivity.activity_month, func.count(DriverMonthlyActivity.id),
+    ).join(
+        DriverMonthlyActivity, DriverMonthlyActivity.user_id == DriverCohort.user_id
+    ).filter(
+        DriverCohort.cohort_month >= first,
+    ).group_by(DriverCohort.cohort_month, DriverMonthlyActivity.activity_month).all()
+
+    active: Dict[Tuple[date, int], int] = {}
+    for cohort_month, activity_month, count in rows:
+        offset = months_between(cohort_month, activity_month)
+        if offset >= 0:
+            active[(cohort_month, offset)] = int(count)
+
+    matrix = []
+    for n in range(months):
+        cohort_month = add_months(first, n)
+        size = active.get((cohort_month, 0), 0)
+        matrix.append({
+            "cohort": cohort_month.strftime("%Y-%m"),
+            "drivers": size,
+            "retention": [
+                {
+                    "month": k,
+                    "active": active.get((cohort_month, k), 0),
+                    "rate": round(active.get((cohort_month, k), 0) / size, 4) if size else 0.0,
+                }
+                for k in range(months_between(cohort_month, current) + 1)
+            ],
+        })
+    return matrix
@@ -0,0 +1,175 @@
+"""
+Hourly ANPR entry rollup and entry statistics.
+VehicleEntryHourly holds per-pump, per-hour counts of logged entries by
+compliance outcome. Logging an entry adds to its hour in the same DB
+transaction, so week and month statistics read at most a few hundred rollup
+rows; only the partial hours at either end of a window touch raw logs, via
+one conditional-aggregate query on (pump_id, detected_at).
+"""
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import case, func
+
+from extensions import db
+from models import VehicleEntryHourly, VehicleEntryLog
+from services.sales_rollup import lock_for_rebuild
+
+# compliance_status values counted in their own column
+COMPLIANCE_STATUSES = ("compliant", "expired", "expiring_soon", "unknown", "blacklisted")
+COUNTERS = ("total_entries", *COMPLIANCE_STATUSES, "allowed", "alerts_triggered")
+
+HourKey = Tuple[int, datetime]
+
+
+def hour_start(moment: datetime) -> datetime:
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def aggregate_entries(logs: Iterable[VehicleEntryLog]) -> Dict[HourKey, Dict[str, int]]:
+    """Fold entry logs into per-(pump, hour) counter deltas"""
+    totals: Dict[HourKey, Dict[str, int]] = {}
+    for log in logs:
+        bucket = totals.setdefault(
+            (log.pump_id, hour_start(log.detected_at or datetime.utcnow())),
+            dict.fromkeys(COUNTERS, 0),
+        )
+        bucket["total_entries"] += 1
+        if log.compliance_status in COMPLIANCE_STATUSES:
+            bucket[log.compliance_status] += 1
+        bucket["allowed"] += 1 if log.is_allowed_entry else 0
+        bucket["alerts_triggered"] += 1 if log.alert_triggered else 0
+    return totals
+
+
+def add_hourly_entries(totals: Dict[HourKey, Dict[str, int]]) -> None:
+    """
+    Add counter deltas to the rollup in the caller's transaction (no
+    commit), as one upsert where the dialect supports it.
+    """
+    rows = [
+        {"pump_id": pump_id, "hour_start": hour, **counts}
+        for (pump_id, hour), counts in totals.items()
+    ]
+    if not rows:
+        return
+
+    dialect_name = db.session.get_bind().dialect.name
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        _add_hourly_entries_orm(rows)
+        return
+
+    table = VehicleEntryHourly.__table__
+    stmt = dialect_insert(table).values(rows)
+    excluded = stmt.excluded
+    set_ = {name: table.c[name] + excluded[name] for name in COUNTERS}
+    set_["updated_at"] = func.now()
+    stmt = stmt.on_conflict_do_update(index_elements=[table.c.pump_id, table.c.hour_start], set_=set_)
+    db.session.execute(stmt)
+
+
+def _add_hourly_entries_orm(rows: list) -> None:
+    """Fallback for dialects without ON CONFLICT: locked read-modify-write per hour"""
+    for row in rows:
+        rollup = (
+            VehicleEntryHourly.query.filter_by(pump_id=row["pump_id"], hour_start=row["hour_start"])
+            .with_for_update()
+            .first()
+        )
+        if rollup is None:
+            db.session.add(VehicleEntryHourly(**row))
+        else:
+            for name in COUNTERS:
+                setattr(rollup, name, getattr(rollup, name) + row[name])
+
+
+def rebuild_hourly_entries(pump_id: Optional[int] = None, start: Optional[datetime] = None,
+                           end: Optional[datetime] = None, chunk_size: int = 5000) -> int:
+    """
+    Backfill / repair: recompute rollup rows from raw logs for an optional
+    pump and [start, end) range (rounded down to whole hours), replacing
+    what is there. Logs are streamed, so memory grows with hours, not rows.
+    New entries wait on the rollup lock until the rebuild commits. Returns
+    the number of rollup rows written. Commits.
+    """
+    start = hour_start(start) if start else None
+    end = hour_start(end) if end else None
+    delete_q = VehicleEntryHourly.query
+    source = db.session.query(
+        VehicleEntryLog.pump_id, VehicleEntryLog.detected_at, VehicleEntryLog.compliance_status,
+        VehicleEntryLog.is_allowed_entry, VehicleEntryLog.alert_triggered,
+    ).filter(VehicleEntryLog.detected_at.isnot(None))
+    if pump_id is not None:
+        delete_q = delete_q.filter(VehicleEntryHourly.pump_id == pump_id)
+        source = source.filter(VehicleEntryLog.pump_id == pump_id)
+    if start is not None:
+        delete_q = delete_q.filter(VehicleEntryHourly.hour_start >= start)
+        source = source.filter(VehicleEntryLog.detected_at >= start)
+    if end is not None:
+        delete_q = delete_q.filter(VehicleEntryHourly.hour_start < end)
+        source = source.filter(VehicleEntryLog.detected_at < end)
+    lock_for_rebuild(VehicleEntryHourly, delete_q)
+    delete_q.delete(synchronize_session=False)
+
+    totals = aggregate_entries(source.yield_per(chunk_size))
+    db.session.add_all(
+        VehicleEntryHourly(pump_id=row_pump_id, hour_start=hour, **counts)
+        for (row_pump_id, hour), counts in totals.items()
+    )
+    db.session.commit()
+    return len(totals)
+
+
+def _raw_counts(pump_id: int, start: datetime, end: datetime) -> Dict[str, int]:
+    """Counters over raw logs in [start, end) with one conditional-aggregate query"""
+    def count_if(condition):
+        return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+    columns = [func.count(VehicleEntryLog.id)]
+    columns += [count_if(VehicleEntryLog.compliance_status == status) for status in COMPLIANCE_STATUSES]
+    columns += [count_if(VehicleEntryLog.is_allowed_entry.is_(True)),
+                count_if(VehicleEntryLog.alert_triggered.is_(True))]
+    row = db.session.query(*columns).filter(
+        VehicleEntryLog.pump_id == pump_id,
+        VehicleEntryLog.detected_at >= start,
+        VehicleEntryLog.detected_at < end,
+    ).one()
+    return {name: int(value) for name, value in zip(COUNTERS, row)}
+
+
+def _rollup_counts(pump_id: int, start: datetime, end: datetime) -> Dict[str, int]:
+    """Counters from whole rollup hours in [start, end)"""
+    row = db.session.query(
+        *(func.coalesce(func.sum(getattr(VehicleEntryHourly, name)), 0) for name in COUNTERS)
+    ).filter(
+        VehicleEntryHourly.pump_id == pump_id,
+        VehicleEntryHourly.hour_start >= start,
+        VehicleEntryHourly.hour_start < end,
+    ).one()
+    return {name: int(value) for name, value in zip(COUNTERS, row)}
+
+
+def entry_statistics(pump_id: int, start: datetime, end: datetime) -> Dict[str, int]:
+    """
+    Entry counters for [start, end): whole hours from the rollup, the
+    partial first and last hours from raw logs.
+    """
+    first_full_hour = hour_start(start) if start == hour_start(start) else hour_start(start) + timedelta(hours=1)
+    last_full_hour = hour_start(end)
+    if first_full_hour >= last_full_hour:
+        parts = [_raw_counts(pump_id, start, end)]
+    else:
+        parts = [
+            _raw_counts(pump_id, start, first_full_hour) if start < first_full_hour else None,
+            _rollup_counts(pump_id, first_full_hour, last_full_hour),
+            _raw_counts(pump_id, last_full_hour, end) if last_full_hour < end else None,
+        ]
+    totals = dict.fromkeys(COUNTERS, 0)
+    for part in parts:
+        for name, value in (part or {}).items():
+            totals[name] += value
+    return totals
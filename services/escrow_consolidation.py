@@ -0,0 +1,100 @@
+"""
+Escrow sub-account consolidation.
+Top-ups credit one of ESCROW_SHARDS escrow sub-accounts so they never queue
+on a single row. The escrow total is the root "main" account plus its
+sub-accounts; this job periodically moves each sub-account balance into the
+root with a paired debit/credit in the ledger, so every account's ledger
+still sums to its stored balance.
+"""
+import os
+import threading
+import time
+import uuid
+from typing import Any, Dict
+
+from flask import current_app
+from sqlalchemy import func, or_
+
+from extensions import db
+from models import EscrowAccount
+from services.wallet_service import credit_wallet, debit_wallet
+
+# Minutes between background runs; 0 leaves scheduling to cron / the CLI
+ESCROW_CONSOLIDATE_INTERVAL_MINUTES = float(os.getenv("ESCROW_CONSOLIDATE_INTERVAL_MINUTES", "0"))
+
+
+def escrow_balance() -> Dict[str, Any]:
+    """Total escrow held: root balance plus what is still sitting in sub-accounts"""
+    root = EscrowAccount.query.filter_by(name="main").first()
+    if root is None:
+        return {"total": 0.0, "consolidated": 0.0, "unconsolidated": 0.0, "sub_accounts": 0}
+    total, count = db.session.query(
+        func.coalesce(func.sum(EscrowAccount.balance), 0.0),
+        func.count(EscrowAccount.id),
+    ).filter(or_(EscrowAccount.id == root.id, EscrowAccount.parent_id == root.id)).one()
+    return {
+        "total": round(total, 2),
+        "consolidated": round(root.balance or 0.0, 2),
+        "unconsolidated": round(total - (root.balance or 0.0), 2),
+        "sub_accounts": count - 1,
+    }
+
+
+def consolidate_escrow() -> Dict[str, Any]:
+    """
+    Roll every sub-account balance up into the root and commit. Each
+    sub-account is locked and debited by exactly what it holds, and the root
+    credited the same amount in the same ledger group. Top-ups keep landing
+    on other sub-accounts meanwhile and wait at most for one row.
+    """
+    root = EscrowAccount.query.filter_by(name="main").first()
+    if root is None:
+        return {"moved": 0.0, "sub_accounts": 0, **escrow_balance()}
+    root_id = root.id
+    sub_ids = [
+        row[0] for row in db.session.query(EscrowAccount.id)
+        .filter(EscrowAccount.parent_id == root_id, EscrowAccount.balance != 0)
+        .order_by(EscrowAccount.id)
+    ]
+    moved, accounts = 0.0, 0
+    for sub_id in sub_ids:
+        sub = EscrowAccount.query.filter_by(id=sub_id).with_for_update().one()
+        amount = sub.balance or 0.0
+        if amount <= 0:
+            db.session.rollback()
+            continue
+        group_uuid = str(uuid.uuid4())
+        debit_wallet(EscrowAccount, sub.id, amount, event_type="escrow_consolidation",
+                     reference_id=root_id, reference_type="escrow_account", group_uuid=group_uuid)
+        credit_wallet(EscrowAccount, root_id, amount, event_type="escrow_consolidation",
+                      reference_id=sub.id, reference_type="escrow_account", group_uuid=group_uuid)
+        # One sub-account per commit keeps the root row lock short
+        db.session.commit()
+        moved += amount
+        accounts += 1
+
+    current_app.logger.info(f"Escrow consolidation moved {moved:.2f} from {accounts} sub-accounts")
+    return {"moved": round(moved, 2), "sub_accounts": accounts, **escrow_balance()}
+
+
+def consolidation_scheduler(app):
+    """Run consolidate_escrow every ESCROW_CONSOLIDATE_INTERVAL_MINUTES"""
+    while True:
+        with app.app_context():
+            try:
+                consolidate_escrow()
+            except Exception as e:
+                db.session.rollback()
+                app.logger.exception(f"Escrow consolidation failed: {e}")
+            finally:
+                db.session.remove()
+        time.sleep(ESCROW_CONSOLIDATE_INTERVAL_MINUTES * 60)
+
+
+def start_consolidation_service(app):
+    """Start the background consolidation thread if an interval is configured"""
+    if ESCROW_CONSOLIDATE_INTERVAL_MINUTES <= 0:
+        return
+    thread = threading.Thread(target=consolidation_scheduler, args=(app,), daemon=True)
+    thread.start()
+    print(f"✅ Escrow consolidation service started (every {ESCROW_CONSOLIDATE_INTERVAL_MINUTES:g} min)")
@@ -3,15 +3,24 @@ Production-ready escrow service for fuel transactions.
 Handles atomic wallet movements, immutable ledger entries, and verification flows.
 """
 import uuid
-from datetime import datetime
-from typing import Optional, Tuple, Dict, Any
+from datetime import datetime, timedelta
+from typing import Optional, Tuple, Dict, Any, Iterable, List
 from flask import current_app
+from sqlalchemy import insert
 from sqlalchemy.exc import IntegrityError
 
 from extensions import db
+from services.driver_cohorts import add_driver_activity, aggregate_driver_activity
+from services.pagination import keyset_page, cached_count
+from services.receipts import store_receipts
+from services.sales_rollup import add_daily_sales, aggregate_sales, rollup_query, summarize
+from services.vehicle_lookup import resolve_plate, resolve_plates
+from services.wallet_service import (
+    InsufficientBalanceError, credit_wallet, debit_wallet
+)
 from models import (
     FuelTransaction, Wallet, PumpWallet, WalletLedgerEntry,
-    User, PumpOwner, Pump
+    PumpOwner, Pump
 )
 
 
@@ -55,17 +64,6 @@ def _create_ledger_entry(group_uuid: str, event_type: str, direction: str,
     return entry
 
 
-def _find_driver_by_vehicle(vehicle_number: str) -> Optional[User]:
-    """Find driver (cab owner) by vehicle number. In real world, this could be:
-    - Exact match in Vehicle table (license field)
-    - Fuzzy match via external fleet management API
-    - ANPR-linked registry
-    """
-    from models import Vehicle
-    vehicle = Vehicle.query.filter_by(license=vehicle_number.upper()).first()
-    return vehicle.user if vehicle else None
-
-
 def create_fuel_transaction(pump_id: int, vehicle_number: str, fuel_type: str,
                            quantity_litres: float, unit_price: float,
                            attendant_id: int, verification_level: str = "manual",
@@ -122,13 +120,19 @@ def settle_fuel_transaction(transaction_id: int) -> Tuple[FuelTransaction, str]:
     Debits driver wallet, credits pump wallet, creates immutable ledger entries.
     If vehicle is not linked to a driver, marks transaction as 'failed' instead of error.
     """
-    transaction = FuelTransaction.query.get_or_404(transaction_id)
+    # Row lock so two concurrent settle calls cannot both release the same sale
+    transaction = (
+        FuelTransaction.query.filter_by(id=transaction_id)
+        .with_for_update()
+        .first_or_404()
+    )
     if transaction.status != "verified":
         raise VerificationRequiredError(f"Transaction {transaction_id} must be verified before settlement")
     
-    # Find driver by vehicle number
-    driver = _find_driver_by_vehicle(transaction.vehicle_number)
-    if not driver or not driver.wallet:
+    # Find driver wallet by vehicle number
+    # Fresh lookup: checked against the registry version, so another process's vehicle change is seen
+    driver_id, driver_wallet_id = resolve_plate(transaction.vehicle_number, fresh=True) or (None, None)
+    if driver_wallet_id is None:
         # Graceful fallback: mark as failed instead of throwing error
         transaction.status = "failed"
         transaction.extra_data = transaction.extra_data or {}
@@ -137,15 +141,6 @@ def settle_fuel_transaction(transaction_id: int) -> Tuple[FuelTransaction, str]:
         current_app.logger.warning(f"Settlement failed for transaction {transaction_id}: vehicle {transaction.vehicle_number} not linked to driver")
         return transaction, None
     
-    if driver.wallet.balance < transaction.amount:
-        # Mark as failed due to insufficient funds
-        transaction.status = "failed"
-        transaction.extra_data = transaction.extra_data or {}
-        transaction.extra_data["failure_reason"] = f"Insufficient driver balance: {driver.wallet.balance} < {transaction.amount}"
-        db.session.add(transaction)
-        current_app.logger.warning(f"Settlement failed for transaction {transaction_id}: insufficient driver balance")
-        return transaction, None
-    
     # Find pump wallet
     pump = Pump.query.get(transaction.pump_id)
     if not pump or not pump.owner or not pump.owner.wallet:
@@ -153,16 +148,25 @@ def settle_fuel_transaction(transaction_id: int) -> Tuple[FuelTransaction, str]:
     
     pump_wallet = pump.owner.wallet
     
+    # Guarded atomic debit: only succeeds while the balance still covers the sale
+    try:
+        driver_balance_after = debit_wallet(Wallet, driver_wallet_id, transaction.amount)
+    except InsufficientBalanceError:
+        # Mark as failed due to insufficient funds
+        transaction.status = "failed"
+        transaction.extra_data = dict(transaction.extra_data or {})
+        driver_balance = db.session.get(Wallet, driver_wallet_id).balance
+        transaction.extra_data["failure_reason"] = f"Insufficient driver balance: {driver_balance} < {transaction.amount}"
+        db.session.add(transaction)
+        current_app.logger.warning(f"Settlement failed for transaction {transaction_id}: insufficient driver balance")
+        return transaction, None
+    pump_balance_after = credit_wallet(PumpWallet, pump_wallet.id, transaction.amount)
+    
     # Generate a group UUID for this transaction
     group_uuid = str(uuid.uuid4())
     
-    # Capture balances before changes
-    driver_balance_before = driver.wallet.balance
-    pump_balance_before = pump_wallet.balance
-    
-    # Perform atomic wallet updates
-    driver.wallet.balance -= transaction.amount
-    pump_wallet.balance += transaction.amount
+    driver_balance_before = driver_balance_after + transaction.amount
+    pump_balance_before = pump_balance_after - transaction.amount
     
     # Create immutable ledger entries
     _create_ledger_entry(
@@ -170,9 +174,9 @@ def settle_fuel_transaction(transaction_id: int) -> Tuple[FuelTransaction, str]:
         event_type="fuel_sale",
         direction="debit",
         wallet_type="driver_wallet",
-        wallet_id=driver.wallet.id,
+        wallet_id=driver_wallet_id,
         amount=transaction.amount,
-        balance_after=driver.wallet.balance,
+        balance_after=driver_balance_after,
         reference_id=transaction.id,
         reference_type="fuel_transaction"
     )
@@ -184,7 +188,7 @@ def settle_fuel_transaction(transaction_id: int) -> Tuple[FuelTransaction, str]:
         wallet_type="pump_wallet",
         wallet_id=pump_wallet.id,
         amount=transaction.amount,
-        balance_after=pump_wallet.balance,
+        balance_after=pump_balance_after,
         reference_id=transaction.id,
         reference_type="fuel_transaction"
     )
@@ -192,118 +196,252 @@ def settle_fuel_transaction(transaction_id: int) -> Tuple[FuelTransaction, str]:
     # Mark transaction as settled
     transaction.status = "settled"
     transaction.settled_at = datetime.utcnow()
+    add_daily_sales(aggregate_sales([transaction]))
+    add_driver_activity(aggregate_driver_activity([(driver_id, transaction)]))
     
-    # Add settlement metadata to extra_data
-    if not transaction.extra_data:
-        transaction.extra_data = {}
-    transaction.extra_data["settlement"] = {
+    # Add settlement metadata to extra_data (new dict so the JSON change is persisted)
+    extra_data = dict(transaction.extra_data or {})
+    extra_data["settlement"] = {
         "group_uuid": group_uuid,
         "driver_balance_before": driver_balance_before,
-        "driver_balance_after": driver.wallet.balance,
+        "driver_balance_after": driver_balance_after,
         "pump_balance_before": pump_balance_before,
-        "pump_balance_after": pump_wallet.balance,
+        "pump_balance_after": pump_balance_after,
         "settled_at": transaction.settled_at.isoformat()
     }
+    transaction.extra_data = extra_data
     
     db.session.add(transaction)
+    store_receipts([transaction])
     
     current_app.logger.info(
         f"Settled fuel transaction {transaction.id}: "
-        f"-{transaction.amount} from driver {driver.id}, "
+        f"-{transaction.amount} from driver {driver_id}, "
         f"+{transaction.amount} to pump {pump.id} (group {group_uuid})"
     )
     
     return transaction, group_uuid
 
 
-def get_transaction_receipt(transaction_id: int) -> Dict[str, Any]:
+SETTLEMENT_CHUNK_SIZE = 200
+
+
+def _pump_wallets_by_pump(pump_ids) -> Dict[int, int]:
+    """Map pump id -> owner's pump wallet id in one query"""
+    rows = (
+        db.session.query(Pump.id, PumpWallet.id)
+        .join(PumpWallet, PumpWallet.owner_id == Pump.owner_id)
+        .filter(Pump.id.in_(list(pump_ids)))
+        .all()
+    )
+    return {pump_id: wallet_id for pump_id, wallet_id in rows}
+
+
+def _settle_chunk(transaction_ids: List[int]) -> List[Dict[str, Any]]:
     """
-    Step 6: Generate a non-editable digital receipt.
+    Settle one chunk of transactions inside the current DB transaction.
+    Caller commits. Returns one outcome dict per requested id.
     """
-    transaction = FuelTransaction.query.get_or_404(transaction_id)
-    pump = transaction.pump
-    driver = _find_driver_by_vehicle(transaction.vehicle_number)
-    
-    receipt = {
-        "transaction_id": transaction.id,
-        "group_uuid": None,
-        "vehicle_number": transaction.vehicle_number,
-        "fuel_type": transaction.fuel_type,
-        "quantity_litres": transaction.quantity_litres,
-        "unit_price": transaction.unit_price,
-        "amount": transaction.amount,
-        "currency": "INR",
-        "pump": {
-            "id": pump.id,
-            "name": pump.name,
-            "location": pump.location
-        },
-        "status": transaction.status,
-        "created_at": transaction.created_at.isoformat(),
-        "verified_at": transaction.verified_at.isoformat() if transaction.verified_at else None,
-        "settled_at": transaction.settled_at.isoformat() if transaction.settled_at else None,
-        "verification_level": transaction.verification_level,
-        "attendant": transaction.attendant.full_name if transaction.attendant else None,
-        "verifier": transaction.verifier.full_name if transaction.verifier else None,
-        "driver": {
-            "id": driver.id,
-            "name": driver.full_name,
-            "email": driver.email
-        } if driver else None,
-        "ledger_entries": []
-    }
-    
-    # Include settlement UUID if available
-    if transaction.extra_data and "settlement" in transaction.extra_data:
-        receipt["group_uuid"] = transaction.extra_data["settlement"]["group_uuid"]
-    
-    # Fetch ledger entries for this transaction
-    entries = WalletLedgerEntry.query.filter_by(
-        reference_id=transaction.id,
-        reference_type="fuel_transaction"
-    ).order_by(WalletLedgerEntry.created_at).all()
-    
-    for entry in entries:
-        receipt["ledger_entries"].append({
-            "direction": entry.direction,
-            "wallet_type": entry.wallet_type,
-            "amount": entry.amount,
-            "balance_after": entry.balance_after,
-            "created_at": entry.created_at.isoformat()
-        })
-    
-    return receipt
+    transactions = (
+        FuelTransaction.query
+        .filter(FuelTransaction.id.in_(transaction_ids))
+        .order_by(FuelTransaction.id)
+        .with_for_update()
+        .all()
+    )
+    found = {t.id: t for t in transactions}
+    outcomes = {}
+    for transaction_id in transaction_ids:
+        transaction = found.get(transaction_id)
+        if transaction is None:
+            outcomes[transaction_id] = {"transaction_id": transaction_id, "status": "failed",
+                                        "reason": "Transaction not found"}
+        elif transaction.status != "verified":
+            outcomes[transaction_id] = {"transaction_id": transaction_id, "status": "failed",
+                                        "reason": f"Transaction is {transaction.status}, not verified"}
+
+    eligible = [t for t in transactions if t.status == "verified"]
+    drivers = resolve_plates({t.vehicle_number for t in eligible}, fresh=True)
+    pump_wallet_ids = _pump_wallets_by_pump({t.pump_id for t in eligible})
+
+    # Lock every wallet this chunk touches, always driver wallets then pump
+    # wallets and each in id order, so concurrent batches cannot deadlock.
+    driver_wallet_ids = sorted({w for _, w in drivers.values() if w is not None})
+    driver_wallets = {
+        w.id: w for w in Wallet.query.filter(Wallet.id.in_(driver_wallet_ids))
+        .order_by(Wallet.id).with_for_update().all()
+    } if driver_wallet_ids else {}
+    pump_wallets = {
+        w.id: w for w in PumpWallet.query.filter(PumpWallet.id.in_(sorted(set(pump_wallet_ids.values()))))
+        .order_by(PumpWallet.id).with_for_update().all()
+    } if pump_wallet_ids else {}
+
+    balances = {("driver_wallet", wid): w.balance or 0.0 for wid, w in driver_wallets.items()}
+    balances.update({("pump_wallet", wid): w.balance or 0.0 for wid, w in pump_wallets.items()})
+    ledger_rows = []
+    settled = []
+    settled_at = datetime.utcnow()
+
+    for transaction in eligible:
+        driver_id, driver_wallet_id = drivers.get(transaction.vehicle_number, (None, None))
+        pump_wallet_id = pump_wallet_ids.get(transaction.pump_id)
+        failure_reason = None
+        if driver_wallet_id is None or driver_wallet_id not in driver_wallets:
+            failure_reason = "Vehicle not linked to any driver wallet"
+        elif pump_wallet_id is None or pump_wallet_id not in pump_wallets:
+            # Configuration problem on the pump side; leave the transaction verified
+            outcomes[transaction.id] = {"transaction_id": transaction.id, "status": "failed",
+                                        "reason": f"Pump wallet not found for pump {transaction.pump_id}"}
+            continue
+        elif balances[("driver_wallet", driver_wallet_id)] < transaction.amount:
+            failure_reason = (f"Insufficient driver balance: "
+                              f"{balances[('driver_wallet', driver_wallet_id)]} < {transaction.amount}")
+
+        if failure_reason:
+            transaction.status = "failed"
+            extra_data = dict(transaction.extra_data or {})
+            extra_data["failure_reason"] = failure_reason
+            transaction.extra_data = extra_data
+            outcomes[transaction.id] = {"transaction_id": transaction.id, "status": "failed",
+                                        "reason": failure_reason}
+            continue
+
+        driver_key = ("driver_wallet", driver_wallet_id)
+        pump_key = ("pump_wallet", pump_wallet_id)
+        driver_balance_before = balances[driver_key]
+        pump_balance_before = balances[pump_key]
+        balances[driver_key] = driver_balance_before - transaction.amount
+        balances[pump_key] = pump_balance_before + transaction.amount
+
+        group_uuid = str(uuid.uuid4())
+        for direction, (wallet_type, wallet_id) in (("debit", driver_key), ("credit", pump_key)):
+            ledger_rows.append({
+                "group_uuid": group_uuid,
+                "event_type": "fuel_sale",
+                "direction": direction,
+                "wallet_type": wallet_type,
+                "wallet_id": wallet_id,
+                "amount": transaction.amount,
+                "balance_after": balances[(wallet_type, wallet_id)],
+                "reference_id": transaction.id,
+                "reference_type": "fuel_transaction",
+            })
+
+        transaction.status = "settled"
+        transaction.settled_at = settled_at
+        extra_data = dict(transaction.extra_data or {})
+        extra_data["settlement"] = {
+            "group_uuid": group_uuid,
+            "driver_balance_before": driver_balance_before,
+            "driver_balance_after": balances[driver_key],
+            "pump_balance_before": pump_balance_before,
+            "pump_balance_after": balances[pump_key],
+            "settled_at": settled_at.isoformat(),
+        }
+        transaction.extra_data = extra_data
+        settled.append(transaction)
+        outcomes[transaction.id] = {"transaction_id": transaction.id, "status": "settled",
+                                    "group_uuid": group_uuid, "amount": transaction.amount,
+                                    "driver_id": driver_id}
+
+    # One balance write per touched wallet, however many sales it had
+    for (wallet_type, wallet_id), balance in balances.items():
+        wallet = driver_wallets[wallet_id] if wallet_type == "driver_wallet" else pump_wallets[wallet_id]
+        if wallet.balance != balance:
+            wallet.balance = balance
+
+    if ledger_rows:
+        db.session.execute(insert(WalletLedgerEntry), ledger_rows)
+    add_daily_sales(aggregate_sales(settled))
+    add_driver_activity(aggregate_driver_activity(
+        (drivers[t.vehicle_number][0], t) for t in settled
+    ))
+    store_receipts(settled)
+
+    return [outcomes[transaction_id] for transaction_id in transaction_ids]
+
 
+def settle_fuel_transactions_batch(transaction_ids: Iterable[int],
+                                   chunk_size: int = SETTLEMENT_CHUNK_SIZE) -> List[Dict[str, Any]]:
+    """
+    Settle many verified transactions at once (end-of-shift settlement).
+
+    Work is split into chunks of `chunk_size` transactions; each chunk loads
+    drivers and pump wallets with one query each, locks the affected wallets
+    in a fixed order, applies one balance update per wallet, bulk-inserts the
+    ledger entries and commits. A failing chunk is rolled back on its own and
+    reported per transaction; chunks already committed stay settled.
+    """
+    ids = list(dict.fromkeys(int(i) for i in transaction_ids))
+    chunk_size = max(1, int(chunk_size))
+    results = []
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        try:
+            outcomes = _settle_chunk(chunk)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Batch settlement chunk {chunk[0]}..{chunk[-1]} failed: {e}")
+            outcomes = [{"transaction_id": i, "status": "failed", "reason": f"Chunk error: {e}"} for i in chunk]
+        results.extend(outcomes)
+
+    settled = sum(1 for o in results if o["status"] == "settled")
+    current_app.logger.info(f"Batch settlement: {settled} settled, {len(results) - settled} failed")
+    return results
 
-def list_pump_transactions(pump_id: int, status: Optional[str] = None,
-                         limit: int = 100, offset: int = 0) -> Tuple[list, int]:
-    """List fuel transactions for a pump, optionally filtered by status"""
+
+def verified_transaction_ids(pump_ids: Optional[Iterable[int]] = None,
+                             before: Optional[datetime] = None) -> List[int]:
+    """Ids of verified (unsettled) transactions, oldest first"""
+    query = db.session.query(FuelTransaction.id).filter(FuelTransaction.status == "verified")
+    if pump_ids is not None:
+        query = query.filter(FuelTransaction.pump_id.in_(list(pump_ids)))
+    if before is not None:
+        query = query.filter(FuelTransaction.created_at < before)
+    return [row[0] for row in query.order_by(FuelTransaction.id).all()]
+
+
+def list_pump_transactions(pump_id: int, status: Optional[str] = None, limit: int = 100,
+                           cursor: Optional[str] = None) -> Tuple[list, Optional[str], int]:
+    """
+    One page of a pump's fuel transactions (newest first), optionally filtered
+    by status. Returns (transactions, next_cursor, approximate total).
+    """
     query = FuelTransaction.query.filter_by(pump_id=pump_id)
     if status:
         query = query.filter_by(status=status)
     
-    total = query.count()
-    transactions = query.order_by(FuelTransaction.created_at.desc()).offset(offset).limit(limit).all()
+    transactions, next_cursor = keyset_page(query, FuelTransaction.created_at, FuelTransaction.id, limit, cursor)
+    total = cached_count(("pump_transactions", pump_id, status), query)
     
-    return transactions, total
+    return transactions, next_cursor, total
 
 
-def list_driver_transactions(driver_id: int, limit: int = 100, offset: int = 0) -> Tuple[list, int]:
-    """List fuel transactions for a driver (by vehicle numbers they own)"""
+def driver_vehicle_numbers(driver_id: int) -> List[str]:
+    """Vehicle numbers a driver's sales may be recorded under, as typed and normalised"""
     from models import Vehicle
     
-    # Get all vehicle numbers for this driver
-    vehicles = Vehicle.query.filter_by(user_id=driver_id).all()
-    vehicle_numbers = [v.license.upper() for v in vehicles]
-    
+    vehicle_numbers = set()
+    for license_number, plate_key in db.session.query(Vehicle.license, Vehicle.plate_key).filter_by(user_id=driver_id):
+        vehicle_numbers.add(license_number.upper())
+        if plate_key:
+            vehicle_numbers.add(plate_key)
+    return sorted(vehicle_numbers)
+
+
+def list_driver_transactions(driver_id: int, limit: int = 100,
+                             cursor: Optional[str] = None) -> Tuple[list, Optional[str], int]:
+    """One page of fuel transactions for a driver (by vehicle numbers they own)"""
+    vehicle_numbers = driver_vehicle_numbers(driver_id)
     if not vehicle_numbers:
-        return [], 0
+        return [], None, 0
     
     query = FuelTransaction.query.filter(FuelTransaction.vehicle_number.in_(vehicle_numbers))
-    total = query.count()
-    transactions = query.order_by(FuelTransaction.created_at.desc()).offset(offset).limit(limit).all()
+    transactions, next_cursor = keyset_page(query, FuelTransaction.created_at, FuelTransaction.id, limit, cursor)
+    total = cached_count(("driver_transactions", driver_id), query)
     
-    return transactions, total
+    return transactions, next_cursor, total
 
 
 def get_pending_verifications_for_pump(pump_id: int) -> list:
@@ -315,26 +453,36 @@ def get_pending_verifications_for_pump(pump_id: int) -> list:
 
 
 def get_daily_sales_for_pump(pump_id: int, date: datetime) -> Dict[str, Any]:
-    """Get daily sales summary for a pump"""
+    """Get daily sales summary for a pump (totals from the daily rollup)"""
     start = date.replace(hour=0, minute=0, second=0, microsecond=0)
-    end = start.replace(hour=23, minute=59, second=59, microsecond=999999)
+    end = start + timedelta(days=1)
     
+    by_fuel = rollup_query([pump_id], start.date(), end.date()).all()
+    totals = summarize([pump_id], start.date(), end.date())
+    
+    # Half-open range on created_at so the (pump_id, created_at, id) index is used
     transactions = FuelTransaction.query.filter(
         FuelTransaction.pump_id == pump_id,
         FuelTransaction.created_at >= start,
-        FuelTransaction.created_at <= end,
+        FuelTransaction.created_at < end,
         FuelTransaction.status == "settled"
-    ).all()
-    
-    total_amount = sum(t.amount for t in transactions)
-    total_quantity = sum(t.quantity_litres for t in transactions)
+    ).order_by(FuelTransaction.created_at, FuelTransaction.id).all()
     
     return {
         "date": date.date().isoformat(),
         "pump_id": pump_id,
-        "total_transactions": len(transactions),
-        "total_amount": round(total_amount, 2),
-        "total_quantity": round(total_quantity, 2),
+        "total_transactions": totals["count"],
+        "total_amount": round(totals["amount"], 2),
+        "total_quantity": round(totals["litres"], 2),
+        "by_fuel_type": [
+            {
+                "fuel_type": r.fuel_type,
+                "transactions": r.transaction_count,
+                "quantity": round(r.total_litres, 2),
+                "amount": round(r.total_amount, 2)
+            }
+            for r in by_fuel
+        ],
         "transactions": [
             {
                 "id": t.id,
@@ -0,0 +1,220 @@
+"""
+Streaming data exports.
+Rows are read as plain tuples over a server-side cursor (yield_per) in id
+order and written out one partition at a time, so memory stays flat however
+large the table is. CSV is produced chunk by chunk; for Parquet each
+partition becomes a typed polars frame written as one row group, with no
+text round trip (so NULL and "" stay distinct). polars and pyarrow are only
+imported for a Parquet export, so the app runs without them.
+"""
+import csv
+import io
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from sqlalchemy import Boolean, Date, DateTime, Float, Integer, Numeric, select
+
+from extensions import db
+from models import Attendance, FuelTransaction, VehicleEntryLog, VehicleLocation, WalletLedgerEntry
+
+EXPORT_CHUNK_SIZE = 5000
+EXPORT_FORMATS = ("csv", "parquet")
+
+
+def _ledger_pump_filter(pump_ids):
+    # Ledger rows carry no pump; fuel sale entries reference their transaction
+    return (
+        (WalletLedgerEntry.reference_type == "fuel_transaction")
+        & WalletLedgerEntry.reference_id.in_(
+            select(FuelTransaction.id).where(FuelTransaction.pump_id.in_(pump_ids))
+        )
+    )
+
+
+# name -> model, the timestamp the date filter applies to, and how to filter by pump
+EXPORT_DATASETS = {
+    "fuel-transactions": {
+        "model": FuelTransaction,
+        "time_column": FuelTransaction.created_at,
+        "pump_filter": lambda pump_ids: FuelTransaction.pump_id.in_(pump_ids),
+    },
+    "ledger": {
+        "model": WalletLedgerEntry,
+        "time_column": WalletLedgerEntry.created_at,
+        "pump_filter": _ledger_pump_filter,
+    },
+    "attendance": {
+        "model": Attendance,
+        "time_column": Attendance.attendance_date,
+        "pump_filter": lambda pump_ids: Attendance.pump_id.in_(pump_ids),
+    },
+    "entry-logs": {
+        "model": VehicleEntryLog,
+        "time_column": VehicleEntryLog.detected_at,
+        "pump_filter": lambda pump_ids: VehicleEntryLog.pump_id.in_(pump_ids),
+    },
+    "vehicle-locations": {
+        "model": VehicleLocation,
+        "time_column": VehicleLocation.recorded_at,
+        "pump_filter": None,
+    },
+}
+
+
+class ExportError(ValueError):
+    """Raised for an unknown dataset, a filter the dataset does not support, or a missing Parquet library"""
+
+
+def _dataset(name: str) -> Dict[str, Any]:
+    spec = EXPORT_DATASETS.get(name)
+    if spec is None:
+        raise ExportError(f"Unknown dataset {name}; choose from {', '.join(EXPORT_DATASETS)}")
+    return spec
+
+
+def export_columns(name: str) -> List[Any]:
+    return list(_dataset(name)["model"].__table__.columns)
+
+
+def export_statement(name: str, start: Optional[date] = None, end: Optional[date] = None,
+                     pump_ids: Optional[Iterable[int]] = None):
+    """SELECT of every column for a [start, end) date range and optional pumps, in id order"""
+    spec = _dataset(name)
+    table = spec["model"].__table__
+    stmt = select(*table.columns).order_by(table.c.id)
+
+    time_column = spec["time_column"]
+    is_timestamp = isinstance(time_column.type, DateTime)
+    for bound, compare in ((start, time_column.__ge__), (end, time_column.__lt__)):
+        if bound is not None:
+            stmt = stmt.where(compare(datetime.combine(bound, datetime.min.time()) if is_timestamp else bound))
+    if pump_ids is not None:
+        if spec["pump_filter"] is None:
+            raise ExportError(f"{name} cannot be filtered by pump")
+        stmt = stmt.where(spec["pump_filter"](list(pump_ids)))
+    return stmt
+
+
+def iter_export_chunks(name: str, start: Optional[date] = None, end: Optional[date] = None,
+                       pump_ids: Optional[Iterable[int]] = None,
+                       chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[List[tuple]]:
+    """Row tuples in partitions of `chunk_size`, read over a server-side cursor"""
+    stmt = export_statement(name, start, end, pump_ids).execution_options(yield_per=chunk_size)
+    result = db.session.execute(stmt)
+    try:
+        for partition in result.partitions():
+            yield partition
+    finally:
+        result.close()
+
+
+def _csv_value(value: Any) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+    return value
+
+
+def iter_csv(name: str, start: Optional[date] = None, end: Optional[date] = None,
+             pump_ids: Optional[Iterable[int]] = None,
+             chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[str]:
+    """CSV text, header first, one string per partition"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([c.name for c in export_columns(name)])
+    yield buffer.getvalue()
+    for partition in iter_export_chunks(name, start, end, pump_ids, chunk_size):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([_csv_value(v) for v in row] for row in partition)
+        yield buffer.getvalue()
+
+
+def _parquet_modules():
+    """(polars, pyarrow.parquet), or ExportError when either is not installed"""
+    try:
+        import polars as pl
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ExportError(f"Parquet export needs polars and pyarrow installed ({e})")
+    return pl, pq
+
+
+def _polars_dtype(pl, column) -> Any:
+    if isinstance(column.type, Boolean):
+        return pl.Boolean
+    if isinstance(column.type, Integer):
+        return pl.Int64
+    if isinstance(column.type, (Float, Numeric)):
+        return pl.Float64
+    if isinstance(column.type, DateTime):
+        return pl.Datetime("us")
+    if isinstance(column.type, Date):
+        return pl.Date
+    return pl.Utf8
+
+
+def _text_value(value: Any) -> Any:
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+    return str(value)
+
+
+def _float_value(value: Any) -> Any:
+    return float(value) if isinstance(value, Decimal) else value
+
+
+def _parquet_converters(pl, schema: Dict[str, Any]) -> List[Optional[Callable[[Any], Any]]]:
+    """Per-column conversion of DB values to what the polars dtype accepts (None = as is)"""
+    converters = []
+    for dtype in schema.values():
+        if dtype == pl.Utf8:
+            converters.append(_text_value)
+        elif dtype == pl.Float64:
+            converters.append(_float_value)
+        else:
+            converters.append(None)
+    return converters
+
+
+def write_parquet(name: str, path: str, start: Optional[date] = None, end: Optional[date] = None,
+                  pump_ids: Optional[Iterable[int]] = None,
+                  chunk_size: int = EXPORT_CHUNK_SIZE) -> None:
+    """
+    Write a Parquet file at `path`, one row group per `chunk_size` rows.
+    Each partition is built into a polars frame with the column types taken
+    from the model and appended to the file, so values keep their types.
+    Raises ExportError, before writing anything, if polars or pyarrow is
+    missing.
+    """
+    pl, pq = _parquet_modules()
+    schema = {c.name: _polars_dtype(pl, c) for c in export_columns(name)}
+    converters = _parquet_converters(pl, schema)
+    writer = None
+    try:
+        for partition in iter_export_chunks(name, start, end, pump_ids, chunk_size):
+            rows = [
+                [convert(v) if convert else v for convert, v in zip(converters, row)]
+                for row in partition
+            ]
+            table = pl.DataFrame(rows, schema=schema, orient="row").to_arrow()
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+        if writer is None:
+            # No rows: still write the schema
+            table = pl.DataFrame(schema=schema).to_arrow()
+            writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
@@ -0,0 +1,279 @@
+"""
+Bulk fuel-transaction ingest for POS / dispenser integrations.
+Controllers upload buffered sales as NDJSON or CSV, one client-supplied
+idempotency key per sale. The batch is validated column-wise in one polars
+pass, inserted in chunks with ON CONFLICT DO NOTHING on
+(pump_id, idempotency_key), and every row gets an outcome: created,
+duplicate or rejected. Re-sending a batch can never create a second
+transaction for the same key.
+"""
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import polars as pl
+from flask import current_app
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from models import FuelTransaction
+
+INGEST_CHUNK_SIZE = 500
+MAX_INGEST_ROWS = 20000
+# Controller clocks drift; anything further ahead than this is rejected
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+
+NDJSON_MIMETYPES = {"application/x-ndjson", "application/jsonl", "application/json-lines"}
+CSV_MIMETYPES = {"text/csv", "application/csv"}
+
+_TEXT_FIELDS = ("idempotency_key", "pump_id", "vehicle_number", "fuel_type",
+                "quantity_litres", "unit_price")
+
+
+class IngestFormatError(ValueError):
+    """Raised when a batch cannot be parsed at all"""
+
+
+def parse_batch(raw: bytes, fmt: str) -> List[Dict[str, Any]]:
+    """
+    Split an NDJSON or CSV body into row dicts. A line that is not valid
+    JSON becomes a row carrying `_error` so it is reported, not dropped.
+    """
+    try:
+        text = raw.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise IngestFormatError("Batch must be UTF-8 encoded")
+
+    if fmt == "ndjson":
+        rows = []
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            rows.append(record if isinstance(record, dict) else {"_error": "Line is not a JSON object"})
+    elif fmt == "csv":
+        reader = csv.DictReader(io.StringIO(text))
+        missing = [f for f in _TEXT_FIELDS if f not in (reader.fieldnames or [])]
+        if missing:
+            raise IngestFormatError(f"CSV header missing columns: {', '.join(missing)}")
+        rows = list(reader)
+    else:
+        raise IngestFormatError(f"Unsupported batch format {fmt}")
+
+    if len(rows) > MAX_INGEST_ROWS:
+        raise IngestFormatError(f"Batch has {len(rows)} rows; the limit is {MAX_INGEST_ROWS}")
+    return rows
+
+
+def _parse_sold_at(value: Any) -> Tuple[Optional[datetime], bool]:
+    """(naive UTC datetime or None, whether the value was unparseable)"""
+    if value in (None, ""):
+        return None, False
+    try:
+        sold_at = datetime.fromisoformat(str(value).strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None, True
+    if sold_at.tzinfo is not None:
+        sold_at = (sold_at - sold_at.utcoffset()).replace(tzinfo=None)
+    return sold_at, False
+
+
+def _positive(name: str) -> pl.Expr:
+    return pl.col(name).is_not_null() & pl.col(name).is_finite() & (pl.col(name) > 0)
+
+
+def validate_batch(rows: List[Dict[str, Any]], allowed_pump_ids: Iterable[int],
+                   now: Optional[datetime] = None) -> pl.DataFrame:
+    """
+    Validate every row in one vectorised pass. Returns a frame with one row
+    per input row, typed columns and a `reason` that is null for valid rows.
+    """
+    now = now or datetime.utcnow()
+    columns: Dict[str, list] = {f: [] for f in _TEXT_FIELDS}
+    parse_errors, sold_at, sold_at_invalid = [], [], []
+    for record in rows:
+        for f in _TEXT_FIELDS:
+            value = record.get(f)
+            columns[f].append("" if value is None else str(value).strip())
+        parse_errors.append(record.get("_error"))
+        parsed, invalid = _parse_sold_at(record.get("sold_at"))
+        sold_at.append(parsed)
+        sold_at_invalid.append(invalid)
+
+    frame = pl.DataFrame(
+        {
+            "row": list(range(1, len(rows) + 1)),
+            **columns,
+            "parse_error": parse_errors,
+            "sold_at": sold_at,
+            "sold_at_invalid": sold_at_invalid,
+        },
+        schema={
+            "row": pl.Int64,
+            **{f: pl.Utf8 for f in _TEXT_FIELDS},
+            "parse_error": pl.Utf8,
+            "sold_at": pl.Datetime("us"),
+            "sold_at_invalid": pl.Boolean,
+        },
+    ).with_columns(
+        pl.col("pump_id").cast(pl.Int64, strict=False),
+        pl.col("vehicle_number").str.to_uppercase(),
+        pl.col("quantity_litres").cast(pl.Float64, strict=False),
+        pl.col("unit_price").cast(pl.Float64, strict=False),
+    )
+
+    key_len = pl.col("idempotency_key").str.len_chars()
+    reason = (
+        pl.when(pl.col("parse_error").is_not_null()).then(pl.col("parse_error"))
+        .when(key_len == 0).then(pl.lit("Missing idempotency_key"))
+        .when(key_len > 64).then(pl.lit("idempotency_key longer than 64 characters"))
+        .when(pl.col("pump_id").is_null()).then(pl.lit("Invalid pump_id"))
+        .when(~pl.col("pump_id").is_in(list(allowed_pump_ids))).then(pl.lit("Pump not found"))
+        .when(pl.col("vehicle_number").str.len_chars() == 0).then(pl.lit("Missing vehicle_number"))
+        .when(pl.col("vehicle_number").str.len_chars() > 20).then(pl.lit("vehicle_number longer than 20 characters"))
+        .when(pl.col("fuel_type").str.len_chars() == 0).then(pl.lit("Missing fuel_type"))
+        .when(pl.col("fuel_type").str.len_chars() > 20).then(pl.lit("fuel_type longer than 20 characters"))
+        .when(~_positive("quantity_litres")).then(pl.lit("quantity_litres must be a positive number"))
+        .when(~_positive("unit_price")).then(pl.lit("unit_price must be a positive number"))
+        .when(pl.col("sold_at_invalid")).then(pl.lit("Invalid sold_at timestamp"))
+        .when(pl.col("sold_at") > pl.lit(now + MAX_CLOCK_SKEW)).then(pl.lit("sold_at is in the future"))
+        .otherwise(pl.lit(None, dtype=pl.Utf8))
+    )
+    return frame.with_columns(
+        reason.alias("reason"),
+        (pl.col("quantity_litres") * pl.col("unit_price")).round(2).alias("amount"),
+    )
+
+
+def _extra_data(record: Dict[str, Any]) -> Dict[str, Any]:
+    extra = record.get("extra_data")
+    return dict(extra) if isinstance(extra, dict) else {}
+
+
+def _existing_ids(pairs: List[Tuple[int, str]]) -> Dict[Tuple[int, str], int]:
+    """Transaction ids already stored for these (pump_id, idempotency_key) pairs"""
+    if not pairs:
+        return {}
+    wanted = set(pairs)
+    rows = db.session.query(
+        FuelTransaction.id, FuelTransaction.pump_id, FuelTransaction.idempotency_key
+    ).filter(
+        FuelTransaction.pump_id.in_({p for p, _ in wanted}),
+        FuelTransaction.idempotency_key.in_({k for _, k in wanted}),
+    ).all()
+    return {(r.pump_id, r.idempotency_key): r.id for r in rows if (r.pump_id, r.idempotency_key) in wanted}
+
+
+def _insert_chunk(values: List[Dict[str, Any]]) -> Dict[Tuple[int, str], int]:
+    """
+    Insert a chunk, skipping keys that already exist. Returns the ids of the
+    rows this call actually created.
+    """
+    table = FuelTransaction.__table__
+    dialect_name = db.session.get_bind().dialect.name
+    if dialect_name in ("postgresql", "sqlite"):
+        if dialect_name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        stmt = (
+            dialect_insert(table).values(values)
+            .on_conflict_do_nothing(index_elements=[table.c.pump_id, table.c.idempotency_key])
+            .returning(table.c.id, table.c.pump_id, table.c.idempotency_key)
+        )
+        return {(r.pump_id, r.idempotency_key): r.id for r in db.session.execute(stmt)}
+
+    # Fallback: one savepoint per row, a unique violation means a racing duplicate
+    created = {}
+    for row in values:
+        try:
+            with db.session.begin_nested():
+                result = db.session.execute(insert(table).values(row))
+            created[(row["pump_id"], row["idempotency_key"])] = result.inserted_primary_key[0]
+        except IntegrityError:
+            pass
+    return created
+
+
+def ingest_fuel_transactions(rows: List[Dict[str, Any]], allowed_pump_ids: Iterable[int],
+                             attendant_id: int,
+                             chunk_size: int = INGEST_CHUNK_SIZE) -> List[Dict[str, Any]]:
+    """
+    Validate and store a batch of sales as pending_verification transactions.
+    Commits once per chunk, so a failure part way keeps earlier chunks and a
+    retry of the whole batch reports them as duplicates.
+    Returns one outcome per input row, in input order.
+    """
+    now = datetime.utcnow()
+    frame = validate_batch(rows, allowed_pump_ids, now)
+
+    outcomes: Dict[int, Dict[str, Any]] = {}
+    for r in frame.filter(pl.col("reason").is_not_null()).select("row", "idempotency_key", "reason").iter_rows(named=True):
+        outcomes[r["row"]] = {"row": r["row"], "idempotency_key": r["idempotency_key"] or None,
+                              "status": "rejected", "reason": r["reason"]}
+
+    # Only valid rows compete for a key, so a rejected first copy does not
+    # shadow a valid repeat later in the same batch
+    valid = frame.filter(pl.col("reason").is_null()).with_columns(
+        (~pl.struct("pump_id", "idempotency_key").is_first_distinct()).alias("batch_duplicate")
+    )
+    firsts = valid.filter(~pl.col("batch_duplicate"))
+    ids: Dict[Tuple[int, str], int] = {}
+    for offset in range(0, firsts.height, chunk_size):
+        chunk = list(firsts.slice(offset, chunk_size).iter_rows(named=True))
+        pairs = [(r["pump_id"], r["idempotency_key"]) for r in chunk]
+        existing = _existing_ids(pairs)
+        values = [
+            {
+                "pump_id": r["pump_id"],
+                "idempotency_key": r["idempotency_key"],
+                "vehicle_number": r["vehicle_number"],
+                "fuel_type": r["fuel_type"],
+                "quantity_litres": r["quantity_litres"],
+                "unit_price": r["unit_price"],
+                "amount": r["amount"],
+                "status": "pending_verification",
+                "verification_level": "manual",
+                "attendant_id": attendant_id,
+                "extra_data": _extra_data(rows[r["row"] - 1]),
+                "created_at": r["sold_at"] or now,
+                "updated_at": now,
+            }
+            for r in chunk if (r["pump_id"], r["idempotency_key"]) not in existing
+        ]
+        created = _insert_chunk(values) if values else {}
+        # Keys another request inserted between our lookup and our insert
+        raced = [(v["pump_id"], v["idempotency_key"]) for v in values
+                 if (v["pump_id"], v["idempotency_key"]) not in created]
+        existing.update(_existing_ids(raced))
+        db.session.commit()
+
+        for r in chunk:
+            pair = (r["pump_id"], r["idempotency_key"])
+            if pair in created:
+                outcomes[r["row"]] = {"row": r["row"], "idempotency_key": r["idempotency_key"],
+                                      "status": "created", "transaction_id": created[pair]}
+            else:
+                outcomes[r["row"]] = {"row": r["row"], "idempotency_key": r["idempotency_key"],
+                                      "status": "duplicate", "transaction_id": existing.get(pair)}
+        ids.update(created)
+        ids.update(existing)
+
+    for r in valid.filter(pl.col("batch_duplicate")).select("row", "pump_id", "idempotency_key").iter_rows(named=True):
+        outcomes[r["row"]] = {"row": r["row"], "idempotency_key": r["idempotency_key"], "status": "duplicate",
+                              "transaction_id": ids.get((r["pump_id"], r["idempotency_key"]))}
+
+    result = [outcomes[n] for n in sorted(outcomes)]
+    created_count = sum(1 for o in result if o["status"] == "created")
+    current_app.logger.info(
+        f"Bulk ingest by {attendant_id}: {len(result)} rows, {created_count} created, "
+        f"{sum(1 for o in result if o['status'] == 'duplicate')} duplicate, "
+        f"{sum(1 for o in result if o['status'] == 'rejected')} rejected"
+    )
+    return result
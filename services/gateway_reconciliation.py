@@ -0,0 +1,279 @@
+"""
+Offline reconciliation of Razorpay settlement reports.
+The report (CSV or XLSX) is streamed row by row, never loaded whole. Rows
+are joined in chunks against WalletTopup and SubscriptionPayment: one query
+per chunk builds a dict on payment id (and on order id, for top-ups whose
+client never confirmed), and every disagreement is written to a mismatch
+sink as it is found.
+"""
+import csv
+import io
+import re
+from datetime import datetime
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional, Set
+
+from extensions import db
+from models import SubscriptionPayment, WalletTopup
+
+RECONCILE_CHUNK_SIZE = 5000
+AMOUNT_TOLERANCE = 0.01
+
+MISMATCH_COLUMNS = [
+    "kind", "source", "local_id", "payment_id", "order_id", "gateway_amount",
+    "local_amount", "gateway_status", "local_status", "report_row",
+]
+
+# Report headers differ between the dashboard download and the recon API
+# export; match on these normalised aliases, first hit wins
+_REPORT_COLUMNS = {
+    "payment_id": ("paymentid",),
+    "entity_id": ("entityid", "id"),
+    "order_id": ("orderid",),
+    "type": ("type", "entitytype"),
+    "status": ("status", "paymentstatus"),
+    "amount": ("amount", "credit", "grossamount"),
+}
+_CAPTURED_STATUSES = {"captured", "settled", "processed", "paid"}
+# Refund lines that did not move money back to the customer
+_UNSETTLED_REFUND_STATUSES = {"failed", "cancelled", "rejected"}
+# Local status -> payment-line statuses consistent with it; a refunded
+# payment still shows as captured on its original payment line
+_PAYMENT_STATUSES_FOR_LOCAL = {
+    "paid": {"captured"},
+    "captured": {"captured"},
+    "refunded": {"captured", "refunded"},
+}
+
+
+class ReportFormatError(ValueError):
+    """Raised when a settlement report cannot be read"""
+
+
+def _header_map(headers: Iterable[Any]) -> Dict[str, int]:
+    normalised = {re.sub(r"[^a-z]", "", str(h or "").lower()): n for n, h in enumerate(headers)}
+    columns = {
+        field: next((normalised[a] for a in aliases if a in normalised), None)
+        for field, aliases in _REPORT_COLUMNS.items()
+    }
+    if (columns["payment_id"] is None and columns["entity_id"] is None) or columns["amount"] is None:
+        raise ReportFormatError("Report needs a payment/entity id and an amount column")
+    return columns
+
+
+def _cell(values: List[Any], index: Optional[int]) -> str:
+    value = values[index] if index is not None and index < len(values) else None
+    return "" if value is None else str(value).strip()
+
+
+def _report_rows(rows: Iterator[List[Any]], amount_in_paise: bool) -> Iterator[Dict[str, Any]]:
+    """Normalise raw report rows to {row, payment_id, order_id, type, status, amount}"""
+    try:
+        columns = _header_map(next(rows))
+    except StopIteration:
+        return
+    for number, values in enumerate(rows, start=2):
+        cells = {field: _cell(values, index) for field, index in columns.items()}
+        # Refund lines name the refund in entity_id and the payment in payment_id
+        payment_id = cells["payment_id"] or cells["entity_id"]
+        if not payment_id:
+            continue
+        entry_type = cells["type"].lower() or "payment"
+        # Adjustments and transfers have no local counterpart
+        if entry_type not in ("payment", "refund"):
+            continue
+        try:
+            amount = float(cells["amount"].replace(",", ""))
+        except ValueError:
+            amount = None
+        if amount is not None and amount_in_paise:
+            amount /= 100.0
+        status = cells["status"].lower()
+        if entry_type == "refund":
+            # "processed" on a refund line means the money went back
+            if status in _UNSETTLED_REFUND_STATUSES:
+                continue
+            status = "refunded"
+        elif not status or status in _CAPTURED_STATUSES:
+            status = "captured"
+        yield {
+            "row": number,
+            "payment_id": payment_id,
+            "order_id": cells["order_id"] or None,
+            "type": entry_type,
+            "status": status,
+            "amount": amount,
+        }
+
+
+def read_settlement_report(stream: IO[bytes], filename: str,
+                           amount_in_paise: bool = False) -> Iterator[Dict[str, Any]]:
+    """
+    Stream a CSV or XLSX settlement report. XLSX is read with openpyxl in
+    read-only mode, which keeps one row in memory at a time.
+    """
+    name = (filename or "").lower()
+    if name.endswith(".xlsx"):
+        from openpyxl import load_workbook
+
+        try:
+            workbook = load_workbook(stream, read_only=True, data_only=True)
+        except Exception as e:
+            raise ReportFormatError(f"Could not open workbook: {e}")
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        try:
+            yield from _report_rows(iter(rows), amount_in_paise)
+        finally:
+            workbook.close()
+    elif name.endswith(".csv"):
+        text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+        try:
+            yield from _report_rows(iter(csv.reader(text)), amount_in_paise)
+        except UnicodeDecodeError:
+            raise ReportFormatError("CSV report must be UTF-8")
+        finally:
+            text.detach()
+    else:
+        raise ReportFormatError("Report must be a .csv or .xlsx file")
+
+
+class MismatchPreview:
+    """Mismatch sink that keeps only the first `limit` rows (for HTTP responses)"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.rows: List[Dict[str, Any]] = []
+        self.truncated = False
+
+    def writerow(self, row: Dict[str, Any]) -> None:
+        if len(self.rows) < self.limit:
+            self.rows.append(row)
+        else:
+            self.truncated = True
+
+
+def _chunks(rows: Iterable[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _local_payments(payment_ids: Set[str], order_ids: Set[str]) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    Local payments for one chunk as {"payment": {payment_id: row},
+    "order": {order_id: row}}; each row a plain dict tagged with its source.
+    """
+    by_payment: Dict[str, Dict[str, Any]] = {}
+    by_order: Dict[str, Dict[str, Any]] = {}
+    topup_columns = (WalletTopup.id, WalletTopup.amount, WalletTopup.status,
+                     WalletTopup.razorpay_payment_id, WalletTopup.razorpay_order_id, WalletTopup.paid_at)
+    sub_columns = (SubscriptionPayment.id, SubscriptionPayment.amount, SubscriptionPayment.status,
+                   SubscriptionPayment.razorpay_payment_id, SubscriptionPayment.razorpay_order_id,
+                   SubscriptionPayment.created_at)
+    for source, columns in (("wallet_topup", topup_columns), ("subscription_payment", sub_columns)):
+        for local_id, amount, status, payment_id, order_id, paid_at in (
+            db.session.query(*columns).filter(columns[3].in_(payment_ids))
+        ):
+            by_payment[payment_id] = {"source": source, "id": local_id, "amount": amount,
+                                      "status": status, "order_id": order_id, "paid_at": paid_at}
+    # Top-ups paid at the gateway but never confirmed back have only the order id
+    if order_ids:
+        for local_id, amount, status, payment_id, order_id, paid_at in (
+            db.session.query(*topup_columns)
+            .filter(WalletTopup.razorpay_order_id.in_(order_ids), WalletTopup.razorpay_payment_id.is_(None))
+        ):
+            by_order[order_id] = {"source": "wallet_topup", "id": local_id, "amount": amount,
+                                  "status": status, "order_id": order_id, "paid_at": paid_at}
+    return {"payment": by_payment, "order": by_order}
+
+
+def reconcile_settlement_report(rows: Iterable[Dict[str, Any]], sink,
+                                since: Optional[datetime] = None, until: Optional[datetime] = None,
+                                chunk_size: int = RECONCILE_CHUNK_SIZE) -> Dict[str, Any]:
+    """
+    Compare report rows (from read_settlement_report) with local payments,
+    writing one MISMATCH_COLUMNS dict per problem to `sink.writerow`:
+    missing_locally, amount_differs or status_differs. A refund line
+    against a payment still paid locally is a status_differs. With
+    `since`/`until`, paid top-ups and subscription payments in that window
+    that the report never mentioned are written as missing_in_report; only
+    ids inside the window are remembered, so memory is bounded by the
+    window, not the report. Returns the counts.
+    """
+    summary = {"report_rows": 0, "matched": 0, "missing_locally": 0, "amount_differs": 0,
+               "status_differs": 0, "missing_in_report": 0}
+    track_seen = since is not None and until is not None
+    seen = {"wallet_topup": set(), "subscription_payment": set()}
+
+    def mismatch(kind, row, local=None):
+        summary[kind] += 1
+        sink.writerow({
+            "kind": kind,
+            "source": local["source"] if local else "",
+            "local_id": local["id"] if local else "",
+            "payment_id": row["payment_id"] if row else local.get("payment_id", ""),
+            "order_id": (row["order_id"] if row else None) or (local or {}).get("order_id") or "",
+            "gateway_amount": row["amount"] if row else "",
+            "local_amount": local["amount"] if local else "",
+            "gateway_status": row["status"] if row else "",
+            "local_status": local["status"] if local else "",
+            "report_row": row["row"] if row else "",
+        })
+
+    for chunk in _chunks(rows, chunk_size):
+        summary["report_rows"] += len(chunk)
+        local = _local_payments({r["payment_id"] for r in chunk},
+                                {r["order_id"] for r in chunk if r["order_id"]})
+        for row in chunk:
+            match = local["payment"].get(row["payment_id"]) or local["order"].get(row["order_id"])
+            if match is None:
+                if row["type"] == "payment":
+                    mismatch("missing_locally", row)
+                continue
+            if track_seen and match["paid_at"] is not None and since <= match["paid_at"] < until:
+                seen[match["source"]].add(match["id"])
+            if row["type"] == "refund":
+                consistent = match["status"] == "refunded"
+            else:
+                consistent = row["status"] in _PAYMENT_STATUSES_FOR_LOCAL.get(match["status"], {match["status"]})
+            if row["type"] == "payment" and (
+                row["amount"] is None or abs(row["amount"] - match["amount"]) > AMOUNT_TOLERANCE
+            ):
+                mismatch("amount_differs", row, match)
+            elif not consistent:
+                mismatch("status_differs", row, match)
+            else:
+                summary["matched"] += 1
+
+    if track_seen:
+        windows = (
+            ("wallet_topup", WalletTopup, WalletTopup.paid_at, WalletTopup.status == "paid"),
+            ("subscription_payment", SubscriptionPayment, SubscriptionPayment.created_at,
+             SubscriptionPayment.status == "captured"),
+        )
+        for source, model, timestamp, paid in windows:
+            query = (
+                db.session.query(model.id, model.amount, model.status,
+                                 model.razorpay_payment_id, model.razorpay_order_id)
+                .filter(paid, timestamp >= since, timestamp < until)
+                .order_by(model.id)
+                .yield_per(chunk_size)
+            )
+            for local_id, amount, status, payment_id, order_id in query:
+                if local_id not in seen[source]:
+                    mismatch("missing_in_report", None, {
+                        "source": source, "id": local_id, "amount": amount, "status": status,
+                        "payment_id": payment_id or "", "order_id": order_id,
+                    })
+    return summary
+
+
+def write_mismatch_csv(out: IO[str]) -> csv.DictWriter:
+    """A mismatch sink writing MISMATCH_COLUMNS rows to `out`, header included"""
+    writer = csv.DictWriter(out, fieldnames=MISMATCH_COLUMNS)
+    writer.writeheader()
+    return writer
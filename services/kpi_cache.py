@@ -0,0 +1,237 @@
+"""
+Platform KPIs for the investor and admin dashboards.
+Metrics are grouped by what changes them; each group is computed with one
+query and cached in-process for KPI_CACHE_TTL_SECONDS. A session listener
+notes which groups a flush touched (settlements, subscriptions,
+registrations, ...) and drops them once the transaction commits, so this
+process never serves a number older than its own last write. Other worker
+processes catch up within the TTL.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Hashable, Iterable
+
+from sqlalchemy import case, event, func, select
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import (
+    FuelTransaction, PaymentVerification, Pump, PumpDailySales, PumpOwner,
+    PumpRegistrationRequest, PumpSettlement, PumpSubscription, PumpWallet,
+    SubscriptionPayment, User, Vehicle, Wallet, WalletTopup, WalletTopupVerification,
+)
+
+KPI_CACHE_TTL_SECONDS = float(os.getenv("KPI_CACHE_TTL_SECONDS", "60"))
+ADMIN_QUEUE_PREVIEW = 5
+
+# Estimated monthly revenue per active subscription tier
+SUBSCRIPTION_PRICING = {
+    "silver": 999,
+    "gold": 1999,
+    "diamond": 4999,
+}
+
+# Which KPI groups a write to each model can change
+_MODEL_GROUPS = {
+    FuelTransaction: ("sales", "wallets"),
+    PumpDailySales: ("sales",),
+    PumpSettlement: ("settlements", "wallets"),
+    Wallet: ("wallets",),
+    PumpWallet: ("wallets",),
+    WalletTopup: ("wallets",),
+    WalletTopupVerification: ("admin_queues", "wallets"),
+    PaymentVerification: ("admin_queues",),
+    PumpSubscription: ("subscriptions",),
+    SubscriptionPayment: ("subscriptions",),
+    PumpRegistrationRequest: ("admin_queues", "platform"),
+    User: ("platform",),
+    PumpOwner: ("platform",),
+    Pump: ("platform",),
+    Vehicle: ("platform",),
+}
+
+_cache: Dict[Hashable, tuple] = {}
+_cache_lock = threading.Lock()
+
+
+def _scalar(stmt):
+    return stmt.scalar_subquery()
+
+
+def _platform() -> Dict[str, Any]:
+    users, owners, pumps, vehicles = db.session.query(
+        _scalar(select(func.count(User.id))),
+        _scalar(select(func.count(PumpOwner.id))),
+        _scalar(select(func.count(Pump.id))),
+        _scalar(select(func.count(Vehicle.id))),
+    ).one()
+    return {"total_cab_owners": users, "total_pump_owners": owners,
+            "total_pumps": pumps, "total_vehicles": vehicles}
+
+
+def _wallets() -> Dict[str, Any]:
+    driver, pump = db.session.query(
+        _scalar(select(func.coalesce(func.sum(Wallet.balance), 0.0))),
+        _scalar(select(func.coalesce(func.sum(PumpWallet.balance), 0.0))),
+    ).one()
+    return {"total_driver_wallet_balance": float(driver), "total_pump_wallet_balance": float(pump)}
+
+
+def _sales() -> Dict[str, Any]:
+    """Every sales window in one pass over the daily rollup"""
+    today = datetime.utcnow().date()
+    windows = {
+        "today": (today, today + timedelta(days=1)),
+        "monthly": (today - timedelta(days=30), today + timedelta(days=1)),
+        "quarterly": (today - timedelta(days=90), today + timedelta(days=1)),
+        # The 30 days before the monthly window, for month-over-month growth
+        "last_month": (today - timedelta(days=60), today - timedelta(days=30)),
+    }
+    columns = [
+        func.coalesce(func.sum(PumpDailySales.total_amount), 0.0),
+        _scalar(select(func.count(FuelTransaction.id))),
+    ]
+    for start, end in windows.values():
+        in_window = (PumpDailySales.sales_date >= start) & (PumpDailySales.sales_date < end)
+        columns.append(func.coalesce(func.sum(case((in_window, PumpDailySales.transaction_count), else_=0)), 0))
+        columns.append(func.coalesce(func.sum(case((in_window, PumpDailySales.total_amount), else_=0.0)), 0.0))
+    row = db.session.query(*columns).select_from(PumpDailySales).one()
+
+    result = {"total_revenue": float(row[0]), "total_transactions": int(row[1])}
+    for n, name in enumerate(windows):
+        result[f"{name}_transactions"] = int(row[2 + 2 * n])
+        result[f"{name}_revenue"] = float(row[3 + 2 * n])
+    return result
+
+
+def _subscriptions() -> Dict[str, Any]:
+    rows = db.session.query(
+        func.lower(PumpSubscription.subscription_type), func.count(PumpSubscription.id)
+    ).filter(PumpSubscription.subscription_status == "active").group_by(
+        func.lower(PumpSubscription.subscription_type)
+    ).all()
+    return {
+        "active_subscriptions": sum(count for _, count in rows),
+        "total_subscription_revenue": sum(SUBSCRIPTION_PRICING.get(tier, 0) * count for tier, count in rows),
+    }
+
+
+def _settlements() -> Dict[str, Any]:
+    pending, settled = db.session.query(
+        func.coalesce(func.sum(case((PumpSettlement.status == "pending", 1), else_=0)), 0),
+        func.coalesce(func.sum(case((PumpSettlement.status == "processed", PumpSettlement.amount), else_=0.0)), 0.0),
+    ).one()
+    return {"pending_settlements": int(pending), "total_settled_amount": float(settled)}
+
+
+def _admin_queues() -> Dict[str, Any]:
+    """Pending verification counts plus the newest few of each, as plain dicts"""
+    payments, topups, registrations = db.session.query(
+        _scalar(select(func.count(PaymentVerification.id)).where(PaymentVerification.status == "pending")),
+        _scalar(select(func.count(WalletTopupVerification.id)).where(WalletTopupVerification.status == "pending")),
+        _scalar(select(func.count(PumpRegistrationRequest.id)).where(PumpRegistrationRequest.status == "pending")),
+    ).one()
+    return {
+        "pending_payments_count": payments,
+        "pending_wallet_topups_count": topups,
+        "pending_registrations_count": registrations,
+        "pending_payments": [
+            {"id": p.id, "user_email": p.user_email, "plan_type": p.plan_type,
+             "duration": p.duration, "amount": p.amount}
+            for p in db.session.query(
+                PaymentVerification.id, PaymentVerification.user_email, PaymentVerification.plan_type,
+                PaymentVerification.duration, PaymentVerification.amount,
+            ).filter(PaymentVerification.status == "pending")
+            .order_by(PaymentVerification.created_at.desc()).limit(ADMIN_QUEUE_PREVIEW)
+        ] if payments else [],
+        "pending_wallet_topups": [
+            {"id": t.id, "user_email": t.user_email, "amount": t.amount}
+            for t in db.session.query(
+                WalletTopupVerification.id, WalletTopupVerification.user_email, WalletTopupVerification.amount,
+            ).filter(WalletTopupVerification.status == "pending")
+            .order_by(WalletTopupVerification.created_at.desc()).limit(ADMIN_QUEUE_PREVIEW)
+        ] if topups else [],
+        "pending_registrations": [
+            {"id": r.id, "owner_name": r.owner_name, "pump_name": r.pump_name,
+             "contact_number": r.contact_number}
+            for r in db.session.query(
+                PumpRegistrationRequest.id, PumpRegistrationRequest.owner_name,
+                PumpRegistrationRequest.contact_number, Pump.name.label("pump_name"),
+            ).join(Pump, Pump.id == PumpRegistrationRequest.pump_id)
+            .filter(PumpRegistrationRequest.status == "pending")
+            .order_by(PumpRegistrationRequest.created_at.desc()).limit(ADMIN_QUEUE_PREVIEW)
+        ] if registrations else [],
+    }
+
+
+KPI_GROUPS: Dict[str, Callable[[], Dict[str, Any]]] = {
+    "platform": _platform,
+    "wallets": _wallets,
+    "sales": _sales,
+    "subscriptions": _subscriptions,
+    "settlements": _settlements,
+    "admin_queues": _admin_queues,
+}
+
+
+def cached(group: str, key: Hashable, compute: Callable[[], Any]) -> Any:
+    """
+    Value of `compute()` cached under (group, key) for KPI_CACHE_TTL_SECONDS;
+    dropped early whenever `group` is invalidated. Results must be plain
+    data, never ORM objects.
+    """
+    now = time.time()
+    with _cache_lock:
+        hit = _cache.get((group, key))
+        if hit and hit[0] > now:
+            return hit[1]
+    value = compute()
+    with _cache_lock:
+        _cache[(group, key)] = (now + KPI_CACHE_TTL_SECONDS, value)
+    return value
+
+
+def get_kpis(*groups: str) -> Dict[str, Any]:
+    """Merged metrics of the given groups (all groups when none are given)"""
+    result: Dict[str, Any] = {}
+    for group in groups or KPI_GROUPS:
+        result.update(cached(group, "kpis", KPI_GROUPS[group]))
+    return result
+
+
+def invalidate(groups: Iterable[str]) -> None:
+    groups = set(groups)
+    if not groups:
+        return
+    with _cache_lock:
+        for cache_key in [k for k in _cache if k[0] in groups]:
+            _cache.pop(cache_key, None)
+
+
+def note_core_write(model) -> None:
+    """
+    Record a Core UPDATE/INSERT on `model` in the current transaction. The
+    flush listener only sees ORM objects, so statements that bypass the
+    unit of work call this to have their groups dropped on commit too.
+    """
+    db.session.info.setdefault("kpi_groups", set()).update(_MODEL_GROUPS.get(model, ()))
+
+
+@event.listens_for(Session, "after_flush")
+def _note_changed_groups(session, flush_context):
+    changed = session.info.setdefault("kpi_groups", set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        changed.update(_MODEL_GROUPS.get(type(obj), ()))
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed(session):
+    invalidate(session.info.pop("kpi_groups", ()))
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_rolled_back(session, previous_transaction):
+    if not session.in_transaction():
+        session.info.pop("kpi_groups", None)
@@ -0,0 +1,258 @@
+"""
+Ledger reconciliation service.
+Folds new WalletLedgerEntry rows into per-wallet balance checkpoints, flags
+wallets whose stored balance has drifted from the ledger, and answers
+"balance as of" audit queries from the nearest checkpoint.
+Balances that predate the ledger (manual credits that wrote no entries) are
+taken as given by an opening checkpoint per wallet, seeded when checkpoints
+were introduced and by seed_opening_checkpoints for wallets imported later.
+"""
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from flask import current_app
+from sqlalchemy import case, exists, func
+
+from extensions import db
+from models import Wallet, PumpWallet, EscrowAccount, WalletLedgerEntry, WalletBalanceCheckpoint
+
+# Differences below this are float noise, not drift
+DRIFT_TOLERANCE = 0.01
+RECONCILE_CHUNK_SIZE = 200
+# Minutes between background runs; 0 leaves scheduling to cron / the CLI
+RECONCILE_INTERVAL_MINUTES = float(os.getenv("LEDGER_RECONCILE_INTERVAL_MINUTES", "0"))
+
+WALLET_MODELS = {"driver_wallet": Wallet, "pump_wallet": PumpWallet, "escrow": EscrowAccount}
+
+_signed_amount = case(
+    (WalletLedgerEntry.direction == "credit", WalletLedgerEntry.amount),
+    else_=-WalletLedgerEntry.amount,
+)
+
+
+def latest_checkpoint(wallet_type: str, wallet_id: int,
+                      at: Optional[datetime] = None) -> Optional[WalletBalanceCheckpoint]:
+    """Most recent checkpoint for a wallet, optionally only those covering entries up to `at`"""
+    query = WalletBalanceCheckpoint.query.filter_by(wallet_type=wallet_type, wallet_id=wallet_id)
+    if at is not None:
+        query = query.filter(WalletBalanceCheckpoint.last_entry_at <= at)
+    return query.order_by(WalletBalanceCheckpoint.last_entry_id.desc(),
+                          WalletBalanceCheckpoint.id.desc()).first()
+
+
+def _ledger_delta(wallet_type: str, wallet_id: int, after_entry_id: int,
+                  until: Optional[datetime] = None):
+    """Signed sum, last id and last timestamp of a wallet's entries after `after_entry_id`"""
+    query = db.session.query(
+        func.coalesce(func.sum(_signed_amount), 0.0),
+        func.max(WalletLedgerEntry.id),
+        func.max(WalletLedgerEntry.created_at),
+    ).filter(
+        WalletLedgerEntry.wallet_type == wallet_type,
+        WalletLedgerEntry.wallet_id == wallet_id,
+        WalletLedgerEntry.id > after_entry_id,
+    )
+    if until is not None:
+        query = query.filter(WalletLedgerEntry.created_at <= until)
+    return query.one()
+
+
+def reconcile_wallet(wallet_type: str, wallet) -> Dict[str, Any]:
+    """
+    Compare one wallet's stored balance with its ledger, summing only the
+    entries after its last checkpoint, and record a new checkpoint when
+    anything changed. Caller holds the wallet row lock and commits.
+    """
+    checkpoint = latest_checkpoint(wallet_type, wallet.id)
+    base_balance = checkpoint.balance if checkpoint else 0.0
+    base_entry_id = checkpoint.last_entry_id if checkpoint else 0
+
+    delta, last_entry_id, last_entry_at = _ledger_delta(wallet_type, wallet.id, base_entry_id)
+    ledger_balance = round(base_balance + (delta or 0.0), 2)
+    stored_balance = round(wallet.balance or 0.0, 2)
+    drift = round(stored_balance - ledger_balance, 2)
+    if abs(drift) < DRIFT_TOLERANCE:
+        drift = 0.0
+
+    result = {
+        "wallet_type": wallet_type,
+        "wallet_id": wallet.id,
+        "ledger_balance": ledger_balance,
+        "stored_balance": stored_balance,
+        "drift": drift,
+    }
+
+    # Quiet wallet with unchanged drift: nothing worth a new checkpoint row
+    if checkpoint and last_entry_id is None and abs(drift - checkpoint.drift) < DRIFT_TOLERANCE:
+        return result
+
+    db.session.add(WalletBalanceCheckpoint(
+        wallet_type=wallet_type,
+        wallet_id=wallet.id,
+        last_entry_id=last_entry_id or base_entry_id,
+        last_entry_at=last_entry_at or (checkpoint.last_entry_at if checkpoint else None),
+        balance=ledger_balance,
+        stored_balance=stored_balance,
+        drift=drift,
+    ))
+    return result
+
+
+def seed_opening_checkpoints(wallet_types=("driver_wallet", "pump_wallet"),
+                             chunk_size: int = RECONCILE_CHUNK_SIZE) -> int:
+    """
+    Record an opening checkpoint for every wallet that has none: its stored
+    balance is taken as the ledger balance up to its latest entry, drift 0.
+    Wallet rows are share-locked as in reconcile_all, so no entry can land
+    between reading the balance and the entry id. Returns the number of
+    checkpoints written; commits per chunk.
+    """
+    seeded = 0
+    for wallet_type in wallet_types:
+        model = WALLET_MODELS[wallet_type]
+        has_checkpoint = exists().where(
+            WalletBalanceCheckpoint.wallet_type == wallet_type,
+            WalletBalanceCheckpoint.wallet_id == model.id,
+        )
+        last_id = 0
+        while True:
+            wallets = (
+                model.query.filter(model.id > last_id, ~has_checkpoint)
+                .order_by(model.id)
+                .limit(chunk_size)
+                .with_for_update(read=True)
+                .all()
+            )
+            if not wallets:
+                break
+            last_entries = {
+                wallet_id: (entry_id, entry_at)
+                for wallet_id, entry_id, entry_at in db.session.query(
+                    WalletLedgerEntry.wallet_id, func.max(WalletLedgerEntry.id), func.max(WalletLedgerEntry.created_at),
+                ).filter(
+                    WalletLedgerEntry.wallet_type == wallet_type,
+                    WalletLedgerEntry.wallet_id.in_([w.id for w in wallets]),
+                ).group_by(WalletLedgerEntry.wallet_id)
+            }
+            now = datetime.utcnow()
+            for wallet in wallets:
+                entry_id, entry_at = last_entries.get(wallet.id, (0, None))
+                balance = round(wallet.balance or 0.0, 2)
+                db.session.add(WalletBalanceCheckpoint(
+                    wallet_type=wallet_type,
+                    wallet_id=wallet.id,
+                    last_entry_id=entry_id,
+                    last_entry_at=entry_at or now,
+                    balance=balance,
+                    stored_balance=balance,
+                    drift=0.0,
+                ))
+            seeded += len(wallets)
+            db.session.commit()
+            last_id = wallets[-1].id
+    return seeded
+
+
+def reconcile_all(chunk_size: int = RECONCILE_CHUNK_SIZE) -> Dict[str, Any]:
+    """
+    Reconcile every driver wallet, pump wallet and escrow account,
+    `chunk_size` per commit.
+
+    Wallet rows are share-locked while they are checked. Every balance change
+    updates the wallet row before writing its ledger entries in the same
+    transaction, so once we hold the lock all of that wallet's entries are
+    committed and the new checkpoint cannot skip one.
+    """
+    summary = {"checked": 0, "drifted": []}
+    for wallet_type, model in WALLET_MODELS.items():
+        last_id = 0
+        while True:
+            wallets = (
+                model.query.filter(model.id > last_id)
+                .order_by(model.id)
+                .limit(chunk_size)
+                .with_for_update(read=True)
+                .all()
+            )
+            if not wallets:
+                break
+            for wallet in wallets:
+                result = reconcile_wallet(wallet_type, wallet)
+                summary["checked"] += 1
+                if result["drift"]:
+                    summary["drifted"].append(result)
+            db.session.commit()
+            last_id = wallets[-1].id
+
+    for result in summary["drifted"]:
+        current_app.logger.warning(
+            f"Ledger drift on {result['wallet_type']} {result['wallet_id']}: "
+            f"stored {result['stored_balance']} vs ledger {result['ledger_balance']} ({result['drift']:+})"
+        )
+    current_app.logger.info(
+        f"Ledger reconciliation checked {summary['checked']} wallets, {len(summary['drifted'])} drifted"
+    )
+    return summary
+
+
+def balance_as_of(wallet_type: str, wallet_id: int, at: datetime) -> Dict[str, Any]:
+    """
+    Ledger balance of a wallet at `at`: the nearest checkpoint at or before
+    `at` plus only the entries written between it and `at`.
+    """
+    if wallet_type not in WALLET_MODELS:
+        raise ValueError(f"Unknown wallet type {wallet_type}")
+    checkpoint = latest_checkpoint(wallet_type, wallet_id, at=at)
+    base_balance = checkpoint.balance if checkpoint else 0.0
+    base_entry_id = checkpoint.last_entry_id if checkpoint else 0
+    delta, last_entry_id, _ = _ledger_delta(wallet_type, wallet_id, base_entry_id, until=at)
+    return {
+        "wallet_type": wallet_type,
+        "wallet_id": wallet_id,
+        "as_of": at.isoformat(),
+        "balance": round(base_balance + (delta or 0.0), 2),
+        "checkpoint_id": checkpoint.id if checkpoint else None,
+        "last_entry_id": last_entry_id or base_entry_id,
+    }
+
+
+def drifted_wallets() -> list:
+    """Latest checkpoint of every wallet whose last reconciliation found drift"""
+    latest = (
+        db.session.query(func.max(WalletBalanceCheckpoint.id).label("id"))
+        .group_by(WalletBalanceCheckpoint.wallet_type, WalletBalanceCheckpoint.wallet_id)
+        .subquery()
+    )
+    return (
+        WalletBalanceCheckpoint.query
+        .join(latest, WalletBalanceCheckpoint.id == latest.c.id)
+        .filter(WalletBalanceCheckpoint.drift != 0)
+        .order_by(WalletBalanceCheckpoint.wallet_type, WalletBalanceCheckpoint.wallet_id)
+        .all()
+    )
+
+
+def reconciliation_scheduler(app):
+    """Run reconcile_all every RECONCILE_INTERVAL_MINUTES"""
+    while True:
+        with app.app_context():
+            try:
+                reconcile_all()
+            except Exception as e:
+                db.session.rollback()
+                app.logger.exception(f"Ledger reconciliation failed: {e}")
+            finally:
+                db.session.remove()
+        time.sleep(RECONCILE_INTERVAL_MINUTES * 60)
+
+
+def start_reconciliation_service(app):
+    """Start the background reconciliation thread if an interval is configured"""
+    if RECONCILE_INTERVAL_MINUTES <= 0:
+        return
+    thread = threading.Thread(target=reconciliation_scheduler, args=(app,), daemon=True)
+    thread.start()
+    print(f"✅ Ledger reconciliation service started (every {RECONCILE_INTERVAL_MINUTES:g} min)")
@@ -0,0 +1,78 @@
+"""
+Keyset pagination helpers.
+Lists are ordered newest first on (created_at, id). The cursor is the
+(created_at, id) of the last row returned, so every page is one index range
+scan however deep the client pages, instead of an ever-growing OFFSET.
+"""
+import base64
+import binascii
+import threading
+import time
+from datetime import datetime
+from typing import Hashable, Optional, Tuple
+
+from sqlalchemy import tuple_
+
+# Totals shown next to a page are allowed to lag by this much
+COUNT_CACHE_TTL_SECONDS = 60
+_COUNT_CACHE_MAX_KEYS = 5000
+
+_count_cache = {}
+_count_cache_lock = threading.Lock()
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a client sends a cursor we did not issue"""
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        created_raw, id_raw = base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+        return datetime.fromisoformat(created_raw), int(id_raw)
+    except (ValueError, UnicodeDecodeError, binascii.Error):
+        raise InvalidCursorError("Invalid cursor")
+
+
+def keyset_page(query, created_col, id_col, limit: int, cursor: Optional[str] = None):
+    """
+    Return (rows, next_cursor) for one page of `query`, newest first.
+    `next_cursor` is None on the last page. Needs an index ending in
+    (created_at, id) behind the query's equality filters.
+    """
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.filter(tuple_(created_col, id_col) < tuple_(created_at, row_id))
+    rows = query.order_by(created_col.desc(), id_col.desc()).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, created_col.key), getattr(last, id_col.key))
+
+
+def cached_count(key: Hashable, query) -> int:
+    """
+    Row count of `query`, cached per key for COUNT_CACHE_TTL_SECONDS.
+    Callers treat it as approximate; it is only used for "N results" UI.
+    """
+    now = time.time()
+    with _count_cache_lock:
+        hit = _count_cache.get(key)
+        if hit and hit[0] > now:
+            return hit[1]
+
+    total = query.order_by(None).count()
+
+    with _count_cache_lock:
+        if len(_count_cache) >= _COUNT_CACHE_MAX_KEYS:
+            expired = [k for k, (expires, _) in _count_cache.items() if expires <= now]
+            for k in expired or list(_count_cache)[:_COUNT_CACHE_MAX_KEYS // 10]:
+                _count_cache.pop(k, None)
+        _count_cache[key] = (now + COUNT_CACHE_TTL_SECONDS, total)
+    return total
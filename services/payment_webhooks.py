@@ -0,0 +1,274 @@
+"""
+Razorpay webhook ingestion.
+The webhook endpoint only verifies the signature and stores the raw event
+(deduplicated on the event id), so it answers fast and never waits on a
+wallet lock. A worker applies pending events in batches: captured payments
+mark their WalletTopup paid (wallet, escrow and ledger, as the checkout
+callback does) or activate their pump subscription. Both paths are keyed by
+payment / order id, so events, retries and the browser callback can arrive
+in any order and a payment is still applied once.
+"""
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm.exc import StaleDataError
+
+from config import Config
+from extensions import db
+from models import PaymentWebhookEvent, Pump, PumpOwner, WalletTopup
+from services.subscription_payments import record_subscription_payment, subscription_price
+from services.wallet_service import apply_topup_payment, run_with_balance_retry
+
+try:
+    import razorpay  # type: ignore
+except ImportError:  # pragma: no cover - handled at runtime
+    razorpay = None
+
+WEBHOOK_BATCH_SIZE = 100
+# Transient failures are retried this many times before the event is parked as failed
+WEBHOOK_MAX_ATTEMPTS = 5
+# Seconds between worker polls; 0 leaves processing to the CLI
+PAYMENT_WEBHOOK_POLL_SECONDS = float(os.getenv("PAYMENT_WEBHOOK_POLL_SECONDS", "0"))
+
+CAPTURE_EVENTS = {"payment.captured", "order.paid"}
+HANDLED_EVENTS = CAPTURE_EVENTS | {"payment.failed"}
+
+
+class WebhookEventError(ValueError):
+    """Raised for an event that can never be applied (bad payload, amount mismatch)"""
+
+
+def sign_payload(body: bytes, secret: str) -> str:
+    """Razorpay's signature: hex HMAC-SHA256 of the raw body"""
+    return hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+
+
+def verify_signature(body: bytes, signature: str, secret: str) -> bool:
+    return bool(signature) and hmac.compare_digest(sign_payload(body, secret), signature)
+
+
+def _payment_entity(event: Dict[str, Any]) -> Dict[str, Any]:
+    return ((event.get("payload") or {}).get("payment") or {}).get("entity") or {}
+
+
+def _order_entity(event: Dict[str, Any]) -> Dict[str, Any]:
+    return ((event.get("payload") or {}).get("order") or {}).get("entity") or {}
+
+
+def fetch_order_notes(order_id: str) -> Dict[str, str]:
+    """Notes of a Razorpay order, read back from the gateway"""
+    if razorpay is None or not (Config.RAZORPAY_KEY_ID and Config.RAZORPAY_KEY_SECRET):
+        # Not a WebhookEventError: the event is retried once the client is configured
+        raise RuntimeError("Razorpay client not configured; cannot look up order notes")
+    client = razorpay.Client(auth=(Config.RAZORPAY_KEY_ID, Config.RAZORPAY_KEY_SECRET))
+    return client.order.fetch(order_id).get("notes") or {}
+
+
+def enqueue_webhook_event(body: bytes, event_id: Optional[str] = None) -> Tuple[PaymentWebhookEvent, bool]:
+    """
+    Store a verified webhook body and commit. Returns (event, created);
+    a redelivered event id returns the stored row with created False.
+    """
+    try:
+        event = json.loads(body)
+        event_type = event["event"]
+    except (ValueError, KeyError, TypeError):
+        raise WebhookEventError("Webhook body is not a Razorpay event")
+    event_id = (event_id or hashlib.sha256(body).hexdigest())[:64]
+
+    row = PaymentWebhookEvent(
+        event_id=event_id,
+        event_type=str(event_type)[:64],
+        payment_id=_payment_entity(event).get("id"),
+        payload=body.decode("utf-8"),
+    )
+    try:
+        with db.session.begin_nested():
+            db.session.add(row)
+        created = True
+    except IntegrityError:
+        row = PaymentWebhookEvent.query.filter_by(event_id=event_id).one()
+        created = False
+    db.session.commit()
+    return row, created
+
+
+def _apply_capture(event: Dict[str, Any]) -> str:
+    payment = _payment_entity(event)
+    payment_id, order_id = payment.get("id"), payment.get("order_id")
+    if not payment_id:
+        raise WebhookEventError("Payment entity has no id")
+
+    topup = (
+        WalletTopup.query.filter_by(razorpay_order_id=order_id).with_for_update().first()
+        if order_id else None
+    )
+    if topup is not None:
+        if topup.status == "paid":
+            return "processed"
+        amount = (payment.get("amount") or 0) / 100.0
+        if abs(topup.amount - amount) > 0.01:
+            raise WebhookEventError(f"Amount mismatch for top-up {topup.id}: {amount} != {topup.amount}")
+        apply_topup_payment(topup, payment_id, order_id)
+        return "processed"
+
+    if not order_id:
+        return "ignored"
+    # Subscription orders carry the plan in the order's notes (see subscription.create_order):
+    # order.paid includes the order, payment.captured only the payment
+    order = _order_entity(event)
+    notes = order.get("notes") if order.get("id") == order_id else None
+    if notes is None:
+        notes = fetch_order_notes(order_id)
+    if not (notes.get("plan_type") and notes.get("pump_id") and notes.get("user_id")):
+        return "ignored"
+
+    plan_type, duration = notes["plan_type"], notes.get("duration") or "1 Month"
+    price = subscription_price(plan_type, duration)
+    amount = (payment.get("amount") or 0) / 100.0
+    if price <= 0 or abs(price - amount) > 0.01:
+        raise WebhookEventError(f"Amount mismatch for {plan_type} / {duration} subscription: {amount} != {price}")
+    owner = db.session.get(PumpOwner, int(notes["user_id"]))
+    pump = Pump.query.filter_by(id=int(notes["pump_id"]), owner_id=int(notes["user_id"])).first()
+    if owner is None or pump is None:
+        raise WebhookEventError("Subscription payment for an unknown pump or owner")
+    record_subscription_payment(owner, pump, plan_type, duration, payment_id, order_id)
+    return "processed"
+
+
+def _apply_event(event_row: PaymentWebhookEvent) -> str:
+    """Apply one stored event; returns its final status"""
+    if event_row.event_type not in HANDLED_EVENTS:
+        return "ignored"
+    event = json.loads(event_row.payload)
+    if event_row.event_type in CAPTURE_EVENTS:
+        return _apply_capture(event)
+    payment = _payment_entity(event)
+
+    # payment.failed: only a top-up nobody has paid yet can be closed
+    topup = (
+        WalletTopup.query.filter_by(razorpay_order_id=payment.get("order_id")).with_for_update().first()
+        if payment.get("order_id") else None
+    )
+    if topup is None:
+        return "ignored"
+    if topup.status == "created":
+        topup.status = "failed"
+    return "processed"
+
+
+def _process_batch(batch_size: int) -> Dict[str, int]:
+    events = (
+        PaymentWebhookEvent.query.filter_by(status="pending")
+        .order_by(PaymentWebhookEvent.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    summary = {"processed": 0, "ignored": 0, "failed": 0, "retrying": 0}
+    now = datetime.utcnow()
+    for event in events:
+        event.attempts = (event.attempts or 0) + 1
+        try:
+            with db.session.begin_nested():
+                status = _apply_event(event)
+        except (StaleDataError, OperationalError):
+            # Lock conflict: let run_with_balance_retry redo the whole batch
+            raise
+        except WebhookEventError as e:
+            status, event.last_error = "failed", str(e)
+        except Exception as e:
+            event.last_error = str(e)
+            status = "failed" if event.attempts >= WEBHOOK_MAX_ATTEMPTS else "pending"
+        else:
+            event.last_error = None
+        event.status = status
+        if status != "pending":
+            event.processed_at = now
+        summary["retrying" if status == "pending" else status] += 1
+    db.session.commit()
+    summary["events"] = len(events)
+    return summary
+
+
+def process_webhook_events(batch_size: int = WEBHOOK_BATCH_SIZE) -> Dict[str, int]:
+    """
+    Apply up to `batch_size` pending events in id order and commit once.
+    Each event runs in its own savepoint, so a bad one is recorded on its
+    row without undoing the rest. Workers on several processes share the
+    queue through SKIP LOCKED.
+    """
+    return run_with_balance_retry(lambda: _process_batch(batch_size))
+
+
+def webhook_worker(app):
+    """Drain the queue, then poll every PAYMENT_WEBHOOK_POLL_SECONDS"""
+    while True:
+        with app.app_context():
+            try:
+                while process_webhook_events()["events"] == WEBHOOK_BATCH_SIZE:
+                    pass
+            except Exception as e:
+                db.session.rollback()
+                app.logger.exception(f"Payment webhook worker failed: {e}")
+            finally:
+                db.session.remove()
+        time.sleep(PAYMENT_WEBHOOK_POLL_SECONDS)
+
+
+def start_webhook_worker(app):
+    """
+    Start the background webhook worker thread if a poll interval is
+    configured. Without RAZORPAY_WEBHOOK_SECRET the endpoint stores nothing,
+    so the worker is not started either.
+    """
+    if PAYMENT_WEBHOOK_POLL_SECONDS <= 0:
+        return
+    if not Config.RAZORPAY_WEBHOOK_SECRET:
+        print("⚠️ Payment webhook worker not started: RAZORPAY_WEBHOOK_SECRET is not set")
+        return
+    thread = threading.Thread(target=webhook_worker, args=(app,), daemon=True)
+    thread.start()
+    print(f"✅ Payment webhook worker started (every {PAYMENT_WEBHOOK_POLL_SECONDS:g} s)")
+
+
+def sample_event(event_type: str, payment_id: str, order_id: str, amount: float,
+                 notes: Optional[Dict[str, str]] = None) -> bytes:
+    """
+    A minimal Razorpay-shaped event body, for replaying against a local
+    server. `notes` are the order's; like Razorpay, only order.paid carries
+    the order entity.
+    """
+    payload: Dict[str, Any] = {"payment": {"entity": {
+        "id": payment_id,
+        "entity": "payment",
+        "amount": int(round(amount * 100)),
+        "currency": "INR",
+        "status": "failed" if event_type == "payment.failed" else "captured",
+        "order_id": order_id,
+        "notes": {},
+    }}}
+    if event_type == "order.paid":
+        payload["order"] = {"entity": {
+            "id": order_id,
+            "entity": "order",
+            "amount": int(round(amount * 100)),
+            "amount_paid": int(round(amount * 100)),
+            "currency": "INR",
+            "status": "paid",
+            "notes": notes or {},
+        }}
+    return json.dumps({
+        "entity": "event",
+        "event": event_type,
+        "contains": list(payload),
+        "payload": payload,
+        "created_at": int(time.time()),
+    }).encode("utf-8")
@@ -0,0 +1,237 @@
+"""
+Bulk payouts of pump settlements over NEFT/RTGS.
+A payout batch takes pending PumpSettlement rows, debits each pump wallet
+(with its ledger entry) under row locks, and renders one bank bulk-transfer
+CSV for the lot. The bank's response file is ingested later and marks every
+item processed, or failed with the amount credited back to the wallet.
+"""
+import csv
+import io
+import os
+import re
+import secrets
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from flask import current_app
+
+from extensions import db
+from models import PayoutBatch, PumpOwner, PumpSettlement, PumpWallet
+from services.wallet_service import InsufficientBalanceError, credit_wallet, debit_wallet
+
+PAYOUT_BATCH_MAX_ITEMS = 1000
+# RBI: RTGS is for transfers of 2 lakh and above, NEFT below that
+RTGS_MIN_AMOUNT = 200000.0
+PAYOUT_DEBIT_ACCOUNT = os.getenv("PAYOUT_DEBIT_ACCOUNT", "")
+
+PAYOUT_CSV_COLUMNS = [
+    "Payment Mode", "Amount", "Debit Account Number", "Beneficiary Name",
+    "Beneficiary Account Number", "IFSC", "Customer Reference", "Narration", "Value Date",
+]
+
+# Bank response headers vary by bank; match on these normalised aliases
+_RESPONSE_COLUMNS = {
+    "reference": ("customerreference", "custref", "clientreference", "reference", "referenceno"),
+    "status": ("status", "transactionstatus", "paymentstatus"),
+    "utr": ("utr", "utrno", "utrnumber", "bankreference"),
+    "reason": ("reason", "failurereason", "remarks", "errordescription"),
+}
+_SUCCESS_STATUSES = {"success", "successful", "processed", "paid", "completed", "settled"}
+_FAILED_STATUSES = {"failed", "failure", "rejected", "returned", "cancelled", "reversed"}
+_BANK_TEXT_RE = re.compile(r"[^A-Za-z0-9 .&-]")
+
+
+class PayoutConfigError(RuntimeError):
+    """Raised when payouts are not configured (no debit account to pay from)"""
+
+
+class PayoutResponseError(ValueError):
+    """Raised when a bank response file cannot be matched or parsed"""
+
+
+def _bank_text(value: str, length: int) -> str:
+    """Bank upload fields allow a narrow character set and fixed widths"""
+    return _BANK_TEXT_RE.sub("", value or "").strip()[:length]
+
+
+def item_reference(batch: PayoutBatch, settlement_id: int) -> str:
+    return f"{batch.batch_ref}-{settlement_id}"
+
+
+def render_payout_csv(batch: PayoutBatch, items: List[Tuple[PumpSettlement, PumpOwner]]) -> str:
+    """The NEFT/RTGS bulk-transfer file for a batch"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(PAYOUT_CSV_COLUMNS)
+    value_date = datetime.utcnow().strftime("%d/%m/%Y")
+    for settlement, owner in items:
+        writer.writerow([
+            "RTGS" if settlement.amount >= RTGS_MIN_AMOUNT else "NEFT",
+            f"{settlement.amount:.2f}",
+            PAYOUT_DEBIT_ACCOUNT,
+            _bank_text(owner.bank_account_name or owner.full_name, 35),
+            owner.bank_account_number,
+            (owner.bank_ifsc or "").upper(),
+            item_reference(batch, settlement.id),
+            _bank_text(f"Fuel settlement {settlement.id}", 30),
+            value_date,
+        ])
+    return buffer.getvalue()
+
+
+def create_payout_batch(created_by: Optional[str] = None,
+                        limit: int = PAYOUT_BATCH_MAX_ITEMS) -> Tuple[Optional[PayoutBatch], List[Dict[str, Any]]]:
+    """
+    Move up to `limit` pending settlements into a new payout batch and
+    commit. Pump wallets are locked in id order and debited with a
+    'settlement' ledger entry per item. Settlements whose owner has no bank
+    details or whose wallet no longer covers them stay pending and are
+    returned as skipped. Returns (batch or None, skipped). Raises
+    PayoutConfigError, before touching anything, when PAYOUT_DEBIT_ACCOUNT
+    is not set: the bank file would have no account to debit.
+    """
+    if not PAYOUT_DEBIT_ACCOUNT.strip():
+        raise PayoutConfigError("PAYOUT_DEBIT_ACCOUNT is not set; refusing to create a payout batch")
+    settlements = (
+        PumpSettlement.query.filter_by(status="pending")
+        .order_by(PumpSettlement.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    if not settlements:
+        return None, []
+
+    owners = {
+        o.id: o for o in PumpOwner.query.filter(PumpOwner.id.in_({s.pump_owner_id for s in settlements}))
+    }
+    skipped, payable = [], []
+    for s in settlements:
+        owner = owners.get(s.pump_owner_id)
+        if not owner or not owner.bank_account_number or not owner.bank_ifsc:
+            skipped.append({"settlement_id": s.id, "reason": "Beneficiary bank details missing"})
+        else:
+            payable.append(s)
+
+    # Same lock order as every other balance change: wallets by id
+    PumpWallet.query.filter(PumpWallet.id.in_(sorted({s.pump_wallet_id for s in payable})))\
+        .order_by(PumpWallet.id).with_for_update().all()
+
+    batch = PayoutBatch(
+        batch_ref=f"PB{datetime.utcnow():%Y%m%d%H%M%S}{secrets.token_hex(2).upper()}",
+        file_content="",
+        created_by=created_by,
+    )
+    db.session.add(batch)
+    db.session.flush()
+
+    items = []
+    for s in payable:
+        try:
+            debit_wallet(PumpWallet, s.pump_wallet_id, s.amount, event_type="settlement",
+                         reference_id=s.id, reference_type="settlement")
+        except InsufficientBalanceError as e:
+            skipped.append({"settlement_id": s.id, "reason": str(e)})
+            continue
+        s.status = "in_payout"
+        s.payout_batch_id = batch.id
+        items.append((s, owners[s.pump_owner_id]))
+
+    if not items:
+        db.session.rollback()
+        return None, skipped
+
+    batch.item_count = len(items)
+    batch.total_amount = round(sum(s.amount for s, _ in items), 2)
+    batch.file_content = render_payout_csv(batch, items)
+    db.session.commit()
+    current_app.logger.info(
+        f"Payout batch {batch.batch_ref}: {batch.item_count} items, {batch.total_amount} INR, "
+        f"{len(skipped)} skipped"
+    )
+    return batch, skipped
+
+
+def parse_bank_response(raw: bytes) -> List[Dict[str, str]]:
+    """Rows of a bank response CSV as {reference, status, utr, reason}"""
+    try:
+        text = raw.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise PayoutResponseError("Response file must be UTF-8 CSV")
+    reader = csv.DictReader(io.StringIO(text))
+    headers = {re.sub(r"[^a-z]", "", (h or "").lower()): h for h in reader.fieldnames or []}
+    columns = {
+        field: next((headers[a] for a in aliases if a in headers), None)
+        for field, aliases in _RESPONSE_COLUMNS.items()
+    }
+    if not columns["reference"] or not columns["status"]:
+        raise PayoutResponseError("Response file needs a customer reference and a status column")
+    return [
+        {field: (row.get(column) or "").strip() if column else "" for field, column in columns.items()}
+        for row in reader
+    ]
+
+
+def ingest_bank_response(batch_ref: str, raw: bytes) -> Dict[str, Any]:
+    """
+    Apply a bank response file to its batch and commit. Successful items
+    become processed with their UTR; failed ones become failed and the
+    amount is credited back to the pump wallet. Re-ingesting a file, or
+    several partial files, is safe: items already final are left alone.
+    """
+    rows = parse_bank_response(raw)
+    batch = PayoutBatch.query.filter_by(batch_ref=batch_ref).with_for_update().first()
+    if batch is None:
+        raise PayoutResponseError(f"Unknown payout batch {batch_ref}")
+
+    settlements = {
+        s.id: s for s in PumpSettlement.query.filter_by(payout_batch_id=batch.id)
+        .order_by(PumpSettlement.id).with_for_update().all()
+    }
+    summary = {"processed": 0, "failed": 0, "still_pending": 0, "already_final": 0, "unknown_references": []}
+    now = datetime.utcnow()
+    prefix = f"{batch.batch_ref}-"
+    failed = []
+    for row in rows:
+        reference = row["reference"]
+        settlement_id = reference[len(prefix):] if reference.startswith(prefix) else ""
+        settlement = settlements.get(int(settlement_id)) if settlement_id.isdigit() else None
+        if settlement is None:
+            summary["unknown_references"].append(reference)
+            continue
+        if settlement.status != "in_payout":
+            summary["already_final"] += 1
+            continue
+
+        status = row["status"].lower()
+        if status in _SUCCESS_STATUSES:
+            settlement.status = "processed"
+            settlement.utr = row["utr"][:50] or None
+            settlement.processed_at = now
+            summary["processed"] += 1
+        elif status in _FAILED_STATUSES:
+            settlement.status = "failed"
+            settlement.failure_reason = (row["reason"] or row["status"])[:255]
+            settlement.processed_at = now
+            failed.append(settlement)
+            summary["failed"] += 1
+        else:
+            summary["still_pending"] += 1
+
+    # Refunds in wallet id order, matching the lock order used for debits
+    for settlement in sorted(failed, key=lambda s: (s.pump_wallet_id, s.id)):
+        credit_wallet(PumpWallet, settlement.pump_wallet_id, settlement.amount,
+                      event_type="settlement_reversal", reference_id=settlement.id,
+                      reference_type="settlement")
+
+    batch.processed_count = sum(1 for s in settlements.values() if s.status == "processed")
+    batch.failed_count = sum(1 for s in settlements.values() if s.status == "failed")
+    if all(s.status != "in_payout" for s in settlements.values()):
+        batch.status = "completed"
+    batch.response_ingested_at = now
+    db.session.commit()
+    current_app.logger.info(
+        f"Payout batch {batch.batch_ref} response: {summary['processed']} processed, "
+        f"{summary['failed']} failed, {summary['still_pending']} still pending"
+    )
+    return {"batch_ref": batch.batch_ref, "batch_status": batch.status, **summary}
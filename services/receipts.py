@@ -0,0 +1,227 @@
+"""
+Fuel transaction receipts.
+A settled transaction never changes, so its receipt is rendered once, in the
+settlement's own DB transaction, and stored as compact JSON with a sha256
+ETag (and, when enabled, a pre-rendered PDF). Reads serve the stored bytes;
+only transactions that are not settled yet are built on the fly.
+"""
+import hashlib
+import io
+import json
+import os
+import textwrap
+from typing import Any, Dict, Iterable, List, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from models import FuelTransaction, FuelTransactionReceipt, Pump, PumpOwner, User, WalletLedgerEntry
+from services.vehicle_lookup import resolve_plates
+
+# Rendering a PDF per sale costs a few ms inside settlement; off by default,
+# in which case the PDF is rendered and stored on first download instead.
+RECEIPT_PDF_AT_SETTLEMENT = os.getenv("RECEIPT_PDF_AT_SETTLEMENT", "false").lower() == "true"
+
+
+def build_receipts(transactions: Iterable[FuelTransaction]) -> Dict[int, Dict[str, Any]]:
+    """
+    Receipt dicts for many transactions, loading pumps, staff names, drivers
+    and ledger entries with one query each.
+    """
+    transactions = list(transactions)
+    if not transactions:
+        return {}
+
+    pumps = {p.id: p for p in Pump.query.filter(Pump.id.in_({t.pump_id for t in transactions}))}
+    staff_ids = {t.attendant_id for t in transactions} | {t.verifier_id for t in transactions}
+    staff_ids.discard(None)
+    staff = dict(
+        db.session.query(PumpOwner.id, PumpOwner.full_name).filter(PumpOwner.id.in_(staff_ids))
+    ) if staff_ids else {}
+    plates = resolve_plates({t.vehicle_number for t in transactions})
+    driver_ids = {user_id for user_id, _ in plates.values()}
+    drivers = {
+        u.id: u for u in db.session.query(User.id, User.full_name, User.email).filter(User.id.in_(driver_ids))
+    } if driver_ids else {}
+
+    entries: Dict[int, List[Dict[str, Any]]] = {t.id: [] for t in transactions}
+    for entry in WalletLedgerEntry.query.filter(
+        WalletLedgerEntry.reference_type == "fuel_transaction",
+        WalletLedgerEntry.reference_id.in_(list(entries)),
+    ).order_by(WalletLedgerEntry.created_at, WalletLedgerEntry.id):
+        entries[entry.reference_id].append({
+            "direction": entry.direction,
+            "wallet_type": entry.wallet_type,
+            "amount": entry.amount,
+            "balance_after": entry.balance_after,
+            "created_at": entry.created_at.isoformat()
+        })
+
+    receipts = {}
+    for t in transactions:
+        pump = pumps.get(t.pump_id)
+        driver = drivers.get(plates[t.vehicle_number][0]) if t.vehicle_number in plates else None
+        settlement = (t.extra_data or {}).get("settlement") or {}
+        receipts[t.id] = {
+            "transaction_id": t.id,
+            "group_uuid": settlement.get("group_uuid"),
+            "vehicle_number": t.vehicle_number,
+            "fuel_type": t.fuel_type,
+            "quantity_litres": t.quantity_litres,
+            "unit_price": t.unit_price,
+            "amount": t.amount,
+            "currency": "INR",
+            "pump": {
+                "id": pump.id,
+                "name": pump.name,
+                "location": pump.location
+            } if pump else None,
+            "status": t.status,
+            "created_at": t.created_at.isoformat(),
+            "verified_at": t.verified_at.isoformat() if t.verified_at else None,
+            "settled_at": t.settled_at.isoformat() if t.settled_at else None,
+            "verification_level": t.verification_level,
+            "attendant": staff.get(t.attendant_id),
+            "verifier": staff.get(t.verifier_id),
+            "driver": {
+                "id": driver.id,
+                "name": driver.full_name,
+                "email": driver.email
+            } if driver else None,
+            "ledger_entries": entries[t.id]
+        }
+    return receipts
+
+
+def encode_receipt(receipt: Dict[str, Any]) -> str:
+    return json.dumps(receipt, separators=(",", ":"), sort_keys=True, ensure_ascii=False)
+
+
+def receipt_etag(receipt_json: str) -> str:
+    return hashlib.sha256(receipt_json.encode("utf-8")).hexdigest()
+
+
+def render_receipt_pdf(receipt: Dict[str, Any]) -> bytes:
+    """One-page PDF of a receipt (Pillow, which we already ship)"""
+    from PIL import Image, ImageDraw
+
+    pump = receipt.get("pump") or {}
+    driver = receipt.get("driver") or {}
+    lines = [
+        "FUEL RECEIPT",
+        "",
+        f"Transaction #{receipt['transaction_id']}",
+        f"Reference: {receipt.get('group_uuid') or '-'}",
+        f"Pump: {pump.get('name', '-')}",
+        *textwrap.wrap(f"Location: {pump.get('location') or '-'}", 60),
+        f"Vehicle: {receipt['vehicle_number']}",
+        f"Driver: {driver.get('name') or '-'}",
+        "",
+        f"Fuel: {receipt['fuel_type']}",
+        f"Quantity: {receipt['quantity_litres']:.2f} L @ {receipt['unit_price']:.2f}",
+        f"Amount: {receipt['currency']} {receipt['amount']:.2f}",
+        "",
+        f"Sold at: {receipt['created_at']}",
+        f"Verified at: {receipt.get('verified_at') or '-'} ({receipt['verification_level']})",
+        f"Settled at: {receipt.get('settled_at') or '-'}",
+        f"Attendant: {receipt.get('attendant') or '-'}",
+        f"Verifier: {receipt.get('verifier') or '-'}",
+    ]
+    image = Image.new("RGB", (620, 40 + 22 * len(lines)), "white")
+    draw = ImageDraw.Draw(image)
+    for n, line in enumerate(lines):
+        draw.text((30, 20 + 22 * n), line, fill="black")
+    buffer = io.BytesIO()
+    image.save(buffer, format="PDF", resolution=100.0)
+    return buffer.getvalue()
+
+
+def store_receipts(transactions: Iterable[FuelTransaction]) -> int:
+    """
+    Render and store receipts for just-settled transactions in the caller's
+    DB transaction (no commit). Returns the number stored.
+    """
+    receipts = build_receipts(t for t in transactions if t.status == "settled")
+    rows = []
+    for transaction_id, receipt in receipts.items():
+        receipt_json = encode_receipt(receipt)
+        rows.append({
+            "transaction_id": transaction_id,
+            "receipt_json": receipt_json,
+            "etag": receipt_etag(receipt_json),
+            "pdf": render_receipt_pdf(receipt) if RECEIPT_PDF_AT_SETTLEMENT else None,
+        })
+    if rows:
+        db.session.execute(insert(FuelTransactionReceipt), rows)
+    return len(rows)
+
+
+def stored_receipts(transaction_ids: Iterable[int]) -> Dict[int, FuelTransactionReceipt]:
+    ids = list(transaction_ids)
+    if not ids:
+        return {}
+    return {
+        r.transaction_id: r
+        for r in FuelTransactionReceipt.query.filter(FuelTransactionReceipt.transaction_id.in_(ids))
+    }
+
+
+def receipts_json(transaction_ids: List[int]) -> Dict[int, Dict[str, str]]:
+    """
+    {transaction_id: {"json": ..., "etag": ...}} for the given ids that
+    exist. Settled transactions missing a stored receipt (settled before
+    receipts were stored) are stored now; the caller commits.
+    Unsettled transactions get a live receipt with no etag.
+    """
+    stored = stored_receipts(transaction_ids)
+    result = {tid: {"json": r.receipt_json, "etag": r.etag} for tid, r in stored.items()}
+    missing = [tid for tid in transaction_ids if tid not in stored]
+    if not missing:
+        return result
+
+    transactions = FuelTransaction.query.filter(FuelTransaction.id.in_(missing)).all()
+    backfilled = [t for t in transactions if t.status == "settled"]
+    if backfilled:
+        try:
+            with db.session.begin_nested():
+                store_receipts(backfilled)
+        except IntegrityError:
+            # A concurrent read stored them first; use those
+            pass
+        result.update({
+            tid: {"json": r.receipt_json, "etag": r.etag}
+            for tid, r in stored_receipts(t.id for t in backfilled).items()
+        })
+    live = build_receipts(t for t in transactions if t.status != "settled")
+    result.update({tid: {"json": encode_receipt(r), "etag": None} for tid, r in live.items()})
+    return result
+
+
+def receipt_pdf(transaction_id: int) -> Optional[FuelTransactionReceipt]:
+    """Stored receipt with its PDF rendered (and saved) if it was not yet; caller commits"""
+    receipts_json([transaction_id])
+    receipt = stored_receipts([transaction_id]).get(transaction_id)
+    if receipt is not None and receipt.pdf is None:
+        receipt.pdf = render_receipt_pdf(json.loads(receipt.receipt_json))
+    return receipt
+
+
+def backfill_receipts(chunk_size: int = 500) -> int:
+    """Store receipts for settled transactions that predate stored receipts. Commits per chunk."""
+    stored = last_id = 0
+    while True:
+        transactions = (
+            FuelTransaction.query
+            .outerjoin(FuelTransactionReceipt, FuelTransactionReceipt.transaction_id == FuelTransaction.id)
+            .filter(FuelTransaction.status == "settled", FuelTransactionReceipt.id.is_(None),
+                    FuelTransaction.id > last_id)
+            .order_by(FuelTransaction.id)
+            .limit(chunk_size)
+            .all()
+        )
+        if not transactions:
+            return stored
+        stored += store_receipts(transactions)
+        db.session.commit()
+        last_id = transactions[-1].id
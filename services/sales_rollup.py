@@ -0,0 +1,187 @@
+"""
+Per-pump daily sales rollup.
+PumpDailySales holds settled count/litres/amount per (pump, date, fuel type).
+Settlement adds to it inside its own DB transaction, so reports read a few
+rollup rows instead of aggregating raw FuelTransaction history.
+"""
+from datetime import date, datetime
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import func, text
+
+from extensions import db
+from models import FuelTransaction, PumpDailySales
+
+SalesKey = Tuple[int, date, str]
+
+
+def sales_key(transaction: FuelTransaction) -> SalesKey:
+    """Rollup bucket of a transaction: the day the fuel was sold"""
+    sold_at = transaction.created_at or datetime.utcnow()
+    return transaction.pump_id, sold_at.date(), transaction.fuel_type
+
+
+def aggregate_sales(transactions: Iterable[FuelTransaction]) -> Dict[SalesKey, Dict[str, float]]:
+    """Fold settled transactions into per-bucket count/litres/amount deltas"""
+    totals: Dict[SalesKey, Dict[str, float]] = {}
+    for t in transactions:
+        bucket = totals.setdefault(sales_key(t), {"count": 0, "litres": 0.0, "amount": 0.0})
+        bucket["count"] += 1
+        bucket["litres"] += t.quantity_litres or 0.0
+        bucket["amount"] += t.amount or 0.0
+    return totals
+
+
+def add_daily_sales(totals: Dict[SalesKey, Dict[str, float]]) -> None:
+    """
+    Add deltas to the rollup in the caller's transaction (no commit), as one
+    upsert where the dialect supports it.
+    """
+    rows = [
+        {
+            "pump_id": pump_id,
+            "sales_date": sales_date,
+            "fuel_type": fuel_type,
+            "transaction_count": int(v["count"]),
+            "total_litres": v["litres"],
+            "total_amount": v["amount"],
+        }
+        for (pump_id, sales_date, fuel_type), v in totals.items()
+    ]
+    if not rows:
+        return
+
+    dialect_name = db.session.get_bind().dialect.name
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        _add_daily_sales_orm(rows)
+        return
+
+    table = PumpDailySales.__table__
+    stmt = dialect_insert(table).values(rows)
+    excluded = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.pump_id, table.c.sales_date, table.c.fuel_type],
+        set_={
+            "transaction_count": table.c.transaction_count + excluded.transaction_count,
+            "total_litres": table.c.total_litres + excluded.total_litres,
+            "total_amount": table.c.total_amount + excluded.total_amount,
+            "updated_at": func.now(),
+        },
+    )
+    db.session.execute(stmt)
+
+
+def _add_daily_sales_orm(rows: list) -> None:
+    """Fallback for dialects without ON CONFLICT: locked read-modify-write per bucket"""
+    for row in rows:
+        rollup = (
+            PumpDailySales.query.filter_by(
+                pump_id=row["pump_id"], sales_date=row["sales_date"], fuel_type=row["fuel_type"]
+            )
+            .with_for_update()
+            .first()
+        )
+        if rollup is None:
+            db.session.add(PumpDailySales(**row))
+        else:
+            rollup.transaction_count += row["transaction_count"]
+            rollup.total_litres += row["total_litres"]
+            rollup.total_amount += row["total_amount"]
+
+
+def lock_for_rebuild(model, rows_query) -> None:
+    """
+    Keep concurrent incremental upserts out of a rollup while it is deleted
+    and rebuilt, until the caller commits; otherwise an increment landing
+    between the delete and the re-insert is lost. PostgreSQL takes a table
+    lock that blocks writers but not readers; SQLite already serialises
+    writers once the rebuild's delete runs; elsewhere the rows in range are
+    locked (InnoDB range locks also block inserts into the range).
+    """
+    dialect_name = db.session.get_bind().dialect.name
+    if dialect_name == "postgresql":
+        db.session.execute(text(f"LOCK TABLE {model.__tablename__} IN SHARE ROW EXCLUSIVE MODE"))
+    elif dialect_name != "sqlite":
+        rows_query.with_entities(model.id).with_for_update().all()
+
+
+def rebuild_daily_sales(pump_id: Optional[int] = None, start: Optional[date] = None,
+                        end: Optional[date] = None) -> int:
+    """
+    Backfill / repair: recompute rollup rows from settled transactions for an
+    optional pump and [start, end) date range, replacing what is there.
+    Settlements wait on the rollup lock until the rebuild commits, so none
+    of their increments is lost. Returns the number of rollup rows written.
+    Commits.
+    """
+    delete_q = PumpDailySales.query
+    if pump_id is not None:
+        delete_q = delete_q.filter(PumpDailySales.pump_id == pump_id)
+    if start is not None:
+        delete_q = delete_q.filter(PumpDailySales.sales_date >= start)
+    if end is not None:
+        delete_q = delete_q.filter(PumpDailySales.sales_date < end)
+    lock_for_rebuild(PumpDailySales, delete_q)
+    delete_q.delete(synchronize_session=False)
+
+    sold_on = func.date(FuelTransaction.created_at)
+    source = db.session.query(
+        FuelTransaction.pump_id,
+        sold_on.label("sales_date"),
+        FuelTransaction.fuel_type,
+        func.count(FuelTransaction.id),
+        func.coalesce(func.sum(FuelTransaction.quantity_litres), 0.0),
+        func.coalesce(func.sum(FuelTransaction.amount), 0.0),
+    ).filter(FuelTransaction.status == "settled")
+    if pump_id is not None:
+        source = source.filter(FuelTransaction.pump_id == pump_id)
+    # Half-open timestamp bounds keep the created_at index usable
+    if start is not None:
+        source = source.filter(FuelTransaction.created_at >= datetime.combine(start, datetime.min.time()))
+    if end is not None:
+        source = source.filter(FuelTransaction.created_at < datetime.combine(end, datetime.min.time()))
+    source = source.group_by(FuelTransaction.pump_id, sold_on, FuelTransaction.fuel_type)
+
+    written = 0
+    for row_pump_id, sales_date, fuel_type, count, litres, amount in source.all():
+        if isinstance(sales_date, str):  # SQLite returns DATE() as text
+            sales_date = date.fromisoformat(sales_date)
+        db.session.add(PumpDailySales(
+            pump_id=row_pump_id,
+            sales_date=sales_date,
+            fuel_type=fuel_type,
+            transaction_count=count,
+            total_litres=float(litres),
+            total_amount=float(amount),
+        ))
+        written += 1
+    db.session.commit()
+    return written
+
+
+def rollup_query(pump_ids: Optional[Iterable[int]] = None, start: Optional[date] = None,
+                 end: Optional[date] = None):
+    """Base query over the rollup for optional pumps and a [start, end) date range"""
+    query = PumpDailySales.query
+    if pump_ids is not None:
+        query = query.filter(PumpDailySales.pump_id.in_(list(pump_ids)))
+    if start is not None:
+        query = query.filter(PumpDailySales.sales_date >= start)
+    if end is not None:
+        query = query.filter(PumpDailySales.sales_date < end)
+    return query
+
+
+def summarize(pump_ids: Optional[Iterable[int]] = None, start: Optional[date] = None,
+              end: Optional[date] = None) -> Dict[str, float]:
+    """Total count/litres/amount from the rollup"""
+    count, litres, amount = rollup_query(pump_ids, start, end).with_entities(
+        func.coalesce(func.sum(PumpDailySales.transaction_count), 0),
+        func.coalesce(func.sum(PumpDailySales.total_litres), 0.0),
+        func.coalesce(func.sum(PumpDailySales.total_amount), 0.0),
+    ).one()
+    return {"count": int(count), "litres": float(litres), "amount": float(amount)}
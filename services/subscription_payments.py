@@ -0,0 +1,85 @@
+"""
+Recording captured Razorpay subscription payments.
+Both the checkout callback and the payment webhook land here, so a payment
+activates its subscription exactly once whichever arrives first.
+"""
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from models import Pump, PumpOwner, PumpSubscription, SubscriptionPayment
+
+PLAN_PRICES_INR = {
+    "silver": 5000,
+    "gold": 5000,
+    "diamond": 15000,
+}
+DURATION_MONTHS = {
+    "1 Month": 1,
+    "6 Months": 6,
+    "Annual": 12,
+}
+
+
+def subscription_price(plan_type: str, duration: str) -> float:
+    """Total INR price of a plan for a duration (0 for an unknown plan)"""
+    return float(PLAN_PRICES_INR.get((plan_type or "").lower(), 0) * DURATION_MONTHS.get(duration, 1))
+
+
+def record_subscription_payment(owner: PumpOwner, pump: Pump, plan_type: str, duration: str,
+                                razorpay_payment_id: str,
+                                razorpay_order_id: Optional[str] = None) -> Optional[SubscriptionPayment]:
+    """
+    Activate the pump's subscription for a captured payment and store the
+    payment. Idempotent on the payment id: a payment already recorded
+    returns None and changes nothing, including when the callback and the
+    webhook insert it at the same moment. Caller commits.
+    """
+    existing = (
+        SubscriptionPayment.query.filter_by(razorpay_payment_id=razorpay_payment_id)
+        .with_for_update()
+        .first()
+    )
+    if existing:
+        return None
+
+    # The payment row goes first: its unique payment id decides which caller activates
+    payment = SubscriptionPayment(
+        pump_owner_id=owner.id,
+        pump_id=pump.id,
+        plan_type=plan_type.capitalize(),
+        duration=duration,
+        amount=subscription_price(plan_type, duration),
+        razorpay_order_id=razorpay_order_id,
+        razorpay_payment_id=razorpay_payment_id,
+    )
+    try:
+        with db.session.begin_nested():
+            db.session.add(payment)
+    except IntegrityError:
+        return None
+
+    start_date = datetime.utcnow()
+    end_date = start_date + timedelta(days=30 * DURATION_MONTHS.get(duration, 1))
+    subscription = PumpSubscription.query.filter_by(user_id=owner.id, pump_id=pump.id).first()
+    if subscription:
+        subscription.subscription_type = plan_type.capitalize()
+        subscription.subscription_status = "active"
+        subscription.start_date = start_date
+        subscription.end_date = end_date
+    else:
+        db.session.add(PumpSubscription(
+            user_id=owner.id,
+            email=owner.email,
+            pump_id=pump.id,
+            pump_name=pump.name,
+            pump_location=pump.location,
+            subscription_type=plan_type.capitalize(),
+            subscription_status="active",
+            start_date=start_date,
+            end_date=end_date,
+        ))
+    db.session.flush()
+    return payment
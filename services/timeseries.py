@@ -0,0 +1,60 @@
+"""
+Daily time series for charts.
+One GROUP BY over the whole window instead of a query per day. The window is
+a half-open [start, end) range applied to the raw column, so an index on it
+stays usable; only the bucket expression wraps the column. Days with no rows
+are filled in Python.
+"""
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import DateTime, func
+
+from extensions import db
+
+
+def last_n_days(days: int, today: Optional[date] = None) -> Tuple[date, date]:
+    """Half-open [start, end) window covering the last `days` days including today"""
+    today = today or datetime.utcnow().date()
+    return today - timedelta(days=days - 1), today + timedelta(days=1)
+
+
+def daily_series(day_column, metrics: Dict[str, Any], start: date, end: date,
+                 filters: Optional[List[Any]] = None) -> List[Dict[str, Any]]:
+    """
+    [{"date": "YYYY-MM-DD", <metric>: value, ...}] for every day in
+    [start, end), oldest first. `day_column` is a Date or DateTime column;
+    `metrics` maps output names to aggregate expressions (func.count(...),
+    func.sum(...)); `filters` are extra WHERE clauses. Missing days get 0.
+    """
+    if isinstance(day_column.type, DateTime):
+        bucket = func.date(day_column)
+        bounds = (datetime.combine(start, datetime.min.time()), datetime.combine(end, datetime.min.time()))
+    else:
+        bucket = day_column
+        bounds = (start, end)
+
+    names = list(metrics)
+    query = (
+        db.session.query(bucket.label("day"), *(metrics[name].label(name) for name in names))
+        .filter(day_column >= bounds[0], day_column < bounds[1], *(filters or []))
+        .group_by(bucket)
+    )
+    by_day = {}
+    for row in query.all():
+        day = row.day
+        if isinstance(day, str):  # SQLite returns DATE() as text
+            day = date.fromisoformat(day)
+        elif isinstance(day, datetime):
+            day = day.date()
+        by_day[day] = row
+
+    series = []
+    for offset in range((end - start).days):
+        day = start + timedelta(days=offset)
+        row = by_day.get(day)
+        point = {"date": day.strftime("%Y-%m-%d")}
+        for name in names:
+            point[name] = (getattr(row, name) or 0) if row else 0
+        series.append(point)
+    return series
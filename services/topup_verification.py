@@ -0,0 +1,124 @@
+"""
+Bulk verification of manual (screenshot) wallet top-ups.
+Approving many requests at once locks the selected top-ups and their
+wallets, writes one balance update per wallet and bulk-inserts the ledger
+credits, all in one DB transaction.
+"""
+import uuid
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from flask import current_app
+from sqlalchemy import insert
+
+from extensions import db
+from models import Wallet, WalletLedgerEntry, WalletTopupVerification
+
+BULK_VERIFY_MAX_ITEMS = 500
+
+
+def _wallets_for_users(user_ids: Iterable[int]) -> Dict[int, Wallet]:
+    """
+    {user_id: Wallet} for the given users, creating missing wallets. Every
+    wallet is locked, in id order like every other balance change.
+    """
+    user_ids = sorted(set(user_ids))
+    if not user_ids:
+        return {}
+    existing = {
+        user_id for (user_id,) in
+        db.session.query(Wallet.user_id).filter(Wallet.user_id.in_(user_ids))
+    }
+    missing = [user_id for user_id in user_ids if user_id not in existing]
+    if missing:
+        db.session.add_all([Wallet(user_id=user_id, balance=0.0) for user_id in missing])
+        db.session.flush()
+    wallets = {}
+    for wallet in (Wallet.query.filter(Wallet.user_id.in_(user_ids))
+                   .order_by(Wallet.id).with_for_update().all()):
+        # Oldest wallet wins if a user somehow has several, as user.wallet does
+        wallets.setdefault(wallet.user_id, wallet)
+    return wallets
+
+
+def bulk_verify_topups(topup_ids: Iterable[int], action: str, verified_by: Optional[str],
+                       reason: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Approve or reject many pending top-ups and commit once. Approvals credit
+    each driver wallet by the sum of its top-ups with one balance write and
+    one ledger credit per top-up, each in its own ledger group. Returns one
+    {"topup_id", "status", ...} per requested id, in request order; ids that
+    are unknown or no longer pending come back as "skipped".
+    """
+    if action not in ("approve", "reject"):
+        raise ValueError("Invalid action")
+    ids = list(dict.fromkeys(int(i) for i in topup_ids))
+
+    # Locked in id order so two admins selecting overlapping sets cannot deadlock
+    topups = (
+        WalletTopupVerification.query
+        .filter(WalletTopupVerification.id.in_(ids))
+        .order_by(WalletTopupVerification.id)
+        .with_for_update()
+        .all()
+    )
+    found = {t.id: t for t in topups}
+    outcomes = {}
+    for topup_id in ids:
+        topup = found.get(topup_id)
+        if topup is None:
+            outcomes[topup_id] = {"topup_id": topup_id, "status": "skipped", "reason": "Top-up not found"}
+        elif topup.status != "pending":
+            outcomes[topup_id] = {"topup_id": topup_id, "status": "skipped",
+                                  "reason": f"Top-up already {topup.status}"}
+
+    pending = [t for t in topups if t.status == "pending"]
+    now = datetime.utcnow()
+
+    if action == "reject":
+        for topup in pending:
+            topup.status = "rejected"
+            topup.verified_at = now
+            topup.verified_by = verified_by
+            topup.rejection_reason = reason or "Invalid payment proof"
+            outcomes[topup.id] = {"topup_id": topup.id, "status": "rejected"}
+        db.session.commit()
+        return [outcomes[topup_id] for topup_id in ids]
+
+    wallets = _wallets_for_users(t.user_id for t in pending)
+    balances = {w.id: w.balance or 0.0 for w in wallets.values()}
+    ledger_rows = []
+    for topup in pending:
+        wallet = wallets[topup.user_id]
+        balances[wallet.id] += topup.amount
+        ledger_rows.append({
+            # Each top-up is its own ledger event, as when approved one at a time
+            "group_uuid": str(uuid.uuid4()),
+            "event_type": "wallet_topup",
+            "direction": "credit",
+            "wallet_type": "driver_wallet",
+            "wallet_id": wallet.id,
+            "amount": topup.amount,
+            "balance_after": balances[wallet.id],
+            "reference_id": topup.id,
+            "reference_type": "wallet_topup",
+        })
+        topup.status = "approved"
+        topup.verified_at = now
+        topup.verified_by = verified_by
+        outcomes[topup.id] = {"topup_id": topup.id, "status": "approved", "amount": topup.amount,
+                              "wallet_id": wallet.id, "balance_after": balances[wallet.id]}
+
+    # One balance write per wallet, however many top-ups it had
+    for wallet in wallets.values():
+        if wallet.balance != balances[wallet.id]:
+            wallet.balance = balances[wallet.id]
+    if ledger_rows:
+        db.session.execute(insert(WalletLedgerEntry), ledger_rows)
+    db.session.commit()
+
+    current_app.logger.info(
+        f"Bulk top-up approval by {verified_by}: {len(ledger_rows)} approved, "
+        f"{round(sum(r['amount'] for r in ledger_rows), 2)} INR over {len(wallets)} wallets"
+    )
+    return [outcomes[topup_id] for topup_id in ids]
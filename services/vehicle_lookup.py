@@ -0,0 +1,145 @@
+"""
+Vehicle-to-driver resolution.
+Maps a number plate to (driver user id, driver wallet id) through the
+indexed Vehicle.plate_key, with an in-process LRU cache in front of it.
+Every vehicle write bumps PlateRegistryVersion in its own transaction, so a
+process can tell its cache is stale with one primary-key read. Paths that
+pick the wallet to debit resolve with fresh=True, which makes that check
+first; read-only lookups (receipts) rely on the TTL.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import event, inspect, update
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models import PlateRegistryVersion, Vehicle, Wallet, normalize_plate
+
+PLATE_CACHE_SIZE = int(os.getenv("PLATE_CACHE_SIZE", "4096"))
+# Bound on staleness for lookups that skip the registry version check
+PLATE_CACHE_TTL_SECONDS = float(os.getenv("PLATE_CACHE_TTL_SECONDS", "300"))
+
+_cache: "OrderedDict[str, Tuple[float, Tuple[int, int]]]" = OrderedDict()
+_cache_lock = threading.Lock()
+# Registry version the cache was last checked against, and a counter bumped
+# on every clear so a lookup that started before a clear does not refill it
+_registry_version: Optional[int] = None
+_cache_epoch = 0
+
+
+def _cache_get(plate_key: str) -> Optional[Tuple[int, int]]:
+    with _cache_lock:
+        hit = _cache.get(plate_key)
+        if hit is None:
+            return None
+        if hit[0] <= time.time():
+            del _cache[plate_key]
+            return None
+        _cache.move_to_end(plate_key)
+        return hit[1]
+
+
+def _cache_put(plate_key: str, value: Tuple[int, int], epoch: int) -> None:
+    with _cache_lock:
+        if epoch != _cache_epoch:
+            return
+        _cache[plate_key] = (time.time() + PLATE_CACHE_TTL_SECONDS, value)
+        _cache.move_to_end(plate_key)
+        while len(_cache) > PLATE_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def invalidate_plate(plate: str) -> None:
+    """Drop a plate from the cache after its vehicle is added, changed or removed"""
+    global _cache_epoch
+    with _cache_lock:
+        _cache.pop(normalize_plate(plate), None)
+        _cache_epoch += 1
+
+
+def clear_plate_cache() -> None:
+    global _cache_epoch
+    with _cache_lock:
+        _cache.clear()
+        _cache_epoch += 1
+
+
+def _check_registry_version() -> None:
+    """Clear the cache if any process has written a vehicle since the last check"""
+    global _registry_version, _cache_epoch
+    version = db.session.query(PlateRegistryVersion.version).filter_by(id=1).scalar()
+    with _cache_lock:
+        if version is None or version != _registry_version:
+            _cache.clear()
+            _cache_epoch += 1
+            _registry_version = version
+
+
+@event.listens_for(Session, "before_flush")
+def _bump_registry_version(session, flush_context, instances):
+    """Bump the registry version in the same transaction as any vehicle write"""
+    changed = any(isinstance(obj, Vehicle) for obj in (*session.new, *session.deleted)) or any(
+        isinstance(obj, Vehicle) and (
+            inspect(obj).attrs.plate_key.history.has_changes()
+            or inspect(obj).attrs.user_id.history.has_changes()
+        )
+        for obj in session.dirty
+    )
+    if not changed:
+        return
+    table = PlateRegistryVersion.__table__
+    bumped = session.execute(update(table).where(table.c.id == 1).values(version=table.c.version + 1))
+    if bumped.rowcount == 0:
+        # Seeded by migration 4e7b2d9a8f13; only a bare create_all lacks it
+        session.add(PlateRegistryVersion(id=1, version=1))
+
+
+def resolve_plates(plates: Iterable[str], fresh: bool = False) -> Dict[str, Tuple[int, Optional[int]]]:
+    """
+    Map each plate (as given) to (user_id, wallet_id). Cache misses are
+    resolved with one query. Plates with no registered vehicle are left
+    out; a driver without a wallet comes back with wallet_id None and is
+    not cached, so the next lookup sees the wallet once it exists. With
+    `fresh`, the cache is first checked against the registry version, so
+    a plate another process reassigned or removed is never served from it.
+    """
+    if fresh:
+        _check_registry_version()
+    with _cache_lock:
+        epoch = _cache_epoch
+    keys = {plate: normalize_plate(plate) for plate in plates if plate}
+    found: Dict[str, Tuple[int, Optional[int]]] = {}
+    missing = set()
+    for key in set(keys.values()):
+        hit = _cache_get(key)
+        if hit is not None:
+            found[key] = hit
+        elif key:
+            missing.add(key)
+
+    if missing:
+        rows = (
+            db.session.query(Vehicle.plate_key, Vehicle.user_id, Wallet.id)
+            .outerjoin(Wallet, Wallet.user_id == Vehicle.user_id)
+            .filter(Vehicle.plate_key.in_(missing))
+            .order_by(Vehicle.id)
+            .all()
+        )
+        for plate_key, user_id, wallet_id in rows:
+            # First registered vehicle wins when a plate is registered twice
+            if plate_key in found:
+                continue
+            found[plate_key] = (user_id, wallet_id)
+            if wallet_id is not None:
+                _cache_put(plate_key, (user_id, wallet_id), epoch)
+
+    return {plate: found[key] for plate, key in keys.items() if key in found}
+
+
+def resolve_plate(plate: str, fresh: bool = False) -> Optional[Tuple[int, Optional[int]]]:
+    """(user_id, wallet_id) for one plate, or None if no vehicle has it"""
+    return resolve_plates([plate], fresh=fresh).get(plate)
@@ -1,9 +1,20 @@
+import hashlib
+import os
+import random
+import threading
+import time
 import uuid
 from datetime import datetime
 
+from sqlalchemy import func, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm.exc import StaleDataError
+
 from extensions import db
 from config import Config
-from models import Wallet, EscrowAccount, WalletTopup, WalletLedgerEntry
+from services.kpi_cache import note_core_write
+from services.pagination import keyset_page, cached_count
+from models import Wallet, PumpWallet, EscrowAccount, WalletTopup, WalletLedgerEntry
 
 try:
     import razorpay  # type: ignore
@@ -22,15 +33,166 @@ def _get_or_create_wallet(user):
 
 
 def _get_main_escrow():
-    """Return the main escrow account, creating it if needed."""
+    """Return the main escrow account, creating it if needed.
+
+    Migration c4f7a1d8e263 seeds it; if it is still missing, two first
+    top-ups may race to create it, and the loser re-reads the winner's row
+    instead of failing its payment.
+    """
     account = EscrowAccount.query.filter_by(name="main").first()
-    if not account:
-        account = EscrowAccount(name="main", balance=0.0)
-        db.session.add(account)
-        db.session.flush()
+    if account is None:
+        try:
+            with db.session.begin_nested():
+                account = EscrowAccount(name="main", balance=0.0)
+                db.session.add(account)
+        except IntegrityError:
+            account = EscrowAccount.query.filter_by(name="main").one()
     return account
 
 
+# Top-ups spread over this many escrow sub-accounts instead of one hot row
+ESCROW_SHARDS = int(os.getenv("ESCROW_SHARDS", "16"))
+
+_escrow_shard_ids = {}
+_escrow_shard_lock = threading.Lock()
+
+
+def escrow_shard_for(key):
+    """Stable sub-account number for a top-up, from its transaction key"""
+    return int(hashlib.sha1(str(key).encode()).hexdigest(), 16) % ESCROW_SHARDS
+
+
+def _escrow_shard_id(shard):
+    """Id of escrow sub-account `shard`, creating it on first use."""
+    with _escrow_shard_lock:
+        cached = _escrow_shard_ids.get(shard)
+    if cached:
+        return cached
+
+    name = f"main#{shard}"
+    account = EscrowAccount.query.filter_by(name=name).first()
+    if account is None:
+        root = _get_main_escrow()
+        try:
+            with db.session.begin_nested():
+                account = EscrowAccount(name=name, balance=0.0, parent_id=root.id, shard=shard)
+                db.session.add(account)
+            # Not cached until a later lookup sees it committed
+            return account.id
+        except IntegrityError:
+            account = EscrowAccount.query.filter_by(name=name).one()
+    with _escrow_shard_lock:
+        _escrow_shard_ids[shard] = account.id
+    return account.id
+
+
+BALANCE_RETRY_ATTEMPTS = 5
+
+
+class InsufficientBalanceError(ValueError):
+    """Raised when a guarded debit finds less than the requested amount"""
+
+
+def _apply_balance_delta(model, wallet_id, delta, require_funds=False):
+    """
+    Add `delta` to a Wallet/PumpWallet balance with a single UPDATE and bump
+    its version. With `require_funds`, the UPDATE only matches while
+    balance >= -delta, so two concurrent debits can never overdraw. The
+    KPI "wallets" group is dropped when the caller commits.
+    Returns the new balance, or None if no row matched.
+    """
+    table = model.__table__
+    current = func.coalesce(table.c.balance, 0.0)
+    stmt = (
+        update(table)
+        .where(table.c.id == wallet_id)
+        .values(balance=current + delta, version=table.c.version + 1)
+    )
+    if require_funds:
+        stmt = stmt.where(current >= -delta)
+    if db.session.execute(stmt).rowcount == 0:
+        return None
+    note_core_write(model)
+    # Our UPDATE holds the row lock until commit, so this reads our own write.
+    # populate_existing also refreshes any copy already loaded in the session.
+    wallet = db.session.get(model, wallet_id, populate_existing=True)
+    return wallet.balance
+
+
+def _wallet_type(model):
+    if model is EscrowAccount:
+        return "escrow"
+    return "pump_wallet" if model is PumpWallet else "driver_wallet"
+
+
+def _record_movement(model, wallet_id, direction, amount, balance_after, event_type,
+                     reference_id=None, reference_type=None, group_uuid=None):
+    """Append the ledger row for a balance change made outside escrow settlement"""
+    db.session.add(WalletLedgerEntry(
+        group_uuid=group_uuid or str(uuid.uuid4()),
+        event_type=event_type,
+        direction=direction,
+        wallet_type=_wallet_type(model),
+        wallet_id=wallet_id,
+        amount=amount,
+        balance_after=balance_after,
+        reference_id=reference_id,
+        reference_type=reference_type,
+    ))
+
+
+def credit_wallet(model, wallet_id, amount, event_type=None, reference_id=None,
+                  reference_type=None, group_uuid=None):
+    """
+    Atomically add `amount` to a wallet balance; returns the new balance.
+    With `event_type`, also writes the matching ledger credit.
+    """
+    balance = _apply_balance_delta(model, wallet_id, amount)
+    if balance is None:
+        raise ValueError(f"{model.__name__} {wallet_id} not found")
+    if event_type:
+        _record_movement(model, wallet_id, "credit", amount, balance, event_type,
+                         reference_id, reference_type, group_uuid)
+    return balance
+
+
+def debit_wallet(model, wallet_id, amount, event_type=None, reference_id=None,
+                 reference_type=None, group_uuid=None):
+    """
+    Atomically subtract `amount` if the balance covers it; returns the new
+    balance or raises InsufficientBalanceError. With `event_type`, also
+    writes the matching ledger debit.
+    """
+    balance = _apply_balance_delta(model, wallet_id, -amount, require_funds=True)
+    if balance is None:
+        wallet = db.session.get(model, wallet_id, populate_existing=True)
+        if wallet is None:
+            raise ValueError(f"{model.__name__} {wallet_id} not found")
+        raise InsufficientBalanceError(
+            f"Insufficient balance: {wallet.balance or 0.0} < {amount}"
+        )
+    if event_type:
+        _record_movement(model, wallet_id, "debit", amount, balance, event_type,
+                         reference_id, reference_type, group_uuid)
+    return balance
+
+
+def run_with_balance_retry(operation, attempts=BALANCE_RETRY_ATTEMPTS):
+    """
+    Run `operation()` (which must commit its own unit of work) and retry it
+    after a rollback when it hits a version conflict or a deadlock /
+    serialization failure. Other exceptions propagate unchanged.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            return operation()
+        except (StaleDataError, OperationalError):
+            db.session.rollback()
+            if attempt == attempts:
+                raise
+            time.sleep(random.uniform(0, 0.02 * (2 ** attempt)))
+
+
 def create_wallet_topup_order(user, amount):
     """Create a Razorpay order and a pending WalletTopup record."""
     if amount <= 0:
@@ -85,85 +247,68 @@ def create_wallet_topup_order(user, amount):
 def confirm_wallet_topup_payment(user, txn_uuid, amount, razorpay_payment_id, razorpay_order_id, razorpay_signature=None):
     """Mark a top-up as paid and move funds into driver wallet + escrow.
 
-    This function is idempotent with respect to txn_uuid.
+    This function is idempotent with respect to txn_uuid. The escrow side
+    goes to the sub-account picked by hashing txn_uuid, so concurrent
+    top-ups lock different rows.
     """
     wallet = _get_or_create_wallet(user)
-    escrow = _get_main_escrow()
 
-    with db.session.begin():
-        topup = (
-            WalletTopup.query.filter_by(txn_uuid=txn_uuid)
-            .with_for_update()
-            .first()
-        )
-        if not topup:
-            raise ValueError("Unknown top-up transaction")
-
-        if topup.driver_id != user.id:
-            raise ValueError("Top-up does not belong to this user")
-
-        # Idempotent: if already paid, just return current balance
-        if topup.status == "paid":
-            return wallet.balance
-
-        # Basic tampering protection
-        if abs(topup.amount - float(amount)) > 0.01:
-            raise ValueError("Amount mismatch for this transaction")
-
-        topup.status = "paid"
-        topup.razorpay_payment_id = razorpay_payment_id
-        topup.razorpay_order_id = razorpay_order_id
-        topup.razorpay_signature = razorpay_signature
-        topup.paid_at = datetime.utcnow()
-
-        wallet.balance += topup.amount
-        escrow.balance += topup.amount
-
-        group_uuid = str(uuid.uuid4())
-
-        # Escrow credit entry
-        escrow_entry = WalletLedgerEntry(
-            group_uuid=group_uuid,
-            event_type="TOPUP",
-            direction="credit",
-            account_type="escrow",
-            escrow_account_id=escrow.id,
-            amount=topup.amount,
-            balance_after=escrow.balance,
-            topup_id=topup.id,
-        )
-        db.session.add(escrow_entry)
-
-        # Driver credit entry
-        driver_entry = WalletLedgerEntry(
-            group_uuid=group_uuid,
-            event_type="TOPUP",
-            direction="credit",
-            account_type="driver",
-            driver_wallet_id=wallet.id,
-            amount=topup.amount,
-            balance_after=wallet.balance,
-            topup_id=topup.id,
-        )
-        db.session.add(driver_entry)
+    topup = (
+        WalletTopup.query.filter_by(txn_uuid=txn_uuid)
+        .with_for_update()
+        .first()
+    )
+    if not topup:
+        raise ValueError("Unknown top-up transaction")
 
-    return wallet.balance
+    if topup.driver_id != user.id:
+        raise ValueError("Top-up does not belong to this user")
 
+    # Idempotent: if already paid, just return current balance
+    if topup.status == "paid":
+        return wallet.balance
 
-def get_driver_wallet_transactions(user, page=1, per_page=20):
-    """Return paginated ledger entries for the driver's wallet."""
-    wallet = _get_or_create_wallet(user)
+    # Basic tampering protection
+    if abs(topup.amount - float(amount)) > 0.01:
+        raise ValueError("Amount mismatch for this transaction")
 
-    query = (
-        WalletLedgerEntry.query
-        .filter_by(account_type="driver", driver_wallet_id=wallet.id)
-        .order_by(WalletLedgerEntry.created_at.desc())
-    )
+    balance = apply_topup_payment(topup, razorpay_payment_id, razorpay_order_id, razorpay_signature)
+    db.session.commit()
+
+    return balance
+
+
+def apply_topup_payment(topup, razorpay_payment_id, razorpay_order_id, razorpay_signature=None):
+    """Mark a locked, unpaid top-up paid and credit its wallet and escrow shard.
+
+    Shared by the checkout callback and the payment webhook worker; the
+    caller holds the top-up row lock, checks it is not paid yet and commits.
+    Returns the new wallet balance.
+    """
+    topup.status = "paid"
+    topup.razorpay_payment_id = razorpay_payment_id
+    topup.razorpay_order_id = razorpay_order_id
+    topup.razorpay_signature = razorpay_signature
+    topup.paid_at = datetime.utcnow()
+
+    group_uuid = str(uuid.uuid4())
+    balance = credit_wallet(Wallet, topup.wallet_id, topup.amount, event_type="wallet_topup",
+                            reference_id=topup.id, reference_type="wallet_topup", group_uuid=group_uuid)
+    credit_wallet(EscrowAccount, _escrow_shard_id(escrow_shard_for(topup.txn_uuid)), topup.amount,
+                  event_type="wallet_topup", reference_id=topup.id, reference_type="wallet_topup",
+                  group_uuid=group_uuid)
+    return balance
+
+
+def get_driver_wallet_transactions(user, limit=20, cursor=None):
+    """Return one page (newest first) of ledger entries for the driver's wallet."""
+    wallet = _get_or_create_wallet(user)
 
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    query = WalletLedgerEntry.query.filter_by(wallet_type="driver_wallet", wallet_id=wallet.id)
+    entries, next_cursor = keyset_page(query, WalletLedgerEntry.created_at, WalletLedgerEntry.id, limit, cursor)
 
     items = []
-    for entry in pagination.items:
+    for entry in entries:
         items.append(
             {
                 "event_type": entry.event_type,
@@ -177,7 +322,6 @@ def get_driver_wallet_transactions(user, page=1, per_page=20):
 
     return {
         "transactions": items,
-        "page": pagination.page,
-        "pages": pagination.pages,
-        "total": pagination.total,
+        "next_cursor": next_cursor,
+        "total": cached_count(("driver_ledger", wallet.id), query),
     }
@@ -1,14 +1,21 @@
+import re
+
 from flask import Blueprint, request, jsonify
 from flask_login import login_required, current_user
 from datetime import datetime, timedelta
 from sqlalchemy import func
 
 from extensions import db
-from models import PumpOwner, PumpWallet, PumpSettlement, FuelTransaction
+from models import PumpOwner, PumpWallet, PumpSettlement
+from services.sales_rollup import summarize
+from services.wallet_service import InsufficientBalanceError, debit_wallet
 
 
 settlement_bp = Blueprint("settlement", __name__)
 
+IFSC_RE = re.compile(r"^[A-Z]{4}0[A-Z0-9]{6}$")
+ACCOUNT_NUMBER_RE = re.compile(r"^[0-9]{9,18}$")
+
 
 @settlement_bp.route("/pump-wallet", methods=["GET"])
 @login_required
@@ -17,11 +24,46 @@ def pump_wallet_balance():
     if not isinstance(current_user, PumpOwner):
         return jsonify({"success": False, "message": "Access denied"}), 403
 
-    wallet = getattr(current_user, "pump_wallet", None)
+    wallet = getattr(current_user, "wallet", None)
     balance = wallet.balance if wallet else 0.0
     return jsonify({"success": True, "balance": round(balance, 2)})
 
 
+@settlement_bp.route("/bank-account", methods=["GET", "PUT"])
+@login_required
+def bank_account():
+    """View or set the bank account settlements are paid out to (NEFT/RTGS)."""
+    if not isinstance(current_user, PumpOwner):
+        return jsonify({"success": False, "message": "Access denied"}), 403
+
+    if request.method == "PUT":
+        data = request.get_json(force=True, silent=True) or {}
+        account_name = (data.get("account_name") or "").strip()
+        account_number = re.sub(r"\s", "", str(data.get("account_number") or ""))
+        ifsc = (data.get("ifsc") or "").strip().upper()
+        if not account_name:
+            return jsonify({"success": False, "message": "Account holder name required"}), 400
+        if not ACCOUNT_NUMBER_RE.match(account_number):
+            return jsonify({"success": False, "message": "Account number must be 9-18 digits"}), 400
+        if not IFSC_RE.match(ifsc):
+            return jsonify({"success": False, "message": "Invalid IFSC code"}), 400
+
+        current_user.bank_account_name = account_name[:100]
+        current_user.bank_account_number = account_number
+        current_user.bank_ifsc = ifsc
+        db.session.commit()
+
+    number = current_user.bank_account_number
+    return jsonify({
+        "success": True,
+        "bank_account": {
+            "account_name": current_user.bank_account_name,
+            "account_number": f"XXXX{number[-4:]}" if number else None,
+            "ifsc": current_user.bank_ifsc
+        }
+    })
+
+
 @settlement_bp.route("/pending", methods=["GET"])
 @login_required
 def pending_settlements():
@@ -65,7 +107,7 @@ def request_settlement():
 
     try:
         amount = float(amount)
-        wallet = current_user.pump_wallet
+        wallet = current_user.wallet
         if not wallet or wallet.balance < amount:
             return jsonify({"success": False, "message": "Insufficient wallet balance"}), 400
 
@@ -117,6 +159,8 @@ def settlement_history():
                     "currency": s.currency,
                     "status": s.status,
                     "bank_reference": s.bank_reference,
+                    "utr": s.utr,
+                    "failure_reason": s.failure_reason,
                     "requested_at": s.requested_at.isoformat(),
                     "processed_at": s.processed_at.isoformat() if s.processed_at else None
                 }
@@ -135,7 +179,7 @@ def settlement_summary():
         return jsonify({"success": False, "message": "Access denied"}), 403
 
     try:
-        wallet = current_user.pump_wallet
+        wallet = current_user.wallet
         balance = wallet.balance if wallet else 0.0
 
         # Pending settlements amount
@@ -143,14 +187,11 @@ def settlement_summary():
             .filter_by(pump_owner_id=current_user.id, status="pending").scalar()
         pending_amount = float(pending) if pending else 0.0
 
-        # Today's sales (settled fuel transactions)
+        # Today's sales (settled fuel transactions sold today, from the daily rollup)
         today = datetime.utcnow().date()
-        today_sales = db.session.query(func.sum(FuelTransaction.amount))\
-            .join(Pump, FuelTransaction.pump_id == Pump.id)\
-            .filter(Pump.owner_id == current_user.id,
-                    FuelTransaction.status == "settled",
-                    func.date(FuelTransaction.settled_at) == today).scalar()
-        today_sales_amount = float(today_sales) if today_sales else 0.0
+        today_sales_amount = summarize(
+            [p.id for p in current_user.pumps], today, today + timedelta(days=1)
+        )["amount"]
 
         return jsonify({
             "success": True,
@@ -169,16 +210,22 @@ def settlement_summary():
 @settlement_bp.route("/admin/list", methods=["GET"])
 @login_required
 def admin_list_pending():
-    """List all pending settlements (admin only)."""
+    """
+    List pending settlements, oldest first, one page at a time (admin only).
+    Pass the returned next_after_id as ?after_id= for the next page.
+    """
     # In production, add admin role check
+    limit = min(max(request.args.get("limit", 100, type=int), 1), 500)
+    after_id = request.args.get("after_id", 0, type=int)
     try:
         settlements = db.session.query(PumpSettlement, PumpOwner)\
             .join(PumpOwner, PumpSettlement.pump_owner_id == PumpOwner.id)\
-            .filter(PumpSettlement.status == "pending")\
-            .order_by(PumpSettlement.requested_at.asc()).all()
+            .filter(PumpSettlement.status == "pending", PumpSettlement.id > after_id)\
+            .order_by(PumpSettlement.id.asc()).limit(limit).all()
 
         return jsonify({
             "success": True,
+            "next_after_id": settlements[-1][0].id if len(settlements) == limit else None,
             "settlements": [
                 {
                     "id": s.id,
@@ -212,17 +259,24 @@ def admin_process_settlement(settlement_id):
         return jsonify({"success": False, "message": "Invalid action"}), 400
 
     try:
-        settlement = PumpSettlement.query.get_or_404(settlement_id)
+        settlement = (
+            PumpSettlement.query.filter_by(id=settlement_id)
+            .with_for_update()
+            .first_or_404()
+        )
         if settlement.status != "pending":
             return jsonify({"success": False, "message": "Settlement already processed"}), 400
 
         if action == "approve":
             # Deduct from pump wallet
-            wallet = settlement.pump_wallet
-            if wallet.balance < settlement.amount:
+            try:
+                debit_wallet(PumpWallet, settlement.pump_wallet_id, settlement.amount,
+                             event_type="settlement", reference_id=settlement.id,
+                             reference_type="settlement")
+            except InsufficientBalanceError:
+                db.session.rollback()
                 return jsonify({"success": False, "message": "Insufficient wallet balance to settle"}), 400
 
-            wallet.balance -= settlement.amount
             settlement.status = "approved"
             settlement.processed_at = datetime.utcnow()
             # In production, you'd add bank_reference or transfer_id
@@ -20,8 +20,17 @@ else
 fi
 
 # Start Gunicorn
+# gthread workers: a live camera stream (MJPEG video_feed) parks one thread on
+# its frame queue instead of holding a whole sync worker, so other requests keep
+# being served. gevent is avoided on purpose: monkey-patching would turn the
+# OpenCV/YOLO pipeline threads into greenlets and stall every request.
 echo "🔥 Starting Gunicorn server..."
-exec gunicorn app:app --workers ${WEB_CONCURRENCY:-1} --timeout 120 --bind 0.0.0.0:${PORT:-8080}
+exec gunicorn app:app \
+    --worker-class gthread \
+    --workers ${WEB_CONCURRENCY:-1} \
+    --threads ${GUNICORN_THREADS:-64} \
+    --timeout 120 \
+    --bind 0.0.0.0:${PORT:-8080}
 
 
 
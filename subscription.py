@@ -2,7 +2,9 @@
 from flask import Blueprint, request, jsonify, render_template, redirect, url_for, flash
 from flask_login import current_user, login_required
 from datetime import datetime, timedelta
-from models import db, PumpSubscription, Pump, PumpOwner, PaymentVerification
+from models import db, PumpSubscription, Pump, PumpOwner, PumpWallet, PaymentVerification
+from services.subscription_payments import PLAN_PRICES_INR, record_subscription_payment
+from services.wallet_service import InsufficientBalanceError, debit_wallet
 from config import Config
 from werkzeug.utils import secure_filename
 import os
@@ -16,11 +18,6 @@ subscription_bp = Blueprint("subscription", __name__)
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'pdf'}
 
-PLAN_PRICES_INR = {
-    "silver": 5000,
-    "gold": 5000,
-    "diamond": 15000,
-}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -105,14 +102,15 @@ def subscribe():
     months = duration_map.get(duration)
     total_price = base_price * months
 
-    # Check balance
-    if wallet.balance < total_price:
+    # Deduct balance (guarded, so concurrent purchases cannot overdraw)
+    try:
+        debit_wallet(PumpWallet, wallet.id, total_price, event_type="subscription",
+                     reference_id=pump.id, reference_type="pump")
+    except InsufficientBalanceError:
+        db.session.rollback()
         flash("Insufficient wallet balance. Please add funds.", "error")
         return jsonify({"error": "Insufficient funds"}), 402
 
-    # Deduct balance
-    wallet.balance -= total_price
-
     # Calculate subscription duration
     start_date = datetime.utcnow()
     end_date = start_date + timedelta(days=30 * months)
@@ -281,37 +279,9 @@ def payment_success():
     if not pump:
         return jsonify({"error": "Pump not found"}), 404
 
-    # Calculate subscription duration
-    duration_map = {
-        "1 Month": 1,
-        "6 Months": 6,
-        "Annual": 12
-    }
-    months = duration_map.get(duration, 1)
-    start_date = datetime.utcnow()
-    end_date = start_date + timedelta(days=30 * months)
-
-    # Update or create subscription
-    existing = PumpSubscription.query.filter_by(user_id=current_user.id, pump_id=pump_id).first()
-
-    if existing:
-        existing.subscription_type = plan_type.capitalize()
-        existing.subscription_status = "active"
-        existing.start_date = start_date
-        existing.end_date = end_date
-    else:
-        new_sub = PumpSubscription(
-            user_id=current_user.id,
-            email=current_user.email,
-            pump_id=pump_id,
-            pump_name=pump.name,
-            pump_location=pump.location,
-            subscription_type=plan_type.capitalize(),
-            subscription_status="active",
-            start_date=start_date,
-            end_date=end_date
-        )
-        db.session.add(new_sub)
+    # Also recorded by the payment webhook; whichever arrives second is a no-op
+    record_subscription_payment(current_user, pump, plan_type, duration,
+                                razorpay_payment_id, razorpay_order_id)
 
     db.session.commit()
 
@@ -0,0 +1,70 @@
+"""
+Bulk top-up verification checks.
+
+Approves and rejects several manual top-ups at once through
+bulk_verify_topups and checks balances, ledger credits and skipped ids.
+
+Usage:
+    python -m pytest -q topup_verification_test.py
+"""
+from extensions import db
+from models import User, Wallet, WalletLedgerEntry, WalletTopupVerification
+from services.topup_verification import bulk_verify_topups
+
+
+def _driver(email, balance=None):
+    driver = User(full_name="Topup Driver", email=email)
+    db.session.add(driver)
+    db.session.flush()
+    if balance is not None:
+        db.session.add(Wallet(user_id=driver.id, balance=balance))
+        db.session.flush()
+    return driver
+
+
+def _request(driver, amount, status="pending"):
+    topup = WalletTopupVerification(user_id=driver.id, user_email=driver.email, amount=amount,
+                                    screenshot_filename="proof.png", status=status)
+    db.session.add(topup)
+    db.session.flush()
+    return topup.id
+
+
+def test_bulk_approve_credits_each_wallet_once(app):
+    funded = _driver("funded@example.com", balance=100.0)
+    fresh = _driver("fresh@example.com")
+    first, second = _request(funded, 200.0), _request(funded, 50.0)
+    third = _request(fresh, 75.0)
+    done = _request(fresh, 10.0, status="approved")
+    db.session.commit()
+
+    results = bulk_verify_topups([first, second, third, done, 9999, first], "approve", "admin@example.com")
+
+    assert [(r["topup_id"], r["status"]) for r in results] == [
+        (first, "approved"), (second, "approved"), (third, "approved"), (done, "skipped"), (9999, "skipped"),
+    ]
+    assert [r["balance_after"] for r in results[:3]] == [300.0, 350.0, 75.0]
+    assert Wallet.query.filter_by(user_id=funded.id).one().balance == 350.0
+    assert Wallet.query.filter_by(user_id=fresh.id).one().balance == 75.0
+
+    credits = WalletLedgerEntry.query.filter_by(event_type="wallet_topup").order_by(WalletLedgerEntry.id).all()
+    assert [(c.reference_id, c.amount, c.balance_after) for c in credits] == [
+        (first, 200.0, 300.0), (second, 50.0, 350.0), (third, 75.0, 75.0),
+    ]
+    # Every top-up is its own ledger event
+    assert len({c.group_uuid for c in credits}) == 3
+    assert db.session.get(WalletTopupVerification, first).verified_by == "admin@example.com"
+
+
+def test_bulk_reject_leaves_balances_alone(app):
+    driver = _driver("rejected@example.com", balance=40.0)
+    topup_id = _request(driver, 500.0)
+    db.session.commit()
+
+    results = bulk_verify_topups([topup_id], "reject", "admin@example.com", reason="Blurry screenshot")
+
+    assert results == [{"topup_id": topup_id, "status": "rejected"}]
+    topup = db.session.get(WalletTopupVerification, topup_id)
+    assert (topup.status, topup.rejection_reason) == ("rejected", "Blurry screenshot")
+    assert Wallet.query.filter_by(user_id=driver.id).one().balance == 40.0
+    assert WalletLedgerEntry.query.count() == 0
@@ -1,5 +1,6 @@
 from flask import Blueprint, redirect, url_for, request, flash
 from models import db, Vehicle
+from services.vehicle_lookup import invalidate_plate
 from flask_login import current_user, login_required
 
 vehicle_bp = Blueprint("vehicle", __name__)
@@ -30,6 +31,7 @@ def add_vehicle():
     )
     db.session.add(vehicle)
     db.session.commit()
+    invalidate_plate(license_plate)
     flash("Vehicle added successfully!", "success")
     return redirect(url_for("dashboard.dashboard"))
 
@@ -39,8 +41,10 @@ def add_vehicle():
 def remove_vehicle(vehicle_id):
     vehicle = Vehicle.query.get(vehicle_id)
     if vehicle and vehicle.user_id == current_user.id:
+        license_plate = vehicle.license
         db.session.delete(vehicle)
         db.session.commit()
+        invalidate_plate(license_plate)
         flash("Vehicle removed successfully!", "success")
     else:
         flash("Vehicle not found or unauthorized.", "error")
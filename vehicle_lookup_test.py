@@ -0,0 +1,64 @@
+"""
+Plate resolution cache checks.
+
+A vehicle changed by "another process" (an ORM write that does not touch
+this process's cache) must not be served stale to settlement lookups.
+
+Usage:
+    python -m pytest -q vehicle_lookup_test.py
+"""
+import pytest
+
+from extensions import db
+from models import PlateRegistryVersion, User, Vehicle, Wallet
+from services import vehicle_lookup
+from services.vehicle_lookup import resolve_plate
+
+
+@pytest.fixture(autouse=True)
+def _empty_cache():
+    vehicle_lookup.clear_plate_cache()
+    vehicle_lookup._registry_version = None
+
+
+def _driver(email):
+    driver = User(full_name="Plate Driver", email=email)
+    db.session.add(driver)
+    db.session.flush()
+    wallet = Wallet(user_id=driver.id, balance=0.0)
+    db.session.add(wallet)
+    db.session.flush()
+    return driver.id, wallet.id
+
+
+def test_fresh_lookup_sees_reassigned_plate(app):
+    seller = _driver("seller@example.com")
+    buyer = _driver("buyer@example.com")
+    vehicle = Vehicle(name="Cab", type="Sedan", year="2020", license="ka-01 ab 1234",
+                      fuel_type="Diesel", user_id=seller[0])
+    db.session.add(vehicle)
+    db.session.commit()
+    assert resolve_plate("KA01AB1234", fresh=True) == seller
+
+    # Written without invalidate_plate, as another worker process would
+    version = db.session.get(PlateRegistryVersion, 1).version
+    vehicle.user_id = buyer[0]
+    db.session.commit()
+    assert db.session.get(PlateRegistryVersion, 1).version == version + 1
+
+    assert resolve_plate("KA01AB1234") == seller  # read-only lookups wait for the TTL
+    assert resolve_plate("KA01AB1234", fresh=True) == buyer
+    assert resolve_plate("KA01AB1234") == buyer
+
+
+def test_fresh_lookup_drops_removed_plate(app):
+    owner = _driver("owner@example.com")
+    vehicle = Vehicle(name="Cab", type="Sedan", year="2020", license="MH12XY9876",
+                      fuel_type="Petrol", user_id=owner[0])
+    db.session.add(vehicle)
+    db.session.commit()
+    assert resolve_plate("mh 12 xy 9876", fresh=True) == owner
+
+    db.session.delete(vehicle)
+    db.session.commit()
+    assert resolve_plate("mh 12 xy 9876", fresh=True) is None
@@ -5,7 +5,15 @@ import os
 import uuid
 
 from extensions import db
-from models import Wallet, User, WalletTopupVerification
+from models import Wallet, User, PumpOwner, WalletTopupVerification
+from services.pagination import InvalidCursorError
+from services.wallet_service import (
+    InsufficientBalanceError,
+    credit_wallet,
+    debit_wallet,
+    get_driver_wallet_transactions,
+    run_with_balance_retry,
+)
 
 
 wallet_bp = Blueprint("wallet", __name__)
@@ -30,20 +38,23 @@ def add_funds():
 
         user = current_user
 
-        # Initialize wallet if it doesn't exist
-        if not user.wallet:
-            wallet = Wallet(user_id=user.id, balance=amount)
-            db.session.add(wallet)
-            user.wallet = wallet
-        else:
-            user.wallet.balance += amount
+        def _credit():
+            # Initialize wallet if it doesn't exist
+            if not user.wallet:
+                wallet = Wallet(user_id=user.id, balance=0.0)
+                db.session.add(wallet)
+                db.session.flush()
+                user.wallet = wallet
+            new_balance = credit_wallet(Wallet, user.wallet.id, amount, event_type="wallet_topup")
+            db.session.commit()
+            return new_balance
 
-        db.session.commit()
+        new_balance = run_with_balance_retry(_credit)
 
         return jsonify({
             "success": True,
             "message": f"₹{amount:.2f} added to wallet successfully!",
-            "new_balance": round(user.wallet.balance, 2)
+            "new_balance": round(new_balance, 2)
         })
 
     except ValueError:
@@ -68,6 +79,24 @@ def get_balance():
         return jsonify({"success": False, "message": f"Server error: {str(e)}"}), 500
 
 
+@wallet_bp.route("/wallet_transactions", methods=["GET"])
+@login_required
+def wallet_transactions():
+    """Ledger history for the driver's wallet; page with ?cursor=<next_cursor>"""
+    if isinstance(current_user, PumpOwner):
+        return jsonify({"success": False, "message": "Access denied"}), 403
+    limit = max(1, min(request.args.get("limit", 20, type=int), 100))
+    try:
+        page = get_driver_wallet_transactions(current_user, limit=limit, cursor=request.args.get("cursor"))
+        db.session.commit()  # in case the wallet row was just created
+        return jsonify({"success": True, **page})
+    except InvalidCursorError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": f"Server error: {str(e)}"}), 500
+
+
 @wallet_bp.route("/deduct_funds", methods=["POST"])
 def deduct_funds():
     try:
@@ -83,19 +112,24 @@ def deduct_funds():
         if not cab_user or not cab_user.wallet:
             return jsonify({"success": False, "message": "Cab owner wallet not found."}), 404
 
-        if cab_user.wallet.balance < amount:
+        def _debit():
+            new_balance = debit_wallet(Wallet, cab_user.wallet.id, amount, event_type="wallet_debit")
+            db.session.commit()
+            return new_balance
+
+        try:
+            new_balance = run_with_balance_retry(_debit)
+        except InsufficientBalanceError:
+            db.session.rollback()
             return jsonify({
                 "success": False,
-                "message": f"Insufficient balance. Available: ₹{cab_user.wallet.balance:.2f}"
+                "message": f"Insufficient balance. Available: ₹{(cab_user.wallet.balance or 0.0):.2f}"
             }), 400
 
-        cab_user.wallet.balance -= amount
-        db.session.commit()
-
         return jsonify({
             "success": True,
             "message": f"₹{amount:.2f} deducted from {cab_email}'s wallet!",
-            "new_balance": round(cab_user.wallet.balance, 2)
+            "new_balance": round(new_balance, 2)
         })
 
     except Exception as e:
@@ -0,0 +1,195 @@
+"""
+Wallet concurrency load test.
+
+Hammers the guarded balance updates from many threads and checks that no
+update is lost and no wallet is overdrawn:
+
+  * N workers each settle their share of verified fuel transactions for the
+    same driver and the same pump (settle_fuel_transaction + retry wrapper)
+  * the same workers interleave top-ups (credit_wallet) on the driver wallet
+
+At the end the driver/pump balances, wallet versions and ledger rows must all
+agree exactly with what was committed.
+
+Usage (use Postgres for a real concurrency test; SQLite serialises writers):
+    DATABASE_URL=postgresql://... python wallet_concurrency_load_test.py --workers 16 --transactions 800
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from flask import Flask
+from sqlalchemy import func
+
+from extensions import db
+from models import (
+    User, Vehicle, Wallet, PumpOwner, Pump, PumpWallet,
+    FuelTransaction, WalletLedgerEntry,
+)
+from services.escrow_service import settle_fuel_transaction
+from services.wallet_service import credit_wallet, run_with_balance_retry
+
+
+def _make_app(database_url):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_url
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    if database_url.startswith("sqlite:"):
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+            "connect_args": {"check_same_thread": False, "timeout": 30},
+        }
+    db.init_app(app)
+    return app
+
+
+def _seed(transactions, amount, opening_balance):
+    suffix = str(int(time.time() * 1000))
+    driver = User(full_name="Load Test Driver", email=f"loadtest-driver-{suffix}@example.com")
+    owner = PumpOwner(full_name="Load Test Owner", email=f"loadtest-owner-{suffix}@example.com")
+    db.session.add_all([driver, owner])
+    db.session.flush()
+
+    plate = f"LT{suffix[-8:]}"
+    db.session.add(Vehicle(name="Load Test Cab", type="car", year="2024", license=plate,
+                           fuel_type="Petrol", user_id=driver.id))
+    driver_wallet = Wallet(user_id=driver.id, balance=opening_balance)
+    pump_wallet = PumpWallet(owner_id=owner.id, balance=0.0)
+    pump = Pump(name="Load Test Pump", location="Nowhere", owner_id=owner.id)
+    db.session.add_all([driver_wallet, pump_wallet, pump])
+    db.session.flush()
+
+    db.session.add_all([
+        FuelTransaction(pump_id=pump.id, vehicle_number=plate, fuel_type="Petrol",
+                        quantity_litres=1.0, unit_price=amount, amount=amount,
+                        status="verified", verification_level="manual")
+        for _ in range(transactions)
+    ])
+    db.session.commit()
+
+    ids = [row[0] for row in db.session.query(FuelTransaction.id)
+           .filter_by(pump_id=pump.id).order_by(FuelTransaction.id).all()]
+    return driver_wallet.id, pump_wallet.id, ids
+
+
+def _worker(app, transaction_ids, driver_wallet_id, topup_every, topup_amount, stats, lock):
+    settled = failed = topups = errors = 0
+    with app.app_context():
+        for n, transaction_id in enumerate(transaction_ids, start=1):
+            def _settle():
+                result = settle_fuel_transaction(transaction_id)
+                db.session.commit()
+                return result
+
+            try:
+                transaction, _ = run_with_balance_retry(_settle)
+                if transaction.status == "settled":
+                    settled += 1
+                else:
+                    failed += 1
+            except Exception as e:
+                db.session.rollback()
+                errors += 1
+                print(f"  settle {transaction_id} error: {e}")
+
+            if topup_every and n % topup_every == 0:
+                def _topup():
+                    credit_wallet(Wallet, driver_wallet_id, topup_amount)
+                    db.session.commit()
+
+                try:
+                    run_with_balance_retry(_topup)
+                    topups += 1
+                except Exception as e:
+                    db.session.rollback()
+                    errors += 1
+                    print(f"  topup error: {e}")
+        db.session.remove()
+
+    with lock:
+        stats["settled"] += settled
+        stats["failed"] += failed
+        stats["topups"] += topups
+        stats["errors"] += errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--transactions", type=int, default=400)
+    parser.add_argument("--amount", type=float, default=10.0)
+    parser.add_argument("--opening-balance", type=float, default=None,
+                        help="Driver opening balance (default: enough for ~half the sales, so the guard is exercised)")
+    parser.add_argument("--topup-every", type=int, default=5, help="Each worker tops up after every N settlements")
+    parser.add_argument("--topup-amount", type=float, default=10.0)
+    args = parser.parse_args()
+
+    database_url = os.getenv("DATABASE_URL") or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "wallet_load.db")
+    if database_url.startswith("postgres://"):
+        database_url = database_url.replace("postgres://", "postgresql://", 1)
+    opening_balance = args.opening_balance
+    if opening_balance is None:
+        opening_balance = args.amount * args.transactions / 2
+
+    app = _make_app(database_url)
+    with app.app_context():
+        db.create_all()
+        driver_wallet_id, pump_wallet_id, ids = _seed(args.transactions, args.amount, opening_balance)
+
+    stats = {"settled": 0, "failed": 0, "topups": 0, "errors": 0}
+    lock = threading.Lock()
+    threads = [
+        threading.Thread(target=_worker, args=(app, ids[i::args.workers], driver_wallet_id,
+                                               args.topup_every, args.topup_amount, stats, lock))
+        for i in range(args.workers)
+    ]
+    started = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - started
+
+    with app.app_context():
+        driver_wallet = db.session.get(Wallet, driver_wallet_id)
+        pump_wallet = db.session.get(PumpWallet, pump_wallet_id)
+        settled_total = db.session.query(func.coalesce(func.sum(FuelTransaction.amount), 0.0)).filter(
+            FuelTransaction.id.in_(ids), FuelTransaction.status == "settled").scalar()
+        settled_count = FuelTransaction.query.filter(
+            FuelTransaction.id.in_(ids), FuelTransaction.status == "settled").count()
+        ledger_rows = WalletLedgerEntry.query.filter(
+            WalletLedgerEntry.reference_type == "fuel_transaction",
+            WalletLedgerEntry.reference_id.in_(ids)).count()
+
+        driver_balance = driver_wallet.balance
+        expected_driver = opening_balance + stats["topups"] * args.topup_amount - settled_total
+        expected_driver_version = 1 + stats["topups"] + settled_count
+        expected_pump_version = 1 + settled_count
+
+        checks = [
+            ("driver balance", driver_wallet.balance, expected_driver),
+            ("pump balance", pump_wallet.balance, settled_total),
+            ("driver wallet version", driver_wallet.version, expected_driver_version),
+            ("pump wallet version", pump_wallet.version, expected_pump_version),
+            ("ledger rows", ledger_rows, 2 * settled_count),
+            ("settled count", settled_count, stats["settled"]),
+        ]
+
+    print(f"{args.workers} workers, {len(ids)} settlements, {stats['topups']} top-ups in {elapsed:.2f}s "
+          f"({(len(ids) + stats['topups']) / elapsed:.0f} ops/s)")
+    print(f"settled={stats['settled']} failed(insufficient)={stats['failed']} errors={stats['errors']}")
+
+    ok = stats["errors"] == 0 and driver_balance >= 0
+    for name, actual, expected in checks:
+        match = abs(actual - expected) < 1e-6
+        ok = ok and match
+        print(f"  {'OK ' if match else 'BAD'} {name}: {actual} (expected {expected})")
+
+    print("PASS: no lost updates" if ok else "FAIL")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+# webhooks.py - Payment gateway webhooks
+import click
+from flask import Blueprint, current_app, jsonify, request, url_for
+
+from config import Config
+from extensions import csrf
+from services.payment_webhooks import (
+    WEBHOOK_BATCH_SIZE,
+    WebhookEventError,
+    enqueue_webhook_event,
+    process_webhook_events,
+    sample_event,
+    sign_payload,
+    verify_signature,
+)
+
+webhooks_bp = Blueprint("webhooks", __name__)
+
+
+@csrf.exempt
+@webhooks_bp.route("/razorpay", methods=["POST"])
+def razorpay_webhook():
+    """Verify and queue a Razorpay event; the webhook worker applies it"""
+    secret = Config.RAZORPAY_WEBHOOK_SECRET
+    if not secret:
+        return jsonify({"success": False, "message": "Webhook secret not configured"}), 503
+
+    body = request.get_data()
+    if not verify_signature(body, request.headers.get("X-Razorpay-Signature", ""), secret):
+        return jsonify({"success": False, "message": "Invalid signature"}), 400
+    try:
+        event, created = enqueue_webhook_event(body, request.headers.get("X-Razorpay-Event-Id"))
+    except WebhookEventError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return jsonify({"success": True, "event_id": event.event_id, "duplicate": not created})
+
+
+@webhooks_bp.cli.command("process")
+@click.option("--batch-size", type=int, default=WEBHOOK_BATCH_SIZE, show_default=True)
+def process_command(batch_size):
+    """Apply all pending payment webhook events."""
+    while True:
+        summary = process_webhook_events(batch_size=batch_size)
+        click.echo(f"{summary['events']} events: {summary['processed']} processed, {summary['ignored']} ignored, "
+                   f"{summary['failed']} failed, {summary['retrying']} to retry")
+        if summary["events"] < batch_size:
+            break
+
+
+@webhooks_bp.cli.command("replay")
+@click.argument("event_files", nargs=-1, type=click.File("rb"))
+@click.option("--event", "event_type", default="payment.captured", show_default=True,
+              help="Event type for a generated event (when no files are given).")
+@click.option("--order-id", default=None, help="Generate an event for this order id.")
+@click.option("--payment-id", default=None, help="Payment id of the generated event.")
+@click.option("--amount", type=float, default=None, help="Amount (INR) of the generated event.")
+@click.option("--note", "notes", multiple=True, help="key=value order note, e.g. plan_type=gold (sent with order.paid).")
+@click.option("--process", "process_now", is_flag=True, help="Run the worker after queueing.")
+def replay_command(event_files, event_type, order_id, payment_id, amount, notes, process_now):
+    """Sign sample events with the webhook secret and post them to the local endpoint."""
+    secret = Config.RAZORPAY_WEBHOOK_SECRET
+    if not secret:
+        raise click.ClickException("RAZORPAY_WEBHOOK_SECRET is not set")
+    bodies = [f.read() for f in event_files]
+    if order_id:
+        if amount is None:
+            raise click.ClickException("--amount is required with --order-id")
+        bodies.append(sample_event(event_type, payment_id or f"pay_local_{order_id}", order_id, amount,
+                                   dict(n.split("=", 1) for n in notes)))
+    if not bodies:
+        raise click.ClickException("Give event files or --order-id/--amount")
+
+    client = current_app.test_client()
+    with current_app.test_request_context():
+        path = url_for("webhooks.razorpay_webhook")
+    for body in bodies:
+        response = client.post(path, data=body, content_type="application/json",
+                               headers={"X-Razorpay-Signature": sign_payload(body, secret)})
+        click.echo(f"{response.status_code} {response.get_data(as_text=True).strip()}")
+    if process_now:
+        summary = process_webhook_events()
+        click.echo(f"{summary['processed']} processed, {summary['ignored']} ignored, "
+                   f"{summary['failed']} failed, {summary['retrying']} to retry")